@@ -38,6 +38,10 @@ export default function CockpitPage() {
   const [backendStatus, setBackendStatus] = useState<'offline' | 'online'>('offline');
   const [isSettingsOpen, setIsSettingsOpen] = useState(false);
   const logsEndRef = useRef<HTMLDivElement>(null);
+  // Sequência dos deltas do gráfico (buraco na sequência => pede resync ao servidor)
+  const seqGraficoRef = useRef<number | null>(null);
+  // Resync já pedido: deltas são descartados até o snapshot chegar (um pedido por buraco)
+  const resyncPendenteRef = useRef(false);
 
   // Estados Dinâmicos do Gráfico Financeiro
   const [visualStudies, setVisualStudies] = useState<VisualStudies | undefined>(undefined);
@@ -139,6 +143,7 @@ export default function CockpitPage() {
       ws = new WebSocket(wsUrl);
 
       ws.onopen = () => {
+        resyncPendenteRef.current = false;
         setBackendStatus('online');
         setAiStatus('connected');
       };
@@ -162,7 +167,39 @@ export default function CockpitPage() {
           
           // 2. Tratamento de Dados de Mercado (Olhos - Game Mode)
           if (data.type === 'market_data') {
-            if (data.candles) {
+            if (data.modo === 'delta') {
+              if (resyncPendenteRef.current) {
+                return;
+              }
+              if (seqGraficoRef.current === null || data.seq !== seqGraficoRef.current + 1) {
+                seqGraficoRef.current = null;
+                resyncPendenteRef.current = true;
+                ws?.send(JSON.stringify({ type: 'resync' }));
+                return;
+              }
+              seqGraficoRef.current = data.seq;
+              // Delta compacto: [time, open, high, low, close] do candle em formação e dos recém-fechados
+              const novos: CandlestickData<Time>[] = data.candles.map((c: number[]) => ({
+                time: c[0] as Time, open: c[1], high: c[2], low: c[3], close: c[4],
+              }));
+              setChartData((prev) => {
+                const atualizado = [...prev];
+                for (const candle of novos) {
+                  const ultimo = atualizado[atualizado.length - 1];
+                  if (ultimo && ultimo.time === candle.time) {
+                    atualizado[atualizado.length - 1] = candle;
+                  } else if (!ultimo || (candle.time as number) > (ultimo.time as number)) {
+                    atualizado.push(candle);
+                  }
+                }
+                return atualizado;
+              });
+            }
+            else if (data.candles) {
+              if (typeof data.seq === 'number') {
+                seqGraficoRef.current = data.seq;
+              }
+              resyncPendenteRef.current = false;
               setChartData(data.candles);
             } 
             else if (data.tick) {
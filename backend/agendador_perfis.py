@@ -0,0 +1,331 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+import numpy as np
+
+
+@dataclass(slots=True)
+class EstadoPerfil:
+    """Relógios e memória de agendamento de um perfil (antes eram globais por ativo no loop)."""
+    profile_id: str
+    config: dict
+    ultimo_ts_ia: float = 0.0
+    contador_posicionado: int = 0
+    posicionado: bool = False
+    relevancia: int = 1
+    ciclos: int = 0
+    atrasos: deque = field(default_factory=lambda: deque(maxlen=200))       # despertar - evento (s)
+    desvios_ia: deque = field(default_factory=lambda: deque(maxlen=200))    # período do ciclo da IA - intervalo (s)
+
+    @property
+    def ativo(self):
+        return self.config.get('ativo', 'BITG26')
+
+    def marcar_ciclo_ia(self, agora, intervalo):
+        if self.ultimo_ts_ia:
+            self.desvios_ia.append(agora - self.ultimo_ts_ia - intervalo)
+        self.ultimo_ts_ia = agora
+
+
+class _Espera:
+    __slots__ = ("futuro", "tarefa")
+
+    def __init__(self, futuro, tarefa):
+        self.futuro = futuro
+        self.tarefa = tarefa
+
+
+class AgendadorPerfis:
+    """
+    Uma tarefa por perfil, cada uma com os próprios relógios: o perfil roda o ciclo e dorme até o
+    próximo fechamento de barra do seu ativo, o próximo tick (se pedir) ou o próprio timer, o que
+    vier primeiro. Um único despachante lê o relógio de cada ativo observado (`ler_tick(ativo)` ->
+    (horário do servidor, marca do tick) ou None) a cada `passo` segundos, detecta a virada da barra
+    e acorda quem espera por ela.
+    `observados()` lista ativos lidos a cada passo mesmo sem perfil esperando (armadilhas armadas:
+    o fechamento da barra não pode esperar o perfil terminar a chamada da IA).
+    Com `avancar` (simulador sem velocidade própria) o tempo é virtual: quando todas as tarefas estão
+    dormindo, o despachante pula o relógio direto para o próximo evento.
+    A ordem de atendimento na IA sai de prioridade(): perfis posicionados primeiro, depois os de
+    relevância alta (o pool de inferência envelhece a prioridade de quem espera).
+    """
+
+    def __init__(self, relogio, ler_tick, segundos_barra=60, passo=0.25, espera_maxima=60.0,
+                 avancar=None, ao_fechar_barra=None, observados=None):
+        self.relogio = relogio
+        self.ler_tick = ler_tick
+        self.segundos_barra = segundos_barra
+        self.passo = passo
+        self.espera_maxima = espera_maxima
+        self.avancar = avancar
+        self.ao_fechar_barra = ao_fechar_barra
+        self.observados = observados
+        self.estados = {}
+        self.tarefas = {}
+        self._timers = []                # (instante, seq, espera)
+        self._seq = itertools.count()
+        self._barras = {}                # ativo -> [esperas]
+        self._ticks = {}                 # ativo -> [esperas]
+        self._ultima_barra = {}
+        self._ultimo_tick = {}
+        self._ativas = set()             # tarefas acordadas (rodando um ciclo)
+        self._ocioso = asyncio.Event()
+        self._ocioso.set()
+        self.barras_fechadas = 0
+        self.despertares = {"barra": 0, "tick": 0, "timer": 0}
+
+    # --- Tarefas -------------------------------------------------------------------------------
+
+    def lancar(self, corrotina):
+        """Tarefa gerenciada: conta como ocupada até chamar aguardar()/dormir()."""
+        tarefa = asyncio.ensure_future(corrotina)
+        self._marcar_ativa(tarefa)
+        tarefa.add_done_callback(self._desmarcar_ativa)
+        return tarefa
+
+    def sincronizar(self, configs, executar_perfil):
+        """Cria a tarefa dos perfis novos, atualiza a config dos existentes e encerra os removidos."""
+        vistos = set()
+        for config in configs or []:
+            profile_id = config.get('profile_id')
+            vistos.add(profile_id)
+            estado = self.estados.get(profile_id)
+            if estado is None:
+                estado = self.estados[profile_id] = EstadoPerfil(profile_id, config)
+            else:
+                estado.config = config
+            if profile_id not in self.tarefas or self.tarefas[profile_id].done():
+                self.tarefas[profile_id] = self.lancar(executar_perfil(estado))
+        for profile_id in list(self.tarefas):
+            if profile_id not in vistos:
+                self.tarefas.pop(profile_id).cancel()
+                self.estados.pop(profile_id, None)
+
+    @staticmethod
+    def prioridade(estado: EstadoPerfil) -> int:
+        """Menor = atendido antes: posicionado 0, depois relevância 5 -> 1 ... relevância 1 -> 5."""
+        return 0 if estado.posicionado else 6 - max(1, min(5, int(estado.relevancia or 1)))
+
+    def _marcar_ativa(self, tarefa):
+        self._ativas.add(tarefa)
+        self._ocioso.clear()
+
+    def _desmarcar_ativa(self, tarefa):
+        self._ativas.discard(tarefa)
+        if not self._ativas:
+            self._ocioso.set()
+
+    # --- Espera --------------------------------------------------------------------------------
+
+    async def aguardar(self, estado: EstadoPerfil, ate=None, ticks=False):
+        """
+        Dorme até a próxima barra do ativo do perfil, o próximo tick (`ticks`) ou o instante `ate`
+        (relógio do provedor), limitado a `espera_maxima`. Devolve o motivo ("barra", "tick", "timer").
+        """
+        limite = self.relogio() + self.espera_maxima
+        ate = limite if ate is None else min(ate, limite)
+        espera = self._nova_espera(ate)
+        self._barras.setdefault(estado.ativo, []).append(espera)
+        if ticks:
+            self._ticks.setdefault(estado.ativo, []).append(espera)
+        motivo, instante = await self._dormir(espera)
+        estado.atrasos.append(self.relogio() - instante)
+        estado.ciclos += 1
+        return motivo
+
+    async def dormir(self, segundos):
+        """Pausa de uma tarefa gerenciada no relógio do provedor (virtual no simulador)."""
+        await self._dormir(self._nova_espera(self.relogio() + segundos))
+
+    def _nova_espera(self, ate):
+        espera = _Espera(asyncio.get_running_loop().create_future(), asyncio.current_task())
+        heapq.heappush(self._timers, (ate, next(self._seq), espera))
+        return espera
+
+    async def _dormir(self, espera):
+        self._desmarcar_ativa(espera.tarefa)
+        try:
+            return await espera.futuro
+        finally:
+            self._marcar_ativa(espera.tarefa)
+
+    def _acordar(self, espera, motivo, instante):
+        if espera.futuro.done():
+            return
+        # Conta como ocupada já no disparo: o despachante virtual não pode pular o relógio antes dela rodar
+        self._marcar_ativa(espera.tarefa)
+        espera.futuro.set_result((motivo, instante))
+        self.despertares[motivo] += 1
+
+    # --- Despachante ---------------------------------------------------------------------------
+
+    async def executar(self):
+        """Despachante de eventos (rodar junto das demais tarefas do robô)."""
+        while True:
+            try:
+                if self.avancar is not None:
+                    await self._ocioso.wait()
+                    alvo = self._proximo_evento()
+                    if alvo is None:
+                        await asyncio.sleep(self.passo)
+                        continue
+                    self.avancar(max(0.0, alvo - self.relogio()))
+                else:
+                    await asyncio.sleep(self.passo)
+                self._disparar()
+                await asyncio.sleep(0)
+            except Exception as e:
+                print(f"Erro no agendador de perfis: {e}")
+                await asyncio.sleep(1)
+
+    def _proximo_evento(self):
+        while self._timers and self._timers[0][2].futuro.done():
+            heapq.heappop(self._timers)
+        candidatos = [self._timers[0][0]] if self._timers else []
+        if any(self._barras.values()) or (self.observados is not None and self.observados()):
+            candidatos.append((self.relogio() // self.segundos_barra + 1) * self.segundos_barra)
+        return min(candidatos) if candidatos else None
+
+    def _disparar(self):
+        agora = self.relogio()
+        ativos = {a for a in set(self._barras) | set(self._ticks) if self._barras.get(a) or self._ticks.get(a)}
+        if self.observados is not None:
+            ativos.update(self.observados())
+        for ativo in ativos:
+            leitura = self.ler_tick(ativo)
+            if leitura is None:
+                continue
+            tempo_servidor, marca = leitura
+            barra = int(tempo_servidor // self.segundos_barra)
+            anterior = self._ultima_barra.get(ativo)
+            self._ultima_barra[ativo] = barra
+            if anterior is not None and barra > anterior:
+                self.barras_fechadas += 1
+                if self.ao_fechar_barra is not None:
+                    self.ao_fechar_barra(ativo)
+                # Instante do fechamento no relógio local (o servidor pode estar em outro fuso)
+                instante = agora - (tempo_servidor - barra * self.segundos_barra)
+                for espera in self._barras.pop(ativo, []):
+                    self._acordar(espera, "barra", instante)
+            if marca != self._ultimo_tick.get(ativo):
+                self._ultimo_tick[ativo] = marca
+                for espera in self._ticks.pop(ativo, []):
+                    self._acordar(espera, "tick", agora)
+        while self._timers and self._timers[0][0] <= agora:
+            instante, _, espera = heapq.heappop(self._timers)
+            self._acordar(espera, "timer", instante)
+
+    def estatisticas(self):
+        resumo = {"perfis": len(self.tarefas), "ocupados": len(self._ativas),
+                  "barras_fechadas": self.barras_fechadas, "despertares": dict(self.despertares)}
+        atrasos = [a for estado in self.estados.values() for a in estado.atrasos]
+        if atrasos:
+            atrasos = np.asarray(atrasos) * 1000
+            resumo["atraso_despertar_ms"] = {"p50": round(float(np.percentile(atrasos, 50)), 1),
+                                             "p95": round(float(np.percentile(atrasos, 95)), 1),
+                                             "max": round(float(atrasos.max()), 1)}
+        desvios = [d for estado in self.estados.values() for d in estado.desvios_ia]
+        if desvios:
+            desvios = np.abs(np.asarray(desvios))
+            resumo["desvio_ciclo_ia_s"] = {"p50": round(float(np.percentile(desvios, 50)), 2),
+                                           "p95": round(float(np.percentile(desvios, 95)), 2)}
+        return resumo
+
+
+if __name__ == "__main__":
+    import random
+
+    from pool_inferencia import PoolInferencia
+
+    # 50 perfis em 5 ativos (10 posicionados, ciclo de 150s; os demais 60s), IA de ~3s com 4 vagas.
+    # Relógio acelerado 60x (uma barra M1 por segundo); 8 minutos de pregão.
+    # Antes: loop serial com pausa fixa de 15s e ciclo da IA por ativo. Depois: uma tarefa por perfil.
+    ACELERACAO, MINUTOS, PERFIS = 60.0, 8, 50
+    ativos = ["WIN", "WDO", "PETR4", "VALE3", "BITG26"]
+
+    def novo_relogio():
+        base, t0 = 1_700_000_000.0, time.monotonic()
+        return lambda: base + (time.monotonic() - t0) * ACELERACAO
+
+    def perfis():
+        return [EstadoPerfil(f"p{i:02d}", {"ativo": ativos[i % len(ativos)], "profile_id": f"p{i:02d}"},
+                             posicionado=i < 10, relevancia=1 + i % 5) for i in range(PERFIS)]
+
+    async def analisar(pool, relogio, aleatorio, classe, esperas, com_prioridade=True):
+        chegada = relogio()
+
+        async def chamada():
+            esperas.append((classe, relogio() - chegada))
+            await asyncio.sleep(aleatorio.lognormvariate(1.0, 0.3) / ACELERACAO)
+
+        await pool.executar("modelo", chamada, classe if com_prioridade else 0)
+
+    def resumo(nome, estados, esperas):
+        desvios = np.abs([d for e in estados for d in e.desvios_ia])
+        jitter = [float(np.std(e.desvios_ia)) for e in estados if len(e.desvios_ia) > 1]
+        classes = {"posicionados": [w for c, w in esperas if c == 0], "relevância 4-5": [w for c, w in esperas if c in (1, 2)],
+                   "relevância 1-3": [w for c, w in esperas if c >= 3]}
+        filas = ", ".join(f"{classe} {np.percentile(w, 95):.1f}s" for classe, w in classes.items())
+        print(f"{nome}: atraso do ciclo da IA p50={np.percentile(desvios, 50):.1f}s p95={np.percentile(desvios, 95):.1f}s "
+              f"max={desvios.max():.1f}s | jitter por perfil (desvio-padrão do período) médio={np.mean(jitter):.1f}s | "
+              f"fila da IA p95: {filas}")
+
+    async def antes():
+        relogio, aleatorio = novo_relogio(), random.Random(5)
+        pool = PoolInferencia(4)
+        # Ordem do loop antigo: perfis agrupados por ativo
+        estados, esperas, ultimo_ts_ia = sorted(perfis(), key=lambda e: e.ativo), [], {}
+        fim = relogio() + MINUTOS * 60
+        while relogio() < fim:
+            liberados, pendentes = set(), []
+            for estado in estados:
+                agora = relogio()
+                intervalo = 150 if estado.posicionado else 60
+                if estado.ativo not in liberados and agora - ultimo_ts_ia.get(estado.ativo, 0) < intervalo:
+                    continue
+                ultimo_ts_ia[estado.ativo] = agora
+                liberados.add(estado.ativo)
+                estado.marcar_ciclo_ia(agora, intervalo)
+                pendentes.append(analisar(pool, relogio, aleatorio, AgendadorPerfis.prioridade(estado), esperas, False))
+            await asyncio.gather(*pendentes)
+            await asyncio.sleep(15 / ACELERACAO)
+        return estados, esperas
+
+    async def depois(com_prioridade):
+        relogio, aleatorio = novo_relogio(), random.Random(5)
+        pool = PoolInferencia(4)
+        agendador = AgendadorPerfis(relogio, lambda ativo: (relogio(), int(relogio() * 4)), passo=0.25 / ACELERACAO)
+        esperas = []
+
+        async def executar_perfil(estado):
+            while True:
+                agora = relogio()
+                intervalo = 150 if estado.posicionado else 60
+                proximo = estado.ultimo_ts_ia + intervalo
+                if agora >= proximo - 5:
+                    estado.marcar_ciclo_ia(agora, intervalo)
+                    await analisar(pool, relogio, aleatorio, agendador.prioridade(estado), esperas, com_prioridade)
+                    proximo = estado.ultimo_ts_ia + intervalo
+                await agendador.aguardar(estado, proximo)
+
+        despachante = asyncio.ensure_future(agendador.executar())
+        iniciais = perfis()
+        agendador.sincronizar([e.config for e in iniciais], executar_perfil)
+        for inicial in iniciais:
+            estado = agendador.estados[inicial.profile_id]
+            estado.posicionado, estado.relevancia = inicial.posicionado, inicial.relevancia
+        await asyncio.sleep(MINUTOS * 60 / ACELERACAO)
+        for tarefa in agendador.tarefas.values():
+            tarefa.cancel()
+        despachante.cancel()
+        return list(agendador.estados.values()), esperas, agendador.estatisticas()
+
+    resumo("antes (loop serial, 15s)", *asyncio.run(antes()))
+    resumo("tarefa por perfil, fila FIFO", *asyncio.run(depois(False))[:2])
+    estados, esperas, estatisticas = asyncio.run(depois(True))
+    resumo("tarefa por perfil, fila por prioridade", estados, esperas)
+    print(f"agendador: {estatisticas}")
@@ -1,98 +1,167 @@
 import os
-import json
+import asyncio
 import numpy as np
 import pandas as pd
-import requests
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
 from PIL import Image # NOVO: Biblioteca de visão computacional
 from google import genai
 from google.genai import types
 
-class NewsRadar:
-    def __init__(self):
-        # Gatilhos Reais: Brasil, USA e Crypto (Essencial para BITH11 e WIN/WDO)
-        self.hard_triggers = [
-            "Copom", "IPCA", "Payroll", "FOMC", "Taxa de Juros", 
-            "PIB", "CPI", "Decisão FED", "SEC", 
-            "Relatório Focus", "Caged", "Inflação", "PMI", "Non-Farm"
-        ]
-        self.eventos_cache = []
-        self.ultimo_update = 0
-
-    def capturar_calendario_real(self):
-        """Busca notícias de alto impacto (USD) que afetam a B3 e o mundo."""
-        agora_ts = time.time()
-        # Atualiza o cache a cada 4 horas
-        if self.eventos_cache and (agora_ts - self.ultimo_update < 14400):
-            return self.eventos_cache
-
-        eventos = []
-        try:
-            # Fonte pública gratuita e confiável para calendário econômico (Forex Factory)
-            url = "https://nfs.faireconomy.media/ff_calendar_thisweek.json"
-            response = requests.get(url, timeout=10)
-            if response.status_code == 200:
-                dados = response.json()
-                for item in dados:
-                    # Filtra apenas notícias de ALTO IMPACTO para USD (afeta B3 em cheio) ou BRL (se disponível)
-                    if item.get('impact') == 'High' and item.get('country') in ['USD', 'BRL']:
-                        data_str = item.get('date', '')
-                        if data_str:
-                            try:
-                                # O formato ISO vem com timezone (ex: 2026-03-02T10:00:00-05:00)
-                                dt_evento = datetime.fromisoformat(data_str)
-                                # Converte para o fuso horário local do servidor (onde o robô roda)
-                                dt_evento_local = dt_evento.astimezone()
-                                eventos.append({
-                                    'evento': item.get('title'),
-                                    'hora': dt_evento_local.strftime("%H:%M"),
-                                    'data_completa': dt_evento_local,
-                                    'moeda': item.get('country')
-                                })
-                            except Exception as e:
-                                pass
-                
-                self.eventos_cache = eventos
-                self.ultimo_update = agora_ts
-                print(f"📡 Radar de Notícias Atualizado: {len(eventos)} eventos de ALTO IMPACTO encontrados para esta semana.")
-        except Exception as e:
-            print(f"⚠️ Erro ao capturar calendário econômico: {e}")
-            
-        return self.eventos_cache
+from backend_llm import RespostaGravada, criar_backend
+from cache_instrucao import CacheInstrucao
+from fragmentos_prompt import CacheFragmentos, chave_candles, formatar_linhas_raio_x, raio_x_compacto
+from pivots import DTYPE_PIVOT, DetectorPivots, encontrar_pivots, formatar_pivots, janela_pivots
+from pool_inferencia import PoolInferencia
+from radar_noticias import NewsRadar
+from roteador_modelos import RoteadorModelos
+from resposta_ia import ESQUEMA_RESPOSTA, ErroRespostaIA, LeitorJSONIncremental, MetricasResposta, RespostaIA
 
-    def verificar_bloqueio_operacional(self):
-        """Implementa o Hiato Operacional de 30 minutos em torno de notícias fatais."""
-        eventos = self.capturar_calendario_real()
-        agora = datetime.now().astimezone() # Usa timezone aware para comparar corretamente
+# CÉREBRO DA IA (ESTRUTURA HEDGE FUND): regras fixas do operador.
+# Precisa ser idêntica byte a byte entre as chamadas para ser servida pelo cache de contexto do
+# Gemini: nada de valores do mercado aqui, eles vão no prompt de cada análise.
+INSTRUCAO_SISTEMA = """
+        Você é um Quant Trader Sênior Híbrido operando como 'Camaleão Dinâmico' Multimodal (Lê Texto, Números e IMAGENS).
+        Sua missão é gerar lucro implacável, focar em PULLBACKS SAUDÁVEIS e evitar REVERSÕES.
+
+        ESTRUTURA DE DADOS OBRIGATÓRIA (Siga o JSON estritamente, nesta ordem: decisão e armadilha primeiro):
+        {
+            "relevancia": inteiro de 1 a 5,
+            "decisao": "WAIT", "WAIT_TO_BUY", "WAIT_TO_SELL", "BUY", "SELL", "HOLD", ou "BREAKEVEN",
+            "motivo": "Explicação do momento.",
+            "estado_operacional": "SUA MEMÓRIA. OBRIGATÓRIO INICIAR COM O PREÇO. Ex: '[Preço <Preço Atual>] Aguardando pullback no suporte.'",
+            "ordem_programada": {
+                "acao": "BUY", "SELL" ou "NONE",
+                "preco_gatilho": 0.0,
+                "motivo_gatilho": "Breve motivo da armadilha"
+            },
+            "regime_mercado": "Ex: Colapso M1 / Consolidação M15",
+            "estrategia_escolhida": "Nome do sub-modo ativado",
+            "raciocinio_macro": "Leitura rápida M15",
+            "raciocinio_micro": "Leitura rápida M1 e M5",
+            "adaptabilidade": "Justificativa curta de mudança",
+            "probabilidade_acerto": "Ex: '85%'",
+            "estudos_visuais": {
+                "suporte": 0.0,
+                "resistencia": 0.0,
+                "tendencia_direcao": "UP", "DOWN" ou "SIDEWAYS",
+                "tendencia_preco": 0.0,
+                "linhas_tendencia": [],
+                "fibo_proposals": []
+            }
+        }
         
-        for evento in eventos:
-            try:
-                dt_evento = evento['data_completa']
-                
-                # Verifica se o evento é HOJE
-                if dt_evento.date() == agora.date():
-                    # Janela de Proteção: 15min antes e 15min depois (Total 30 min)
-                    inicio_janela = dt_evento - timedelta(minutes=15)
-                    fim_janela = dt_evento + timedelta(minutes=15)
-                    
-                    if inicio_janela <= agora <= fim_janela:
-                        return True, f"{evento['moeda']} - {evento['evento']}"
-            except Exception as e:
-                continue
-                
-        return False, None
+        --- INSTRUÇÕES BÁSICAS DE OPERACIONAL DO MERCADO ---
+        0. REGRA DE TENDÊNCIA (CRÍTICA E INQUEBRÁVEL): A TENDÊNCIA (Direção de Compra ou Venda) DEVE SER DEFINIDA EXCLUSIVAMENTE PELO GRÁFICO M5 E M15. Analise os topos e fundos maiores/menores das últimas horas. O Gráfico M1 serve APENAS para refinar o timing de entrada (gatilho) A FAVOR da tendência macro. 
+           - Se o M5 diz ALTA (LTA), você SÓ PODE procurar COMPRA no M1. É ESTRITAMENTE PROIBIDO VENDER.
+           - Se o M5 diz BAIXA (LTB), você SÓ PODE procurar VENDA no M1. É ESTRITAMENTE PROIBIDO COMPRAR.
+           - Micro-tendências contrárias no M1 e falsos rompimentos DEVEM SER IGNORADOS como ruído. NUNCA opere contra a tendência macro acreditando em reversões antecipadas do M1.
+        1. A LEI DA VWAP (VOLUME WEIGHTED AVERAGE PRICE): Institucionais operam pela VWAP. 
+           - NUNCA compre se o preço estiver ABAIXO da VWAP.
+           - NUNCA venda se o preço estiver ACIMA da VWAP.
+           - A VWAP atua como um ímã (Mean Reversion) e como suporte/resistência dinâmico.
+        2. VOLATILIDADE E STOP LOSS (ATR): O ATR (Average True Range) mede a volatilidade real.
+           - Use o ATR Atual (informado nos dados de cada análise) para definir o Stop Loss. Exemplo: Stop Loss = 1.5x ATR.
+           - Se o ATR estiver muito alto, exija confirmações mais fortes antes de entrar.
+        3. ZONAS DE LIQUIDEZ (D-1): As Máximas e Mínimas do dia anterior são piscinas de liquidez.
+           - Comprar exatamente em cima da Máxima de ontem é suicídio (armadilha de liquidez).
+           - Vender exatamente em cima da Mínima de ontem é suicídio.
+           - Espere o rompimento claro ou a rejeição nessas zonas.
+        4. SUPORTE E RESISTÊNCIA (S/R): 
+         * Suporte (S): É sempre a base (parte de baixo) do movimento que forma topos e fundos.
+         * Resistência (R): É sempre o teto (parte de cima) do movimento que forma topos e fundos.
+        5. PullBack: Estratégia de operar a favor da tendência buscando maior margem quando acontece uma correção (recuo) tocando S/R e entrando a favor da tendência.
+        6. LINHAS DE TENDÊNCIA:
+         * LTA (Linha de Tendência de Alta): Linha base dos candles de fundos cada vez mais altos/baixos (sempre na tendência atual), ela forma entre o último Suporte após romper, e o último Suporte atual.
+         * LTB (Linha de Tendência de Baixa): Linha teto dos candles de topos cada vez mais baixos/altos (sempre na tendência atual), ela forma entre a última Resistência após romper, e a última resistência atual.
+         * Conceito de LTA + LTB: Quando o mercado está perdendo a força entre tendência ou lateralização, usa-se as 2 linhas para identificar onde o mercado vai se romper LTA ou LTB.
+
+        --- 🚨 A LEI DO TIMING E O PULLBACK OBRIGATÓRIO 🚨 ---
+        REGRA DE OURO: É TOTALMENTE PROIBIDO ENTRAR NO ROMPIMENTO. O rompimento é apenas um aviso, NÃO É O GATILHO DE ENTRADA.
+        Imponha este protocolo de 4 passos:
+        1. Confirmação 1 (Macro): A tendência principal vista no M5 (1 hora) DEVE apoiar a direção. Se o M5 estiver lateralizado, não opere tendência.
+        2. Confirmação 2 e 3 (Rompimento e Volume): Houve um rompimento de estrutura com volume alto a favor da tendência M5? O rompimento é APENAS um aviso. Emita "WAIT".
+        3. O PULLBACK OBRIGATÓRIO: O robô DEVE ESPERAR o preço recuar e tocar no Suporte/Resistência recém rompido (ou na LTA/LTB).
+        4. Gatilho de Entrada (A Fraqueza): A ordem (BUY/SELL) só pode ser disparada quando o preço bater nesse nível de Pullback E o candle demonstrar fraqueza/rejeição (pavio contra o pullback, ex: doji, martelo), indicando que a tendência macro vai ser retomada. Pegue todo o movimento a favor sem entrar no topo/fundo esticado!
+        
+        Outras Regras de Proteção:
+        5. ⚠️ ALERTA DE REVERSÃO: Se o preço voltar contra a tendência RASGANDO o S/R e a LTA/LTB com velas fortes (engolfos) e volume alto, CANCELE a ideia de pullback e emita WAIT. NÃO tente adivinhar o fundo/topo.
+        6. ⚠️ EXCEÇÃO DE CONTRA-TENDÊNCIA (DUPLO ROMPIMENTO): A regra de nunca operar contra a tendência tem UMA ÚNICA EXCEÇÃO. Se ocorrer um "Duplo Rompimento" (rompimento simultâneo de uma LTA/LTB e de um Suporte/Resistência importante), você tem permissão para operar a reversão. PORÉM, essa reversão SÓ PODE SER OPERADA se o Duplo Rompimento for CONFIRMADO NO GRÁFICO M5. Se o duplo rompimento acontecer apenas no M1, trate como falso rompimento (ruído) e não opere.
+        7. TRAILLING STOP ÁGIL: Perceba as mudanças que podem dar loss e coloque o gain para 0 a 0 para se voltar o movimento dá tempo de reverter a perda, usando "decisao": "HOLD" ou "BREAKEVEN".
+
+        --- ⚖️ MODO SCALPER (LATERALIZAÇÃO) ⚖️ ---
+        Se a estrutura do mercado for "LATERALIZAÇÃO (Consolidação)":
+        1. ESQUEÇA ROMPIMENTOS: Em consolidação, rompimentos são armadilhas (Breakout Traps) em 80% das vezes.
+        2. OPERE AS EXTREMIDADES A FAVOR DA MACRO: Use o RSI e o Estocástico, mas SEMPRE respeitando a tendência do M15/M5.
+           - Se a macro for de ALTA, APENAS arme COMPRA no Suporte (RSI < 30). NUNCA venda na resistência.
+           - Se a macro for de BAIXA, APENAS arme VENDA na Resistência (RSI > 70). NUNCA compre no suporte.
+        3. FAST-EXIT (SAÍDA RÁPIDA): No campo "estrategia_escolhida", escreva "SCALPER_MODE".
+        4. ROMPIMENTO DE CAIXOTE: Se o preço romper a consolidação com FORÇA (Volume Anômalo + Vela de Força), a lateralização acabou. Mude para o modo Tendência e arme a ordem a favor do rompimento no primeiro pullback.
+
+        --- FILTROS DE VERBOSIDADE E ECONOMIA DE TOKENS ---
+        1. SE A DECISÃO FOR 'WAIT' E A ARMADILHA FOR 'NONE': O campo 'motivo' DEVE ser EXATAMENTE "[Preço <Preço Atual>] Status mantido. Aguardando confirmação." (com o Preço Atual informado nos dados). NÃO escreva mais nada.
+        2. A PRIMEIRA ANÁLISE: SE e SOMENTE SE a sua memória (estado_anterior) for "Iniciando...", você tem permissão para fazer textão.
+        3. TEXTO LONGO APENAS EM GATILHOS: Só justifique detalhadamente se a Relevância for 4★ ou 5★.
+
+        --- ANÁLISE MULTIMODAL (FOTOS A CADA 5 MINUTOS) ---
+        Se receber as FOTOS do M1 e M5, saiba ler o gráfico:
+        1. MÉDIAS MÓVEIS (CRUCIAL): A linha AMARELA brilhante é a Média Móvel Rápida (9). A linha AZUL CLARO é a Média Móvel Lenta (21). Use elas como zonas de Pullback dinâmico. Se o preço cruzar e fechar do outro lado da linha Azul com força, suspeite de Reversão!
+        2. DIAGONAIS PRIMEIRO: Procure linhas de tendência de alta (LTA) ou baixa (LTB) visuais para confirmar se a estrutura macro ainda está intacta durante o pullback.
+
+        --- O MANIFESTO DO CAMALEÃO (ANÁLISE DE CONTEXTO PROFUNDO) ---
+        1. CONTEXTO É REI: Antes de decidir atirar a mercado ou armar tocaia, você OBRIGATORIAMENTE deve cruzar 4 fatores: 
+           A) Estrutura (Rompeu LTA/LTB recente? Fez reteste? O Preço está acima ou abaixo das linhas Amarela e Azul?)
+           B) Volume (A anomalia de volume apoia o lado do rompimento? O volume secou durante o pullback?)
+           C) Zonas de S/R (O preço está na beira do abismo ou no meio do ruído?)
+           D) Padrões de Candle (Há engolfo, martelo, doji ou estrela cadente rejeitando a zona de reteste?)
+        2. REGRA DO DOUBLE CHECK (PRIMEIRO PASSO): Se você identificar um setup de alta probabilidade, NÃO envie BUY/SELL direto. Emita "WAIT_TO_BUY" ou "WAIT_TO_SELL" e grave na memória o motivo.
+        3. O TIRO DE CONFIRMAÇÃO (SEGUNDO PASSO): No ciclo de 15s seguinte, leia sua memória. Se a força se manteve e o candle confirmou o padrão a seu favor (ex: rejeitou o suporte no pullback), emita a decisão final "BUY" ou "SELL" para atirar a mercado.
+        4. PACIÊNCIA SNIPER (MEAN REVERSION): Se a foto mostrar o preço esticado longe das médias, NUNCA entre a favor do movimento. Aguarde a regressão à média (o preço retornar para perto da linha Amarela/Azul).
+        """
 
 class AITrader:
     def __init__(self):
         api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
+        # Gemini ao vivo, gravando em cassete ou reproduzindo um cassete offline (GEMINI_BACKEND)
+        self.backend = criar_backend(lambda: genai.Client(api_key=api_key))
+        if not api_key and self.backend.client is not None:
             print("ERRO CRÍTICO: GEMINI_API_KEY não configurada no .env.")
+        if self.backend.client is None:
+            print(f"📼 IA em replay offline: {self.backend.estatisticas()}")
         
-        self.client = genai.Client(api_key=api_key)
+        self.client = self.backend.client
         self.model_name = "gemini-2.5-flash-lite"
         self.fallback_model_name = "gemini-2.5-flash"
+        # Tempo máximo de uma chamada ao modelo antes de cancelar e responder WAIT
+        self.timeout_ia = float(os.getenv("GEMINI_TIMEOUT", "20"))
+        # Instrução de sistema registrada uma vez por modelo no cache de contexto do Gemini
+        self.cache_instrucao = CacheInstrucao(self.client, ttl_segundos=int(os.getenv("GEMINI_CACHE_TTL", "3600")))
+        # Saída estruturada (response_schema + validação em RespostaIA); GEMINI_SCHEMA=0 volta ao JSON livre
+        self.usar_schema = os.getenv("GEMINI_SCHEMA", "1") != "0"
+        # Streaming com decisão antecipada (GEMINI_STREAM=1): a armadilha/execução não espera a narrativa
+        self.usar_stream = os.getenv("GEMINI_STREAM", "0") == "1"
+        # RAIO-X no prompt: "verboso" (rótulos por campo) ou "compacto" (cabeçalho + CSV relativo à REF)
+        self.formato_candles = os.getenv("PROMPT_CANDLES", "verboso").lower()
+        self.metricas_resposta = MetricasResposta()
+        # Chamadas simultâneas ao modelo e cota por modelo (requisições por minuto; sem cota no replay offline)
+        self.pool = PoolInferencia(
+            max_concorrencia=int(os.getenv("IA_MAX_CONCORRENCIA", "4")),
+            limites_rpm={
+                self.model_name: int(os.getenv("GEMINI_RPM", "60")),
+                self.fallback_model_name: int(os.getenv("GEMINI_RPM_FALLBACK", "60")),
+            } if self.backend.client is not None else None
+        )
+        # Principal com hedge no reserva a partir do p95 e disjuntor por modelo (GEMINI_HEDGE=0 desliga o hedge)
+        self.roteador = RoteadorModelos(
+            [self.model_name, self.fallback_model_name],
+            hedge=os.getenv("GEMINI_HEDGE", "1") != "0",
+            atraso_minimo=float(os.getenv("GEMINI_HEDGE_MINIMO", "1.0")),
+            limite_falhas=int(os.getenv("GEMINI_DISJUNTOR_FALHAS", "3")),
+            pausa=float(os.getenv("GEMINI_DISJUNTOR_PAUSA", "60"))
+        )
         self.radar = NewsRadar()
+        self.detectores_pivots = {}
+        self.fragmentos = CacheFragmentos()
 
     def _analise_estatistica_previa(self, df_m1, df_m5):
         """Calcula saúde macro, padrões e suportes REAIS do momento exato (INTEGRADO)."""
@@ -146,131 +215,41 @@ class AITrader:
             "min_recente_m5": min_recente
         }
 
-    def _formatar_candles_raio_x(self, df, num_candles):
-        """Formata os candles fechados com cálculo exato de pavios e indicadores para a IA."""
+    def _formatar_candles_raio_x(self, df, num_candles, ativo=None, rotulo=""):
+        """Formata os candles fechados com cálculo exato de pavios e indicadores para a IA.
+        Com `ativo`, as linhas dos candles já vistos vêm do cache de fragmentos."""
         if df is None or df.empty or len(df) < 2: return "N/A"
+        if ativo:
+            return self.fragmentos.raio_x(ativo, rotulo, df, num_candles)
         # Remove o candle atual (aberto) e pega os últimos 'num_candles'
-        df_closed = df.iloc[:-1].tail(num_candles)
-        linhas = []
-        for _, row in df_closed.iterrows():
-            if isinstance(row['time'], (int, float, np.integer, np.floating)):
-                tempo = pd.to_datetime(row['time'], unit='s').strftime('%H:%M')
-            else:
-                tempo = pd.to_datetime(row['time']).strftime('%H:%M')
-            o, h, l, c = row['open'], row['high'], row['low'], row['close']
-            pavio_sup = h - max(o, c)
-            pavio_inf = min(o, c) - l
-            
-            # Adiciona RSI e Estocástico se existirem no DataFrame
-            rsi = f" | RSI: {row['rsi_14']:.1f}" if 'rsi_14' in row else ""
-            stoch = f" | StochK: {row['stoch_k']:.1f}" if 'stoch_k' in row else ""
-            vwap = f" | VWAP: {row['vwap']:.5f}" if 'vwap' in row else ""
-            
-            linhas.append(f"[Tempo: {tempo} | Abertura: {o:.5f} | Max: {h:.5f} | Min: {l:.5f} | Fechamento: {c:.5f} | Pavio Sup: {pavio_sup:.5f} | Pavio Inf: {pavio_inf:.5f}{rsi}{stoch}{vwap}]")
+        _, linhas = formatar_linhas_raio_x(df.iloc[:-1].tail(num_candles))
         return "\n".join(linhas)
 
-    def _encontrar_pivots(self, df, num_pivots=3):
-        """Encontra os últimos topos e fundos confirmados (Pivot Points) com proteção anti-ruído."""
+    def _encontrar_pivots(self, df, num_pivots=3, chave=None):
+        """Encontra os últimos topos e fundos confirmados (Pivot Points) com proteção anti-ruído.
+        Com `chave` (ativo, timeframe) usa o detector incremental da série, que só avalia os candles novos."""
         if df is None or len(df) < 10: return "N/A"
         
         # Proteção: Se o DataFrame não tiver dados suficientes para a janela, reduz a exigência
-        janela = 2 if len(df) > 20 else 1
-        
-        highs = df['high'].values
-        lows = df['low'].values
-        times = df['time'].values
-        
-        topos = []
-        fundos = []
+        janela = janela_pivots(len(df))
         
         try:
-            for i in range(janela, len(df) - janela):
-                # Verifica se é o maior valor na janela local (Topo)
-                is_topo = True
-                for j in range(1, janela + 1):
-                    if highs[i] <= highs[i-j] or highs[i] <= highs[i+j]:
-                        is_topo = False
-                        break
-                
-                if is_topo:
-                    t = times[i]
-                    if isinstance(t, (int, float, np.integer, np.floating)):
-                        t_str = pd.to_datetime(t, unit='s').strftime('%H:%M')
-                    else:
-                        t_str = pd.to_datetime(t).strftime('%H:%M')
-                    topos.append(f"{highs[i]:.5f} ({t_str})")
-                
-                # Verifica se é o menor valor na janela local (Fundo)
-                is_fundo = True
-                for j in range(1, janela + 1):
-                    if lows[i] >= lows[i-j] or lows[i] >= lows[i+j]:
-                        is_fundo = False
-                        break
-                        
-                if is_fundo:
-                    t = times[i]
-                    if isinstance(t, (int, float, np.integer, np.floating)):
-                        t_str = pd.to_datetime(t, unit='s').strftime('%H:%M')
-                    else:
-                        t_str = pd.to_datetime(t).strftime('%H:%M')
-                    fundos.append(f"{lows[i]:.5f} ({t_str})")
+            if chave is None:
+                topos, fundos = encontrar_pivots(df['high'].values, df['low'].values, df['time'].values, janela)
+            else:
+                detector = self.detectores_pivots.get(chave)
+                if detector is None or detector.janela != janela:
+                    detector = DetectorPivots(janela)
+                    self.detectores_pivots[chave] = detector
+                topos, fundos = detector.atualizar(df['high'].values, df['low'].values, df['time'].values)
         except Exception as e:
             print(f"Aviso: Erro ao calcular pivôs: {e}")
-            pass
-                
-        topos_str = ", ".join(topos[-num_pivots:]) if topos else "Nenhum topo claro"
-        fundos_str = ", ".join(fundos[-num_pivots:]) if fundos else "Nenhum fundo claro"
+            topos = fundos = np.empty(0, dtype=DTYPE_PIVOT)
         
-        # Define a estrutura Macro (Tendência vs Lateralização)
-        estrutura = "INDEFINIDA"
-        if len(topos) >= 2 and len(fundos) >= 2:
-            ultimo_topo = float(topos[-1].split(" ")[0])
-            penultimo_topo = float(topos[-2].split(" ")[0])
-            ultimo_fundo = float(fundos[-1].split(" ")[0])
-            penultimo_fundo = float(fundos[-2].split(" ")[0])
-            
-            # Tolerância para lateralização (0.05% do preço)
-            tolerancia = ultimo_topo * 0.0005
-            
-            if (ultimo_topo > penultimo_topo + tolerancia) and (ultimo_fundo > penultimo_fundo + tolerancia):
-                estrutura = "TENDÊNCIA DE ALTA (HH/HL)"
-            elif (ultimo_topo < penultimo_topo - tolerancia) and (ultimo_fundo < penultimo_fundo - tolerancia):
-                estrutura = "TENDÊNCIA DE BAIXA (LH/LL)"
-            else:
-                estrutura = "LATERALIZAÇÃO (Consolidação)"
-        
-        return f"Estrutura: {estrutura} | Topos: {topos_str} | Fundos: {fundos_str}"
-
-    def analisar_mercado(self, dados_macro_df, dados_micro_df, estrategia: str, relevancia_anterior: int, dados_ontem: dict, estado_anterior: str = "", image_path_m1: str = None, image_path_m5: str = None, posicao_aberta: dict = None) -> dict:
-        """
-        BRAIN V8.0 - HEDGE FUND MODE (Fotos a cada 5m + Ordens Programadas)
-        """
-        df_m1 = dados_micro_df.get("m1")
-        df_m5 = dados_micro_df.get("m5")
-        df_m15 = dados_macro_df if dados_macro_df is not None else dados_micro_df.get("m15")
-
-        if df_m1 is None or df_m1.empty:
-            return {"relevancia": 1, "decisao": "WAIT", "motivo": "Aguardando fluxo de dados..."}
-
-        # 1. ESCUDO FUNDAMENTALISTA (NEWS)
-        noticia_ativa, nome_evento = self.radar.verificar_bloqueio_operacional()
-        if noticia_ativa:
-            return {
-                "relevancia": 5, "decisao": "WAIT",
-                "motivo": f"BLOQUEIO: Notícia de Alto Impacto ({nome_evento}) detectada. Protegendo capital.",
-                "regime_mercado": "Alta Volatilidade / Manipulação de News",
-                "estado_operacional": "Aguardando",
-                "ordem_programada": {"acao": "NONE", "preco_gatilho": 0.0, "motivo_gatilho": ""},
-                "estudos_visuais": {"linhas_tendencia": [], "suporte_resistencia": [], "fibo_proposals": []}
-            }
+        return formatar_pivots(topos, fundos, num_pivots)
 
-        # 2. INTELIGÊNCIA MATEMÁTICA E MÉTRICAS
-        stats = self._analise_estatistica_previa(df_m1, df_m5)
-        preco_atual = df_m1['close'].iloc[-1]
-        vwap_atual = df_m1['vwap'].iloc[-1] if 'vwap' in df_m1.columns else preco_atual
-        atr_atual = stats.get('atr', 0)
-        
-        # --- ANÁLISE DE GAP E SESSÃO ---
+    def _analisar_gap_sessao(self, df_m1, dados_ontem):
+        """Gap de abertura contra o fechamento de ontem e tempo decorrido do pregão."""
         gap_info = "Sem dados de gap."
         sessao_info = "Sessão em andamento."
         
@@ -324,6 +303,53 @@ class AITrader:
                     sessao_info = f"INÍCIO DE PREGÃO (Aberto há {int(minutos_desde_abertura)} min). ATENÇÃO: Alta volatilidade, falsos rompimentos e formação de nova tendência."
                 else:
                     sessao_info = f"PREGÃO EM ANDAMENTO (Aberto há {int(minutos_desde_abertura/60)}h {int(minutos_desde_abertura%60)}m)."
+
+        return gap_info, sessao_info
+
+    def _secao(self, ativo, nome, chave, calcular):
+        """Seção do contexto memoizada no cache de fragmentos do ativo (sem ativo, calcula direto)."""
+        if not ativo or chave is None:
+            return calcular()
+        return self.fragmentos.secao(ativo, nome, chave, calcular)
+
+    def _preparar_analise(self, dados_macro_df, dados_micro_df, estrategia: str, relevancia_anterior: int, dados_ontem: dict, estado_anterior: str = "", image_path_m1: str = None, image_path_m5: str = None, posicao_aberta: dict = None, ativo: str = None, digitos: int = None):
+        """
+        BRAIN V8.0 - HEDGE FUND MODE (Fotos a cada 5m + Ordens Programadas)
+        Monta a requisição ao modelo. Devolve (resposta_imediata, None) quando não há o que perguntar
+        (sem dados, bloqueio de notícia) ou (None, (contents_payload, system_instruction)).
+        """
+        df_m1 = dados_micro_df.get("m1")
+        df_m5 = dados_micro_df.get("m5")
+        df_m15 = dados_macro_df if dados_macro_df is not None else dados_micro_df.get("m15")
+
+        if df_m1 is None or df_m1.empty:
+            return {"relevancia": 1, "decisao": "WAIT", "motivo": "Aguardando fluxo de dados..."}, None
+
+        # 1. ESCUDO FUNDAMENTALISTA (NEWS)
+        noticia_ativa, nome_evento = self.radar.verificar_bloqueio_operacional(ativo)
+        if noticia_ativa:
+            return {
+                "relevancia": 5, "decisao": "WAIT",
+                "motivo": f"BLOQUEIO: Notícia de Alto Impacto ({nome_evento}) detectada. Protegendo capital.",
+                "regime_mercado": "Alta Volatilidade / Manipulação de News",
+                "estado_operacional": "Aguardando",
+                "ordem_programada": {"acao": "NONE", "preco_gatilho": 0.0, "motivo_gatilho": ""},
+                "estudos_visuais": {"linhas_tendencia": [], "suporte_resistencia": [], "fibo_proposals": []}
+            }, None
+
+        # 2. INTELIGÊNCIA MATEMÁTICA E MÉTRICAS
+        # Seções memoizadas por ativo: só recalculam quando muda o último candle fechado
+        # ou algum campo do candle em formação que a seção lê
+        chave_stats = (chave_candles(df_m1, ('high', 'low', 'close', 'tick_volume', 'atr_14')), chave_candles(df_m5))
+        stats = self._secao(ativo, "stats", chave_stats, lambda: self._analise_estatistica_previa(df_m1, df_m5))
+        preco_atual = df_m1['close'].iloc[-1]
+        vwap_atual = df_m1['vwap'].iloc[-1] if 'vwap' in df_m1.columns else preco_atual
+        atr_atual = stats.get('atr', 0)
+        
+        # --- ANÁLISE DE GAP E SESSÃO ---
+        fechamento_ontem = dados_ontem.get('fechamento_ontem') if dados_ontem else None
+        gap_info, sessao_info = self._secao(ativo, "gap_sessao", (chave_candles(df_m1, ()), fechamento_ontem),
+                                            lambda: self._analisar_gap_sessao(df_m1, dados_ontem))
         
         # Zonas de Liquidez
         sup_m15 = df_m15['low'].min() if df_m15 is not None and not df_m15.empty else 0
@@ -332,110 +358,24 @@ class AITrader:
         contexto_ontem = f"MÁXIMA: {dados_ontem.get('maxima_ontem')} | MÍNIMA: {dados_ontem.get('minima_ontem')} | FECHAMENTO: {dados_ontem.get('fechamento_ontem')}" if dados_ontem else "Sem dados de ontem."
 
         # RAIO-X FRACTAL (Pré-Processamento para a IA)
-        raio_x_m1 = self._formatar_candles_raio_x(df_m1, 30)
-        raio_x_m5 = self._formatar_candles_raio_x(df_m5, 36)
-        pivots_m1 = self._encontrar_pivots(df_m1, 3)
-        pivots_m5 = self._encontrar_pivots(df_m5, 3)
+        if self.formato_candles == "compacto":
+            # Casas decimais do ativo (WIN/WDO sem as 5 casas de ruído); sem especificação, 5 casas como antes
+            casas = 5 if digitos is None else int(digitos)
+            titulo_raio_x = "RAIO-X FRACTAL (CANDLES FECHADOS; preço = REF + valor da tabela, psup/pinf = pavios)"
+            raio_x_m1 = raio_x_compacto(df_m1, 30, casas)
+            raio_x_m5 = raio_x_compacto(df_m5, 36, casas)
+        else:
+            titulo_raio_x = "RAIO-X FRACTAL (CANDLES FECHADOS COM PAVIOS)"
+            raio_x_m1 = self._formatar_candles_raio_x(df_m1, 30, ativo, "M1")
+            raio_x_m5 = self._formatar_candles_raio_x(df_m5, 36, ativo, "M5")
+        pivots_m1 = self._secao(ativo, "pivots_m1", chave_candles(df_m1, ('high', 'low')),
+                                lambda: self._encontrar_pivots(df_m1, 3, (ativo, "M1") if ativo else None))
+        pivots_m5 = self._secao(ativo, "pivots_m5", chave_candles(df_m5, ('high', 'low')),
+                                lambda: self._encontrar_pivots(df_m5, 3, (ativo, "M5") if ativo else None))
 
         # 3. CONSTRUÇÃO DO CÉREBRO DA IA (ESTRUTURA HEDGE FUND)
-        system_instruction = f"""
-        Você é um Quant Trader Sênior Híbrido operando como 'Camaleão Dinâmico' Multimodal (Lê Texto, Números e IMAGENS).
-        Sua missão é gerar lucro implacável, focar em PULLBACKS SAUDÁVEIS e evitar REVERSÕES.
-
-        ESTRUTURA DE DADOS OBRIGATÓRIA (Siga o JSON estritamente):
-        {{
-            "relevancia": inteiro de 1 a 5,
-            "decisao": "WAIT", "WAIT_TO_BUY", "WAIT_TO_SELL", "BUY", "SELL", "HOLD", ou "BREAKEVEN",
-            "motivo": "Explicação do momento.",
-            "regime_mercado": "Ex: Colapso M1 / Consolidação M15",
-            "estrategia_escolhida": "Nome do sub-modo ativado",
-            "raciocinio_macro": "Leitura rápida M15",
-            "raciocinio_micro": "Leitura rápida M1 e M5",
-            "adaptabilidade": "Justificativa curta de mudança",
-            "probabilidade_acerto": "Ex: '85%'",
-            "estado_operacional": "SUA MEMÓRIA. OBRIGATÓRIO INICIAR COM O PREÇO. Ex: '[Preço {preco_atual}] Aguardando pullback no suporte.'",
-            "ordem_programada": {{
-                "acao": "BUY", "SELL" ou "NONE",
-                "preco_gatilho": 0.0,
-                "motivo_gatilho": "Breve motivo da armadilha"
-            }},
-            "estudos_visuais": {{
-                "suporte": 0.0,
-                "resistencia": 0.0,
-                "tendencia_direcao": "UP", "DOWN" ou "SIDEWAYS",
-                "tendencia_preco": 0.0,
-                "linhas_tendencia": [],
-                "fibo_proposals": []
-            }}
-        }}
-        
-        --- INSTRUÇÕES BÁSICAS DE OPERACIONAL DO MERCADO ---
-        0. REGRA DE TENDÊNCIA (CRÍTICA E INQUEBRÁVEL): A TENDÊNCIA (Direção de Compra ou Venda) DEVE SER DEFINIDA EXCLUSIVAMENTE PELO GRÁFICO M5 E M15. Analise os topos e fundos maiores/menores das últimas horas. O Gráfico M1 serve APENAS para refinar o timing de entrada (gatilho) A FAVOR da tendência macro. 
-           - Se o M5 diz ALTA (LTA), você SÓ PODE procurar COMPRA no M1. É ESTRITAMENTE PROIBIDO VENDER.
-           - Se o M5 diz BAIXA (LTB), você SÓ PODE procurar VENDA no M1. É ESTRITAMENTE PROIBIDO COMPRAR.
-           - Micro-tendências contrárias no M1 e falsos rompimentos DEVEM SER IGNORADOS como ruído. NUNCA opere contra a tendência macro acreditando em reversões antecipadas do M1.
-        1. A LEI DA VWAP (VOLUME WEIGHTED AVERAGE PRICE): Institucionais operam pela VWAP. 
-           - NUNCA compre se o preço estiver ABAIXO da VWAP.
-           - NUNCA venda se o preço estiver ACIMA da VWAP.
-           - A VWAP atua como um ímã (Mean Reversion) e como suporte/resistência dinâmico.
-        2. VOLATILIDADE E STOP LOSS (ATR): O ATR (Average True Range) mede a volatilidade real.
-           - Use o ATR atual ({atr_atual:.5f}) para definir o Stop Loss. Exemplo: Stop Loss = 1.5x ATR.
-           - Se o ATR estiver muito alto, exija confirmações mais fortes antes de entrar.
-        3. ZONAS DE LIQUIDEZ (D-1): As Máximas e Mínimas do dia anterior são piscinas de liquidez.
-           - Comprar exatamente em cima da Máxima de ontem é suicídio (armadilha de liquidez).
-           - Vender exatamente em cima da Mínima de ontem é suicídio.
-           - Espere o rompimento claro ou a rejeição nessas zonas.
-        4. SUPORTE E RESISTÊNCIA (S/R): 
-         * Suporte (S): É sempre a base (parte de baixo) do movimento que forma topos e fundos.
-         * Resistência (R): É sempre o teto (parte de cima) do movimento que forma topos e fundos.
-        5. PullBack: Estratégia de operar a favor da tendência buscando maior margem quando acontece uma correção (recuo) tocando S/R e entrando a favor da tendência.
-        6. LINHAS DE TENDÊNCIA:
-         * LTA (Linha de Tendência de Alta): Linha base dos candles de fundos cada vez mais altos/baixos (sempre na tendência atual), ela forma entre o último Suporte após romper, e o último Suporte atual.
-         * LTB (Linha de Tendência de Baixa): Linha teto dos candles de topos cada vez mais baixos/altos (sempre na tendência atual), ela forma entre a última Resistência após romper, e a última resistência atual.
-         * Conceito de LTA + LTB: Quando o mercado está perdendo a força entre tendência ou lateralização, usa-se as 2 linhas para identificar onde o mercado vai se romper LTA ou LTB.
-
-        --- 🚨 A LEI DO TIMING E O PULLBACK OBRIGATÓRIO 🚨 ---
-        REGRA DE OURO: É TOTALMENTE PROIBIDO ENTRAR NO ROMPIMENTO. O rompimento é apenas um aviso, NÃO É O GATILHO DE ENTRADA.
-        Imponha este protocolo de 4 passos:
-        1. Confirmação 1 (Macro): A tendência principal vista no M5 (1 hora) DEVE apoiar a direção. Se o M5 estiver lateralizado, não opere tendência.
-        2. Confirmação 2 e 3 (Rompimento e Volume): Houve um rompimento de estrutura com volume alto a favor da tendência M5? O rompimento é APENAS um aviso. Emita "WAIT".
-        3. O PULLBACK OBRIGATÓRIO: O robô DEVE ESPERAR o preço recuar e tocar no Suporte/Resistência recém rompido (ou na LTA/LTB).
-        4. Gatilho de Entrada (A Fraqueza): A ordem (BUY/SELL) só pode ser disparada quando o preço bater nesse nível de Pullback E o candle demonstrar fraqueza/rejeição (pavio contra o pullback, ex: doji, martelo), indicando que a tendência macro vai ser retomada. Pegue todo o movimento a favor sem entrar no topo/fundo esticado!
-        
-        Outras Regras de Proteção:
-        5. ⚠️ ALERTA DE REVERSÃO: Se o preço voltar contra a tendência RASGANDO o S/R e a LTA/LTB com velas fortes (engolfos) e volume alto, CANCELE a ideia de pullback e emita WAIT. NÃO tente adivinhar o fundo/topo.
-        6. ⚠️ EXCEÇÃO DE CONTRA-TENDÊNCIA (DUPLO ROMPIMENTO): A regra de nunca operar contra a tendência tem UMA ÚNICA EXCEÇÃO. Se ocorrer um "Duplo Rompimento" (rompimento simultâneo de uma LTA/LTB e de um Suporte/Resistência importante), você tem permissão para operar a reversão. PORÉM, essa reversão SÓ PODE SER OPERADA se o Duplo Rompimento for CONFIRMADO NO GRÁFICO M5. Se o duplo rompimento acontecer apenas no M1, trate como falso rompimento (ruído) e não opere.
-        7. TRAILLING STOP ÁGIL: Perceba as mudanças que podem dar loss e coloque o gain para 0 a 0 para se voltar o movimento dá tempo de reverter a perda, usando "decisao": "HOLD" ou "BREAKEVEN".
-
-        --- ⚖️ MODO SCALPER (LATERALIZAÇÃO) ⚖️ ---
-        Se a estrutura do mercado for "LATERALIZAÇÃO (Consolidação)":
-        1. ESQUEÇA ROMPIMENTOS: Em consolidação, rompimentos são armadilhas (Breakout Traps) em 80% das vezes.
-        2. OPERE AS EXTREMIDADES A FAVOR DA MACRO: Use o RSI e o Estocástico, mas SEMPRE respeitando a tendência do M15/M5.
-           - Se a macro for de ALTA, APENAS arme COMPRA no Suporte (RSI < 30). NUNCA venda na resistência.
-           - Se a macro for de BAIXA, APENAS arme VENDA na Resistência (RSI > 70). NUNCA compre no suporte.
-        3. FAST-EXIT (SAÍDA RÁPIDA): No campo "estrategia_escolhida", escreva "SCALPER_MODE".
-        4. ROMPIMENTO DE CAIXOTE: Se o preço romper a consolidação com FORÇA (Volume Anômalo + Vela de Força), a lateralização acabou. Mude para o modo Tendência e arme a ordem a favor do rompimento no primeiro pullback.
-
-        --- FILTROS DE VERBOSIDADE E ECONOMIA DE TOKENS ---
-        1. SE A DECISÃO FOR 'WAIT' E A ARMADILHA FOR 'NONE': O campo 'motivo' DEVE ser EXATAMENTE "[Preço {preco_atual}] Status mantido. Aguardando confirmação.". NÃO escreva mais nada.
-        2. A PRIMEIRA ANÁLISE: SE e SOMENTE SE a sua memória (estado_anterior) for "Iniciando...", você tem permissão para fazer textão.
-        3. TEXTO LONGO APENAS EM GATILHOS: Só justifique detalhadamente se a Relevância for 4★ ou 5★.
-
-        --- ANÁLISE MULTIMODAL (FOTOS A CADA 5 MINUTOS) ---
-        Se receber as FOTOS do M1 e M5, saiba ler o gráfico:
-        1. MÉDIAS MÓVEIS (CRUCIAL): A linha AMARELA brilhante é a Média Móvel Rápida (9). A linha AZUL CLARO é a Média Móvel Lenta (21). Use elas como zonas de Pullback dinâmico. Se o preço cruzar e fechar do outro lado da linha Azul com força, suspeite de Reversão!
-        2. DIAGONAIS PRIMEIRO: Procure linhas de tendência de alta (LTA) ou baixa (LTB) visuais para confirmar se a estrutura macro ainda está intacta durante o pullback.
-
-        --- O MANIFESTO DO CAMALEÃO (ANÁLISE DE CONTEXTO PROFUNDO) ---
-        1. CONTEXTO É REI: Antes de decidir atirar a mercado ou armar tocaia, você OBRIGATORIAMENTE deve cruzar 4 fatores: 
-           A) Estrutura (Rompeu LTA/LTB recente? Fez reteste? O Preço está acima ou abaixo das linhas Amarela e Azul?)
-           B) Volume (A anomalia de volume apoia o lado do rompimento? O volume secou durante o pullback?)
-           C) Zonas de S/R (O preço está na beira do abismo ou no meio do ruído?)
-           D) Padrões de Candle (Há engolfo, martelo, doji ou estrela cadente rejeitando a zona de reteste?)
-        2. REGRA DO DOUBLE CHECK (PRIMEIRO PASSO): Se você identificar um setup de alta probabilidade, NÃO envie BUY/SELL direto. Emita "WAIT_TO_BUY" ou "WAIT_TO_SELL" e grave na memória o motivo.
-        3. O TIRO DE CONFIRMAÇÃO (SEGUNDO PASSO): No ciclo de 15s seguinte, leia sua memória. Se a força se manteve e o candle confirmou o padrão a seu favor (ex: rejeitou o suporte no pullback), emita a decisão final "BUY" ou "SELL" para atirar a mercado.
-        4. PACIÊNCIA SNIPER (MEAN REVERSION): Se a foto mostrar o preço esticado longe das médias, NUNCA entre a favor do movimento. Aguarde a regressão à média (o preço retornar para perto da linha Amarela/Azul).
-        """
+        # A instrução de sistema é estática (INSTRUCAO_SISTEMA, registrada no cache de contexto);
+        # tudo o que muda a cada análise (preço, ATR, memória, candles) vai no prompt
 
         status_posicao_str = f"ABERTA -> {posicao_aberta['type']} no preço {posicao_aberta['price_open']} (Lucro: {posicao_aberta['profit']})" if posicao_aberta else "NENHUMA (Aguardando nova entrada)"
         
@@ -471,7 +411,7 @@ class AITrader:
         Pivots M1: {pivots_m1}
         Macro (M15): S:{sup_m15} / R:{res_m15}
         
-        RAIO-X FRACTAL (CANDLES FECHADOS COM PAVIOS):
+        {titulo_raio_x}:
         M5 (Últimos 36 candles - Coração do Fluxo): 
         {raio_x_m5}
         
@@ -502,47 +442,203 @@ class AITrader:
             except Exception as e:
                 pass
 
+        return None, (contents_payload, INSTRUCAO_SISTEMA)
+
+    def _config_geracao(self, system_instruction, cache_nome=None):
+        if cache_nome:
+            # Instrução servida pelo cache de contexto: só o prompt dinâmico é enviado
+            return types.GenerateContentConfig(
+                cached_content=cache_nome,
+                response_mime_type="application/json",
+                response_schema=ESQUEMA_RESPOSTA if self.usar_schema else None,
+                temperature=0.2
+            )
+        return types.GenerateContentConfig(
+            system_instruction=system_instruction,
+            response_mime_type="application/json",
+            response_schema=ESQUEMA_RESPOSTA if self.usar_schema else None,
+            temperature=0.2
+        )
+
+    def _interpretar_resposta(self, modelo, response, segundos, com_cache) -> dict:
+        """Valida a resposta contra o contrato (RespostaIA) e registra tokens, latência e falhas de parse."""
+        self.cache_instrucao.registrar_uso(modelo, response, segundos, com_cache)
+        modo = "schema" if self.usar_schema else "livre"
         try:
-            # Chamada unificada enviando texto e AS DUAS imagens
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=contents_payload, 
-                config=types.GenerateContentConfig(
-                    system_instruction=system_instruction,
-                    response_mime_type="application/json",
-                    temperature=0.2
-                )
+            resposta = RespostaIA.de_json(response.text, estrito=self.usar_schema)
+        except ErroRespostaIA as e:
+            self.metricas_resposta.registrar(modo, response, segundos, falhou=True)
+            print(f"⚠️ [{modelo}] Resposta fora do contrato: {e}")
+            raise
+        self.metricas_resposta.registrar(modo, response, segundos, falhou=False)
+        return resposta.para_dict()
+
+    @staticmethod
+    def _erro_de_cache(erro) -> bool:
+        return "cache" in str(erro).lower()
+
+    def _gerar_conteudo(self, modelo, contents_payload, system_instruction) -> dict:
+        """Chamada síncrona ao modelo (texto + imagens) já convertida para dict."""
+        cache_nome = self.cache_instrucao.obter(modelo, system_instruction)
+        inicio = time.perf_counter()
+        try:
+            response = self.backend.gerar(
+                modelo, contents_payload, self._config_geracao(system_instruction, cache_nome), system_instruction
             )
-            return json.loads(response.text)
-            
         except Exception as e:
-            if "503" in str(e) or "UNAVAILABLE" in str(e):
-                print(f"⚠️ Modelo {self.model_name} indisponível (503). Tentando fallback para {self.fallback_model_name}...")
+            if not cache_nome or not self._erro_de_cache(e):
+                raise
+            # Cache expirado/apagado do lado do Gemini: repete com a instrução inline e recria depois
+            self.cache_instrucao.invalidar(modelo, system_instruction)
+            cache_nome = None
+            inicio = time.perf_counter()
+            response = self.backend.gerar(
+                modelo, contents_payload, self._config_geracao(system_instruction), system_instruction
+            )
+        return self._interpretar_resposta(modelo, response, time.perf_counter() - inicio, cache_nome is not None)
+
+    async def _ler_stream(self, modelo, contents_payload, config, system_instruction, ao_decidir, parcial: dict):
+        """
+        Consome a resposta em streaming com o parser incremental. Quando os campos de decisão fecham
+        (e passam na validação), entrega a decisão a `ao_decidir` e guarda em `parcial`; a narrativa
+        segue chegando. Devolve o texto inteiro no formato de resposta do backend.
+        """
+        inicio = time.perf_counter()
+        leitor = LeitorJSONIncremental()
+        textos, uso, segundos_decisao = [], None, None
+        async for trecho in self.backend.gerar_stream_async(modelo, contents_payload, config, system_instruction):
+            texto = getattr(trecho, "text", None) or ""
+            textos.append(texto)
+            uso = getattr(trecho, "usage_metadata", None) or uso
+            leitor.alimentar(texto)
+            if segundos_decisao is None and leitor.tem_campos():
+                segundos_decisao = time.perf_counter() - inicio
                 try:
-                    response = self.client.models.generate_content(
-                        model=self.fallback_model_name,
-                        contents=contents_payload, 
-                        config=types.GenerateContentConfig(
-                            system_instruction=system_instruction,
-                            response_mime_type="application/json",
-                            temperature=0.2
-                        )
-                    )
-                    return json.loads(response.text)
-                except Exception as fallback_e:
-                    print(f"❌ Erro no fallback: {fallback_e}")
-                    return {
-                        "relevancia": 1, "decisao": "WAIT", 
-                        "motivo": f"Erro IA Multimodal (Fallback): {str(fallback_e)}",
-                        "estado_operacional": f"Aguardando estabilidade. Erro na leitura visual dupla.", 
-                        "ordem_programada": {"acao": "NONE", "preco_gatilho": 0.0, "motivo_gatilho": ""},
-                        "estudos_visuais": {"suporte_resistencia": []}
-                    }
+                    parcial.update(RespostaIA.de_dict(leitor.campos).para_dict())
+                except ErroRespostaIA:
+                    continue   # decisão fora do contrato: o loop recebe o erro da resposta completa
+                ao_decidir(dict(parcial))
+        if parcial:
+            self.metricas_resposta.registrar_fluxo(segundos_decisao, time.perf_counter() - inicio)
+        return RespostaGravada("".join(textos), uso)
+
+    async def _gerar_conteudo_async(self, modelo, contents_payload, system_instruction, ao_decidir=None, prioridade=0,
+                                    ao_iniciar=None) -> dict:
+        """
+        Chamada assíncrona ao modelo (client.aio): o event loop segue atendendo ticks e gráfico
+        enquanto o modelo pensa. Passa pelo pool de inferência (vaga + cota do modelo); a partir da
+        saída da fila, estoura asyncio.TimeoutError após `timeout_ia` segundos. Cancelar a task que
+        aguarda também cancela a requisição HTTP.
+        A chamada em si é do backend (Gemini ao vivo, gravador ou reprodutor de cassete). Com streaming
+        e `ao_decidir`, a decisão é entregue antes do fim da resposta; se a chamada falhar ou o tempo
+        estourar depois dela, a decisão sem a narrativa vale como resposta.
+        `ao_iniciar()` é chamado quando a requisição sai da fila do pool (relógio de latência do roteador).
+        """
+        cache_nome = await self.cache_instrucao.obter_async(modelo, system_instruction)
+        parcial = {}
+
+        def chamada(cache_nome):
+            if ao_iniciar is not None:
+                ao_iniciar()
+            config = self._config_geracao(system_instruction, cache_nome)
+            if self.usar_stream and ao_decidir is not None:
+                corrotina = self._ler_stream(modelo, contents_payload, config, system_instruction, ao_decidir, parcial)
             else:
-                return {
-                    "relevancia": 1, "decisao": "WAIT", 
-                    "motivo": f"Erro IA Multimodal Dupla: {str(e)}",
-                    "estado_operacional": f"Aguardando estabilidade. Erro na leitura visual dupla.", 
-                    "ordem_programada": {"acao": "NONE", "preco_gatilho": 0.0, "motivo_gatilho": ""},
-                    "estudos_visuais": {"suporte_resistencia": []}
-                }
\ No newline at end of file
+                corrotina = self.backend.gerar_async(modelo, contents_payload, config, system_instruction)
+            return asyncio.wait_for(corrotina, timeout=self.timeout_ia)
+
+        inicio = time.perf_counter()
+        try:
+            response = await self.pool.executar(modelo, lambda: chamada(cache_nome), prioridade)
+        except Exception as e:
+            if parcial:
+                motivo = f"timeout de {self.timeout_ia:.0f}s" if isinstance(e, asyncio.TimeoutError) else str(e)
+                print(f"⏱️ [{modelo}] Resposta interrompida depois da decisão ({motivo}). Vale a decisão sem a narrativa.")
+                return parcial
+            if not cache_nome or not self._erro_de_cache(e):
+                raise
+            # Cache expirado/apagado do lado do Gemini: repete com a instrução inline e recria depois
+            self.cache_instrucao.invalidar(modelo, system_instruction)
+            cache_nome = None
+            inicio = time.perf_counter()
+            response = await self.pool.executar(modelo, lambda: chamada(None), prioridade)
+        return self._interpretar_resposta(modelo, response, time.perf_counter() - inicio, cache_nome is not None)
+
+    @staticmethod
+    def _modelo_indisponivel(erro) -> bool:
+        return "503" in str(erro) or "UNAVAILABLE" in str(erro)
+
+    @staticmethod
+    def _resposta_erro(motivo: str) -> dict:
+        return {
+            "relevancia": 1, "decisao": "WAIT", 
+            "motivo": motivo,
+            "estado_operacional": f"Aguardando estabilidade. Erro na leitura visual dupla.", 
+            "ordem_programada": {"acao": "NONE", "preco_gatilho": 0.0, "motivo_gatilho": ""},
+            "estudos_visuais": {"suporte_resistencia": []}
+        }
+
+    def analisar_mercado(self, *args, **kwargs) -> dict:
+        """Versão bloqueante (scripts e uso fora do event loop). O robô usa analisar_mercado_async."""
+        resposta, requisicao = self._preparar_analise(*args, **kwargs)
+        if requisicao is None:
+            return resposta
+
+        try:
+            # Chamada unificada enviando texto e AS DUAS imagens
+            return self._gerar_conteudo(self.model_name, *requisicao)
+        except Exception as e:
+            if not self._modelo_indisponivel(e):
+                return self._resposta_erro(f"Erro IA Multimodal Dupla: {str(e)}")
+            print(f"⚠️ Modelo {self.model_name} indisponível (503). Tentando fallback para {self.fallback_model_name}...")
+            try:
+                return self._gerar_conteudo(self.fallback_model_name, *requisicao)
+            except Exception as fallback_e:
+                print(f"❌ Erro no fallback: {fallback_e}")
+                return self._resposta_erro(f"Erro IA Multimodal (Fallback): {str(fallback_e)}")
+
+    async def analisar_mercado_async(self, *args, ao_decidir=None, prazo_segundos=None, prioridade=0, **kwargs) -> dict:
+        """
+        Mesma análise de analisar_mercado, sem bloquear o event loop, com timeout por chamada.
+        O roteador escolhe o modelo: hedge no reserva quando o principal passa do p95, reserva direto
+        em 503 e desvio do modelo com disjuntor aberto.
+        Com GEMINI_STREAM=1, `ao_decidir(decisao)` recebe os campos de decisão assim que chegam;
+        o retorno continua sendo a resposta completa.
+        `prazo_segundos` (tempo de parede até a decisão deixar de servir) cancela a chamada inteira,
+        hedge incluído, quando estoura; se a decisão já chegou, ela vale sem a narrativa.
+        `prioridade` ordena a fila do pool de inferência (menor primeiro; ver AgendadorPerfis.prioridade).
+        """
+        resposta, requisicao = self._preparar_analise(*args, **kwargs)
+        if requisicao is None:
+            return resposta
+        if prazo_segundos is not None and prazo_segundos <= 0:
+            return self._resposta_erro("Prazo IA: a barra do snapshot já passou da tolerância. Chamada não enviada.")
+
+        decidida = {}
+
+        def decidir(decisao):
+            decidida.update(decisao)
+            ao_decidir(decisao)
+
+        def chamada(modelo, decidir, iniciou):
+            return self._gerar_conteudo_async(modelo, *requisicao, ao_decidir=decidir, prioridade=prioridade,
+                                              ao_iniciar=iniciou)
+
+        inicio = time.monotonic()
+        try:
+            return await asyncio.wait_for(
+                self.roteador.executar(chamada, decidir if ao_decidir is not None else None,
+                                       falha_modelo=self._modelo_indisponivel),
+                timeout=prazo_segundos
+            )
+        except asyncio.TimeoutError:
+            if prazo_segundos is not None and time.monotonic() - inicio >= prazo_segundos:
+                if decidida:
+                    return dict(decidida)
+                print(f"⌛ IA sem decisão em {prazo_segundos:.1f}s, prazo da barra estourado. Chamada cancelada.")
+                return self._resposta_erro(f"Prazo IA: sem decisão antes do prazo da barra ({prazo_segundos:.1f}s).")
+            print(f"⏱️ IA não respondeu em {self.timeout_ia:.0f}s. Chamada cancelada.")
+            return self._resposta_erro(f"Timeout IA: sem resposta em {self.timeout_ia:.0f}s.")
+        except Exception as e:
+            print(f"❌ Erro na IA: {e}")
+            return self._resposta_erro(f"Erro IA Multimodal Dupla: {str(e)}")
@@ -0,0 +1,319 @@
+import os
+import shutil
+import threading
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+# Esquema colunar: um arquivo binário por coluna dentro de cada partição
+ESQUEMA = {
+    'time': np.dtype('<i8'), 'open': np.dtype('<f8'), 'high': np.dtype('<f8'), 'low': np.dtype('<f8'),
+    'close': np.dtype('<f8'), 'tick_volume': np.dtype('<u8'), 'spread': np.dtype('<i4'), 'real_volume': np.dtype('<u8'),
+}
+DTYPE_RATES = np.dtype(list(ESQUEMA.items()))
+
+
+def nome_timeframe(timeframe: int) -> str:
+    """Nome legível do timeframe a partir da constante numérica do MetaTrader5 (1 -> M1, 16385 -> H1)."""
+    if timeframe < 0x4000:
+        return f"M{timeframe}"
+    if timeframe < 0x8000:
+        horas = timeframe & 0x3FFF
+        return "D1" if horas == 24 else f"H{horas}"
+    return str(timeframe)
+
+
+def _timeframe_do_nome(nome: str):
+    """Inverso de nome_timeframe (None se a pasta não for de um timeframe)."""
+    if nome == "D1":
+        return 0x4000 | 24
+    if len(nome) > 1 and nome[1:].isdigit():
+        if nome[0] == "M":
+            return int(nome[1:])
+        if nome[0] == "H":
+            return 0x4000 | int(nome[1:])
+    return None
+
+
+def _dia(timestamp) -> str:
+    return datetime.fromtimestamp(int(timestamp), tz=timezone.utc).strftime('%Y-%m-%d')
+
+
+def _inicio_particao(nome: str) -> int:
+    formato = '%Y-%m-%d' if len(nome) == 10 else '%Y-%m'
+    return int(datetime.strptime(nome, formato).replace(tzinfo=timezone.utc).timestamp())
+
+
+class ArmazemCandles:
+    """
+    Armazém colunar de candles em disco, particionado por ativo/timeframe/dia:
+        {raiz}/{ATIVO}/{TF}/{AAAA-MM-DD}/{coluna}.bin
+    Gravação apenas por append (só candles fechados e mais novos que o último gravado).
+    Leituras por intervalo devolvem views de np.memmap, sem carregar nada no pandas.
+    A compactação junta os dias de meses encerrados numa partição mensal ({AAAA-MM}). Dias que ainda
+    existam ao lado da partição mensal do mesmo mês são sobras de uma compactação interrompida (ou de
+    arquivos presos por outro processo): a leitura os ignora e a próxima compactação os apaga.
+    As colunas de uma partição são anexadas uma a uma; antes de anexar, todas são cortadas ao número
+    de linhas completas, para que uma queda no meio de um lote não desalinhe as linhas seguintes.
+    A compactação pode rodar numa thread (asyncio.to_thread) enquanto o loop grava e lê.
+    """
+
+    def __init__(self, raiz=None):
+        self.raiz = raiz or os.getenv("ARMAZEM_CANDLES_DIR", "dados_candles")
+        self._ultimo_gravado = {}
+        self._abertos = {}
+        self._trava_abertos = threading.Lock()  # o cache de memmaps é usado também pela compactação
+
+    def _dir_serie(self, ativo, timeframe):
+        return os.path.join(self.raiz, ativo, nome_timeframe(timeframe))
+
+    # --- ESCRITA ---
+    def gravar(self, ativo: str, timeframe: int, rates):
+        """Anexa candles fechados (ordenados por tempo). Retorna quantos foram gravados."""
+        if rates is None or len(rates) == 0:
+            return 0
+        chave = (ativo, timeframe)
+        if chave not in self._ultimo_gravado:
+            self._ultimo_gravado[chave] = self._ler_ultimo_tempo(ativo, timeframe)
+        ultimo = self._ultimo_gravado[chave]
+        if ultimo is not None:
+            rates = rates[rates['time'] > ultimo]
+        if len(rates) == 0:
+            return 0
+
+        dias = np.array([_dia(t) for t in rates['time'][[0, -1]]])
+        if dias[0] == dias[1]:
+            grupos = [(dias[0], rates)]
+        else:
+            rotulos = np.array([_dia(t) for t in rates['time']])
+            grupos = [(d, rates[rotulos == d]) for d in dict.fromkeys(rotulos)]
+
+        for dia, parte in grupos:
+            pasta = os.path.join(self._dir_serie(ativo, timeframe), dia)
+            os.makedirs(pasta, exist_ok=True)
+            self._alinhar_colunas(pasta)
+            for coluna, dtype in ESQUEMA.items():
+                with open(os.path.join(pasta, f"{coluna}.bin"), 'ab') as arquivo:
+                    arquivo.write(np.ascontiguousarray(parte[coluna], dtype=dtype).tobytes())
+        self._ultimo_gravado[chave] = int(rates['time'][-1])
+        return len(rates)
+
+    def _alinhar_colunas(self, pasta):
+        """Corta as colunas da partição ao número de linhas presentes em todas (sobra de lote interrompido)."""
+        tamanhos = {}
+        for coluna in ESQUEMA:
+            caminho = os.path.join(pasta, f"{coluna}.bin")
+            tamanhos[caminho] = os.path.getsize(caminho) if os.path.exists(caminho) else 0
+        linhas = min(tamanho // dtype.itemsize for tamanho, dtype in zip(tamanhos.values(), ESQUEMA.values()))
+        for (caminho, tamanho), dtype in zip(tamanhos.items(), ESQUEMA.values()):
+            if tamanho != linhas * dtype.itemsize:
+                with self._trava_abertos:
+                    self._abertos.pop(pasta, None)
+                os.truncate(caminho, linhas * dtype.itemsize)
+
+    def _ler_ultimo_tempo(self, ativo, timeframe):
+        particoes = self.particoes(ativo, timeframe)
+        for _, caminho in reversed(particoes):
+            colunas = self._abrir(caminho)
+            if colunas and len(colunas['time']):
+                return int(colunas['time'][-1])
+        return None
+
+    # --- LEITURA ---
+    def _nomes_particoes(self, ativo, timeframe):
+        pasta = self._dir_serie(ativo, timeframe)
+        if not os.path.isdir(pasta):
+            return pasta, []
+        return pasta, sorted(n for n in os.listdir(pasta) if not n.endswith('.tmp'))
+
+    def particoes(self, ativo: str, timeframe: int):
+        """Lista de (início_unix, caminho) das partições da série, em ordem cronológica."""
+        pasta, nomes = self._nomes_particoes(ativo, timeframe)
+        meses = {n for n in nomes if len(n) == 7}
+        visiveis = [n for n in nomes if len(n) == 7 or n[:7] not in meses]
+        # Solta os memmaps de partições que saíram da leitura (no Windows eles impedem apagar os arquivos)
+        caminhos = {os.path.join(pasta, n) for n in visiveis}
+        with self._trava_abertos:
+            for caminho in [c for c in self._abertos if os.path.dirname(c) == pasta and c not in caminhos]:
+                del self._abertos[caminho]
+        return sorted((_inicio_particao(n), os.path.join(pasta, n)) for n in visiveis)
+
+    def _abrir(self, caminho):
+        """Mapeia as colunas da partição (reabre se o arquivo cresceu). Linhas incompletas são ignoradas."""
+        arquivo_time = os.path.join(caminho, "time.bin")
+        if not os.path.exists(arquivo_time):
+            return None
+        tamanho = os.path.getsize(arquivo_time)
+        with self._trava_abertos:
+            em_cache = self._abertos.get(caminho)
+        if em_cache and em_cache[0] == tamanho:
+            return em_cache[1]
+
+        linhas = min(os.path.getsize(os.path.join(caminho, f"{c}.bin")) // d.itemsize for c, d in ESQUEMA.items())
+        if linhas == 0:
+            colunas = {c: np.empty(0, dtype=d) for c, d in ESQUEMA.items()}
+        else:
+            colunas = {c: np.memmap(os.path.join(caminho, f"{c}.bin"), dtype=d, mode='r', shape=(linhas,))
+                       for c, d in ESQUEMA.items()}
+        with self._trava_abertos:
+            self._abertos[caminho] = (tamanho, colunas)
+        return colunas
+
+    def iterar_intervalo(self, ativo: str, timeframe: int, inicio=None, fim=None, colunas=None):
+        """Gera, partição a partição, dicionários coluna -> view (sem cópia) com inicio <= time < fim."""
+        inicio = -np.inf if inicio is None else int(inicio.timestamp() if isinstance(inicio, datetime) else inicio)
+        fim = np.inf if fim is None else int(fim.timestamp() if isinstance(fim, datetime) else fim)
+        particoes = self.particoes(ativo, timeframe)
+        for i, (inicio_particao, caminho) in enumerate(particoes):
+            proximo = particoes[i + 1][0] if i + 1 < len(particoes) else np.inf
+            if proximo <= inicio or inicio_particao >= fim:
+                continue
+            dados = self._abrir(caminho)
+            if not dados or len(dados['time']) == 0:
+                continue
+            a = int(np.searchsorted(dados['time'], inicio, side='left'))
+            b = int(np.searchsorted(dados['time'], fim, side='left'))
+            if a < b:
+                yield {c: dados[c][a:b] for c in (colunas or ESQUEMA)}
+
+    def ler_intervalo(self, ativo: str, timeframe: int, inicio=None, fim=None, colunas=None):
+        """
+        Colunas do intervalo pedido. Se o intervalo cabe numa partição, devolve as views do memmap
+        (zero cópia); se atravessa partições, concatena (uma cópia por coluna).
+        """
+        pedacos = list(self.iterar_intervalo(ativo, timeframe, inicio, fim, colunas))
+        nomes = colunas or list(ESQUEMA)
+        if not pedacos:
+            return {c: np.empty(0, dtype=ESQUEMA[c]) for c in nomes}
+        if len(pedacos) == 1:
+            return pedacos[0]
+        return {c: np.concatenate([p[c] for p in pedacos]) for c in nomes}
+
+    def ler_rates(self, ativo: str, timeframe: int, inicio=None, fim=None):
+        """Intervalo no formato de copy_rates_from_pos (array estruturado; sempre copia)."""
+        colunas = self.ler_intervalo(ativo, timeframe, inicio, fim)
+        rates = np.zeros(len(colunas['time']), dtype=DTYPE_RATES)
+        for coluna in ESQUEMA:
+            rates[coluna] = colunas[coluna]
+        return rates
+
+    # --- COMPACTAÇÃO ---
+    def compactar(self, ativo: str, timeframe: int, antes_de=None):
+        """
+        Junta as partições diárias de cada mês encerrado (anterior a `antes_de`, no máximo o mês atual)
+        numa partição mensal ordenada e sem duplicatas. A mensal é gravada numa pasta .tmp e publicada
+        com rename antes de qualquer dia ser apagado: uma queda no meio deixa os dias (sem mensal) ou a
+        mensal com dias que a leitura já ignora, nunca o mês perdido. Erro ao apagar um dia é propagado.
+        O mês só conta como encerrado um dia depois da virada (o último candle dele ainda pode chegar).
+        Retorna a lista de meses compactados.
+        """
+        mes_atual = (datetime.now(tz=timezone.utc) - timedelta(days=1)).strftime('%Y-%m')
+        limite = min(antes_de or mes_atual, mes_atual)
+        pasta_serie, nomes = self._nomes_particoes(ativo, timeframe)
+        por_mes = {}
+        for nome in nomes:
+            if nome[:7] < limite:
+                por_mes.setdefault(nome[:7], []).append(nome)
+
+        compactados = []
+        for mes, nomes_mes in sorted(por_mes.items()):
+            destino = os.path.join(pasta_serie, mes)
+            dias = [os.path.join(pasta_serie, n) for n in nomes_mes if n != mes]
+            if not dias:
+                continue  # mês já compactado
+            if mes not in nomes_mes:
+                pedacos = [self._abrir(c) for c in dias]
+                pedacos = [p for p in pedacos if p and len(p['time'])]
+                if not pedacos:
+                    continue
+                tempos = np.concatenate([p['time'] for p in pedacos])
+                # Ordena e mantém a última ocorrência de cada horário
+                ordem = np.argsort(tempos, kind='stable')
+                tempos_ordenados = tempos[ordem]
+                manter = np.r_[tempos_ordenados[1:] != tempos_ordenados[:-1], True]
+                indices = ordem[manter]
+
+                temporario = destino + ".tmp"
+                if os.path.exists(temporario):
+                    shutil.rmtree(temporario)
+                os.makedirs(temporario)
+                for coluna, dtype in ESQUEMA.items():
+                    valores = np.concatenate([p[coluna] for p in pedacos])[indices]
+                    valores.astype(dtype).tofile(os.path.join(temporario, f"{coluna}.bin"))
+                del pedacos
+                # Publica a mensal: a partir daqui os dias do mês saem da leitura
+                os.replace(temporario, destino)
+                compactados.append(mes)
+
+            with self._trava_abertos:
+                for caminho in dias:
+                    self._abertos.pop(caminho, None)
+            for caminho in dias:
+                shutil.rmtree(caminho)
+        return compactados
+
+    def compactar_tudo(self, antes_de=None):
+        """Compacta todas as séries do armazém. Retorna {(ativo, timeframe): meses} das que mudaram."""
+        resultado = {}
+        if not os.path.isdir(self.raiz):
+            return resultado
+        for ativo in sorted(os.listdir(self.raiz)):
+            pasta_ativo = os.path.join(self.raiz, ativo)
+            if not os.path.isdir(pasta_ativo):
+                continue
+            for nome_tf in sorted(os.listdir(pasta_ativo)):
+                timeframe = _timeframe_do_nome(nome_tf)
+                if timeframe is None:
+                    continue
+                meses = self.compactar(ativo, timeframe, antes_de)
+                if meses:
+                    resultado[(ativo, nome_tf)] = meses
+        return resultado
+
+
+if __name__ == "__main__":
+    import tempfile
+    import time
+
+    import pandas as pd
+
+    # Benchmark: 1 ano de M1 sintético (~525 mil candles), leitura de 1 mês e de 1 dia
+    qtd = 365 * 1440
+    inicio = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp())
+    rng = np.random.default_rng(7)
+    rates = np.zeros(qtd, dtype=DTYPE_RATES)
+    rates['time'] = inicio + np.arange(qtd) * 60
+    rates['close'] = 100 + np.cumsum(rng.normal(0, 0.05, qtd))
+    rates['open'] = np.r_[100.0, rates['close'][:-1]]
+    rates['high'] = np.maximum(rates['open'], rates['close']) + 0.02
+    rates['low'] = np.minimum(rates['open'], rates['close']) - 0.02
+    rates['tick_volume'] = rng.integers(1, 300, qtd)
+
+    with tempfile.TemporaryDirectory() as raiz:
+        armazem = ArmazemCandles(raiz)
+        t0 = time.perf_counter()
+        for i in range(0, qtd, 1440):
+            armazem.gravar("BENCH", 1, rates[i:i + 1440])
+        print(f"Gravação (365 partições diárias): {time.perf_counter() - t0:.2f}s")
+
+        t0 = time.perf_counter()
+        meses = armazem.compactar("BENCH", 1, antes_de="2025-01")
+        print(f"Compactação de {len(meses)} meses: {time.perf_counter() - t0:.2f}s")
+
+        junho = (datetime(2024, 6, 1, tzinfo=timezone.utc), datetime(2024, 7, 1, tzinfo=timezone.utc))
+        dia = (datetime(2024, 6, 10, tzinfo=timezone.utc), datetime(2024, 6, 11, tzinfo=timezone.utc))
+        for rotulo, (a, b) in (("1 mês", junho), ("1 dia", dia)):
+            t0 = time.perf_counter()
+            for _ in range(100):
+                colunas = armazem.ler_intervalo("BENCH", 1, a, b, colunas=['time', 'close'])
+                float(colunas['close'][-1])
+            t_memmap = (time.perf_counter() - t0) / 100
+
+            df = pd.DataFrame(rates)
+            t0 = time.perf_counter()
+            for _ in range(10):
+                fatia = df[(df['time'] >= a.timestamp()) & (df['time'] < b.timestamp())]
+                float(fatia['close'].iloc[-1])
+            t_pandas = (time.perf_counter() - t0) / 10
+            print(f"Leitura {rotulo}: memmap {t_memmap * 1e6:.0f} µs | pandas em memória {t_pandas * 1e6:.0f} µs "
+                  f"({len(colunas['time'])} candles)")
@@ -0,0 +1,355 @@
+import asyncio
+import hashlib
+import os
+import random
+import sqlite3
+import time
+import zlib
+from collections import namedtuple
+from dataclasses import dataclass
+
+# Mesmos nomes de campo do usage_metadata do Gemini: registrar_uso/MetricasResposta leem os dois iguais
+UsoGravado = namedtuple("UsoGravado", "prompt_token_count cached_content_token_count candidates_token_count total_token_count")
+
+
+@dataclass(slots=True)
+class RespostaGravada:
+    """Resposta servida pelo cassete com os atributos da resposta do Gemini usados pelo robô."""
+    text: str
+    usage_metadata: UsoGravado
+    latencia: float = 0.0
+
+
+class ErroCassete(LookupError):
+    """Requisição sem resposta gravada no cassete (modo de falta 'erro')."""
+
+
+def chave_requisicao(modelo: str, contents, instrucao: str = "", com_schema: bool = True) -> str:
+    """
+    Hash da requisição: modelo, instrução de sistema, contrato de saída e conteúdo (texto e pixels
+    das imagens). O nome do cache de contexto fica de fora: a mesma análise feita com a instrução
+    inline ou via cache é a mesma requisição.
+    """
+    h = hashlib.sha1()
+    for parte in (modelo, instrucao or "", "schema" if com_schema else "livre"):
+        h.update(parte.encode("utf-8"))
+        h.update(b"\x00")
+    for parte in contents:
+        if isinstance(parte, str):
+            h.update(parte.encode("utf-8"))
+        elif isinstance(parte, (bytes, bytearray)):
+            h.update(parte)
+        elif hasattr(parte, "tobytes"):
+            # PIL.Image: modo, tamanho e pixels (o PNG reaberto tem o mesmo hash que o original)
+            h.update(f"{parte.mode}{parte.size}".encode("utf-8"))
+            h.update(parte.tobytes())
+        else:
+            h.update(repr(parte).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def _uso(response) -> UsoGravado:
+    uso = getattr(response, "usage_metadata", None)
+    return UsoGravado(*((getattr(uso, campo, None) or 0) if uso else 0 for campo in UsoGravado._fields))
+
+
+class BackendGemini:
+    """Backend ao vivo: client do google-genai (síncrono e client.aio)."""
+
+    nome = "gemini"
+
+    def __init__(self, client):
+        self.client = client
+
+    def gerar(self, modelo, contents, config, instrucao=""):
+        return self.client.models.generate_content(model=modelo, contents=contents, config=config)
+
+    async def gerar_async(self, modelo, contents, config, instrucao=""):
+        return await self.client.aio.models.generate_content(model=modelo, contents=contents, config=config)
+
+    async def gerar_stream_async(self, modelo, contents, config, instrucao=""):
+        """Trechos da resposta conforme o modelo gera (o último traz o usage_metadata)."""
+        async for trecho in await self.client.aio.models.generate_content_stream(model=modelo, contents=contents, config=config):
+            yield trecho
+
+    def estatisticas(self):
+        return {"backend": self.nome}
+
+
+class Cassete:
+    """
+    Armazém local das chamadas gravadas (sqlite, um arquivo): por requisição, o texto da resposta
+    comprimido com zlib, a latência e os tokens. A mesma requisição pode ter várias gravações,
+    servidas na ordem em que foram feitas.
+    """
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        pasta = os.path.dirname(caminho)
+        if pasta:
+            os.makedirs(pasta, exist_ok=True)
+        self._conexao = sqlite3.connect(caminho)
+        self._conexao.execute(
+            "CREATE TABLE IF NOT EXISTS chamadas (seq INTEGER PRIMARY KEY, chave TEXT NOT NULL, modelo TEXT NOT NULL, "
+            "resposta BLOB NOT NULL, latencia REAL NOT NULL, tokens_entrada INTEGER, tokens_cache INTEGER, "
+            "tokens_saida INTEGER, tokens_total INTEGER, gravado_em REAL)"
+        )
+        self._conexao.execute("CREATE INDEX IF NOT EXISTS idx_chamadas_chave ON chamadas (chave)")
+        self._conexao.commit()
+
+    def gravar(self, chave, modelo, texto, latencia, uso: UsoGravado):
+        self._conexao.execute(
+            "INSERT INTO chamadas (chave, modelo, resposta, latencia, tokens_entrada, tokens_cache, tokens_saida, "
+            "tokens_total, gravado_em) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (chave, modelo, zlib.compress((texto or "").encode("utf-8"), 9), latencia, *uso, time.time())
+        )
+        self._conexao.commit()
+
+    def carregar(self):
+        """Todas as gravações em ordem: (seq, chave, modelo, RespostaGravada)."""
+        linhas = self._conexao.execute(
+            "SELECT seq, chave, modelo, resposta, latencia, tokens_entrada, tokens_cache, tokens_saida, tokens_total "
+            "FROM chamadas ORDER BY seq"
+        )
+        return [(seq, chave, modelo, RespostaGravada(zlib.decompress(resposta).decode("utf-8"), UsoGravado(*uso), latencia))
+                for seq, chave, modelo, resposta, latencia, *uso in linhas]
+
+    def fechar(self):
+        self._conexao.close()
+
+
+class GravadorCassete:
+    """Backend que repassa as chamadas a outro (o Gemini ao vivo) e grava requisição -> resposta no cassete."""
+
+    nome = "gravar"
+
+    def __init__(self, backend, caminho):
+        self.backend = backend
+        self.client = getattr(backend, "client", None)
+        self.cassete = Cassete(caminho)
+        self.gravadas = 0
+
+    def _gravar(self, modelo, contents, config, instrucao, response, latencia):
+        chave = chave_requisicao(modelo, contents, instrucao, getattr(config, "response_schema", None) is not None)
+        self.cassete.gravar(chave, modelo, response.text, latencia, _uso(response))
+        self.gravadas += 1
+
+    def gerar(self, modelo, contents, config, instrucao=""):
+        inicio = time.perf_counter()
+        response = self.backend.gerar(modelo, contents, config, instrucao)
+        self._gravar(modelo, contents, config, instrucao, response, time.perf_counter() - inicio)
+        return response
+
+    async def gerar_async(self, modelo, contents, config, instrucao=""):
+        inicio = time.perf_counter()
+        response = await self.backend.gerar_async(modelo, contents, config, instrucao)
+        self._gravar(modelo, contents, config, instrucao, response, time.perf_counter() - inicio)
+        return response
+
+    async def gerar_stream_async(self, modelo, contents, config, instrucao=""):
+        """Repassa os trechos e grava a resposta inteira (mesmo registro de uma chamada sem streaming)."""
+        inicio = time.perf_counter()
+        textos, ultimo = [], None
+        async for trecho in self.backend.gerar_stream_async(modelo, contents, config, instrucao):
+            textos.append(getattr(trecho, "text", None) or "")
+            ultimo = trecho
+            yield trecho
+        self._gravar(modelo, contents, config, instrucao,
+                     RespostaGravada("".join(textos), _uso(ultimo)), time.perf_counter() - inicio)
+
+    def estatisticas(self):
+        return {"backend": self.nome, "cassete": self.cassete.caminho, "gravadas": self.gravadas}
+
+
+class ReprodutorCassete:
+    """
+    Backend offline e determinístico: serve as respostas gravadas sem rede nem GEMINI_API_KEY.
+    - latencia: None (instantâneo, replay na velocidade máxima), "gravada" (a latência registrada
+      daquela chamada) ou "distribuicao" (sorteada, com `semente`, entre as latências gravadas do modelo);
+      `escala` multiplica a espera;
+    - modo_falta: requisição que não está no cassete (ex.: prompt alterado) levanta ErroCassete ("erro")
+      ou recebe a próxima gravação ainda não servida do modelo, na ordem original ("sequencial").
+    No streaming, o texto sai em trechos de `tamanho_trecho` caracteres com a espera dividida entre eles.
+    """
+
+    nome = "reproduzir"
+    client = None
+
+    def __init__(self, caminho, latencia=None, escala=1.0, semente=0, modo_falta="erro", tamanho_trecho=64):
+        if latencia not in (None, "gravada", "distribuicao"):
+            raise ValueError(f"latência de replay desconhecida: {latencia!r}")
+        if modo_falta not in ("erro", "sequencial"):
+            raise ValueError(f"modo de falta desconhecido: {modo_falta!r}")
+        self.caminho = caminho
+        self.latencia = latencia
+        self.escala = escala
+        self.modo_falta = modo_falta
+        self.tamanho_trecho = tamanho_trecho
+        self._aleatorio = random.Random(semente)
+        cassete = Cassete(caminho)
+        gravacoes = cassete.carregar()
+        cassete.fechar()
+        self._por_chave = {}      # chave -> [seq, ...]
+        self._por_modelo = {}     # modelo -> [seq, ...]
+        self._respostas = {}      # seq -> RespostaGravada
+        for seq, chave, modelo, resposta in gravacoes:
+            self._por_chave.setdefault(chave, []).append(seq)
+            self._por_modelo.setdefault(modelo, []).append(seq)
+            self._respostas[seq] = resposta
+        self._latencias = {modelo: [self._respostas[s].latencia for s in seqs] for modelo, seqs in self._por_modelo.items()}
+        self._proxima_por_chave = {}
+        self._proxima_por_modelo = {}
+        self._servidas = set()
+        self.exatas = 0
+        self.sequenciais = 0
+        self.faltas = 0
+
+    def __len__(self):
+        return len(self._respostas)
+
+    def _servir(self, modelo, contents, config, instrucao):
+        chave = chave_requisicao(modelo, contents, instrucao, getattr(config, "response_schema", None) is not None)
+        seqs = self._por_chave.get(chave)
+        if seqs:
+            # Mesma requisição gravada mais de uma vez: uma por vez, repetindo a última
+            indice = self._proxima_por_chave.get(chave, 0)
+            self._proxima_por_chave[chave] = indice + 1
+            seq = seqs[min(indice, len(seqs) - 1)]
+            self.exatas += 1
+        elif self.modo_falta == "sequencial":
+            seqs = self._por_modelo.get(modelo, [])
+            indice = self._proxima_por_modelo.get(modelo, 0)
+            while indice < len(seqs) and seqs[indice] in self._servidas:
+                indice += 1
+            if indice >= len(seqs):
+                self.faltas += 1
+                raise ErroCassete(f"cassete sem gravações restantes para {modelo}")
+            self._proxima_por_modelo[modelo] = indice + 1
+            seq = seqs[indice]
+            self.sequenciais += 1
+        else:
+            self.faltas += 1
+            raise ErroCassete(f"requisição {chave[:12]} ({modelo}) não está no cassete {self.caminho}")
+        self._servidas.add(seq)
+        return self._respostas[seq]
+
+    def _espera(self, modelo, resposta):
+        if self.latencia == "gravada":
+            return resposta.latencia * self.escala
+        if self.latencia == "distribuicao":
+            return self._aleatorio.choice(self._latencias[modelo]) * self.escala
+        return 0.0
+
+    def gerar(self, modelo, contents, config, instrucao=""):
+        resposta = self._servir(modelo, contents, config, instrucao)
+        espera = self._espera(modelo, resposta)
+        if espera > 0:
+            time.sleep(espera)
+        return resposta
+
+    async def gerar_async(self, modelo, contents, config, instrucao=""):
+        resposta = self._servir(modelo, contents, config, instrucao)
+        espera = self._espera(modelo, resposta)
+        if espera > 0:
+            await asyncio.sleep(espera)
+        return resposta
+
+    async def gerar_stream_async(self, modelo, contents, config, instrucao=""):
+        resposta = self._servir(modelo, contents, config, instrucao)
+        texto = resposta.text
+        partes = [texto[i:i + self.tamanho_trecho] for i in range(0, len(texto), self.tamanho_trecho)] or [""]
+        espera = self._espera(modelo, resposta) / len(partes)
+        for i, parte in enumerate(partes):
+            if espera > 0:
+                await asyncio.sleep(espera)
+            yield RespostaGravada(parte, resposta.usage_metadata if i == len(partes) - 1 else None)
+
+    def estatisticas(self):
+        return {"backend": self.nome, "cassete": self.caminho, "gravacoes": len(self._respostas),
+                "exatas": self.exatas, "sequenciais": self.sequenciais, "faltas": self.faltas}
+
+
+def criar_backend(client_factory):
+    """
+    Backend da IA escolhido por GEMINI_BACKEND no .env:
+    'gemini' (padrão, ao vivo), 'gravar' (ao vivo gravando em GEMINI_CASSETE) ou 'reproduzir'
+    (offline a partir de GEMINI_CASSETE; GEMINI_CASSETE_LATENCIA e GEMINI_CASSETE_FALTA ajustam o replay).
+    `client_factory` só é chamado quando o backend precisa do Gemini de verdade.
+    """
+    modo = os.getenv("GEMINI_BACKEND", "gemini").lower()
+    caminho = os.getenv("GEMINI_CASSETE", "cassetes/gemini.db")
+    if modo == "reproduzir":
+        return ReprodutorCassete(
+            caminho,
+            latencia=os.getenv("GEMINI_CASSETE_LATENCIA") or None,
+            escala=float(os.getenv("GEMINI_CASSETE_ESCALA", "1")),
+            modo_falta=os.getenv("GEMINI_CASSETE_FALTA", "erro"),
+        )
+    if modo == "gravar":
+        return GravadorCassete(BackendGemini(client_factory()), caminho)
+    return BackendGemini(client_factory())
+
+
+if __name__ == "__main__":
+    import json
+    import statistics
+    import tempfile
+
+    # Grava um "pregão" de 200 análises com um backend falso (latência de 0.8-2.5s encolhida 1000x)
+    # e reproduz: exato, com a distribuição de latências, e com o prompt alterado (modo sequencial)
+    class BackendFalso:
+        nome = "falso"
+
+        def __init__(self):
+            self.aleatorio = random.Random(42)
+            self.latencias = []
+
+        def gerar(self, modelo, contents, config, instrucao=""):
+            latencia = self.aleatorio.uniform(0.8, 2.5) / 1000
+            self.latencias.append(latencia)
+            time.sleep(latencia)
+            texto = json.dumps({"relevancia": 2, "decisao": self.aleatorio.choice(["WAIT", "WAIT_TO_BUY", "HOLD"]),
+                                "motivo": contents[0][-40:], "estado_operacional": "[Preço 1] ok",
+                                "ordem_programada": {"acao": "NONE", "preco_gatilho": 0.0}})
+            return RespostaGravada(texto, UsoGravado(6000, 0, 180, 6180))
+
+    class Config:
+        response_schema = object()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = os.path.join(pasta, "gemini.db")
+        gravador = GravadorCassete(BackendFalso(), caminho)
+        prompts = [f"ANÁLISE ciclo {i} | Preço Atual: {128000 + i * 5}" for i in range(200)]
+        originais = [gravador.gerar("gemini-2.5-flash-lite", [p], Config(), "INSTRUÇÃO").text for p in prompts]
+        gravador.cassete.fechar()
+        tamanho = os.path.getsize(caminho)
+        print(f"Gravadas {gravador.gravadas} chamadas em {tamanho / 1024:.0f} KiB "
+              f"({tamanho / gravador.gravadas:.0f} bytes por chamada)")
+
+        reprodutor = ReprodutorCassete(caminho)
+        t0 = time.perf_counter()
+        reproduzidas = [reprodutor.gerar("gemini-2.5-flash-lite", [p], Config(), "INSTRUÇÃO").text for p in prompts]
+        duracao = time.perf_counter() - t0
+        print(f"Replay exato: {'idêntico' if reproduzidas == originais else 'DIVERGENTE'} | "
+              f"{len(prompts)} chamadas em {duracao * 1000:.1f} ms ({duracao / len(prompts) * 1e6:.0f} µs/chamada) "
+              f"vs {sum(gravador.backend.latencias) * 1000:.0f}s de IA ao vivo | {reprodutor.estatisticas()}")
+
+        for latencia in ("gravada", "distribuicao"):
+            reprodutor = ReprodutorCassete(caminho, latencia=latencia, semente=7)
+            t0 = time.perf_counter()
+            for p in prompts[:100]:
+                reprodutor.gerar("gemini-2.5-flash-lite", [p], Config(), "INSTRUÇÃO")
+            print(f"Replay com latência {latencia}: 100 chamadas em {time.perf_counter() - t0:.3f}s "
+                  f"(gravação: {sum(gravador.backend.latencias[:100]):.3f}s, "
+                  f"média {statistics.mean(gravador.backend.latencias) * 100:.3f}s)")
+
+        reprodutor = ReprodutorCassete(caminho, modo_falta="sequencial")
+        alteradas = [reprodutor.gerar("gemini-2.5-flash-lite", [p + " (formato novo)"], Config(), "INSTRUÇÃO").text
+                     for p in prompts]
+        print(f"Prompt alterado, modo sequencial: {'mesma sequência' if alteradas == originais else 'DIVERGENTE'} | "
+              f"{reprodutor.estatisticas()}")
+        try:
+            ReprodutorCassete(caminho).gerar("gemini-2.5-flash-lite", ["prompt inédito"], Config(), "INSTRUÇÃO")
+        except ErroCassete as e:
+            print(f"Modo erro: {e}")
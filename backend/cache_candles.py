@@ -0,0 +1,235 @@
+import time
+
+import numpy as np
+
+from provedor_mercado import ProvedorMercado, provedor_adiado
+from reamostragem import reamostrar, comparar_com_corretora
+
+# Provedor resolvido no primeiro uso: importar o módulo não exige o MetaTrader5
+mt5 = provedor_adiado
+
+# Timeframes intradiários derivados localmente do M1 (N minutos, alinhados à meia-noite).
+# Constantes da interface (mesmos valores do MetaTrader5), sem consultar o provedor no import
+MINUTOS_POR_TIMEFRAME = {
+    ProvedorMercado.TIMEFRAME_M2: 2, ProvedorMercado.TIMEFRAME_M3: 3, ProvedorMercado.TIMEFRAME_M4: 4, ProvedorMercado.TIMEFRAME_M5: 5,
+    ProvedorMercado.TIMEFRAME_M6: 6, ProvedorMercado.TIMEFRAME_M10: 10, ProvedorMercado.TIMEFRAME_M12: 12, ProvedorMercado.TIMEFRAME_M15: 15,
+    ProvedorMercado.TIMEFRAME_M20: 20, ProvedorMercado.TIMEFRAME_M30: 30, ProvedorMercado.TIMEFRAME_H1: 60, ProvedorMercado.TIMEFRAME_H2: 120,
+    ProvedorMercado.TIMEFRAME_H3: 180, ProvedorMercado.TIMEFRAME_H4: 240, ProvedorMercado.TIMEFRAME_H6: 360, ProvedorMercado.TIMEFRAME_H8: 480,
+    ProvedorMercado.TIMEFRAME_H12: 720,
+}
+
+
+class BufferCandles:
+    """
+    Ring buffer pré-alocado de rates de um (ativo, timeframe).
+    Cada candle é gravado duas vezes (posição i e i + capacidade), assim qualquer janela
+    dos últimos N candles é uma view contígua do numpy, sem cópia.
+    """
+
+    def __init__(self, capacidade, dtype):
+        self.capacidade = capacidade
+        self._dados = np.zeros(2 * capacidade, dtype=dtype)
+        self._total = 0  # total de candles já escritos (posição lógica)
+
+    @property
+    def tamanho(self):
+        return min(self._total, self.capacidade)
+
+    def ultimo_tempo(self):
+        if self._total == 0:
+            return None
+        return int(self._dados[(self._total - 1) % self.capacidade]['time'])
+
+    def resetar(self):
+        self._total = 0
+
+    def _gravar(self, posicoes, candles):
+        indices = posicoes % self.capacidade
+        self._dados[indices] = candles
+        self._dados[indices + self.capacidade] = candles
+
+    def inserir(self, rates):
+        """
+        Sobrescreve o candle em formação (mesmo horário do último) e anexa os candles novos.
+        Retorna quantos candles novos entraram no buffer.
+        """
+        if rates is None or len(rates) == 0:
+            return 0
+        ultimo = self.ultimo_tempo()
+        if ultimo is not None:
+            atual = rates[rates['time'] == ultimo]
+            if len(atual):
+                self._gravar(np.array([self._total - 1]), atual[-1:])
+            rates = rates[rates['time'] > ultimo]
+        if len(rates) > self.capacidade:
+            rates = rates[-self.capacidade:]
+        if len(rates):
+            self._gravar(self._total + np.arange(len(rates)), rates)
+            self._total += len(rates)
+        return len(rates)
+
+    def visao(self, qtd=None):
+        """View (sem cópia) dos últimos `qtd` candles. Válida até a próxima inserção."""
+        n = self.tamanho if qtd is None else min(qtd, self.tamanho)
+        fim = (self._total - 1) % self.capacidade + self.capacidade + 1
+        return self._dados[fim - n:fim]
+
+
+class ReamostradorIncremental:
+    """
+    Timeframe de N minutos derivado do M1. Os candles fechados ficam num BufferCandles próprio;
+    a cada atualização só os M1 do candle em formação em diante são reagregados.
+    """
+
+    def __init__(self, minutos: int, capacidade: int):
+        self.minutos = minutos
+        self.capacidade = capacidade
+        self.buffer = None
+
+    def atualizar(self, rates_m1):
+        if rates_m1 is None or len(rates_m1) == 0:
+            return
+        if self.buffer is not None:
+            ultimo = self.buffer.ultimo_tempo()
+            if int(rates_m1['time'][0]) <= ultimo:
+                inicio = int(np.searchsorted(rates_m1['time'], ultimo, side='left'))
+                self.buffer.inserir(reamostrar(rates_m1[inicio:], self.minutos))
+                return
+            # O M1 não cobre mais o candle em formação: reconstrói do zero
+            self.buffer = None
+
+        derivados = reamostrar(rates_m1, self.minutos)
+        # A janela M1 pode começar no meio do primeiro candle: descarta o candle incompleto
+        if len(derivados) > 1 and int(rates_m1['time'][0]) != int(derivados['time'][0]):
+            derivados = derivados[1:]
+        self.buffer = BufferCandles(self.capacidade, rates_m1.dtype)
+        self.buffer.inserir(derivados)
+
+
+class CacheCandles:
+    """
+    Cache de candles compartilhado entre perfis, um BufferCandles por (ativo, timeframe).
+    Depois do aquecimento só busca no terminal o candle em formação e os candles novos.
+    Timeframes de N minutos (M2, M5, M15...) são reamostrados do M1, então cada ativo
+    consome uma única série do terminal.
+    """
+
+    def __init__(self, capacidade=1000, validade_segundos=2.0, armazem=None):
+        self.capacidade = capacidade
+        self.validade_segundos = validade_segundos
+        # ArmazemCandles opcional: os candles fechados vindos do terminal são persistidos em disco
+        self.armazem = armazem
+        self.buffers = {}
+        self.reamostradores = {}
+        self._ultima_busca = {}
+        self._historico_completo = {}
+        self.hits = 0
+        self.misses = 0
+        self.chamadas_terminal = 0
+
+    def obter(self, ativo: str, timeframe: int, qtd_candles: int):
+        """Retorna uma view com os últimos `qtd_candles` rates (ou None se o terminal falhar)."""
+        minutos = MINUTOS_POR_TIMEFRAME.get(timeframe)
+        if minutos is not None:
+            return self.obter_reamostrado(ativo, minutos, qtd_candles)
+
+        chave = (ativo, timeframe)
+        buffer = self.buffers.get(chave)
+        agora = time.monotonic()
+
+        aquecido = buffer is not None and (buffer.tamanho >= qtd_candles or self._historico_completo.get(chave))
+        if aquecido and agora - self._ultima_busca.get(chave, 0) < self.validade_segundos:
+            self.hits += 1
+            return buffer.visao(qtd_candles)
+
+        self.misses += 1
+        if aquecido:
+            sucesso = self._buscar_incremental(ativo, timeframe, buffer)
+        else:
+            sucesso = self._aquecer(chave, max(qtd_candles, self.capacidade))
+            buffer = self.buffers.get(chave)
+
+        if not sucesso:
+            return None
+        self._ultima_busca[chave] = agora
+        return buffer.visao(qtd_candles)
+
+    def obter_reamostrado(self, ativo: str, minutos: int, qtd_candles: int):
+        """Candles de N minutos construídos a partir do M1 em cache."""
+        rates_m1 = self.obter(ativo, mt5.TIMEFRAME_M1, (qtd_candles + 1) * minutos)
+        if rates_m1 is None or len(rates_m1) == 0:
+            return None
+        chave = (ativo, minutos)
+        reamostrador = self.reamostradores.get(chave)
+        if reamostrador is None:
+            reamostrador = ReamostradorIncremental(minutos, max(self.capacidade, qtd_candles))
+            self.reamostradores[chave] = reamostrador
+        reamostrador.atualizar(rates_m1)
+        return reamostrador.buffer.visao(qtd_candles)
+
+    def verificar_consistencia(self, ativo: str, timeframe: int, qtd_candles: int = 30):
+        """Compara os candles reamostrados com os da corretora (1 chamada extra ao terminal)."""
+        minutos = MINUTOS_POR_TIMEFRAME.get(timeframe)
+        if minutos is None:
+            return None
+        locais = self.obter_reamostrado(ativo, minutos, qtd_candles)
+        corretora = mt5.copy_rates_from_pos(ativo, timeframe, 0, qtd_candles)
+        self.chamadas_terminal += 1
+        return comparar_com_corretora(locais, corretora)
+
+    def _aquecer(self, chave, qtd_candles):
+        """Carga inicial: puxa o histórico completo do (ativo, timeframe)."""
+        ativo, timeframe = chave
+        rates = mt5.copy_rates_from_pos(ativo, timeframe, 0, qtd_candles)
+        self.chamadas_terminal += 1
+        if rates is None or len(rates) == 0:
+            return False
+
+        buffer = BufferCandles(max(self.capacidade, qtd_candles), rates.dtype)
+        buffer.inserir(rates)
+        self.buffers[chave] = buffer
+        self._persistir(ativo, timeframe, rates)
+        # Corretora com menos histórico que o pedido: não tenta reaquecer a cada chamada
+        self._historico_completo[chave] = len(rates) < qtd_candles
+        return True
+
+    def _buscar_incremental(self, ativo, timeframe, buffer):
+        """Busca só o candle em formação e os fechados desde o último horário conhecido."""
+        ultimo = buffer.ultimo_tempo()
+        qtd = 2
+        while True:
+            rates = mt5.copy_rates_from_pos(ativo, timeframe, 0, qtd)
+            self.chamadas_terminal += 1
+            if rates is None or len(rates) == 0:
+                return False
+            if int(rates[0]['time']) <= ultimo or qtd >= buffer.capacidade:
+                break
+            # Ficamos sem atualizar por mais de `qtd` candles: amplia a janela
+            qtd = min(qtd * 4, buffer.capacidade)
+
+        if int(rates[0]['time']) > ultimo:
+            # Buraco maior que o buffer: descarta o histórico antigo
+            buffer.resetar()
+        buffer.inserir(rates)
+        self._persistir(ativo, timeframe, rates)
+        return True
+
+    def _persistir(self, ativo, timeframe, rates):
+        """Grava no armazém só os candles fechados (o último ainda está em formação)."""
+        if self.armazem is None or len(rates) < 2:
+            return
+        try:
+            self.armazem.gravar(ativo, timeframe, rates[:-1])
+        except OSError as e:
+            print(f"⚠️ Falha ao gravar candles de {ativo} no armazém: {e}")
+
+    def estatisticas(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "chamadas_terminal": self.chamadas_terminal,
+            "taxa_acerto": round(self.hits / total, 3) if total else 0.0,
+            "series": len(self.buffers),
+            "reamostrados": len(self.reamostradores),
+        }
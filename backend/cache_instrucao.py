@@ -0,0 +1,178 @@
+import asyncio
+import hashlib
+import time
+
+from google.genai import types
+
+
+class CacheInstrucao:
+    """
+    Instrução de sistema estática (idêntica byte a byte entre chamadas) registrada uma única vez
+    por modelo no cache de contexto do Gemini (client.caches), com o TTL renovado antes de expirar.
+    As chamadas passam a referenciar o cache pelo nome em vez de reenviar as regras inteiras.
+    Se o cache não puder ser criado (modelo sem suporte, instrução abaixo do mínimo de tokens,
+    cota), a instrução segue inline e uma nova tentativa só é feita após `espera_apos_falha`.
+    Sem client (replay offline de cassete) a instrução vai sempre inline.
+    """
+
+    def __init__(self, client, ttl_segundos=3600, margem_segundos=300, espera_apos_falha=600):
+        self.client = client
+        self.ttl_segundos = ttl_segundos
+        self.margem_segundos = margem_segundos
+        self.espera_apos_falha = espera_apos_falha
+        self._entradas = {}   # (modelo, hash) -> [nome do cache, expira_em (monotonic)]
+        self._falhas = {}     # (modelo, hash) -> instante (monotonic) liberado para nova tentativa
+        self._travas = {}
+        self.criacoes = 0
+        self.renovacoes = 0
+        self.falhas = 0
+        # modo ("cache"/"inline") -> [chamadas, tokens de entrada, tokens vindos do cache, segundos]
+        self._uso = {"cache": [0, 0, 0, 0.0], "inline": [0, 0, 0, 0.0]}
+        self.tokens_totais = 0   # entrada + saída de todas as chamadas
+
+    @staticmethod
+    def _chave(modelo, instrucao):
+        return modelo, hashlib.sha1(instrucao.encode("utf-8")).hexdigest()
+
+    def _acao(self, chave):
+        """'usar', 'criar', 'renovar' ou 'inline' (sem client ou falha recente) para a instrução deste modelo."""
+        if self.client is None:
+            return "inline"
+        agora = time.monotonic()
+        entrada = self._entradas.get(chave)
+        if entrada is not None:
+            return "usar" if entrada[1] - agora > self.margem_segundos else "renovar"
+        if self._falhas.get(chave, 0.0) > agora:
+            return "inline"
+        return "criar"
+
+    def _config_criacao(self, chave, instrucao):
+        return types.CreateCachedContentConfig(
+            system_instruction=instrucao,
+            ttl=f"{self.ttl_segundos}s",
+            display_name=f"instrucao-{chave[1][:12]}",
+        )
+
+    def _registrar(self, chave, nome):
+        self._entradas[chave] = [nome, time.monotonic() + self.ttl_segundos]
+        self._falhas.pop(chave, None)
+        return nome
+
+    def _registrar_falha(self, chave, erro, acao):
+        self.falhas += 1
+        self._entradas.pop(chave, None)
+        self._falhas[chave] = time.monotonic() + self.espera_apos_falha
+        print(f"⚠️ Cache da instrução ({chave[0]}) indisponível ao {acao}: {erro}. Seguindo com a instrução inline.")
+        return None
+
+    def obter(self, modelo: str, instrucao: str):
+        """Nome do cached content da instrução para o modelo (ou None para enviar inline)."""
+        chave = self._chave(modelo, instrucao)
+        acao = self._acao(chave)
+        if acao == "usar":
+            return self._entradas[chave][0]
+        if acao == "inline":
+            return None
+        try:
+            if acao == "renovar":
+                self.client.caches.update(name=self._entradas[chave][0],
+                                          config=types.UpdateCachedContentConfig(ttl=f"{self.ttl_segundos}s"))
+                self.renovacoes += 1
+                return self._registrar(chave, self._entradas[chave][0])
+            cache = self.client.caches.create(model=modelo, config=self._config_criacao(chave, instrucao))
+            self.criacoes += 1
+            return self._registrar(chave, cache.name)
+        except Exception as e:
+            return self._registrar_falha(chave, e, acao)
+
+    async def obter_async(self, modelo: str, instrucao: str):
+        """Igual a obter(), pelo client.aio; chamadas concorrentes esperam uma única criação/renovação."""
+        chave = self._chave(modelo, instrucao)
+        if self._acao(chave) == "usar":
+            return self._entradas[chave][0]
+        async with self._travas.setdefault(chave, asyncio.Lock()):
+            acao = self._acao(chave)
+            if acao == "usar":
+                return self._entradas[chave][0]
+            if acao == "inline":
+                return None
+            try:
+                if acao == "renovar":
+                    await self.client.aio.caches.update(name=self._entradas[chave][0],
+                                                        config=types.UpdateCachedContentConfig(ttl=f"{self.ttl_segundos}s"))
+                    self.renovacoes += 1
+                    return self._registrar(chave, self._entradas[chave][0])
+                cache = await self.client.aio.caches.create(model=modelo, config=self._config_criacao(chave, instrucao))
+                self.criacoes += 1
+                return self._registrar(chave, cache.name)
+            except Exception as e:
+                return self._registrar_falha(chave, e, acao)
+
+    def invalidar(self, modelo: str, instrucao: str):
+        """Esquece o cache (ex.: expirou ou foi apagado do lado do Gemini); a próxima chamada recria."""
+        self._entradas.pop(self._chave(modelo, instrucao), None)
+
+    def registrar_uso(self, modelo: str, response, segundos: float, com_cache: bool):
+        """Loga os tokens de entrada (usage_metadata) e a latência da chamada, separados por modo."""
+        uso = getattr(response, "usage_metadata", None)
+        entrada = (getattr(uso, "prompt_token_count", None) or 0) if uso else 0
+        em_cache = (getattr(uso, "cached_content_token_count", None) or 0) if uso else 0
+        saida = (getattr(uso, "candidates_token_count", None) or 0) if uso else 0
+        totais = self._uso["cache" if com_cache else "inline"]
+        totais[0] += 1
+        totais[1] += entrada
+        totais[2] += em_cache
+        totais[3] += segundos
+        self.tokens_totais += entrada + saida
+        print(f"🧾 [{modelo}] Tokens entrada: {entrada} (cache: {em_cache}) | saída: {saida} | "
+              f"{'instrução em cache' if com_cache else 'instrução inline'} | {segundos:.2f}s")
+
+    def tokens_medios_por_chamada(self):
+        chamadas = sum(totais[0] for totais in self._uso.values())
+        return self.tokens_totais / chamadas if chamadas else 0
+
+    def estatisticas(self):
+        resumo = {"criacoes": self.criacoes, "renovacoes": self.renovacoes, "falhas": self.falhas}
+        for modo, (chamadas, entrada, em_cache, segundos) in self._uso.items():
+            if chamadas:
+                resumo[modo] = {
+                    "chamadas": chamadas,
+                    "tokens_entrada_medio": round(entrada / chamadas),
+                    "tokens_cache_medio": round(em_cache / chamadas),
+                    # Tokens efetivamente processados/cobrados a preço cheio
+                    "tokens_cheios_medio": round((entrada - em_cache) / chamadas),
+                    "latencia_media_s": round(segundos / chamadas, 2),
+                }
+        return resumo
+
+
+if __name__ == "__main__":
+    import os
+
+    from dotenv import load_dotenv
+    from google import genai
+
+    from ai_service import INSTRUCAO_SISTEMA
+
+    # A/B ao vivo (precisa de GEMINI_API_KEY): mesma análise com a instrução inline e via cache
+    load_dotenv()
+    client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+    modelo = os.getenv("GEMINI_MODELO_BENCH", "gemini-2.5-flash")
+    cache = CacheInstrucao(client, ttl_segundos=600)
+    prompt = ("ANÁLISE HÍBRIDA (DADOS + IMAGEM) EM TEMPO REAL.\nEstratégia: Camaleão | Preço Atual: 128450.0\n"
+              "VWAP Atual: 128390.00000 | ATR Atual: 85.00000\nSUA MEMÓRIA DO CICLO ANTERIOR: \"Iniciando...\"\n"
+              "Gere o JSON estrito.")
+    for com_cache in (False, True):
+        for _ in range(5):
+            nome = cache.obter(modelo, INSTRUCAO_SISTEMA) if com_cache else None
+            if nome:
+                config = types.GenerateContentConfig(cached_content=nome, response_mime_type="application/json", temperature=0.2)
+            else:
+                config = types.GenerateContentConfig(system_instruction=INSTRUCAO_SISTEMA,
+                                                     response_mime_type="application/json", temperature=0.2)
+            inicio = time.perf_counter()
+            resposta = client.models.generate_content(model=modelo, contents=[prompt], config=config)
+            cache.registrar_uso(modelo, resposta, time.perf_counter() - inicio, nome is not None)
+    print(cache.estatisticas())
+    for nome, _ in cache._entradas.values():
+        client.caches.delete(name=nome)
@@ -0,0 +1,147 @@
+import asyncio
+import copy
+import time
+
+
+class AnaliseCancelada(Exception):
+    """A chamada compartilhada da IA foi cancelada (não quem a aguardava): o perfil fica sem decisão."""
+
+
+class ContextosAtivos:
+    """
+    Contexto de mercado por ativo, montado uma única vez por ciclo e compartilhado por todos os
+    perfis que operam o mesmo ativo (dados M1/M2/M5/M15, preços da última vela, ATR, ontem, fotos).
+    As análises da IA também são compartilhadas: perfis do mesmo ativo com as mesmas entradas
+    (estratégia, memória, posição, fotos) reaproveitam a mesma resposta dentro do ciclo.
+    Cada perfil continua aplicando o próprio lote/SL/TP/agressividade sobre o resultado.
+    """
+
+    def __init__(self, montar, validade_segundos=10.0, relogio=time.monotonic):
+        self.montar = montar                      # montar(ativo) -> dict com o contexto ou None
+        self.validade_segundos = validade_segundos
+        self.relogio = relogio                    # relógio do provedor no robô (virtual no simulador)
+        self._contextos = {}
+        self.buscas = 0
+        self.buscas_evitadas = 0
+        self.chamadas_ia = 0
+        self.chamadas_ia_evitadas = 0
+
+    def novo_ciclo(self, ativo: str = None):
+        """Descarta os contextos (todos, ou só o do ativo que virou a barra)."""
+        if ativo is None:
+            self._contextos = {}
+        else:
+            self._contextos.pop(ativo, None)
+
+    def obter(self, ativo: str):
+        """Contexto do ativo neste ciclo (refeito se envelheceu durante esperas longas do ciclo)."""
+        contexto = self._contextos.get(ativo)
+        if contexto is not None and self.relogio() - contexto["criado_em"] < self.validade_segundos:
+            self.buscas_evitadas += 1
+            return contexto
+        self.buscas += 1
+        contexto = self.montar(ativo)
+        if contexto is None:
+            self._contextos.pop(ativo, None)
+            return None
+        contexto["criado_em"] = self.relogio()
+        contexto["analises"] = {}
+        self._contextos[ativo] = contexto
+        return contexto
+
+    def _entrada(self, contexto: dict, chave, calcular):
+        """(decisão, tarefa) da análise `chave`: cria a chamada na primeira vez, depois só reaproveita."""
+        entrada = contexto["analises"].get(chave)
+        if entrada is not None:
+            self.chamadas_ia_evitadas += 1
+            return entrada
+        self.chamadas_ia += 1
+        decisao = asyncio.get_running_loop().create_future()
+
+        def ao_decidir(parcial):
+            if not decisao.done():
+                decisao.set_result(parcial)
+
+        def ao_terminar(tarefa):
+            # Sem decisão antecipada (sem streaming, erro, bloqueio de notícia) vale a resposta completa
+            if decisao.done():
+                return
+            if tarefa.cancelled():
+                decisao.cancel()
+            elif tarefa.exception() is not None:
+                decisao.set_exception(tarefa.exception())
+            else:
+                decisao.set_result(tarefa.result())
+
+        tarefa = asyncio.ensure_future(calcular(ao_decidir=ao_decidir))
+        tarefa.add_done_callback(ao_terminar)
+        entrada = contexto["analises"][chave] = (decisao, tarefa)
+        return entrada
+
+    async def analise(self, contexto: dict, chave, calcular):
+        """
+        Resposta da IA para as entradas `chave` sobre este contexto; a corrotina `calcular(ao_decidir=...)`
+        só roda na primeira vez. Perfis analisados em paralelo aguardam a mesma chamada em voo.
+        Devolve uma cópia, pois o loop altera o dicionário (armadilha, motivo) por perfil.
+        """
+        _, tarefa = self._entrada(contexto, chave, calcular)
+        return copy.deepcopy(await tarefa)
+
+    def analise_em_etapas(self, contexto: dict, chave, calcular):
+        """
+        Como analise(), em duas etapas: (decisão, completa). A primeira resolve quando `calcular`
+        chama `ao_decidir` (campos de decisão do streaming) ou, sem isso, junto com a resposta completa.
+        As duas são compartilhadas: cancelar um perfil que aguarda não cancela a chamada dos outros
+        (shield), e a chamada cancelada chega a cada perfil como AnaliseCancelada, não como o
+        CancelledError da própria tarefa.
+        """
+        decisao, tarefa = self._entrada(contexto, chave, calcular)
+
+        async def copia(aguardavel):
+            try:
+                resultado = await asyncio.shield(aguardavel)
+            except asyncio.CancelledError:
+                if aguardavel.cancelled():
+                    raise AnaliseCancelada("Chamada da IA compartilhada cancelada.") from None
+                raise
+            return copy.deepcopy(resultado)
+
+        return copia(decisao), copia(tarefa)
+
+    def estatisticas(self):
+        return {
+            "buscas": self.buscas,
+            "buscas_evitadas": self.buscas_evitadas,
+            "chamadas_ia": self.chamadas_ia,
+            "chamadas_ia_evitadas": self.chamadas_ia_evitadas,
+        }
+
+
+if __name__ == "__main__":
+    # Ciclo com 10 perfis no WIN e 2 no WDO: 8 deles com a mesma memória/estratégia no WIN
+    perfis = [("WIN", "Camaleão", 1)] * 8 + [("WIN", "Tendência", 1), ("WIN", "Camaleão", 4)] + [("WDO", "Camaleão", 1)] * 2
+    chamadas = {"montar": 0, "ia": 0}
+
+    def montar(ativo):
+        chamadas["montar"] += 1
+        return {"preco_atual": 100.0}
+
+    async def analisar(ao_decidir=None):
+        chamadas["ia"] += 1
+        await asyncio.sleep(0.01)
+        return {"decisao": "WAIT", "ordem_programada": {"acao": "NONE"}}
+
+    async def ciclo(contextos):
+        # Perfis analisados em paralelo, como no loop do robô
+        async def perfil(ativo, estrategia, relevancia):
+            contexto = contextos.obter(ativo)
+            analise = await contextos.analise(contexto, (estrategia, relevancia), analisar)
+            analise["ordem_programada"]["motivo_ia"] = "alterado por perfil"
+        await asyncio.gather(*(perfil(*p) for p in perfis))
+
+    contextos = ContextosAtivos(montar)
+    for _ in range(3):
+        contextos.novo_ciclo()
+        asyncio.run(ciclo(contextos))
+    print(f"3 ciclos x {len(perfis)} perfis: {chamadas['montar']} montagens de contexto e {chamadas['ia']} chamadas à IA "
+          f"(antes: {3 * len(perfis)} de cada) | {contextos.estatisticas()}")
@@ -0,0 +1,143 @@
+import time
+from collections import namedtuple
+
+from provedor_mercado import provedor_adiado
+
+# Provedor resolvido no primeiro uso: importar o módulo não exige o MetaTrader5
+mt5 = provedor_adiado
+
+# Especificação do ativo já com os valores derivados usados na montagem da ordem
+EspecificacaoAtivo = namedtuple("EspecificacaoAtivo", "ativo point digits volume_step volume_min type_filling "
+                                                      "deviation_pts quantum_preco carregado_em")
+
+
+def deviation_padrao(ativo: str) -> int:
+    """Slippage máximo (deviation) por família de ativo."""
+    # B3 (WIN/WDO) exige margens diferentes de Forex para evitar rejeição em volatilidade
+    if "WIN" in ativo.upper():
+        return 150  # 30 ticks (150 pontos) no índice
+    if "WDO" in ativo.upper():
+        return 10   # 20 ticks (10 pontos) no dólar
+    if "BIT" in ativo.upper():
+        return 500  # Volatilidade cripto B3
+    return 20       # Padrão Forex/Outros
+
+
+def tipo_preenchimento(filling_mode: int) -> int:
+    """Constante ORDER_FILLING_* a partir do filling_mode do ativo."""
+    # O MetaTrader5 em Python não possui a flag SYMBOL_FILLING_RETURN.
+    # filling_mode = 1 (FOK), 2 (IOC), 3 (FOK e IOC), 0 (RETURN - comum na B3).
+    if filling_mode == 1 or filling_mode == 3:
+        return mt5.ORDER_FILLING_FOK
+    if filling_mode == 2:
+        return mt5.ORDER_FILLING_IOC
+    return mt5.ORDER_FILLING_RETURN
+
+
+def arredondar_preco(especificacao, preco: float) -> float:
+    """Preço no grid de negociação do ativo (múltiplo do quantum, com as casas decimais do ativo)."""
+    return round(round(preco / especificacao.quantum_preco) * especificacao.quantum_preco, especificacao.digits)
+
+
+class CacheEspecificacoes:
+    """
+    Especificações dos ativos (point, digits, volume_step, filling_mode) lidas uma vez do terminal,
+    com renovação por validade ou quando uma ordem é rejeitada por preço/volume/preenchimento.
+    Assim o caminho do sinal até o order_send não faz consultas extras ao terminal.
+    """
+
+    # Rejeições que podem indicar especificação desatualizada
+    RETCODES_RECARREGAR = (10013, 10014, 10015, 10016, 10030)
+
+    def __init__(self, validade_segundos=3600.0):
+        self.validade_segundos = validade_segundos
+        self._especificacoes = {}
+        self.cargas = 0
+
+    def carregar(self, ativos):
+        """Pré-carrega (na partida ou ao recarregar as configurações) os ativos informados."""
+        for ativo in dict.fromkeys(ativos):
+            self._buscar(ativo)
+
+    def obter(self, ativo: str):
+        especificacao = self._especificacoes.get(ativo)
+        if especificacao is None or time.monotonic() - especificacao.carregado_em > self.validade_segundos:
+            especificacao = self._buscar(ativo) or especificacao
+        return especificacao
+
+    def invalidar(self, ativo: str, retcode=None):
+        """Descarta a especificação (sem retcode, ou com uma rejeição que pede recarga)."""
+        if retcode is None or retcode in self.RETCODES_RECARREGAR:
+            self._especificacoes.pop(ativo, None)
+
+    def _buscar(self, ativo):
+        info = mt5.symbol_info(ativo)
+        self.cargas += 1
+        if info is None:
+            print(f"Ativo {ativo} não encontrado.")
+            return None
+        if not info.visible and not mt5.symbol_select(ativo, True):
+            print(f"Falha ao selecionar ativo {ativo}.")
+            return None
+
+        # Quantum de preço: tick mínimo do ativo (WIN anda de 5 em 5) ou a última casa decimal
+        quantum = info.trade_tick_size if getattr(info, 'trade_tick_size', 0) else 10.0 ** -info.digits
+        especificacao = EspecificacaoAtivo(
+            ativo=ativo, point=info.point, digits=info.digits, volume_step=info.volume_step,
+            volume_min=info.volume_min, type_filling=tipo_preenchimento(info.filling_mode),
+            deviation_pts=deviation_padrao(ativo), quantum_preco=quantum, carregado_em=time.monotonic(),
+        )
+        self._especificacoes[ativo] = especificacao
+        return especificacao
+
+
+if __name__ == "__main__":
+    import tempfile
+    import json
+    import os
+
+    import numpy as np
+
+    from indicadores import _gerar_rates_sinteticos
+    from provedor_mercado import ProvedorSimulado
+
+    # Latência sinal -> order_send com o terminal simulado, contando as idas ao terminal.
+    # No MT5 real cada chamada é uma ida e volta IPC (ordem de ms), então o ganho real é maior.
+    with tempfile.TemporaryDirectory() as pasta:
+        rates = _gerar_rates_sinteticos(2000)
+        np.save(os.path.join(pasta, "BENCH_M1.npy"), rates)
+        with open(os.path.join(pasta, "BENCH.json"), "w") as arquivo:
+            json.dump({"point": 0.01, "digits": 2, "volume_step": 1.0}, arquivo)
+        simulado = ProvedorSimulado(pasta, inicio=int(rates['time'][-1]))
+        simulado.initialize()
+
+        chamadas = {"symbol_info": 0}
+        symbol_info_original = simulado.symbol_info
+
+        def symbol_info_contado(symbol):
+            chamadas["symbol_info"] += 1
+            return symbol_info_original(symbol)
+
+        simulado.symbol_info = symbol_info_contado
+        mt5 = simulado
+
+        def montar_legado():
+            info = mt5.symbol_info("BENCH")
+            tick = mt5.symbol_info_tick("BENCH")
+            return round(tick.ask, info.digits), tipo_preenchimento(info.filling_mode), deviation_padrao("BENCH")
+
+        cache = CacheEspecificacoes()
+        cache.carregar(["BENCH"])
+
+        def montar_cache():
+            spec = cache.obter("BENCH")
+            tick = mt5.symbol_info_tick("BENCH")
+            return round(tick.ask, spec.digits), spec.type_filling, spec.deviation_pts
+
+        for rotulo, montar in (("symbol_info por ordem", montar_legado), ("cache de especificações", montar_cache)):
+            chamadas["symbol_info"] = 0
+            t0 = time.perf_counter()
+            for _ in range(5000):
+                montar()
+            custo = (time.perf_counter() - t0) / 5000
+            print(f"{rotulo}: {custo * 1e6:.1f} µs até o order_send | symbol_info por ordem: {chamadas['symbol_info'] / 5000:.0f}")
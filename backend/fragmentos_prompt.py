@@ -0,0 +1,347 @@
+import re
+import time
+
+import numpy as np
+
+from pivots import tempos_unix
+
+_TOKENS = re.compile(r"\d|[^\W\d_]+|[^\w\s]")
+
+# Colunas opcionais do RAIO-X (sufixo da linha, na ordem em que aparecem)
+COLUNAS_OPCIONAIS = (('rsi_14', " | RSI: {:.1f}"), ('stoch_k', " | StochK: {:.1f}"), ('vwap', " | VWAP: {:.5f}"))
+
+
+def formatar_linhas_raio_x(df, indices=None):
+    """
+    Formatador vetorizado (partida a frio): pavios e horários calculados em numpy para todas
+    as linhas (ou só as posições `indices`) de uma vez, sem iterrows. Devolve (tempos_unix, linhas).
+    """
+    selecao = slice(None) if indices is None else np.asarray(indices)
+    tempos = tempos_unix(df['time'].values[selecao])
+    o = df['open'].values[selecao].astype(np.float64)
+    h = df['high'].values[selecao].astype(np.float64)
+    l = df['low'].values[selecao].astype(np.float64)
+    c = df['close'].values[selecao].astype(np.float64)
+    pavio_sup = h - np.maximum(o, c)
+    pavio_inf = np.minimum(o, c) - l
+
+    horas = ((tempos // 3600) % 24).tolist()
+    minutos = ((tempos // 60) % 60).tolist()
+    sufixos = [""] * len(tempos)
+    for coluna, modelo in COLUNAS_OPCIONAIS:
+        if coluna in df.columns:
+            sufixos = [s + modelo.format(v) for s, v in zip(sufixos, df[coluna].values[selecao].tolist())]
+
+    linhas = [
+        f"[Tempo: {hh:02d}:{mm:02d} | Abertura: {a:.5f} | Max: {b:.5f} | Min: {d:.5f} | Fechamento: {e:.5f} "
+        f"| Pavio Sup: {ps:.5f} | Pavio Inf: {pi:.5f}{s}]"
+        for hh, mm, a, b, d, e, ps, pi, s in zip(horas, minutos, o.tolist(), h.tolist(), l.tolist(), c.tolist(),
+                                                  pavio_sup.tolist(), pavio_inf.tolist(), sufixos)
+    ]
+    return tempos, linhas
+
+
+# Colunas opcionais da tabela compacta: (coluna, cabeçalho, casas decimais ou None para preço relativo)
+COLUNAS_COMPACTAS = (('rsi_14', "rsi", 0), ('stoch_k', "stk", 0), ('vwap', "vwap", None))
+
+
+def formatar_tabela_compacta(df, digitos=5, referencia=None, indices=None):
+    """
+    RAIO-X compacto: um cabeçalho e uma linha CSV por candle (hora,abe,max,min,fec,psup,pinf[,rsi,stk,vwap]).
+    Preços com `digitos` casas (os do ativo) e relativos a `referencia` (preço = REF + valor);
+    pavios são amplitudes, sem referência. Devolve (referencia, cabecalho, linhas).
+    """
+    selecao = slice(None) if indices is None else np.asarray(indices)
+    tempos = tempos_unix(df['time'].values[selecao])
+    o = df['open'].values[selecao].astype(np.float64)
+    h = df['high'].values[selecao].astype(np.float64)
+    l = df['low'].values[selecao].astype(np.float64)
+    c = df['close'].values[selecao].astype(np.float64)
+    if referencia is None:
+        referencia = round(float(c[-1]), digitos) if len(c) else 0.0
+    pavio_sup = h - np.maximum(o, c)
+    pavio_inf = np.minimum(o, c) - l
+
+    # Uma matriz de valores e um único formato por linha
+    colunas = [o - referencia, h - referencia, l - referencia, c - referencia, pavio_sup, pavio_inf]
+    formatos = [f"{{:.{digitos}f}}"] * 6
+    cabecalho = ["hora", "abe", "max", "min", "fec", "psup", "pinf"]
+    for coluna, nome, casas in COLUNAS_COMPACTAS:
+        if coluna in df.columns:
+            valores = df[coluna].values[selecao].astype(np.float64)
+            colunas.append(valores - referencia if casas is None else valores)
+            formatos.append(f"{{:.{digitos if casas is None else casas}f}}")
+            cabecalho.append(nome)
+    # Arredonda antes de formatar para não imprimir "-0"
+    matriz = np.round(np.column_stack(colunas), digitos) + 0.0
+    modelo = ",".join(["{:02d}:{:02d}"] + formatos)
+    horas = ((tempos // 3600) % 24).tolist()
+    minutos = ((tempos // 60) % 60).tolist()
+    linhas = [modelo.format(hh, mm, *valores) for hh, mm, valores in zip(horas, minutos, matriz.tolist())]
+    return referencia, ",".join(cabecalho), linhas
+
+
+def raio_x_compacto(df, num_candles: int, digitos=5):
+    """Bloco RAIO-X compacto dos últimos `num_candles` fechados (REF = fechamento do último deles)."""
+    if df is None or df.empty or len(df) < 2: return "N/A"
+    referencia, cabecalho, linhas = formatar_tabela_compacta(df.iloc[:-1].tail(num_candles), digitos)
+    return f"REF={referencia:.{digitos}f} | {cabecalho}\n" + "\n".join(linhas)
+
+
+class CodificadorTabela:
+    """
+    Tabelas compactas por perfil com codificação delta entre ciclos: o primeiro ciclo (e a cada
+    `intervalo_quadro` ciclos) envia o quadro completo com uma REF nova; os seguintes enviam só os
+    candles fechados depois do último enviado, relativos à mesma REF. O delta só faz sentido para
+    quem ainda tem o quadro anterior no contexto (ex.: conversa com histórico); cada chamada
+    avulsa ao modelo precisa do quadro completo.
+    """
+
+    def __init__(self, intervalo_quadro=10):
+        self.intervalo_quadro = intervalo_quadro
+        self._estados = {}   # chave -> [referencia, último tempo enviado, ciclos desde o quadro]
+        self.quadros = 0
+        self.deltas = 0
+
+    def codificar(self, chave, df, num_candles: int, digitos=5, rotulo=""):
+        """Texto do ciclo para `chave` (perfil + timeframe): quadro completo ou só as linhas novas."""
+        if df is None or df.empty or len(df) < 2: return "N/A"
+        janela = df.iloc[:-1].tail(num_candles)
+        tempos = tempos_unix(janela['time'].values)
+        estado = self._estados.get(chave)
+        if estado is None or estado[2] + 1 >= self.intervalo_quadro:
+            self._estados[chave] = [round(float(janela['close'].iloc[-1]), digitos), int(tempos[-1]), 0]
+            self.quadros += 1
+            return rotulo + raio_x_compacto(df, num_candles, digitos)
+        referencia, ultimo_tempo, ciclos = estado
+        novas = np.nonzero(tempos > ultimo_tempo)[0]
+        estado[2] = ciclos + 1
+        self.deltas += 1
+        if len(novas) == 0:
+            return f"{rotulo}sem candles novos (REF={referencia:.{digitos}f})"
+        _, _, linhas = formatar_tabela_compacta(janela, digitos, referencia, novas)
+        estado[1] = int(tempos[-1])
+        return f"{rotulo}+{len(novas)} candle(s) após a tabela anterior (REF={referencia:.{digitos}f})\n" + "\n".join(linhas)
+
+    def esquecer(self, chave):
+        self._estados.pop(chave, None)
+
+    def estatisticas(self):
+        return {"quadros": self.quadros, "deltas": self.deltas}
+
+
+def estimar_tokens(texto: str) -> int:
+    """
+    Estimativa offline de tokens no estilo SentencePiece do Gemini: cada dígito, cada sinal de
+    pontuação e cada palavra contam como um token (palavras longas contam uma peça a cada 6 letras).
+    Serve para comparar formatos; a contagem exata vem de client.models.count_tokens.
+    """
+    total = 0
+    for pedaco in _TOKENS.findall(texto):
+        total += 1 if not pedaco[0].isalpha() else -(-len(pedaco) // 6)
+    return total
+
+
+class CacheFragmentos:
+    """
+    Cache de trechos do prompt por ativo.
+    - Linhas do RAIO-X: candles fechados são imutáveis, então cada um é formatado uma única vez.
+    - Seções (estatística, pivôs, gap/sessão): guardam o último resultado e só recalculam quando
+      muda o último candle fechado ou algum campo do candle em formação que a seção lê.
+    """
+
+    def __init__(self, capacidade=200):
+        self.capacidade = capacidade
+        self._linhas = {}
+        self._secoes = {}
+        self.linhas_formatadas = 0
+        self.linhas_reaproveitadas = 0
+        self.secoes_hits = 0
+        self.secoes_misses = 0
+
+    def raio_x(self, ativo: str, rotulo: str, df, num_candles: int):
+        """Bloco RAIO-X dos últimos `num_candles` fechados (o último candle do df está em formação)."""
+        if df is None or df.empty or len(df) < 2: return "N/A"
+        # O formato da linha depende das colunas de indicadores presentes
+        chave = (ativo, rotulo, tuple(c for c, _ in COLUNAS_OPCIONAIS if c in df.columns))
+        cache = self._linhas.setdefault(chave, {})
+
+        inicio = max(0, len(df) - 1 - num_candles)
+        tempos = tempos_unix(df['time'].values[inicio:-1]).tolist()
+        faltando = [i for i, t in enumerate(tempos) if t not in cache]
+        if faltando:
+            novos_tempos, novas_linhas = formatar_linhas_raio_x(df, [inicio + i for i in faltando])
+            cache.update(zip(novos_tempos.tolist(), novas_linhas))
+            self.linhas_formatadas += len(faltando)
+        self.linhas_reaproveitadas += len(tempos) - len(faltando)
+
+        if len(cache) > 2 * self.capacidade:
+            # Descarta as linhas mais antigas (dict mantém a ordem de inserção)
+            for t in list(cache)[:len(cache) - self.capacidade]:
+                del cache[t]
+        return "\n".join(cache[t] for t in tempos)
+
+    def secao(self, ativo: str, nome: str, chave, calcular):
+        """Resultado memoizado de uma seção do contexto; `calcular` só roda quando a chave muda."""
+        anterior = self._secoes.get((ativo, nome))
+        if anterior is not None and anterior[0] == chave:
+            self.secoes_hits += 1
+            return anterior[1]
+        self.secoes_misses += 1
+        valor = calcular()
+        self._secoes[(ativo, nome)] = (chave, valor)
+        return valor
+
+    def estatisticas(self):
+        return {
+            "linhas_formatadas": self.linhas_formatadas,
+            "linhas_reaproveitadas": self.linhas_reaproveitadas,
+            "secoes_hits": self.secoes_hits,
+            "secoes_misses": self.secoes_misses,
+        }
+
+
+def chave_candles(df, colunas_formando=('high', 'low', 'close')):
+    """
+    Identidade da janela para as seções memoizadas: tamanho, horário do último candle fechado
+    e os campos do candle em formação que a seção lê.
+    """
+    if df is None or df.empty:
+        return None
+    ultimo = df.iloc[-1]
+    fechado = df['time'].iloc[-2] if len(df) > 1 else None
+    return (len(df), fechado, ultimo['time']) + tuple(ultimo[c] for c in colunas_formando if c in df.columns)
+
+
+def _formatar_candles_raio_x_legado(df, num_candles):
+    """Implementação original (iterrows), mantida só para a paridade e o benchmark."""
+    import pandas as pd
+
+    if df is None or df.empty or len(df) < 2: return "N/A"
+    df_closed = df.iloc[:-1].tail(num_candles)
+    linhas = []
+    for _, row in df_closed.iterrows():
+        if isinstance(row['time'], (int, float, np.integer, np.floating)):
+            tempo = pd.to_datetime(row['time'], unit='s').strftime('%H:%M')
+        else:
+            tempo = pd.to_datetime(row['time']).strftime('%H:%M')
+        o, h, l, c = row['open'], row['high'], row['low'], row['close']
+        pavio_sup = h - max(o, c)
+        pavio_inf = min(o, c) - l
+        rsi = f" | RSI: {row['rsi_14']:.1f}" if 'rsi_14' in row else ""
+        stoch = f" | StochK: {row['stoch_k']:.1f}" if 'stoch_k' in row else ""
+        vwap = f" | VWAP: {row['vwap']:.5f}" if 'vwap' in row else ""
+        linhas.append(f"[Tempo: {tempo} | Abertura: {o:.5f} | Max: {h:.5f} | Min: {l:.5f} | Fechamento: {c:.5f} | Pavio Sup: {pavio_sup:.5f} | Pavio Inf: {pavio_inf:.5f}{rsi}{stoch}{vwap}]")
+    return "\n".join(linhas)
+
+
+if __name__ == "__main__":
+    from indicadores import MotorIndicadores, _gerar_rates_sinteticos
+
+    rates = _gerar_rates_sinteticos(1500)
+    motor = MotorIndicadores()
+    cache = CacheFragmentos()
+
+    # Paridade: candle a candle, como o loop do robô (M1 com 100 candles, RAIO-X dos últimos 30)
+    divergencias = 0
+    t_legado = t_cache = 0.0
+    for fim in range(120, len(rates)):
+        motor.atualizar(rates[fim - 100:fim])
+        df = motor.para_dataframe(100)
+        t0 = time.perf_counter()
+        esperado = _formatar_candles_raio_x_legado(df, 30)
+        t1 = time.perf_counter()
+        obtido = cache.raio_x("BENCH", "M1", df, 30)
+        t2 = time.perf_counter()
+        t_legado += t1 - t0
+        t_cache += t2 - t1
+        divergencias += obtido != esperado
+
+    # Partida a frio (36 linhas de uma vez, como o RAIO-X M5)
+    df = motor.para_dataframe(100)
+    t0 = time.perf_counter()
+    for _ in range(200):
+        formatar_linhas_raio_x(df.iloc[:-1].tail(36))
+    t_frio = (time.perf_counter() - t0) / 200
+
+    ciclos = len(rates) - 120
+    print(f"Paridade RAIO-X: {divergencias} divergências em {ciclos} ciclos | {cache.estatisticas()}")
+    print(f"iterrows: {t_legado / ciclos * 1e6:.0f} µs | cache: {t_cache / ciclos * 1e6:.0f} µs | "
+          f"partida a frio vetorizada (36 linhas): {t_frio * 1e6:.0f} µs")
+
+    # RAIO-X compacto x atual: tokens (estimados offline; exatos com GEMINI_API_KEY) e tempo de formatação
+    # por prompt (M1 30 + M5 36 candles), em ativos com preço inteiro, de 1 casa e de 5 casas
+    import os
+
+    def escalar(rates_base, escala, deslocamento, tick, digitos):
+        escalados = rates_base.copy()
+        for campo in ('open', 'high', 'low', 'close'):
+            escalados[campo] = np.round(np.round((rates_base[campo] - 100) * escala / tick) * tick + deslocamento, digitos)
+        return escalados
+
+    base_m1 = _gerar_rates_sinteticos(400)
+    base_m5 = _gerar_rates_sinteticos(400, passo=300, semente=7)
+    textos_exatos = []
+    for ativo, escala, deslocamento, tick, digitos in (("WIN", 250, 128000, 5, 0), ("WDO", 10, 5000, 0.5, 1),
+                                                        ("EURUSD", 0.002, 1.08, 0.00001, 5)):
+        m1, m5 = escalar(base_m1, escala, deslocamento, tick, digitos), escalar(base_m5, escala, deslocamento, tick, digitos)
+        motor_m1, motor_m5 = MotorIndicadores(), MotorIndicadores()
+        codificador = CodificadorTabela()
+        tokens = {"atual": [], "compacto": [], "delta": []}
+        tempos_fmt = {"atual": 0.0, "compacto": 0.0}
+        erro_maximo = 0.0
+        ciclos = 0
+        for fim in range(200, len(m1)):
+            motor_m1.atualizar(m1[fim - 100:fim])
+            df_m1 = motor_m1.para_dataframe(100)
+            motor_m5.atualizar(m5[fim // 5 - 60 + 100:fim // 5 + 100])
+            df_m5 = motor_m5.para_dataframe(60)
+            t0 = time.perf_counter()
+            atual = "\n".join(formatar_linhas_raio_x(df_m5.iloc[:-1].tail(36))[1] + formatar_linhas_raio_x(df_m1.iloc[:-1].tail(30))[1])
+            t1 = time.perf_counter()
+            compacto = raio_x_compacto(df_m5, 36, digitos) + "\n" + raio_x_compacto(df_m1, 30, digitos)
+            t2 = time.perf_counter()
+            delta = codificador.codificar("m5", df_m5, 36, digitos) + "\n" + codificador.codificar("m1", df_m1, 30, digitos)
+            tempos_fmt["atual"] += t1 - t0
+            tempos_fmt["compacto"] += t2 - t1
+            for formato, texto in (("atual", atual), ("compacto", compacto), ("delta", delta)):
+                tokens[formato].append(estimar_tokens(texto))
+            # Paridade: REF + valor reconstrói o fechamento com as casas do ativo
+            referencia, _, linhas = formatar_tabela_compacta(df_m1.iloc[:-1].tail(30), digitos)
+            fechamentos = np.round(np.array([float(linha.split(",")[4]) for linha in linhas]) + referencia, digitos)
+            erro_maximo = max(erro_maximo, float(np.abs(fechamentos - df_m1['close'].values[:-1][-30:]).max()))
+            ciclos += 1
+        if ativo == "WIN":
+            textos_exatos = [atual, compacto]
+        medias = {f: np.mean(v) for f, v in tokens.items()}
+        print(f"[{ativo}] tokens estimados por prompt: atual {medias['atual']:.0f} | compacto {medias['compacto']:.0f} "
+              f"({1 - medias['compacto'] / medias['atual']:.0%} menos) | delta {medias['delta']:.0f} "
+              f"({1 - medias['delta'] / medias['atual']:.0%} menos, {codificador.estatisticas()}) | "
+              f"formatação: atual {tempos_fmt['atual'] / ciclos * 1e6:.0f} µs, compacto {tempos_fmt['compacto'] / ciclos * 1e6:.0f} µs | "
+              f"erro de reconstrução máximo: {erro_maximo:g}")
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    if os.getenv("GEMINI_API_KEY"):
+        from google import genai
+        from google.genai import types
+
+        from ai_service import INSTRUCAO_SISTEMA
+
+        # Contagem exata e latência ao vivo do modelo com cada formato (mesmo cabeçalho de prompt)
+        client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+        modelo = os.getenv("GEMINI_MODELO_BENCH", "gemini-2.5-flash-lite")
+        config = types.GenerateContentConfig(system_instruction=INSTRUCAO_SISTEMA, response_mime_type="application/json",
+                                             temperature=0.2)
+        for formato, tabela in zip(("atual", "compacto"), textos_exatos):
+            if formato == "compacto":
+                tabela = "RAIO-X (preço = REF + valor; psup/pinf = pavios):\n" + tabela
+            prompt = f"ANÁLISE EM TEMPO REAL. Estratégia: Camaleão | Preço Atual: 128000\n{tabela}\nGere o JSON estrito."
+            contagem = client.models.count_tokens(model=modelo, contents=[prompt]).total_tokens
+            latencias = []
+            for _ in range(5):
+                inicio = time.perf_counter()
+                client.models.generate_content(model=modelo, contents=[prompt], config=config)
+                latencias.append(time.perf_counter() - inicio)
+            print(f"[WIN ao vivo] {formato}: {contagem} tokens (estimativa {estimar_tokens(prompt)}) | "
+                  f"latência mediana {np.median(latencias):.2f}s")
@@ -0,0 +1,179 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+# Registro fixo de 40 bytes por tick
+DTYPE_TICK = np.dtype([('time_msc', '<i8'), ('bid', '<f8'), ('ask', '<f8'), ('last', '<f8'), ('volume', '<f8')])
+
+
+def _dia(time_msc) -> str:
+    return datetime.fromtimestamp(time_msc // 1000, tz=timezone.utc).strftime('%Y-%m-%d')
+
+
+def _caminho(raiz, ativo, dia):
+    return os.path.join(raiz, ativo, f"{dia}.ticks")
+
+
+class GravadorTicks:
+    """
+    Log binário append-only de ticks, um arquivo por ativo por dia: {raiz}/{ATIVO}/{AAAA-MM-DD}.ticks
+    Os ticks ficam num lote em memória e vão para o disco quando o lote enche (write, sem fsync).
+    O fsync fica só com a tarefa executar(), que a cada `intervalo_fsync` descarrega os lotes no loop
+    e faz flush+fsync numa thread: o loop de 0.5s nunca espera o disco. Sem ela o lote só desce
+    quando enche, e com o mercado parado ele ficaria na memória.
+    """
+
+    def __init__(self, raiz=None, tamanho_lote=64, intervalo_fsync=5.0):
+        self.raiz = raiz or os.getenv("GRAVADOR_TICKS_DIR", "dados_ticks")
+        self.tamanho_lote = tamanho_lote
+        self.intervalo_fsync = intervalo_fsync
+        self._pendentes = {}
+        self._ultimo_msc = {}
+        self._arquivos = {}
+        self._sujo = False  # há bytes escritos desde o último fsync
+        self.gravados = 0
+        self.repetidos = 0
+
+    def registrar(self, ativo: str, tick):
+        """Enfileira um tick do MT5 (ignora o mesmo tick lido de novo pelo polling)."""
+        time_msc = int(tick.time_msc)
+        if ativo not in self._ultimo_msc:
+            self._ultimo_msc[ativo] = self._ultimo_gravado(ativo, time_msc)
+        if time_msc <= self._ultimo_msc[ativo]:
+            self.repetidos += 1
+            return False
+
+        volume = getattr(tick, 'volume_real', 0.0) or float(tick.volume)
+        self._pendentes.setdefault(ativo, []).append((time_msc, tick.bid, tick.ask, tick.last, volume))
+        self._ultimo_msc[ativo] = time_msc
+
+        if len(self._pendentes[ativo]) >= self.tamanho_lote:
+            self.descarregar(ativo)
+        return True
+
+    def _ultimo_gravado(self, ativo, time_msc):
+        """Último time_msc já em disco no dia (evita duplicar o tick após reiniciar o robô)."""
+        caminho = _caminho(self.raiz, ativo, _dia(time_msc))
+        if not os.path.exists(caminho) or os.path.getsize(caminho) < DTYPE_TICK.itemsize:
+            return -1
+        ticks = ler_ticks(ativo, _dia(time_msc), self.raiz)
+        return int(ticks['time_msc'][-1])
+
+    def descarregar(self, ativo=None):
+        """Escreve os lotes pendentes nos arquivos do dia (sem fsync)."""
+        for simbolo in ([ativo] if ativo else list(self._pendentes)):
+            pendentes = self._pendentes.get(simbolo)
+            if not pendentes:
+                continue
+            lote = np.array(pendentes, dtype=DTYPE_TICK)
+            self._pendentes[simbolo] = []
+            primeiro, ultimo = _dia(lote['time_msc'][0]), _dia(lote['time_msc'][-1])
+            if primeiro == ultimo:
+                grupos = [(primeiro, lote)]
+            else:
+                rotulos = np.array([_dia(t) for t in lote['time_msc']])
+                grupos = [(d, lote[rotulos == d]) for d in dict.fromkeys(rotulos)]
+            for dia, parte in grupos:
+                self._arquivo(simbolo, dia).write(parte.tobytes())
+            self.gravados += len(lote)
+            self._sujo = True
+
+    def _arquivo(self, ativo, dia):
+        chave = (ativo, dia)
+        if chave not in self._arquivos:
+            # Virou o dia: fecha o arquivo anterior do ativo
+            for antiga in [k for k in self._arquivos if k[0] == ativo]:
+                self._fechar_arquivo(antiga)
+            os.makedirs(os.path.join(self.raiz, ativo), exist_ok=True)
+            caminho = _caminho(self.raiz, ativo, dia)
+            arquivo = open(caminho, 'ab')
+            # Registro incompleto de uma queda anterior: alinha o arquivo ao tamanho do registro
+            sobra = arquivo.tell() % DTYPE_TICK.itemsize
+            if sobra:
+                arquivo.truncate(arquivo.tell() - sobra)
+                arquivo.seek(0, os.SEEK_END)
+            self._arquivos[chave] = arquivo
+        return self._arquivos[chave]
+
+    def _fechar_arquivo(self, chave):
+        arquivo = self._arquivos.pop(chave)
+        arquivo.flush()
+        os.fsync(arquivo.fileno())
+        arquivo.close()
+
+    def _a_sincronizar(self):
+        """Descarrega os lotes e devolve os arquivos que precisam de fsync (vazio se nada mudou)."""
+        self.descarregar()
+        if not self._sujo:
+            return []
+        self._sujo = False
+        return list(self._arquivos.values())
+
+    @staticmethod
+    def _fsync(arquivos):
+        for arquivo in arquivos:
+            try:
+                arquivo.flush()
+                os.fsync(arquivo.fileno())
+            except ValueError:
+                pass  # fechado na virada do dia enquanto esperava: o fechamento já fez o fsync
+
+    def sincronizar(self):
+        """Descarrega tudo e força o fsync na hora (uso síncrono, fora do loop)."""
+        self._fsync(self._a_sincronizar())
+
+    async def executar(self):
+        """Timer do fsync: a cada `intervalo_fsync` descarrega no loop e faz o fsync numa thread."""
+        while True:
+            await asyncio.sleep(self.intervalo_fsync)
+            try:
+                await asyncio.to_thread(self._fsync, self._a_sincronizar())
+            except OSError as e:
+                print(f"⚠️ Gravador de ticks: falha ao sincronizar o log ({e}).")
+
+    def fechar(self):
+        self.descarregar()
+        for chave in list(self._arquivos):
+            self._fechar_arquivo(chave)
+        self._sujo = False
+
+
+def dias_gravados(ativo: str, raiz=None):
+    pasta = os.path.join(raiz or os.getenv("GRAVADOR_TICKS_DIR", "dados_ticks"), ativo)
+    if not os.path.isdir(pasta):
+        return []
+    return sorted(n[:-6] for n in os.listdir(pasta) if n.endswith(".ticks"))
+
+
+def ler_ticks(ativo: str, dia: str, raiz=None):
+    """Log de ticks do dia como array estruturado (np.memmap somente leitura, sem carregar o arquivo)."""
+    caminho = _caminho(raiz or os.getenv("GRAVADOR_TICKS_DIR", "dados_ticks"), ativo, dia)
+    if not os.path.exists(caminho):
+        return np.empty(0, dtype=DTYPE_TICK)
+    registros = os.path.getsize(caminho) // DTYPE_TICK.itemsize
+    if registros == 0:
+        return np.empty(0, dtype=DTYPE_TICK)
+    return np.memmap(caminho, dtype=DTYPE_TICK, mode='r', shape=(registros,))
+
+
+if __name__ == "__main__":
+    import tempfile
+    from collections import namedtuple
+
+    # Custo por tick no loop quente (lote de 64; o fsync fica com o timer, fora do loop)
+    Tick = namedtuple("Tick", "time bid ask last volume time_msc flags volume_real")
+    with tempfile.TemporaryDirectory() as raiz:
+        gravador = GravadorTicks(raiz)
+        inicio_msc = 1_700_000_000_000
+        qtd = 100_000
+        t0 = time.perf_counter()
+        for i in range(qtd):
+            gravador.registrar("BENCH", Tick(0, 100.0 + i * 1e-4, 100.1, 100.05, 1, inicio_msc + i * 500, 0, 1.0))
+        gravador.fechar()
+        custo = (time.perf_counter() - t0) / qtd
+        ticks = ler_ticks("BENCH", _dia(inicio_msc), raiz)
+        print(f"Custo por tick: {custo * 1e6:.1f} µs | {gravador.gravados} gravados | "
+              f"{len(ticks)} lidos do dia {_dia(inicio_msc)}")
@@ -0,0 +1,313 @@
+import math
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+# Colunas devolvidas por MT5Service.obter_dados_mercado (contrato com a IA e o gráfico)
+COLUNAS_INDICADORES = ['time', 'open', 'high', 'low', 'close', 'tick_volume', 'rsi_14', 'stoch_k', 'stoch_d', 'atr_14', 'vwap']
+
+
+def calcular_indicadores_pandas(df):
+    """
+    Implementação de referência (pandas) dos indicadores: recalcula tudo do zero.
+    Mantida para o teste de paridade do MotorIndicadores.
+    """
+    df = df.copy()
+    if not pd.api.types.is_datetime64_any_dtype(df['time']):
+        df['time'] = pd.to_datetime(df['time'], unit='s')
+
+    # 1. RSI (Relative Strength Index) - Período 14
+    delta = df['close'].diff()
+    gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
+    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
+    rs = gain / loss
+    df['rsi_14'] = 100 - (100 / (1 + rs))
+
+    # 2. Estocástico (Stochastic Oscillator) - %K(14), %D(3)
+    low_14 = df['low'].rolling(window=14).min()
+    high_14 = df['high'].rolling(window=14).max()
+    df['stoch_k'] = 100 * ((df['close'] - low_14) / (high_14 - low_14))
+    df['stoch_d'] = df['stoch_k'].rolling(window=3).mean()
+
+    # 3. ATR (Average True Range) - Período 14
+    df['prev_close'] = df['close'].shift(1)
+    df['tr1'] = df['high'] - df['low']
+    df['tr2'] = abs(df['high'] - df['prev_close'])
+    df['tr3'] = abs(df['low'] - df['prev_close'])
+    df['tr'] = df[['tr1', 'tr2', 'tr3']].max(axis=1)
+    df['atr_14'] = df['tr'].rolling(window=14).mean()
+
+    # 4. VWAP (Volume Weighted Average Price) Diária
+    df['date'] = df['time'].dt.date
+    df['typical_price'] = (df['high'] + df['low'] + df['close']) / 3
+    df['tp_vol'] = df['typical_price'] * df['tick_volume']
+    df['cum_vol'] = df.groupby('date')['tick_volume'].cumsum()
+    df['cum_tp_vol'] = df.groupby('date')['tp_vol'].cumsum()
+    df['vwap'] = df['cum_tp_vol'] / df['cum_vol']
+
+    # Preenche NaNs iniciais com 50 (neutro) para evitar quebra na IA
+    df.fillna({'rsi_14': 50, 'stoch_k': 50, 'stoch_d': 50, 'atr_14': 0, 'vwap': df['close']}, inplace=True)
+
+    return df[COLUNAS_INDICADORES]
+
+
+class _JanelaSoma:
+    """Soma móvel dos últimos N valores (não-negativos) com atualização O(1)."""
+
+    def __init__(self, tamanho):
+        self.valores = deque(maxlen=tamanho)
+        self.soma = 0.0
+        self.nao_zeros = 0
+
+    def adicionar(self, valor):
+        if len(self.valores) == self.valores.maxlen:
+            antigo = self.valores[0]
+            self.soma -= antigo
+            if antigo != 0:
+                self.nao_zeros -= 1
+        self.valores.append(valor)
+        self.soma += valor
+        if valor != 0:
+            self.nao_zeros += 1
+        # Janela toda zerada: elimina o resíduo de ponto flutuante da subtração
+        if self.nao_zeros == 0 or self.soma < 0:
+            self.soma = 0.0
+
+
+class _JanelaExtremo:
+    """Mínimo/máximo móvel com deque monotônica (O(1) amortizado)."""
+
+    def __init__(self, tamanho, maximo):
+        self.tamanho = tamanho
+        self.maximo = maximo
+        self.itens = deque()  # (indice, valor)
+
+    def adicionar(self, indice, valor):
+        if self.maximo:
+            while self.itens and self.itens[-1][1] <= valor:
+                self.itens.pop()
+        else:
+            while self.itens and self.itens[-1][1] >= valor:
+                self.itens.pop()
+        self.itens.append((indice, valor))
+        while self.itens[0][0] <= indice - self.tamanho:
+            self.itens.popleft()
+
+    def valor(self):
+        return self.itens[0][1] if self.itens else None
+
+
+class MotorIndicadores:
+    """
+    Motor incremental de RSI-14, Estocástico 14/3, ATR-14 e VWAP diária para um (ativo, timeframe).
+
+    Os candles fechados são consolidados em janelas móveis (somas e deques de mín/máx) e no
+    acumulado da VWAP; o candle em formação é recalculado em O(1) a partir desse estado a cada
+    atualização. O resultado é idêntico ao de calcular_indicadores_pandas sobre o mesmo histórico.
+    """
+
+    def __init__(self, periodo=14, periodo_d=3, capacidade=500):
+        self.periodo = periodo
+        self.periodo_d = periodo_d
+        self.capacidade = capacidade
+        self.resetar()
+
+    def resetar(self):
+        p = self.periodo
+        # Estado consolidado (apenas candles fechados)
+        self._n_fechados = 0
+        self._close_anterior = None
+        self._ganhos = _JanelaSoma(p - 1)
+        self._perdas = _JanelaSoma(p - 1)
+        self._tr = _JanelaSoma(p - 1)
+        self._minimas = _JanelaExtremo(p - 1, maximo=False)
+        self._maximas = _JanelaExtremo(p - 1, maximo=True)
+        self._stoch_k_fechados = deque(maxlen=self.periodo_d - 1)
+        self._vwap_dia = None
+        self._cum_vol = 0.0
+        self._cum_tp_vol = 0.0
+        # Candle em formação (recalculado a cada tick)
+        self._ultimo_tempo = None
+        self._formando = None
+        self._parciais = None
+        self._saida_formando = None
+        self._saidas = deque(maxlen=self.capacidade)
+
+    def atualizar(self, rates):
+        """
+        Consome um array de rates do MT5 (ordenado por tempo). Candles já consolidados são
+        ignorados, o candle com o mesmo horário do último é tratado como atualização do candle
+        em formação e cada candle novo fecha o anterior.
+        """
+        if rates is None or len(rates) == 0:
+            return
+        tempos = rates['time']
+        inicio = 0
+        if self._ultimo_tempo is not None:
+            if int(tempos[0]) > self._ultimo_tempo:
+                # Sem sobreposição com o que já vimos: pode haver buraco, recomeça do zero
+                self.resetar()
+            else:
+                inicio = int(np.searchsorted(tempos, self._ultimo_tempo, side='left'))
+
+        for i in range(inicio, len(rates)):
+            row = rates[i]
+            tempo = int(row['time'])
+            if self._ultimo_tempo is not None and tempo < self._ultimo_tempo:
+                continue
+            if self._ultimo_tempo is not None and tempo > self._ultimo_tempo:
+                self._fechar_formando()
+            self._ultimo_tempo = tempo
+            self._formando = (tempo, float(row['open']), float(row['high']), float(row['low']),
+                              float(row['close']), int(row['tick_volume']))
+            self._calcular_formando()
+
+    def _calcular_formando(self):
+        tempo, o, h, l, c, vol = self._formando
+        p = self.periodo
+        n = self._n_fechados  # índice do candle em formação no fluxo
+        pronto = n >= p - 1
+
+        # RSI: o primeiro candle entra com ganho/perda zero (mesmo comportamento do diff + where)
+        if self._close_anterior is None:
+            ganho = perda = 0.0
+            tr = h - l
+        else:
+            delta = c - self._close_anterior
+            ganho = delta if delta > 0 else 0.0
+            perda = -delta if delta < 0 else 0.0
+            tr = max(h - l, abs(h - self._close_anterior), abs(l - self._close_anterior))
+
+        rsi_raw = math.nan
+        atr_raw = math.nan
+        stoch_k_raw = math.nan
+        if pronto:
+            media_ganho = (self._ganhos.soma + ganho) / p
+            media_perda = (self._perdas.soma + perda) / p
+            if media_perda == 0:
+                rsi_raw = 100.0 if media_ganho > 0 else math.nan
+            else:
+                rsi_raw = 100 - (100 / (1 + media_ganho / media_perda))
+            atr_raw = (self._tr.soma + tr) / p
+            minima = min(self._minimas.valor(), l)
+            maxima = max(self._maximas.valor(), h)
+            if maxima != minima:
+                stoch_k_raw = 100 * ((c - minima) / (maxima - minima))
+
+        stoch_d_raw = math.nan
+        if len(self._stoch_k_fechados) == self.periodo_d - 1:
+            janela_k = list(self._stoch_k_fechados) + [stoch_k_raw]
+            if not any(math.isnan(k) for k in janela_k):
+                stoch_d_raw = sum(janela_k) / self.periodo_d
+
+        # VWAP diária (reinicia no primeiro candle de cada dia)
+        dia = tempo // 86400
+        tp_vol = ((h + l + c) / 3) * vol
+        if dia == self._vwap_dia:
+            cum_vol = self._cum_vol + vol
+            cum_tp_vol = self._cum_tp_vol + tp_vol
+        else:
+            cum_vol = float(vol)
+            cum_tp_vol = tp_vol
+        vwap = cum_tp_vol / cum_vol if cum_vol != 0 else c
+
+        self._parciais = (ganho, perda, tr, stoch_k_raw, dia, cum_vol, cum_tp_vol)
+        self._saida_formando = (
+            tempo, o, h, l, c, vol,
+            50.0 if math.isnan(rsi_raw) else rsi_raw,
+            50.0 if math.isnan(stoch_k_raw) else stoch_k_raw,
+            50.0 if math.isnan(stoch_d_raw) else stoch_d_raw,
+            0.0 if math.isnan(atr_raw) else atr_raw,
+            vwap,
+        )
+
+    def _fechar_formando(self):
+        """Consolida o candle em formação no estado das janelas."""
+        if self._formando is None:
+            return
+        _, _, h, l, c, _ = self._formando
+        ganho, perda, tr, stoch_k_raw, dia, cum_vol, cum_tp_vol = self._parciais
+        n = self._n_fechados
+        self._ganhos.adicionar(ganho)
+        self._perdas.adicionar(perda)
+        self._tr.adicionar(tr)
+        self._minimas.adicionar(n, l)
+        self._maximas.adicionar(n, h)
+        self._stoch_k_fechados.append(stoch_k_raw)
+        self._vwap_dia, self._cum_vol, self._cum_tp_vol = dia, cum_vol, cum_tp_vol
+        self._close_anterior = c
+        self._n_fechados += 1
+        self._saidas.append(self._saida_formando)
+
+    def para_dataframe(self, qtd_candles=100):
+        """Devolve os últimos `qtd_candles` (fechados + em formação) com as colunas de indicadores."""
+        if self._saida_formando is None:
+            return None
+        fechados = list(self._saidas)[-(qtd_candles - 1):] if qtd_candles > 1 else []
+        df = pd.DataFrame.from_records(fechados + [self._saida_formando], columns=COLUNAS_INDICADORES)
+        df['time'] = pd.to_datetime(df['time'], unit='s')
+        return df
+
+
+def verificar_paridade(rates, tolerancia=1e-6):
+    """
+    Alimenta o motor candle a candle (incluindo atualizações do candle em formação) e compara
+    com a referência pandas sobre o mesmo histórico. Retorna a maior divergência por coluna.
+    """
+    motor = MotorIndicadores(capacidade=len(rates))
+    for i in range(1, len(rates) + 1):
+        parcial = rates[max(0, i - 100):i].copy()
+        # Simula o candle em formação: primeiro só a abertura, depois o candle completo
+        formando = parcial[-1:].copy()
+        for campo in ('high', 'low', 'close'):
+            formando[campo] = formando['open']
+        motor.atualizar(np.concatenate([parcial[:-1], formando]))
+        motor.atualizar(parcial)
+
+    df_motor = motor.para_dataframe(len(rates))
+    df_ref = calcular_indicadores_pandas(pd.DataFrame(rates))
+    divergencias = {}
+    for coluna in COLUNAS_INDICADORES[6:]:
+        divergencias[coluna] = float(np.max(np.abs(df_motor[coluna].values - df_ref[coluna].values)))
+    return all(d <= tolerancia for d in divergencias.values()), divergencias
+
+
+def _gerar_rates_sinteticos(qtd, inicio=1_700_000_000, passo=60, semente=42):
+    """Passeio aleatório no formato de copy_rates_from_pos (para paridade e benchmark)."""
+    rng = np.random.default_rng(semente)
+    dtype = [('time', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8'),
+             ('tick_volume', '<u8'), ('spread', '<i4'), ('real_volume', '<u8')]
+    rates = np.zeros(qtd, dtype=dtype)
+    closes = 100 + np.cumsum(rng.normal(0, 0.2, qtd))
+    opens = np.concatenate([[100.0], closes[:-1]])
+    rates['time'] = inicio + np.arange(qtd) * passo
+    rates['open'] = opens
+    rates['close'] = closes
+    rates['high'] = np.maximum(opens, closes) + rng.random(qtd) * 0.1
+    rates['low'] = np.minimum(opens, closes) - rng.random(qtd) * 0.1
+    rates['tick_volume'] = rng.integers(0, 500, qtd)
+    return rates
+
+
+if __name__ == "__main__":
+    import time
+
+    rates = _gerar_rates_sinteticos(3000)
+    ok, divergencias = verificar_paridade(rates)
+    print(f"Paridade motor x pandas: {'OK' if ok else 'FALHOU'} | {divergencias}")
+
+    # Benchmark: 1 atualização do candle em formação sobre janela de 100 candles
+    janela = rates[-100:]
+    motor = MotorIndicadores()
+    motor.atualizar(janela)
+    rodadas = 2000
+    t0 = time.perf_counter()
+    for _ in range(rodadas):
+        motor.atualizar(janela[-2:])
+    t_motor = (time.perf_counter() - t0) / rodadas
+    t0 = time.perf_counter()
+    for _ in range(200):
+        calcular_indicadores_pandas(pd.DataFrame(janela))
+    t_pandas = (time.perf_counter() - t0) / 200
+    print(f"Atualização incremental: {t_motor * 1e6:.1f} µs | Pandas completo: {t_pandas * 1e6:.1f} µs")
@@ -0,0 +1,69 @@
+import time
+
+from provedor_mercado import provedor_adiado
+
+# Provedor resolvido no primeiro uso: importar o módulo não exige o MetaTrader5
+mt5 = provedor_adiado
+
+
+class LivroPosicoes:
+    """
+    Foto das posições abertas da conta, indexada por ativo e por ticket.
+    Uma única chamada positions_get() alimenta todas as consultas do ciclo; a foto é descartada
+    no início de cada ciclo (novo_ciclo), após qualquer order_send (invalidar) ou quando passa
+    de `validade_segundos` (ciclos longos, com espera da IA no meio).
+    """
+
+    def __init__(self, validade_segundos=5.0):
+        self.validade_segundos = validade_segundos
+        self._por_ativo = {}
+        self._por_ticket = {}
+        self._atualizado_em = None
+        self.chamadas_terminal = 0
+        self.leituras = 0
+
+    def novo_ciclo(self):
+        self._atualizado_em = None
+
+    def invalidar(self):
+        """Chamar depois de todo order_send (abertura, fechamento, SL/TP)."""
+        self._atualizado_em = None
+
+    def _garantir_atualizado(self):
+        self.leituras += 1
+        agora = time.monotonic()
+        if self._atualizado_em is not None and agora - self._atualizado_em < self.validade_segundos:
+            return True
+        posicoes = mt5.positions_get()
+        self.chamadas_terminal += 1
+        if posicoes is None:
+            # Falha no terminal: não guarda a foto, a próxima leitura tenta de novo
+            self._por_ativo, self._por_ticket = {}, {}
+            return False
+        por_ativo = {}
+        for posicao in posicoes:
+            por_ativo.setdefault(posicao.symbol, []).append(posicao)
+        self._por_ativo = por_ativo
+        self._por_ticket = {posicao.ticket: posicao for posicao in posicoes}
+        self._atualizado_em = agora
+        return True
+
+    def posicoes(self, ativo: str):
+        self._garantir_atualizado()
+        return self._por_ativo.get(ativo, [])
+
+    def posicao(self, ativo: str):
+        """Primeira posição aberta do ativo (ou None)."""
+        posicoes = self.posicoes(ativo)
+        return posicoes[0] if posicoes else None
+
+    def por_ticket(self, ticket: int):
+        self._garantir_atualizado()
+        return self._por_ticket.get(ticket)
+
+    def estatisticas(self):
+        return {
+            "leituras": self.leituras,
+            "chamadas_terminal": self.chamadas_terminal,
+            "abertas": len(self._por_ticket),
+        }
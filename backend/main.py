@@ -8,6 +8,10 @@ from supabase import create_client, Client
 from dotenv import load_dotenv
 from typing import List
 
+from armazem_candles import ArmazemCandles
+from reamostragem import reamostrar
+from stream_candles import EstadoGrafico
+
 # Carrega variáveis de ambiente
 load_dotenv()
 
@@ -47,6 +51,12 @@ class ConnectionManager:
 
 manager = ConnectionManager()
 
+# Histórico local de candles (gravado pelo trading_bot a partir das leituras do MT5)
+armazem_candles = ArmazemCandles()
+
+# Último snapshot do gráfico com os deltas aplicados (para conexões novas e resync)
+estado_grafico = EstadoGrafico()
+
 # --- CONFIGURAÇÕES GLOBAIS DE CONTROLE ---
 current_symbol = "EURUSD" # padrão inicial se no supabase não configurado outro
 replay_speed = 1.0
@@ -117,9 +127,34 @@ async def broadcast_log(data: dict):
     Este é o endpoint que o trading_bot.py chama.
     Agora ele usa o manager.broadcast corretamente.
     """
+    if data.get("type") == "market_data" and "modo" in data:
+        if not estado_grafico.aplicar(data):
+            # Delta fora de sequência: descarta e pede um snapshot ao robô
+            return {"status": "resync", "resync": True}
     await manager.broadcast(data)
     return {"status": "sent"}
 
+@app.get("/api/candles/{ativo}")
+async def historico_candles(ativo: str, minutos: int = 5, inicio: int | None = None, fim: int | None = None, limite: int = 500):
+    """
+    Histórico de candles direto do armazém local (memmap), sem consultar o MT5.
+    `inicio`/`fim` em timestamp unix; sem `inicio`, busca a última semana gravada.
+    """
+    if inicio is None:
+        inicio = (fim or int(datetime.now().timestamp())) - 7 * 86400
+    rates_m1 = armazem_candles.ler_rates(ativo, 1, inicio, fim)
+    rates = reamostrar(rates_m1, minutos) if minutos > 1 else rates_m1
+    rates = rates[-limite:]
+    return {
+        "ativo": ativo,
+        "minutos": minutos,
+        "candles": [
+            {"time": t, "open": o, "high": h, "low": l, "close": c}
+            for t, o, h, l, c in zip(rates['time'].tolist(), rates['open'].tolist(), rates['high'].tolist(),
+                                     rates['low'].tolist(), rates['close'].tolist())
+        ]
+    }
+
 # --- ENDPOINT WEBSOCKET ---
 
 @app.websocket("/ws/logs")
@@ -136,10 +171,23 @@ async def websocket_logs(websocket: WebSocket):
             "message": "Motor Consists Trade AI Iniciado. Conexão Estabelecida."
         })
         
+        # Gráfico atual, para o cliente não esperar o próximo snapshot do robô
+        snapshot = estado_grafico.snapshot()
+        if snapshot:
+            await websocket.send_json(snapshot)
+        
         while True:
             # Mantém a conexão aberta recebendo pings ou apenas aguardando
             data = await websocket.receive_text()
-            # Se o frontend mandar algo, podemos tratar aqui
+            # Cliente detectou buraco na sequência dos deltas: reenvia o gráfico completo
+            try:
+                pedido = json.loads(data)
+            except ValueError:
+                continue
+            if isinstance(pedido, dict) and pedido.get("type") == "resync":
+                snapshot = estado_grafico.snapshot()
+                if snapshot:
+                    await websocket.send_json(snapshot)
             
     except WebSocketDisconnect:
         manager.disconnect(websocket)
@@ -0,0 +1,77 @@
+import asyncio
+import time
+from collections import deque
+
+import numpy as np
+
+
+class MonitorLoop:
+    """
+    Mede a saúde do event loop do robô:
+    - atraso (lag): uma tarefa dorme `intervalo` segundos e registra quanto acordou atrasada.
+      Qualquer chamada bloqueante (ex.: IA síncrona) aparece aqui como lag da ordem da sua duração;
+    - cadência: intervalo real entre iterações das tarefas periódicas (ticks a cada 0.5s, gráfico...).
+    """
+
+    def __init__(self, intervalo=0.1, janela=600):
+        self.intervalo = intervalo
+        self.atrasos = deque(maxlen=janela)
+        self.cadencias = {}
+        self._ultimas_batidas = {}
+
+    async def executar(self):
+        while True:
+            inicio = time.perf_counter()
+            await asyncio.sleep(self.intervalo)
+            self.atrasos.append(max(0.0, time.perf_counter() - inicio - self.intervalo))
+
+    def registrar_batida(self, tarefa: str):
+        """Chamar a cada iteração de uma tarefa periódica."""
+        agora = time.perf_counter()
+        anterior = self._ultimas_batidas.get(tarefa)
+        self._ultimas_batidas[tarefa] = agora
+        if anterior is not None:
+            self.cadencias.setdefault(tarefa, deque(maxlen=self.atrasos.maxlen)).append(agora - anterior)
+
+    def estatisticas(self):
+        resumo = {}
+        if self.atrasos:
+            atrasos = np.fromiter(self.atrasos, dtype=np.float64) * 1000
+            resumo["lag_ms"] = {"p50": round(float(np.percentile(atrasos, 50)), 1),
+                                "p99": round(float(np.percentile(atrasos, 99)), 1),
+                                "max": round(float(atrasos.max()), 1)}
+        for tarefa, intervalos in self.cadencias.items():
+            if intervalos:
+                valores = np.fromiter(intervalos, dtype=np.float64)
+                resumo[f"cadencia_{tarefa}_s"] = {"media": round(float(valores.mean()), 3),
+                                                  "max": round(float(valores.max()), 3)}
+        return resumo
+
+
+if __name__ == "__main__":
+    # Tarefa de ticks a cada 0.5s enquanto o "ciclo da IA" faz uma chamada de 3s:
+    # bloqueante (generate_content síncrono) vs. aguardada (client.aio)
+    async def cenario(chamada_bloqueante: bool):
+        monitor = MonitorLoop()
+
+        async def ticks():
+            while True:
+                monitor.registrar_batida("ticks")
+                await asyncio.sleep(0.5)
+
+        async def ciclo_ia():
+            await asyncio.sleep(1.0)
+            if chamada_bloqueante:
+                time.sleep(3.0)
+            else:
+                await asyncio.sleep(3.0)
+            await asyncio.sleep(1.0)
+
+        tarefas = [asyncio.create_task(monitor.executar()), asyncio.create_task(ticks())]
+        await ciclo_ia()
+        for tarefa in tarefas:
+            tarefa.cancel()
+        return monitor.estatisticas()
+
+    print(f"IA síncrona:   {asyncio.run(cenario(True))}")
+    print(f"IA assíncrona: {asyncio.run(cenario(False))}")
@@ -0,0 +1,306 @@
+import bisect
+import itertools
+import math
+from collections import deque
+from dataclasses import dataclass
+
+import numpy as np
+
+
+class RodaTemporizadores:
+    """
+    Roda de temporizadores (hashed timing wheel): `casas` listas, uma por passo de `resolucao`
+    segundos. Agendar e cancelar são O(1); avancar() visita só as casas dos passos que o relógio
+    andou (um salto maior que a roda inteira faz uma volta completa). Vencimentos além de uma
+    volta ficam na casa até a rodada certa. Precisão: até `resolucao` segundos de atraso.
+    """
+
+    def __init__(self, resolucao=1.0, casas=1024):
+        self.resolucao = resolucao
+        self.casas = casas
+        self._casas = [[] for _ in range(casas)]
+        self._vivos = set()
+        self._cursor = None  # último passo processado
+
+    def __len__(self):
+        return len(self._vivos)
+
+    def agendar(self, chave, vencimento):
+        passo = math.ceil(vencimento / self.resolucao)
+        if self._cursor is not None and passo <= self._cursor:
+            passo = self._cursor + 1
+        self._casas[passo % self.casas].append((vencimento, chave))
+        self._vivos.add(chave)
+
+    def cancelar(self, chave):
+        # Remoção preguiçosa: a entrada sai da casa quando a roda passar por ela
+        self._vivos.discard(chave)
+
+    def avancar(self, agora):
+        """Chaves vencidas até `agora`, na ordem dos passos."""
+        alvo = math.floor(agora / self.resolucao)
+        if self._cursor is not None and alvo <= self._cursor:
+            return []
+        if self._cursor is None or alvo - self._cursor >= self.casas:
+            passos = range(alvo - self.casas + 1, alvo + 1)
+        else:
+            passos = range(self._cursor + 1, alvo + 1)
+        self._cursor = alvo
+        vencidas = []
+        for passo in passos:
+            indice = passo % self.casas
+            casa = self._casas[indice]
+            if not casa:
+                continue
+            restantes = []
+            for vencimento, chave in casa:
+                if chave not in self._vivos:
+                    continue
+                if vencimento <= agora:
+                    self._vivos.discard(chave)
+                    vencidas.append(chave)
+                else:
+                    restantes.append((vencimento, chave))
+            self._casas[indice] = restantes
+        return vencidas
+
+
+@dataclass(slots=True)
+class Armadilha:
+    seq: int
+    profile_id: str
+    ativo: str
+    acao: str
+    gatilho: float
+    armada_em: float
+    dados: dict  # ordem_programada da IA (com motivo_ia e timestamp), como foi aplicada
+
+
+class MotorArmadilhas:
+    """
+    Armadilhas (ordens programadas pela IA) indexadas por ativo, com os gatilhos de compra e de
+    venda em listas ordenadas por preço. A confirmação continua sendo a da vela M1 fechada:
+    - BUY: rompimento (abriu no/abaixo do gatilho e fechou acima) ou pullback (mínima tocou o
+      gatilho e a vela fechou verde) -- juntas, equivalem a vela verde com gatilho >= mínima;
+    - SELL: o espelho -- vela vermelha com gatilho <= máxima.
+    Então cada fechamento de barra custa uma busca binária por lado mais as armadilhas acionadas,
+    em vez de percorrer todos os perfis. A validade (`validade` segundos desde a armação) corre
+    numa roda de temporizadores.
+    """
+
+    def __init__(self, validade=900.0, resolucao=1.0, janela=500):
+        self.validade = validade
+        self.roda = RodaTemporizadores(resolucao)
+        self._por_perfil = {}
+        self._por_seq = {}
+        self._gatilhos = {}  # ativo -> {"BUY": [(gatilho, seq)], "SELL": [...]}
+        self._seq = itertools.count(1)
+        self.contagem = {"armadas": 0, "disparadas": 0, "expiradas": 0, "substituidas": 0}
+        self.barras_avaliadas = 0
+        self.atrasos = deque(maxlen=janela)  # fechamento da barra -> envio da ordem (s)
+
+    def obter(self, profile_id) -> dict:
+        """Armadilha do perfil no formato da IA ({"acao": "NONE"} se não houver)."""
+        armadilha = self._por_perfil.get(profile_id)
+        return armadilha.dados if armadilha is not None else {"acao": "NONE"}
+
+    def ativos(self):
+        """Ativos com alguma armadilha armada."""
+        return list(self._gatilhos)
+
+    def armar(self, profile_id, ativo, dados: dict, agora):
+        """Substitui a armadilha do perfil (acao NONE só desarma)."""
+        anterior = self.desarmar(profile_id)
+        if dados.get("acao") not in ("BUY", "SELL"):
+            return None
+        if anterior is not None:
+            self.contagem["substituidas"] += 1
+        armadilha = Armadilha(next(self._seq), profile_id, ativo, dados["acao"], float(dados["preco_gatilho"]),
+                              float(dados.get("timestamp", agora)), dados)
+        self._por_perfil[profile_id] = armadilha
+        self._por_seq[armadilha.seq] = armadilha
+        lados = self._gatilhos.setdefault(ativo, {"BUY": [], "SELL": []})
+        bisect.insort(lados[armadilha.acao], (armadilha.gatilho, armadilha.seq))
+        self.roda.agendar(armadilha.seq, armadilha.armada_em + self.validade)
+        self.contagem["armadas"] += 1
+        return armadilha
+
+    def desarmar(self, profile_id):
+        armadilha = self._por_perfil.pop(profile_id, None)
+        if armadilha is None:
+            return None
+        del self._por_seq[armadilha.seq]
+        self.roda.cancelar(armadilha.seq)
+        lados = self._gatilhos[armadilha.ativo]
+        lista = lados[armadilha.acao]
+        del lista[bisect.bisect_left(lista, (armadilha.gatilho, armadilha.seq))]
+        if not lados["BUY"] and not lados["SELL"]:
+            del self._gatilhos[armadilha.ativo]
+        return armadilha
+
+    def vencer(self, agora):
+        """Desarma e devolve as armadilhas cuja validade acabou até `agora`."""
+        expiradas = []
+        for seq in self.roda.avancar(agora):
+            armadilha = self._por_seq.get(seq)
+            if armadilha is not None:
+                self.desarmar(armadilha.profile_id)
+                expiradas.append(armadilha)
+        self.contagem["expiradas"] += len(expiradas)
+        return expiradas
+
+    def avaliar_barra(self, ativo, abertura, maxima, minima, fechamento):
+        """
+        Armadilhas do ativo confirmadas pela vela fechada, na ordem em que foram armadas, como
+        (armadilha, rompimento, pullback). Não desarma: quem executa chama disparada().
+        """
+        lados = self._gatilhos.get(ativo)
+        if lados is None:
+            return []
+        self.barras_avaliadas += 1
+        confirmadas = []
+        if fechamento > abertura:
+            compras = lados["BUY"]
+            for gatilho, seq in compras[bisect.bisect_left(compras, (minima,)):]:
+                confirmadas.append((self._por_seq[seq], abertura <= gatilho < fechamento, True))
+        elif fechamento < abertura:
+            vendas = lados["SELL"]
+            for gatilho, seq in vendas[:bisect.bisect_right(vendas, (maxima, math.inf))]:
+                confirmadas.append((self._por_seq[seq], fechamento < gatilho <= abertura, True))
+        confirmadas.sort(key=lambda item: item[0].seq)
+        return confirmadas
+
+    def disparada(self, armadilha, atraso=None):
+        """Armadilha executada: sai do índice (não atira duplicado)."""
+        self.desarmar(armadilha.profile_id)
+        self.contagem["disparadas"] += 1
+        if atraso is not None:
+            self.atrasos.append(atraso)
+
+    def estatisticas(self):
+        resumo = dict(self.contagem)
+        resumo.update(armadas_agora=len(self._por_perfil), ativos=len(self._gatilhos),
+                      barras_avaliadas=self.barras_avaliadas)
+        if self.atrasos:
+            atrasos = np.fromiter(self.atrasos, dtype=np.float64)
+            resumo["atraso_disparo_s"] = {"p50": round(float(np.percentile(atrasos, 50)), 2),
+                                          "p95": round(float(np.percentile(atrasos, 95)), 2)}
+        return resumo
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    # Pregão sintético: 5 ativos, ticks a cada ~0.5s (passeio aleatório), 300 perfis armando
+    # armadilhas a 0.05%-0.5% do preço. Antes: cada perfil conferia a própria armadilha quando o
+    # loop serial chegava nele (a cada 15s, sobre a última vela fechada). Depois: o motor avalia
+    # cada ativo no primeiro tick da barra nova.
+    aleatorio = random.Random(5)
+    ATIVOS, PERFIS, MINUTOS, LOOP = ["WIN", "WDO", "PETR4", "VALE3", "BITG26"], 300, 240, 15
+    inicio = 1_700_000_040
+
+    ticks = {}
+    for ativo in ATIVOS:
+        preco, t, serie = 100.0, float(inicio), []
+        while t < inicio + MINUTOS * 60:
+            preco *= 1 + aleatorio.gauss(0, 0.0004)
+            serie.append((t, preco))
+            t += aleatorio.expovariate(2.0)
+        ticks[ativo] = serie
+
+    def velas(serie):
+        barras = {}
+        for t, preco in serie:
+            barra = int(t // 60) * 60
+            o, h, l, c = barras.get(barra, (preco, preco, preco, preco))
+            barras[barra] = (o, max(h, preco), min(l, preco), preco)
+        return barras
+
+    barras = {ativo: velas(serie) for ativo, serie in ticks.items()}
+
+    def preco_em(ativo, instante):
+        serie = ticks[ativo]
+        return serie[max(0, bisect.bisect_right(serie, (instante, math.inf)) - 1)][1]
+
+    def nova_armadilha(ativo, instante):
+        preco = preco_em(ativo, instante)
+        acao = aleatorio.choice(["BUY", "SELL"])
+        distancia = preco * aleatorio.uniform(0.0005, 0.005)
+        return {"acao": acao, "preco_gatilho": preco + distancia if acao == "BUY" else preco - distancia,
+                "timestamp": instante}
+
+    # Cada perfil rearma quando a anterior dispara ou expira, depois de 1-3 minutos (o ciclo da IA)
+    rearmes = sorted((inicio + aleatorio.uniform(0, 120), f"p{i:03d}", ATIVOS[i % len(ATIVOS)]) for i in range(PERFIS))
+
+    def regra(dados, vela):
+        o, h, l, c = vela
+        g = dados["preco_gatilho"]
+        if dados["acao"] == "BUY":
+            return (o <= g and c > g) or (l <= g and c > o)
+        return (o >= g and c < g) or (h >= g and c < o)
+
+    # --- Antes: conferência no ciclo serial do perfil ---
+    aleatorio.seed(9)
+    fila = list(rearmes)
+    memoria, atrasos_antes, disparos_antes, expiradas_antes, verificacoes = {}, [], 0, 0, 0
+    for passo in range(0, MINUTOS * 60, LOOP):
+        agora = inicio + passo
+        while fila and fila[0][0] <= agora:
+            _, perfil, ativo = fila.pop(0)
+            memoria[perfil] = (ativo, nova_armadilha(ativo, agora))
+        for perfil, (ativo, dados) in list(memoria.items()):
+            verificacoes += 1
+            # O loop serial passa pelos perfis em sequência: cada um alguns segundos depois do outro
+            instante = agora + aleatorio.uniform(0, LOOP)
+            if instante - dados["timestamp"] > 900:
+                del memoria[perfil]
+                expiradas_antes += 1
+                fila.append((instante + aleatorio.uniform(60, 180), perfil, ativo))
+                continue
+            fechada = int(instante // 60) * 60 - 60
+            if fechada in barras[ativo] and regra(dados, barras[ativo][fechada]):
+                del memoria[perfil]
+                disparos_antes += 1
+                atrasos_antes.append(instante - (fechada + 60))
+                fila.append((instante + aleatorio.uniform(60, 180), perfil, ativo))
+        fila.sort()
+
+    # --- Depois: motor por ticks, com paridade conferida contra a regra original vela a vela ---
+    aleatorio.seed(9)
+    motor = MotorArmadilhas()
+    fila = list(rearmes)
+    eventos = sorted((t, ativo) for ativo, serie in ticks.items() for t, _ in serie)
+    ultima_barra, divergencias, tempo_avaliacao, tempo_varredura = {}, 0, 0.0, 0.0
+    for t, ativo in eventos:
+        while fila and fila[0][0] <= t:
+            _, perfil, ativo_perfil = fila.pop(0)
+            motor.armar(perfil, ativo_perfil, nova_armadilha(ativo_perfil, t), t)
+        for armadilha in motor.vencer(t):
+            fila.append((t + aleatorio.uniform(60, 180), armadilha.profile_id, armadilha.ativo))
+        barra = int(t // 60) * 60
+        anterior = ultima_barra.get(ativo)
+        ultima_barra[ativo] = barra
+        if anterior is not None and barra > anterior:
+            vela = barras[ativo][anterior]
+            t0 = time.perf_counter()
+            esperadas = {a.seq for a in motor._por_perfil.values() if a.ativo == ativo and regra(a.dados, vela)}
+            tempo_varredura += time.perf_counter() - t0
+            t0 = time.perf_counter()
+            confirmadas = motor.avaliar_barra(ativo, *vela)
+            tempo_avaliacao += time.perf_counter() - t0
+            divergencias += len(esperadas ^ {a.seq for a, _, _ in confirmadas})
+            for armadilha, _, _ in confirmadas:
+                motor.disparada(armadilha, t - barra)
+                fila.append((t + aleatorio.uniform(60, 180), armadilha.profile_id, armadilha.ativo))
+        fila.sort()
+
+    atrasos_antes = np.asarray(atrasos_antes)
+    print(f"antes (loop de {LOOP}s): {disparos_antes} disparos, {expiradas_antes} expiradas, "
+          f"atraso após o fechamento p50={np.percentile(atrasos_antes, 50):.1f}s p95={np.percentile(atrasos_antes, 95):.1f}s "
+          f"max={atrasos_antes.max():.1f}s | {verificacoes} verificações")
+    resumo = motor.estatisticas()
+    print(f"motor por ticks: {resumo} | divergências da regra original: {divergencias} | "
+          f"fechamento de barra: {tempo_avaliacao / max(motor.barras_avaliadas, 1) * 1e6:.1f}µs indexado x "
+          f"{tempo_varredura / max(motor.barras_avaliadas, 1) * 1e6:.1f}µs varrendo os perfis")
+
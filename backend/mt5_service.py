@@ -1,14 +1,38 @@
 import os
-import MetaTrader5 as mt5
+import time as time_lib
 import pandas as pd
+from collections import deque
 from datetime import datetime, time
 
+from armazem_candles import ArmazemCandles
+from cache_candles import CacheCandles
+from especificacoes_ativos import CacheEspecificacoes, arredondar_preco
+from indicadores import MotorIndicadores
+from livro_posicoes import LivroPosicoes
+from provedor_mercado import ProvedorMercado, provedor_adiado
+from resultado_diario import AcumuladorResultado
+
+# Terminal real (MetaTrader5) ou simulado, conforme MT5_PROVEDOR no .env
+# Provedor resolvido no primeiro uso: importar o módulo não exige o MetaTrader5
+mt5 = provedor_adiado
+
 class MT5Service:
     def __init__(self):
         self.login = int(os.getenv("MT5_LOGIN", 0))
         self.password = os.getenv("MT5_PASSWORD", "")
         self.server = os.getenv("MT5_SERVER", "")
         self.connected = False
+        self.motores_indicadores = {}
+        # Cache de candles compartilhado por todos os perfis (um ring buffer por ativo/timeframe),
+        # persistindo os candles fechados no armazém colunar em disco
+        self.cache_candles = CacheCandles(armazem=ArmazemCandles())
+        # Especificações dos ativos (point, digits, filling...) fora do caminho da ordem
+        self.especificacoes = CacheEspecificacoes()
+        self.latencias_ordem = deque(maxlen=200)
+        # Resultado do dia por conta (login), acumulado deal a deal
+        self.resultados_diarios = {}
+        # Posições abertas: uma chamada positions_get por ciclo, compartilhada por todos os perfis
+        self.livro_posicoes = LivroPosicoes()
 
     def conectar(self):
         """
@@ -28,57 +52,31 @@ class MT5Service:
         self.connected = True
         return True
 
-    def obter_dados_mercado(self, ativo: str, timeframe: int = mt5.TIMEFRAME_M5, qtd_candles: int = 100):
+    def obter_dados_mercado(self, ativo: str, timeframe: int = ProvedorMercado.TIMEFRAME_M5, qtd_candles: int = 100):
         """
         Obtém os dados históricos (OHLCV) do ativo especificado e adiciona indicadores de momento (RSI, Estocástico).
+        Os indicadores são mantidos por um MotorIndicadores incremental por (ativo, timeframe).
         """
         if not self.connected:
             print("MT5 não está conectado. Tentando reconectar...")
             if not self.conectar():
                 return None
             
-        rates = mt5.copy_rates_from_pos(ativo, timeframe, 0, qtd_candles)
+        rates = self.cache_candles.obter(ativo, timeframe, qtd_candles)
         if rates is None or len(rates) == 0:
             print(f"Falha ao obter dados para {ativo}: {mt5.last_error()}")
             return None
             
-        df = pd.DataFrame(rates)
-        df['time'] = pd.to_datetime(df['time'], unit='s')
-        
-        # --- CÁLCULO DE INDICADORES NATIVOS (PANDAS) ---
-        # 1. RSI (Relative Strength Index) - Período 14
-        delta = df['close'].diff()
-        gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-        rs = gain / loss
-        df['rsi_14'] = 100 - (100 / (1 + rs))
-        
-        # 2. Estocástico (Stochastic Oscillator) - %K(14), %D(3)
-        low_14 = df['low'].rolling(window=14).min()
-        high_14 = df['high'].rolling(window=14).max()
-        df['stoch_k'] = 100 * ((df['close'] - low_14) / (high_14 - low_14))
-        df['stoch_d'] = df['stoch_k'].rolling(window=3).mean()
-        
-        # 3. ATR (Average True Range) - Período 14
-        df['prev_close'] = df['close'].shift(1)
-        df['tr1'] = df['high'] - df['low']
-        df['tr2'] = abs(df['high'] - df['prev_close'])
-        df['tr3'] = abs(df['low'] - df['prev_close'])
-        df['tr'] = df[['tr1', 'tr2', 'tr3']].max(axis=1)
-        df['atr_14'] = df['tr'].rolling(window=14).mean()
+        # --- INDICADORES INCREMENTAIS (RSI, Estocástico, ATR, VWAP) ---
+        # Um motor por (ativo, timeframe): só o candle novo/em formação é recalculado
+        chave = (ativo, timeframe)
+        motor = self.motores_indicadores.get(chave)
+        if motor is None or motor.capacidade < qtd_candles:
+            motor = MotorIndicadores(capacidade=max(qtd_candles, 500))
+            self.motores_indicadores[chave] = motor
+        motor.atualizar(rates)
 
-        # 4. VWAP (Volume Weighted Average Price) Diária
-        df['date'] = df['time'].dt.date
-        df['typical_price'] = (df['high'] + df['low'] + df['close']) / 3
-        df['tp_vol'] = df['typical_price'] * df['tick_volume']
-        df['cum_vol'] = df.groupby('date')['tick_volume'].cumsum()
-        df['cum_tp_vol'] = df.groupby('date')['tp_vol'].cumsum()
-        df['vwap'] = df['cum_tp_vol'] / df['cum_vol']
-        
-        # Preenche NaNs iniciais com 50 (neutro) para evitar quebra na IA
-        df.fillna({'rsi_14': 50, 'stoch_k': 50, 'stoch_d': 50, 'atr_14': 0, 'vwap': df['close']}, inplace=True)
-        
-        return df[['time', 'open', 'high', 'low', 'close', 'tick_volume', 'rsi_14', 'stoch_k', 'stoch_d', 'atr_14', 'vwap']]
+        return motor.para_dataframe(qtd_candles)
 
     def obter_ohlc_ontem(self, ativo: str):
         """
@@ -161,29 +159,25 @@ class MT5Service:
             print(f"⚠️ Erro ao gerar foto do gráfico: {e}")
             return None
 
-    def enviar_ordem(self, ativo: str, tipo_ordem: str, lote: float, sl_pts: int, tp_pts: int):
+    def enviar_ordem(self, ativo: str, tipo_ordem: str, lote: float, sl_pts: int, tp_pts: int, inicio_sinal: float = None):
         """
         Envia uma ordem a mercado (BUY ou SELL) com precisão fractal e normalização de volume.
         Suporta ativos B3 (BITH11, WIN, WDO) e Forex.
+        `inicio_sinal` (time.perf_counter do momento da decisão) mede a latência até o order_send.
         """
         if not self.connected:
             print("MT5 não está conectado.")
             return None
             
-        symbol_info = mt5.symbol_info(ativo)
-        if symbol_info is None:
-            print(f"Ativo {ativo} não encontrado.")
+        # Especificação em cache (sem ida ao terminal no caminho da ordem)
+        inicio_sinal = inicio_sinal or time_lib.perf_counter()
+        especificacao = self.especificacoes.obter(ativo)
+        if especificacao is None:
             return None
-            
-        if not symbol_info.visible:
-            if not mt5.symbol_select(ativo, True):
-                print(f"Falha ao selecionar ativo {ativo}.")
-                return None
 
         # --- FUNDAMENTOS DO ATIVO ---
-        point = symbol_info.point
-        digits = symbol_info.digits  # BITH11=2, WIN=0, EURUSD=5
-        volume_step = symbol_info.volume_step
+        point = especificacao.point
+        volume_step = especificacao.volume_step
         
         # NORMALIZAÇÃO DO LOTE (Preservando sua lógica robusta)
         lote_normalizado = round(float(lote) / volume_step) * volume_step
@@ -209,36 +203,18 @@ class MT5Service:
             print("tipo_ordem deve ser 'BUY' ou 'SELL'")
             return None
 
-        # TYPE FILLING DINÂMICO
-        filling_mode = symbol_info.filling_mode
-        # O MetaTrader5 em Python não possui a flag SYMBOL_FILLING_RETURN.
-        # filling_mode = 1 (FOK), 2 (IOC), 3 (FOK e IOC), 0 (RETURN - comum na B3).
-        if filling_mode == 1 or filling_mode == 3:
-            type_filling_val = mt5.ORDER_FILLING_FOK
-        elif filling_mode == 2:
-            type_filling_val = mt5.ORDER_FILLING_IOC
-        else:
-            type_filling_val = mt5.ORDER_FILLING_RETURN
-        
-        # --- SLIPPAGE DINÂMICO (DEVIATION) ---
-        # B3 (WIN/WDO) exige margens diferentes de Forex para evitar rejeição em volatilidade
-        if "WIN" in ativo.upper():
-            deviation_pts = 150  # 30 ticks (150 pontos) no índice
-        elif "WDO" in ativo.upper():
-            deviation_pts = 10   # 20 ticks (10 pontos) no dólar
-        elif "BIT" in ativo.upper():
-            deviation_pts = 500  # Volatilidade cripto B3
-        else:
-            deviation_pts = 20   # Padrão Forex/Outros
+        # TYPE FILLING e SLIPPAGE (DEVIATION) pré-calculados na especificação do ativo
+        type_filling_val = especificacao.type_filling
+        deviation_pts = especificacao.deviation_pts
         
         request = {
             "action": mt5.TRADE_ACTION_DEAL,
             "symbol": ativo,
             "volume": float(lote_normalizado),
             "type": order_type,
-            "price": round(price, digits),
-            "sl": round(sl, digits),    # Arredondamento dinâmico para evitar rejeição
-            "tp": round(tp, digits),    # Essencial para ETFs como BITH11
+            "price": arredondar_preco(especificacao, price),
+            "sl": arredondar_preco(especificacao, sl),    # Arredondamento no tick do ativo para evitar rejeição
+            "tp": arredondar_preco(especificacao, tp),    # Essencial para ETFs como BITH11 e para o WIN (5 pts)
             "deviation": deviation_pts,
             "magic": 123456,
             "comment": "Consists Trade AI - Sniper V4",
@@ -247,16 +223,23 @@ class MT5Service:
         }
 
         # ENVIO E VALIDAÇÃO
+        latencia_ms = (time_lib.perf_counter() - inicio_sinal) * 1000
+        self.latencias_ordem.append(latencia_ms)
+        print(f"⏱️ Sinal -> order_send: {latencia_ms:.2f} ms")
         result = mt5.order_send(request)
+        self.livro_posicoes.invalidar()
         
         if result is None:
             print(f"Falha ao enviar ordem (Retorno None): {mt5.last_error()}")
+            self.especificacoes.invalidar(ativo)
             return None
             
         if result.retcode != mt5.TRADE_RETCODE_DONE:
             print(f"ERRO DE EXECUÇÃO: {result.retcode} - Comentário: {result.comment}")
+            # Rejeição por preço/volume/preenchimento: recarrega a especificação na próxima ordem
+            self.especificacoes.invalidar(ativo, result.retcode)
             # Log de depuração para entender rejeições de preço
-            print(f"DEBUG: Price: {round(price, digits)} | SL: {round(sl, digits)} | TP: {round(tp, digits)}")
+            print(f"DEBUG: Price: {request['price']} | SL: {request['sl']} | TP: {request['tp']}")
             return None
             
         print(f"Ordem executada com sucesso! Ticket: {result.order} | Ativo: {ativo}")
@@ -288,12 +271,7 @@ class MT5Service:
         if not self.connected:
             return False
             
-        posicoes = mt5.positions_get(symbol=ativo)
-        
-        if posicoes is None or len(posicoes) == 0:
-            return False
-            
-        return True
+        return self.livro_posicoes.posicao(ativo) is not None
 
     def obter_posicao_aberta(self, ativo: str):
         """
@@ -302,11 +280,10 @@ class MT5Service:
         if not self.connected:
             return None
             
-        posicoes = mt5.positions_get(symbol=ativo)
-        if posicoes is None or len(posicoes) == 0:
+        pos = self.livro_posicoes.posicao(ativo)
+        if pos is None:
             return None
             
-        pos = posicoes[0]
         return {
             "ticket": pos.ticket,
             "type": "BUY" if pos.type == mt5.POSITION_TYPE_BUY else "SELL",
@@ -336,6 +313,7 @@ class MT5Service:
                 "position": posicao["ticket"]
             }
             result = mt5.order_send(request)
+            self.livro_posicoes.invalidar()
             if result is None or result.retcode != mt5.TRADE_RETCODE_DONE:
                 print(f"⚠️ Falha ao mover para Breakeven: {mt5.last_error()}")
                 return False
@@ -343,33 +321,22 @@ class MT5Service:
             return True
         return False
 
-    def obter_resultado_diario(self):
+    def obter_resultado_diario(self, magic: int = None):
         """
         Calcula o lucro/perda total de todas as ordens fechadas hoje.
         Essencial para a trava de meta e limite de perda.
+        `magic` restringe o resultado às ordens do robô com esse magic number.
         """
         if not self.connected:
             return 0.0
 
-        # Define o início do dia de hoje (00:00:00)
-        hoje = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        timestamp_hoje = int(hoje.timestamp())
-
-        # Busca o histórico de ordens finalizadas
-        historico = mt5.history_deals_get(timestamp_hoje, int(datetime.now().timestamp()))
-        
-        if historico is None or len(historico) == 0:
-            return 0.0
-
-        df_historico = pd.DataFrame(list(historico), columns=historico[0]._asdict().keys())
-        
-        # Filtra apenas o que é lucro/prejuízo de trade (ignora depósitos/ajustes)
-        # Entry 1 é 'OUT' (fechamento de posição)
-        lucro_total = df_historico[df_historico['entry'] == 1]['profit'].sum()
-        comissao = df_historico['commission'].sum()
-        swap = df_historico['swap'].sum()
-
-        return float(lucro_total + comissao + swap)
+        # Acumulador incremental da conta: só busca os deals novos desde a última consulta
+        acumulador = self.resultados_diarios.get(self.login)
+        if acumulador is None:
+            acumulador = AcumuladorResultado()
+            self.resultados_diarios[self.login] = acumulador
+        acumulador.atualizar()
+        return acumulador.resultado(magic)
 
     def obter_informacoes_conta(self):
         """
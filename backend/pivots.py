@@ -0,0 +1,238 @@
+import time
+from collections import deque
+
+import numpy as np
+
+# Pivô tipado: preço, horário (unix, s) e índice do candle na janela analisada
+DTYPE_PIVOT = np.dtype([('preco', '<f8'), ('tempo', '<i8'), ('indice', '<i8')])
+
+
+def tempos_unix(tempos):
+    """Converte a coluna 'time' (datetime64 ou numérica) para segundos unix (int64)."""
+    tempos = np.asarray(tempos)
+    if np.issubdtype(tempos.dtype, np.datetime64):
+        return tempos.astype('datetime64[s]').astype(np.int64)
+    return tempos.astype(np.int64)
+
+
+def janela_pivots(qtd_candles: int) -> int:
+    # Proteção: Se o DataFrame não tiver dados suficientes para a janela, reduz a exigência
+    return 2 if qtd_candles > 20 else 1
+
+
+def _mascara_extremos(valores, janela, topo):
+    """Candles cujo valor supera estritamente os `janela` vizinhos de cada lado (comparação deslizante)."""
+    n = len(valores)
+    centro = valores[janela:n - janela]
+    mascara = np.ones(len(centro), dtype=bool)
+    for j in range(1, janela + 1):
+        esquerda = valores[janela - j:n - janela - j]
+        direita = valores[janela + j:n - janela + j]
+        if topo:
+            mascara &= ~((centro <= esquerda) | (centro <= direita))
+        else:
+            mascara &= ~((centro >= esquerda) | (centro >= direita))
+    return mascara
+
+
+def encontrar_pivots(highs, lows, tempos, janela):
+    """Topos e fundos de uma janela de candles como arrays tipados (DTYPE_PIVOT)."""
+    highs = np.asarray(highs, dtype=np.float64)
+    lows = np.asarray(lows, dtype=np.float64)
+    tempos = tempos_unix(tempos)
+    if len(highs) < 2 * janela + 1:
+        vazio = np.empty(0, dtype=DTYPE_PIVOT)
+        return vazio, vazio.copy()
+
+    resultado = []
+    for valores, topo in ((highs, True), (lows, False)):
+        indices = np.flatnonzero(_mascara_extremos(valores, janela, topo)) + janela
+        pivots = np.empty(len(indices), dtype=DTYPE_PIVOT)
+        pivots['preco'] = valores[indices]
+        pivots['tempo'] = tempos[indices]
+        pivots['indice'] = indices
+        resultado.append(pivots)
+    return resultado[0], resultado[1]
+
+
+def classificar_estrutura(topos, fundos):
+    """Estrutura macro (HH/HL, LH/LL ou lateral) a partir dos dois últimos topos e fundos."""
+    if len(topos) < 2 or len(fundos) < 2:
+        return "INDEFINIDA"
+    ultimo_topo, penultimo_topo = float(topos['preco'][-1]), float(topos['preco'][-2])
+    ultimo_fundo, penultimo_fundo = float(fundos['preco'][-1]), float(fundos['preco'][-2])
+
+    # Tolerância para lateralização (0.05% do preço)
+    tolerancia = ultimo_topo * 0.0005
+
+    if (ultimo_topo > penultimo_topo + tolerancia) and (ultimo_fundo > penultimo_fundo + tolerancia):
+        return "TENDÊNCIA DE ALTA (HH/HL)"
+    if (ultimo_topo < penultimo_topo - tolerancia) and (ultimo_fundo < penultimo_fundo - tolerancia):
+        return "TENDÊNCIA DE BAIXA (LH/LL)"
+    return "LATERALIZAÇÃO (Consolidação)"
+
+
+def formatar_pivots(topos, fundos, num_pivots=3):
+    """Única etapa que gera texto: monta a linha de pivôs do prompt."""
+    def _formatar(pivots):
+        return ", ".join(f"{p:.5f} ({time.strftime('%H:%M', time.gmtime(t))})"
+                         for p, t in zip(pivots['preco'][-num_pivots:].tolist(), pivots['tempo'][-num_pivots:].tolist()))
+
+    topos_str = _formatar(topos) if len(topos) else "Nenhum topo claro"
+    fundos_str = _formatar(fundos) if len(fundos) else "Nenhum fundo claro"
+    return f"Estrutura: {classificar_estrutura(topos, fundos)} | Topos: {topos_str} | Fundos: {fundos_str}"
+
+
+class DetectorPivots:
+    """
+    Modo incremental: confirma cada pivô uma única vez, quando os `janela` candles à direita fecham.
+    O candle em formação só participa de uma avaliação provisória do último candidato, refeita a cada
+    chamada, o que mantém o resultado idêntico ao cálculo completo sobre a mesma janela.
+    """
+
+    def __init__(self, janela=2, memoria=200):
+        self.janela = janela
+        self.topos = deque(maxlen=memoria)   # (preco, tempo)
+        self.fundos = deque(maxlen=memoria)
+        self._ultimo_avaliado = None         # horário do último candidato confirmado/descartado
+
+    def resetar(self):
+        self.topos.clear()
+        self.fundos.clear()
+        self._ultimo_avaliado = None
+
+    def atualizar(self, highs, lows, tempos):
+        """
+        Recebe a janela atual (o último candle é o em formação) e devolve (topos, fundos) como
+        arrays DTYPE_PIVOT restritos aos candidatos que o cálculo completo enxergaria nessa janela.
+        """
+        highs = np.asarray(highs, dtype=np.float64)
+        lows = np.asarray(lows, dtype=np.float64)
+        tempos = tempos_unix(tempos)
+        n, j = len(highs), self.janela
+        if n < 2 * j + 1:
+            vazio = np.empty(0, dtype=DTYPE_PIVOT)
+            return vazio, vazio.copy()
+
+        # Candidatos definitivos: todos os vizinhos à direita já fecharam (índices até n - 2 - j)
+        ultimo_definitivo = n - 2 - j
+        if self._ultimo_avaliado is None or tempos[0] > self._ultimo_avaliado:
+            # Primeira chamada ou buraco sem sobreposição: reavalia a janela inteira
+            self.resetar()
+            inicio = j
+        else:
+            inicio = max(j, int(np.searchsorted(tempos, self._ultimo_avaliado, side='right')))
+
+        if inicio <= ultimo_definitivo:
+            trecho = slice(inicio - j, ultimo_definitivo + j + 1)
+            for valores, destino, topo in ((highs, self.topos, True), (lows, self.fundos, False)):
+                for i in np.flatnonzero(_mascara_extremos(valores[trecho], j, topo)) + inicio:
+                    destino.append((float(valores[i]), int(tempos[i])))
+            self._ultimo_avaliado = int(tempos[ultimo_definitivo])
+        elif self._ultimo_avaliado is None:
+            self._ultimo_avaliado = int(tempos[j - 1])
+
+        # Candidato provisório (vizinho direito é o candle em formação)
+        provisorio = n - 1 - j
+        resultado = []
+        for valores, confirmados, topo in ((highs, self.topos, True), (lows, self.fundos, False)):
+            minimo_tempo = tempos[j]
+            lista = [(p, t) for p, t in confirmados if t >= minimo_tempo]
+            if _mascara_extremos(valores[provisorio - j:provisorio + j + 1], j, topo)[0]:
+                lista.append((float(valores[provisorio]), int(tempos[provisorio])))
+            pivots = np.empty(len(lista), dtype=DTYPE_PIVOT)
+            if lista:
+                precos, horarios = zip(*lista)
+                pivots['preco'] = precos
+                pivots['tempo'] = horarios
+                pivots['indice'] = np.searchsorted(tempos, pivots['tempo'])
+            resultado.append(pivots)
+        return resultado[0], resultado[1]
+
+
+def _encontrar_pivots_legado(df, num_pivots=3):
+    """Implementação original (loops em Python), mantida só para a paridade e o benchmark."""
+    import pandas as pd
+
+    def _hora(t):
+        if isinstance(t, (int, float, np.integer, np.floating)):
+            return pd.to_datetime(t, unit='s').strftime('%H:%M')
+        return pd.to_datetime(t).strftime('%H:%M')
+
+    if df is None or len(df) < 10: return "N/A"
+    janela = 2 if len(df) > 20 else 1
+    highs = df['high'].values
+    lows = df['low'].values
+    times = df['time'].values
+    topos = []
+    fundos = []
+    for i in range(janela, len(df) - janela):
+        is_topo = True
+        for j in range(1, janela + 1):
+            if highs[i] <= highs[i-j] or highs[i] <= highs[i+j]:
+                is_topo = False
+                break
+        if is_topo:
+            topos.append(f"{highs[i]:.5f} ({_hora(times[i])})")
+        is_fundo = True
+        for j in range(1, janela + 1):
+            if lows[i] >= lows[i-j] or lows[i] >= lows[i+j]:
+                is_fundo = False
+                break
+        if is_fundo:
+            fundos.append(f"{lows[i]:.5f} ({_hora(times[i])})")
+    topos_str = ", ".join(topos[-num_pivots:]) if topos else "Nenhum topo claro"
+    fundos_str = ", ".join(fundos[-num_pivots:]) if fundos else "Nenhum fundo claro"
+    estrutura = "INDEFINIDA"
+    if len(topos) >= 2 and len(fundos) >= 2:
+        ultimo_topo = float(topos[-1].split(" ")[0])
+        penultimo_topo = float(topos[-2].split(" ")[0])
+        ultimo_fundo = float(fundos[-1].split(" ")[0])
+        penultimo_fundo = float(fundos[-2].split(" ")[0])
+        tolerancia = ultimo_topo * 0.0005
+        if (ultimo_topo > penultimo_topo + tolerancia) and (ultimo_fundo > penultimo_fundo + tolerancia):
+            estrutura = "TENDÊNCIA DE ALTA (HH/HL)"
+        elif (ultimo_topo < penultimo_topo - tolerancia) and (ultimo_fundo < penultimo_fundo - tolerancia):
+            estrutura = "TENDÊNCIA DE BAIXA (LH/LL)"
+        else:
+            estrutura = "LATERALIZAÇÃO (Consolidação)"
+    return f"Estrutura: {estrutura} | Topos: {topos_str} | Fundos: {fundos_str}"
+
+
+if __name__ == "__main__":
+    import pandas as pd
+
+    from indicadores import _gerar_rates_sinteticos
+
+    df_unix = pd.DataFrame(_gerar_rates_sinteticos(4000))
+    df_total = df_unix.copy()
+    df_total['time'] = pd.to_datetime(df_total['time'], unit='s')
+
+    # Paridade (M1 = janelas de 100 candles, M5 = janelas de 60) nos modos vetorizado e incremental,
+    # com a coluna time em datetime64 (DataFrame do mt5_service) e em segundos unix
+    for rotulo, tamanho in (("M1", 100), ("M5", 60)):
+        for base in (df_total, df_unix):
+            detector = DetectorPivots(janela_pivots(tamanho))
+            divergencias = 0
+            for fim in range(tamanho, len(base)):
+                df = base.iloc[fim - tamanho:fim]
+                esperado = _encontrar_pivots_legado(df)
+                janela = janela_pivots(len(df))
+                topos, fundos = encontrar_pivots(df['high'].values, df['low'].values, df['time'].values, janela)
+                topos_inc, fundos_inc = detector.atualizar(df['high'].values, df['low'].values, df['time'].values)
+                if formatar_pivots(topos, fundos) != esperado or formatar_pivots(topos_inc, fundos_inc) != esperado:
+                    divergencias += 1
+            print(f"Paridade {rotulo} (time {base['time'].dtype}): {divergencias} divergências em {len(base) - tamanho} janelas")
+
+    # Benchmark (janela M1 de 100 candles)
+    df = df_total.tail(100)
+    rodadas = 500
+    t0 = time.perf_counter()
+    for _ in range(rodadas):
+        _encontrar_pivots_legado(df)
+    t_legado = (time.perf_counter() - t0) / rodadas
+    t0 = time.perf_counter()
+    for _ in range(rodadas):
+        formatar_pivots(*encontrar_pivots(df['high'].values, df['low'].values, df['time'].values, 2))
+    t_vetorizado = (time.perf_counter() - t0) / rodadas
+    print(f"Legado: {t_legado * 1e6:.0f} µs | Vetorizado: {t_vetorizado * 1e6:.0f} µs")
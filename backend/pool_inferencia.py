@@ -0,0 +1,140 @@
+import asyncio
+import time
+from collections import deque
+
+import numpy as np
+
+
+class PoolInferencia:
+    """
+    Controle de vazão das chamadas ao modelo:
+    - no máximo `max_concorrencia` chamadas em voo ao mesmo tempo (semáforo);
+    - cota por modelo em requisições por minuto (`limites_rpm`), espaçando as chamadas uniformemente.
+      A cota é aguardada antes de pegar a vaga: quem dorme pela cota de um modelo não segura vaga
+      das chamadas de outros modelos;
+    - vaga liberada vai para a menor `prioridade` da fila (empate: quem chegou antes). A cada
+      `envelhecimento` segundos de espera a prioridade melhora um nível, então ninguém fica preso.
+    Expõe fila, chamadas em voo e tempo de espera para dimensionar o pool.
+    """
+
+    def __init__(self, max_concorrencia=4, limites_rpm=None, janela=500, envelhecimento=10.0):
+        self.max_concorrencia = max_concorrencia
+        self.limites_rpm = dict(limites_rpm or {})
+        self.envelhecimento = envelhecimento
+        self._vagas = max_concorrencia
+        self._fila = []  # [prioridade, chegada, futuro]
+        self._proxima_liberacao = {}  # modelo -> instante (monotonic) liberado para a próxima chamada
+        self.na_fila = 0
+        self.em_voo = 0
+        self.executadas = 0
+        self.maior_fila = 0
+        self.esperas = deque(maxlen=janela)
+
+    async def executar(self, modelo: str, fabrica, prioridade=0):
+        """Aguarda a cota do modelo e depois a vaga no pool; então roda a corrotina criada por `fabrica()`."""
+        chegada = time.monotonic()
+        self.na_fila += 1
+        self.maior_fila = max(self.maior_fila, self.na_fila)
+        na_fila = True
+        try:
+            await self._aguardar_cota(modelo)
+            await self._entrar(prioridade, chegada)
+            try:
+                self.na_fila -= 1
+                na_fila = False
+                self.esperas.append(time.monotonic() - chegada)
+                self.em_voo += 1
+                try:
+                    return await fabrica()
+                finally:
+                    self.em_voo -= 1
+                    self.executadas += 1
+            finally:
+                self._sair()
+        finally:
+            if na_fila:
+                # Cancelada ainda na fila
+                self.na_fila -= 1
+
+    async def _entrar(self, prioridade, chegada):
+        if self._vagas > 0 and not self._fila:
+            self._vagas -= 1
+            return
+        item = [prioridade, chegada, asyncio.get_running_loop().create_future()]
+        self._fila.append(item)
+        try:
+            await item[2]
+        except asyncio.CancelledError:
+            if item in self._fila:
+                self._fila.remove(item)
+            else:
+                # A vaga chegou junto com o cancelamento: repassa
+                self._sair()
+            raise
+
+    def _sair(self):
+        """Libera a vaga para o próximo da fila (prioridade envelhecida) ou devolve ao pool."""
+        if not self._fila:
+            self._vagas += 1
+            return
+        agora = time.monotonic()
+        item = min(self._fila, key=lambda i: (i[0] - (agora - i[1]) / self.envelhecimento, i[1]))
+        self._fila.remove(item)
+        item[2].set_result(None)
+
+    async def _aguardar_cota(self, modelo):
+        rpm = self.limites_rpm.get(modelo)
+        if not rpm:
+            return
+        agora = time.monotonic()
+        # Reserva o horário da chamada antes de dormir: chamadas concorrentes recebem horários seguintes
+        liberacao = max(agora, self._proxima_liberacao.get(modelo, 0.0))
+        proxima = liberacao + 60.0 / rpm
+        self._proxima_liberacao[modelo] = proxima
+        if liberacao <= agora:
+            return
+        try:
+            await asyncio.sleep(liberacao - agora)
+        except asyncio.CancelledError:
+            # Cancelada antes de usar o horário: devolve a reserva se ninguém reservou depois dela
+            # (se reservaram, os horários seguintes ficam como estão, só mais espaçados)
+            if self._proxima_liberacao.get(modelo) == proxima:
+                self._proxima_liberacao[modelo] = liberacao
+            raise
+
+    def estatisticas(self):
+        resumo = {
+            "na_fila": self.na_fila,
+            "em_voo": self.em_voo,
+            "maior_fila": self.maior_fila,
+            "executadas": self.executadas,
+        }
+        if self.esperas:
+            esperas = np.fromiter(self.esperas, dtype=np.float64) * 1000
+            resumo["espera_ms"] = {"p50": round(float(np.percentile(esperas, 50)), 1),
+                                   "p95": round(float(np.percentile(esperas, 95)), 1),
+                                   "max": round(float(esperas.max()), 1)}
+        return resumo
+
+
+if __name__ == "__main__":
+    # 10 perfis com ciclo vencido ao mesmo tempo e IA de ~1.5s: quão velho fica o dado do último perfil
+    async def cenario(max_concorrencia, rpm=None):
+        pool = PoolInferencia(max_concorrencia, {"modelo": rpm} if rpm else None)
+
+        async def chamada():
+            await asyncio.sleep(1.5)
+
+        inicio = time.monotonic()
+
+        async def perfil():
+            await pool.executar("modelo", chamada)
+            return time.monotonic() - inicio
+
+        atrasos = await asyncio.gather(*(perfil() for _ in range(10)))
+        return max(atrasos), pool.estatisticas()
+
+    for max_concorrencia, rpm in ((1, None), (4, None), (10, None), (10, 120)):
+        atraso, estatisticas = asyncio.run(cenario(max_concorrencia, rpm))
+        cota = f", {rpm} RPM" if rpm else ""
+        print(f"pool={max_concorrencia}{cota}: último perfil recebe a análise {atraso:.1f}s após o snapshot | {estatisticas}")
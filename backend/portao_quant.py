@@ -0,0 +1,125 @@
+import time
+
+
+def _assinatura_armadilha(armadilha):
+    if not armadilha or armadilha.get("acao", "NONE") == "NONE":
+        return None
+    return armadilha.get("acao"), armadilha.get("preco_gatilho"), armadilha.get("timestamp")
+
+
+def _assinatura_posicao(posicao):
+    if not posicao:
+        return None
+    return posicao.get("ticket"), posicao.get("sl_atual"), posicao.get("tp_atual")
+
+
+class PortaoQuant:
+    """
+    Filtro determinístico antes da IA: se desde a última análise do perfil não fecharam
+    `barras_novas` candles M1, o preço andou menos que `fracao_atr` x ATR e armadilha/posição
+    seguem iguais, a chamada é pulada e a decisão anterior continua valendo (memória e armadilha
+    intactas). Com barras_novas=1 qualquer candle fechado já pede nova análise.
+    Só pula quando a decisão anterior era passiva (WAIT/HOLD): BUY/SELL/BREAKEVEN e os
+    WAIT_TO_* (que pedem o tiro de confirmação) sempre voltam ao modelo, assim como ciclos com fotos.
+    """
+
+    DECISOES_PASSIVAS = ("WAIT", "HOLD")
+
+    def __init__(self, fracao_atr=0.25, barras_novas=1, segundos_barra=60):
+        self.fracao_atr = fracao_atr
+        self.barras_novas = barras_novas
+        self.segundos_barra = segundos_barra
+        self._ultimas = {}   # perfil -> (tempo_fechado, preco, armadilha, posicao, decisao)
+        self.avaliacoes = 0
+        self.pulos = 0
+        self.motivos_chamada = {}
+
+    def avaliar(self, perfil, tempo_fechado, preco: float, atr: float, armadilha, posicao, com_fotos=False):
+        """(pular, motivo): se a chamada à IA pode ser evitada e o porquê (da chamada ou do pulo)."""
+        self.avaliacoes += 1
+        motivo = self._motivo_chamada(perfil, tempo_fechado, preco, atr, armadilha, posicao, com_fotos)
+        if motivo is not None:
+            self.motivos_chamada[motivo] = self.motivos_chamada.get(motivo, 0) + 1
+            return False, motivo
+        self.pulos += 1
+        anterior = self._ultimas[perfil]
+        barras = (tempo_fechado - anterior[0]) // self.segundos_barra
+        return True, (f"{barras} candle(s) M1 novo(s) (< {self.barras_novas}), preço andou "
+                      f"{abs(preco - anterior[1]) / atr:.2f} ATR (< {self.fracao_atr:.2f}), "
+                      f"armadilha e posição inalteradas; mantém {anterior[4]}")
+
+    def _motivo_chamada(self, perfil, tempo_fechado, preco, atr, armadilha, posicao, com_fotos):
+        anterior = self._ultimas.get(perfil)
+        if anterior is None:
+            return "primeira análise"
+        tempo_anterior, preco_anterior, armadilha_anterior, posicao_anterior, decisao_anterior = anterior
+        if com_fotos:
+            return "ciclo com fotos"
+        if decisao_anterior not in self.DECISOES_PASSIVAS:
+            return f"decisão anterior {decisao_anterior}"
+        if tempo_fechado - tempo_anterior >= self.barras_novas * self.segundos_barra:
+            return "candle M1 fechado"
+        if not atr or atr != atr or abs(preco - preco_anterior) >= self.fracao_atr * atr:
+            return "preço andou"
+        if _assinatura_armadilha(armadilha) != armadilha_anterior:
+            return "armadilha mudou"
+        if _assinatura_posicao(posicao) != posicao_anterior:
+            return "posição mudou"
+        return None
+
+    def registrar(self, perfil, tempo_fechado, preco: float, armadilha, posicao, decisao: str):
+        """Estado de referência após uma análise (armadilha já atualizada com a resposta)."""
+        self._ultimas[perfil] = (tempo_fechado, preco, _assinatura_armadilha(armadilha),
+                                 _assinatura_posicao(posicao), decisao)
+
+    def esquecer(self, perfil):
+        self._ultimas.pop(perfil, None)
+
+    def estatisticas(self, tokens_por_chamada=0):
+        return {
+            "avaliacoes": self.avaliacoes,
+            "pulos": self.pulos,
+            "reducao": f"{self.pulos / self.avaliacoes:.0%}" if self.avaliacoes else "0%",
+            "tokens_economizados": round(self.pulos * tokens_por_chamada),
+            "motivos_chamada": dict(self.motivos_chamada),
+        }
+
+
+if __name__ == "__main__":
+    import os
+
+    import numpy as np
+
+    from indicadores import _gerar_rates_sinteticos
+
+    # Replay de um pregão M1 (9h-18h) com o loop acordando a cada 15s. Preço intrabar interpolado
+    # abertura -> máxima/mínima -> fechamento. Sem operações: só WAIT, como na maior parte do dia.
+    TOKENS_POR_CHAMADA = int(os.getenv("PORTAO_TOKENS_BENCH", "9000"))  # prompt + fotos + resposta, ordem de grandeza
+    rates = _gerar_rates_sinteticos(540)
+    amplitude = rates['high'] - rates['low']
+
+    def preco_intrabar(i, passo):
+        caminho = (rates['open'][i], rates['high'][i], rates['low'][i], rates['close'][i])
+        return float(caminho[passo])
+
+    for ciclo_ia, fracao, barras_novas in ((60, 0.25, 1), (60, 0.25, 2), (60, 0.5, 3), (15, 0.25, 1), (15, 0.5, 1)):
+        portao = PortaoQuant(fracao_atr=fracao, barras_novas=barras_novas)
+        chamadas = 0
+        ultimo_ts_ia = -1e9
+        t0 = time.perf_counter()
+        for i in range(15, len(rates)):
+            atr = float(np.mean(amplitude[i - 14:i + 1]))
+            for passo in range(4):
+                agora = i * 60 + passo * 15
+                if agora - ultimo_ts_ia < ciclo_ia:
+                    continue
+                ultimo_ts_ia = agora
+                preco = preco_intrabar(i, passo)
+                pular, _ = portao.avaliar("perfil", int(rates['time'][i - 1]), preco, atr, None, None)
+                if pular:
+                    continue
+                chamadas += 1
+                portao.registrar("perfil", int(rates['time'][i - 1]), preco, None, None, "WAIT")
+        custo = (time.perf_counter() - t0) / max(portao.avaliacoes, 1)
+        print(f"ciclo IA {ciclo_ia}s, limiar {fracao} ATR / {barras_novas} candle(s): {portao.avaliacoes} ciclos -> "
+              f"{chamadas} chamadas | {portao.estatisticas(TOKENS_POR_CHAMADA)} | {custo * 1e6:.1f} µs por avaliação")
@@ -0,0 +1,108 @@
+from collections import deque
+
+import numpy as np
+
+
+class PrazoAnalise:
+    """
+    Prazo de cada análise amarrado à barra M1 do snapshot: a decisão vale por inteiro até essa barra
+    fechar (depois dela o contexto enviado ao modelo já não tem o último candle). Até `tolerancia`
+    segundos além do fechamento a decisão é rebaixada: memória e armadilha valem, ordem a mercado
+    não. Mais tarde que isso é descartada, e a chamada que ainda estiver em voo é cancelada nesse ponto.
+    Os instantes estão no relógio do provedor (mt5.agora()).
+    """
+
+    def __init__(self, segundos_barra=60, tolerancia=60.0, janela=500):
+        self.segundos_barra = segundos_barra
+        self.tolerancia = tolerancia
+        self.contagem = {"no_prazo": 0, "rebaixada": 0, "descartada": 0, "cancelada": 0}
+        self.folgas = deque(maxlen=janela)  # prazo - chegada da decisão (negativo: atrasada)
+
+    def prazo(self, inicio_barra, relogio_servidor, relogio_local) -> float:
+        """
+        Instante, no relógio local, em que fecha a barra aberta em `inicio_barra`. Barras e ticks vêm
+        no relógio do servidor da corretora, então o tempo restante é medido lá e somado ao relógio local.
+        """
+        restante = min(max(inicio_barra + self.segundos_barra - relogio_servidor, 0.0), self.segundos_barra)
+        return relogio_local + restante
+
+    def orcamento(self, prazo, agora) -> float:
+        """Segundos até a decisão deixar de servir (fechamento da barra + tolerância)."""
+        return prazo + self.tolerancia - agora
+
+    def classificar(self, prazo, agora):
+        """(situação, atraso em segundos) de uma decisão que chegou em `agora`."""
+        atraso = agora - prazo
+        if atraso <= 0:
+            return "no_prazo", atraso
+        if atraso <= self.tolerancia:
+            return "rebaixada", atraso
+        return "descartada", atraso
+
+    @staticmethod
+    def rebaixar(decisao: dict, atraso: float) -> dict:
+        """Decisão atrasada sem entrada a mercado (BUY/SELL viram WAIT); gestão e armadilha seguem."""
+        if decisao.get("decisao") not in ("BUY", "SELL"):
+            return decisao
+        return dict(decisao, decisao="WAIT",
+                    motivo=f"{decisao.get('motivo', '')} [REBAIXADA: {decisao['decisao']} chegou {atraso:.1f}s após o fechamento da barra]")
+
+    def registrar(self, situacao: str, folga: float = None):
+        self.contagem[situacao] += 1
+        if folga is not None:
+            self.folgas.append(folga)
+
+    def estatisticas(self, tokens_por_chamada=0):
+        total = sum(self.contagem.values())
+        perdidas = self.contagem["descartada"] + self.contagem["cancelada"]
+        resumo = dict(self.contagem)
+        resumo["taxa_atrasadas"] = f"{(total - self.contagem['no_prazo']) / total:.1%}" if total else "0%"
+        # Estimativa: cada decisão perdida custou uma chamada média (a cancelada já pagou a entrada)
+        resumo["tokens_desperdicados"] = round(perdidas * tokens_por_chamada)
+        if self.folgas:
+            folgas = np.fromiter(self.folgas, dtype=np.float64)
+            resumo["folga_s"] = {"p50": round(float(np.percentile(folgas, 50)), 1),
+                                 "p5": round(float(np.percentile(folgas, 5)), 1)}
+        return resumo
+
+
+if __name__ == "__main__":
+    import os
+    import random
+
+    # Pregão M1 com o loop acordando a cada 15s (snapshot em qualquer ponto da barra) e IA com cauda
+    # longa: fila do pool, cota e modelo lento. Compara executar tudo com o controle de prazo.
+    TOKENS_POR_CHAMADA = int(os.getenv("PORTAO_TOKENS_BENCH", "9000"))
+    aleatorio = random.Random(11)
+    analises = []
+    for barra in range(540):
+        for passo in range(4):
+            if aleatorio.random() < 0.25:
+                inicio_barra = 1_700_000_040 + barra * 60
+                # Relógio do servidor 3h à frente do local: o prazo tem que ser medido nas barras
+                servidor = inicio_barra + passo * 15 + aleatorio.uniform(0, 2)
+                local = servidor - 3 * 3600
+                latencia = aleatorio.uniform(40, 150) if aleatorio.random() < 0.06 else aleatorio.lognormvariate(1.2, 0.6)
+                decisao = aleatorio.choice(["WAIT", "WAIT", "WAIT", "HOLD", "BUY", "SELL"])
+                analises.append((inicio_barra, servidor, local, latencia, decisao))
+
+    obsoletas = sum(local + latencia > local + (inicio + 60 - servidor) for inicio, servidor, local, latencia, _ in analises)
+    print(f"sem prazo: {len(analises)} decisões aplicadas, {obsoletas} ({obsoletas / len(analises):.1%}) "
+          f"sobre um contexto cuja barra já tinha fechado")
+
+    controle = PrazoAnalise(tolerancia=60.0)
+    entradas_evitadas = espera_cortada = 0.0
+    for inicio, servidor, local, latencia, decisao in analises:
+        prazo = controle.prazo(inicio, servidor, local)
+        orcamento = controle.orcamento(prazo, local)
+        if latencia > orcamento:
+            controle.registrar("cancelada")
+            espera_cortada += latencia - orcamento
+            continue
+        situacao, atraso = controle.classificar(prazo, local + latencia)
+        controle.registrar(situacao, -atraso)
+        if situacao == "rebaixada" and controle.rebaixar({"decisao": decisao}, atraso)["decisao"] != decisao:
+            entradas_evitadas += 1
+    print(f"com prazo (tolerância {controle.tolerancia:.0f}s): {controle.estatisticas(TOKENS_POR_CHAMADA)} | "
+          f"{entradas_evitadas:.0f} entradas a mercado atrasadas convertidas em WAIT | "
+          f"{espera_cortada:.0f}s de chamadas canceladas antes do fim")
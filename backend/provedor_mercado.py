@@ -0,0 +1,565 @@
+import glob
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+
+from armazem_candles import ArmazemCandles
+from gravador_ticks import dias_gravados, ler_ticks
+from reamostragem import reamostrar
+
+# --- ESTRUTURAS DE RETORNO (mesmos campos do pacote MetaTrader5) ---
+Tick = namedtuple("Tick", "time bid ask last volume time_msc flags volume_real")
+SymbolInfo = namedtuple("SymbolInfo", "name visible point digits spread volume_min volume_max volume_step "
+                                      "filling_mode trade_tick_value trade_tick_size trade_contract_size")
+TradePosition = namedtuple("TradePosition", "ticket time type magic identifier volume price_open sl tp "
+                                            "price_current swap profit symbol comment")
+TradeDeal = namedtuple("TradeDeal", "ticket order time time_msc type entry magic position_id volume price "
+                                    "commission swap profit fee symbol comment")
+OrderSendResult = namedtuple("OrderSendResult", "retcode deal order volume price bid ask comment request_id request")
+AccountInfo = namedtuple("AccountInfo", "login balance equity margin margin_free profit currency")
+
+DTYPE_RATES = np.dtype([('time', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8'),
+                        ('tick_volume', '<u8'), ('spread', '<i4'), ('real_volume', '<u8')])
+DTYPE_TICKS = np.dtype([('time', '<i8'), ('bid', '<f8'), ('ask', '<f8'), ('last', '<f8'), ('volume', '<u8'),
+                        ('time_msc', '<i8'), ('flags', '<u4'), ('volume_real', '<f8')])
+
+
+class ProvedorMercado(ABC):
+    """
+    Interface de dados de mercado e execução usada pelo motor (mesma assinatura do módulo MetaTrader5).
+    As constantes seguem os valores numéricos do MetaTrader5 para que o código chamador seja o mesmo
+    com o terminal real ou com o simulador. Os métodos do terminal são abstratos: um provedor
+    incompleto falha ao ser construído, não no meio de uma operação.
+    """
+
+    TIMEFRAME_M1, TIMEFRAME_M2, TIMEFRAME_M3, TIMEFRAME_M4, TIMEFRAME_M5, TIMEFRAME_M6 = 1, 2, 3, 4, 5, 6
+    TIMEFRAME_M10, TIMEFRAME_M12, TIMEFRAME_M15, TIMEFRAME_M20, TIMEFRAME_M30 = 10, 12, 15, 20, 30
+    TIMEFRAME_H1, TIMEFRAME_H2, TIMEFRAME_H3, TIMEFRAME_H4 = 16385, 16386, 16387, 16388
+    TIMEFRAME_H6, TIMEFRAME_H8, TIMEFRAME_H12, TIMEFRAME_D1 = 16390, 16392, 16396, 16408
+
+    ORDER_TYPE_BUY, ORDER_TYPE_SELL = 0, 1
+    POSITION_TYPE_BUY, POSITION_TYPE_SELL = 0, 1
+    DEAL_TYPE_BUY, DEAL_TYPE_SELL = 0, 1
+    DEAL_ENTRY_IN, DEAL_ENTRY_OUT = 0, 1
+    TRADE_ACTION_DEAL, TRADE_ACTION_SLTP = 1, 6
+    ORDER_FILLING_FOK, ORDER_FILLING_IOC, ORDER_FILLING_RETURN = 0, 1, 2
+    ORDER_TIME_GTC = 0
+    TRADE_RETCODE_DONE = 10009
+    TRADE_RETCODE_INVALID = 10013
+    TRADE_RETCODE_INVALID_VOLUME = 10014
+    TRADE_RETCODE_INVALID_STOPS = 10016
+    TRADE_RETCODE_MARKET_CLOSED = 10018
+    COPY_TICKS_ALL = -1
+
+    def agora(self):
+        """Relógio do provedor (o simulador devolve o horário virtual do replay)."""
+        return time.time()
+
+    @abstractmethod
+    def initialize(self):
+        ...
+
+    @abstractmethod
+    def login(self, login, password="", server=""):
+        ...
+
+    @abstractmethod
+    def shutdown(self):
+        ...
+
+    @abstractmethod
+    def last_error(self):
+        ...
+
+    @abstractmethod
+    def copy_rates_from_pos(self, symbol, timeframe, start_pos, count):
+        ...
+
+    @abstractmethod
+    def copy_ticks_from(self, symbol, date_from, count, flags=-1):
+        ...
+
+    @abstractmethod
+    def symbol_info(self, symbol):
+        ...
+
+    @abstractmethod
+    def symbol_info_tick(self, symbol):
+        ...
+
+    @abstractmethod
+    def symbol_select(self, symbol, enable=True):
+        ...
+
+    @abstractmethod
+    def positions_get(self, symbol=None, ticket=None):
+        ...
+
+    @abstractmethod
+    def history_deals_get(self, date_from, date_to):
+        ...
+
+    @abstractmethod
+    def order_send(self, request):
+        ...
+
+    @abstractmethod
+    def account_info(self):
+        ...
+
+
+class ProvedorMT5(ProvedorMercado):
+    """Implementação real: repassa as chamadas ao terminal via pacote MetaTrader5 (somente Windows)."""
+
+    def __init__(self):
+        import MetaTrader5
+        self._mt5 = MetaTrader5
+        # Garante as constantes exatas da versão instalada do pacote
+        for nome in dir(ProvedorMercado):
+            if nome.isupper() and hasattr(MetaTrader5, nome):
+                setattr(self, nome, getattr(MetaTrader5, nome))
+
+    def initialize(self):
+        return self._mt5.initialize()
+
+    def login(self, login, password="", server=""):
+        return self._mt5.login(login, password=password, server=server)
+
+    def shutdown(self):
+        return self._mt5.shutdown()
+
+    def last_error(self):
+        return self._mt5.last_error()
+
+    def copy_rates_from_pos(self, symbol, timeframe, start_pos, count):
+        return self._mt5.copy_rates_from_pos(symbol, timeframe, start_pos, count)
+
+    def copy_ticks_from(self, symbol, date_from, count, flags=-1):
+        if flags == -1:
+            flags = self._mt5.COPY_TICKS_ALL
+        return self._mt5.copy_ticks_from(symbol, date_from, count, flags)
+
+    def symbol_info(self, symbol):
+        return self._mt5.symbol_info(symbol)
+
+    def symbol_info_tick(self, symbol):
+        return self._mt5.symbol_info_tick(symbol)
+
+    def symbol_select(self, symbol, enable=True):
+        return self._mt5.symbol_select(symbol, enable)
+
+    def positions_get(self, symbol=None, ticket=None):
+        if ticket is not None:
+            return self._mt5.positions_get(ticket=ticket)
+        if symbol is not None:
+            return self._mt5.positions_get(symbol=symbol)
+        return self._mt5.positions_get()
+
+    def history_deals_get(self, date_from, date_to):
+        return self._mt5.history_deals_get(date_from, date_to)
+
+    def order_send(self, request):
+        return self._mt5.order_send(request)
+
+    def account_info(self):
+        return self._mt5.account_info()
+
+
+def _para_timestamp(valor):
+    if isinstance(valor, datetime):
+        return int(valor.timestamp())
+    return int(valor)
+
+
+def _inferir_digitos(precos, maximo=5):
+    """Menor número de casas decimais que representa todos os preços (WIN=0, WDO=1, EURUSD=5...)."""
+    for digitos in range(maximo + 1):
+        escalado = precos * (10 ** digitos)
+        if np.all(np.abs(escalado - np.round(escalado)) < 1e-6):
+            return digitos
+    return maximo
+
+
+class ProvedorSimulado(ProvedorMercado):
+    """
+    Terminal simulado e determinístico para rodar o pipeline sem MetaTrader (Linux, CI, profiling).
+    Reproduz candles M1 e ticks gravados em arquivos locais e simula execuções a partir de um relógio
+    virtual. Arquivos por ativo em `diretorio`:
+      - {ATIVO}_M1.csv ou {ATIVO}_M1.npy  (time, open, high, low, close, tick_volume[, spread, real_volume])
+      - {ATIVO}_ticks.csv ou .npy         (time_msc, bid, ask, last, volume)  [opcional]
+      - {ATIVO}.json                      (point, digits, volume_step, trade_tick_value...) [opcional]
+    Sem arquivo M1, os candles vêm do ArmazemCandles informado (histórico gravado ao vivo);
+    sem arquivo de ticks, os ticks vêm dos logs do GravadorTicks em `ticks_dir`.
+    O relógio só anda com avancar()/definir_relogio(), ou em tempo acelerado se `velocidade` > 0.
+    """
+
+    def __init__(self, diretorio="dados_simulados", saldo_inicial=100000.0, velocidade=0.0,
+                 inicio=None, aquecimento_candles=300, comissao_por_lote=0.0, armazem=None, ticks_dir=None):
+        self.diretorio = diretorio
+        self.armazem = armazem
+        self.ticks_dir = ticks_dir
+        self.saldo_inicial = saldo_inicial
+        self.velocidade = velocidade
+        self.aquecimento_candles = aquecimento_candles
+        self.comissao_por_lote = comissao_por_lote
+        self._inicio = inicio
+        self._deslocamento = 0.0
+        self._t0 = time.monotonic()
+        self._candles = {}
+        self._ticks = {}
+        self._specs = {}
+        self._posicoes = {}
+        self._deals = []
+        self._saldo = saldo_inicial
+        self._proximo_ticket = 1
+        self._ultima_avaliacao = None
+        self._ultimo_erro = (1, "Success")
+
+    # --- RELÓGIO VIRTUAL ---
+    def _inicio_relogio(self):
+        """Início do replay; sem `inicio` explícito vem do primeiro arquivo M1 (carrega os dados se preciso)."""
+        if self._inicio is None and not self.initialize():
+            raise RuntimeError(f"Relógio do simulador sem início: {self._ultimo_erro[1]}")
+        return self._inicio
+
+    def agora(self):
+        return self._inicio_relogio() + self._deslocamento + (time.monotonic() - self._t0) * self.velocidade
+
+    def avancar(self, segundos):
+        self._deslocamento += segundos
+        self._avaliar_stops()
+
+    def definir_relogio(self, timestamp):
+        self._deslocamento = timestamp - self._inicio_relogio() - (time.monotonic() - self._t0) * self.velocidade
+        self._avaliar_stops()
+
+    # --- CARGA DE DADOS ---
+    def _ler_arquivo(self, base, colunas, dtype):
+        if os.path.exists(base + ".npy"):
+            return np.load(base + ".npy")
+        if not os.path.exists(base + ".csv"):
+            return None
+        bruto = np.genfromtxt(base + ".csv", delimiter=",", names=True)
+        dados = np.zeros(np.atleast_1d(bruto).shape[0], dtype=dtype)
+        for coluna in colunas:
+            if coluna in bruto.dtype.names:
+                dados[coluna] = np.atleast_1d(bruto[coluna])
+        return dados
+
+    def _carregar(self, symbol):
+        if symbol in self._candles:
+            return self._candles[symbol] is not None
+        base = os.path.join(self.diretorio, symbol)
+        candles = self._ler_arquivo(base + "_M1", DTYPE_RATES.names, DTYPE_RATES)
+        if (candles is None or len(candles) == 0) and self.armazem is not None:
+            candles = self.armazem.ler_rates(symbol, self.TIMEFRAME_M1)
+        if candles is None or len(candles) == 0:
+            self._candles[symbol] = None
+            self._ultimo_erro = (-1, f"Sem dados simulados para {symbol}")
+            return False
+        self._candles[symbol] = np.sort(candles, order='time')
+
+        ticks = self._ler_arquivo(base + "_ticks", ('time_msc', 'bid', 'ask', 'last', 'volume'), DTYPE_TICKS)
+        if (ticks is None or len(ticks) == 0) and self.ticks_dir:
+            ticks = self._ler_ticks_gravados(symbol)
+        if ticks is not None and len(ticks):
+            ticks = np.sort(ticks, order='time_msc')
+            ticks['time'] = ticks['time_msc'] // 1000
+            ticks['volume_real'] = ticks['volume']
+        self._ticks[symbol] = ticks
+
+        spec = {}
+        if os.path.exists(base + ".json"):
+            with open(base + ".json", encoding="utf-8") as arquivo:
+                spec = json.load(arquivo)
+        digits = int(spec.get("digits", _inferir_digitos(self._candles[symbol]['close'])))
+        point = float(spec.get("point", 10 ** -digits))
+        self._specs[symbol] = SymbolInfo(
+            name=symbol, visible=True, point=point, digits=digits, spread=int(spec.get("spread", 1)),
+            volume_min=float(spec.get("volume_min", 1.0)), volume_max=float(spec.get("volume_max", 1000.0)),
+            volume_step=float(spec.get("volume_step", 1.0)), filling_mode=int(spec.get("filling_mode", 0)),
+            trade_tick_value=float(spec.get("trade_tick_value", point)),
+            trade_tick_size=float(spec.get("trade_tick_size", point)),
+            trade_contract_size=float(spec.get("trade_contract_size", 1.0)),
+        )
+        if self._inicio is None:
+            indice = min(self.aquecimento_candles, len(self._candles[symbol]) - 1)
+            self._inicio = float(self._candles[symbol]['time'][indice])
+        return True
+
+    def _ler_ticks_gravados(self, symbol):
+        logs = [ler_ticks(symbol, dia, self.ticks_dir) for dia in dias_gravados(symbol, self.ticks_dir)]
+        logs = [log for log in logs if len(log)]
+        if not logs:
+            return None
+        gravados = np.concatenate(logs)
+        ticks = np.zeros(len(gravados), dtype=DTYPE_TICKS)
+        for coluna in ('time_msc', 'bid', 'ask', 'last', 'volume'):
+            ticks[coluna] = gravados[coluna]
+        return ticks
+
+    # --- CICLO DE VIDA ---
+    def initialize(self):
+        for caminho in sorted(glob.glob(os.path.join(self.diretorio, "*_M1.*"))):
+            self._carregar(os.path.basename(caminho).rsplit("_M1.", 1)[0])
+        if self.armazem is not None:
+            for caminho in sorted(glob.glob(os.path.join(self.armazem.raiz, "*", "M1"))):
+                self._carregar(os.path.basename(os.path.dirname(caminho)))
+        if self._inicio is None:
+            self._ultimo_erro = (-1, f"Nenhum arquivo *_M1.csv/.npy em {self.diretorio}")
+            return False
+        return True
+
+    def login(self, login, password="", server=""):
+        return True
+
+    def shutdown(self):
+        return True
+
+    def last_error(self):
+        return self._ultimo_erro
+
+    # --- DADOS DE MERCADO ---
+    def _m1_ate_agora(self, symbol, qtd=None):
+        """Últimos `qtd` candles M1 visíveis no relógio atual; o último é o candle em formação (sem olhar o futuro)."""
+        if not self._carregar(symbol):
+            return None
+        candles = self._candles[symbol]
+        agora = self.agora()
+        fim = int(np.searchsorted(candles['time'], agora, side='right'))
+        if fim == 0:
+            return None
+        visiveis = candles[max(0, fim - qtd) if qtd else 0:fim].copy()
+        formando = visiveis[-1]
+        if formando['time'] + 60 > agora:
+            ticks = self._ticks.get(symbol)
+            parciais = None
+            if ticks is not None:
+                a = np.searchsorted(ticks['time_msc'], formando['time'] * 1000, side='left')
+                b = np.searchsorted(ticks['time_msc'], agora * 1000, side='right')
+                parciais = ticks[a:b]
+            if parciais is not None and len(parciais):
+                precos = np.where(parciais['last'] > 0, parciais['last'], parciais['bid'])
+                formando['high'] = max(formando['open'], precos.max())
+                formando['low'] = min(formando['open'], precos.min())
+                formando['close'] = precos[-1]
+                formando['tick_volume'] = len(parciais)
+            else:
+                formando['high'] = formando['low'] = formando['close'] = formando['open']
+                formando['tick_volume'] = 0
+            visiveis[-1] = formando
+        return visiveis
+
+    def copy_rates_from_pos(self, symbol, timeframe, start_pos, count):
+        minutos = timeframe if timeframe < 0x4000 else (timeframe & 0x3FFF) * 60
+        # Cada candle de N minutos tem no máximo N candles M1: essa janela cobre o pedido
+        m1 = self._m1_ate_agora(symbol, (start_pos + count + 1) * minutos)
+        if m1 is None:
+            return None
+        rates = m1 if timeframe == self.TIMEFRAME_M1 else reamostrar(m1, minutos)
+        fim = len(rates) - start_pos
+        if fim <= 0:
+            return None
+        return rates[max(0, fim - count):fim]
+
+    def copy_ticks_from(self, symbol, date_from, count, flags=-1):
+        if not self._carregar(symbol) or self._ticks.get(symbol) is None:
+            return None
+        ticks = self._ticks[symbol]
+        a = np.searchsorted(ticks['time_msc'], _para_timestamp(date_from) * 1000, side='left')
+        b = np.searchsorted(ticks['time_msc'], self.agora() * 1000, side='right')
+        return ticks[a:min(b, a + count)]
+
+    def symbol_info(self, symbol):
+        return self._specs.get(symbol) if self._carregar(symbol) else None
+
+    def symbol_info_tick(self, symbol):
+        if not self._carregar(symbol):
+            return None
+        agora = self.agora()
+        ticks = self._ticks.get(symbol)
+        if ticks is not None:
+            i = int(np.searchsorted(ticks['time_msc'], agora * 1000, side='right')) - 1
+            if i >= 0:
+                t = ticks[i]
+                return Tick(int(t['time']), float(t['bid']), float(t['ask']), float(t['last']), int(t['volume']),
+                            int(t['time_msc']), 0, float(t['volume_real']))
+        m1 = self._m1_ate_agora(symbol, 1)
+        if m1 is None:
+            return None
+        spec = self._specs[symbol]
+        preco = float(m1[-1]['close'])
+        return Tick(int(agora), preco, preco + spec.spread * spec.point, preco, 0, int(agora * 1000), 0, 0.0)
+
+    def symbol_select(self, symbol, enable=True):
+        return self._carregar(symbol)
+
+    # --- EXECUÇÃO SIMULADA ---
+    def _novo_ticket(self):
+        ticket = self._proximo_ticket
+        self._proximo_ticket += 1
+        return ticket
+
+    def _lucro(self, posicao, preco_saida):
+        spec = self._specs[posicao.symbol]
+        diferenca = preco_saida - posicao.price_open
+        if posicao.type == self.POSITION_TYPE_SELL:
+            diferenca = -diferenca
+        return diferenca / spec.trade_tick_size * spec.trade_tick_value * posicao.volume
+
+    def _registrar_deal(self, posicao, tipo, entrada, preco, lucro, instante):
+        comissao = -self.comissao_por_lote * posicao.volume
+        ticket = self._novo_ticket()
+        self._deals.append(TradeDeal(
+            ticket=ticket, order=ticket, time=int(instante), time_msc=int(instante * 1000), type=tipo,
+            entry=entrada, magic=posicao.magic, position_id=posicao.ticket, volume=posicao.volume, price=preco,
+            commission=comissao, swap=0.0, profit=lucro, fee=0.0, symbol=posicao.symbol, comment=posicao.comment,
+        ))
+        self._saldo += lucro + comissao
+        return ticket
+
+    def _fechar(self, posicao, preco, instante):
+        lucro = self._lucro(posicao, preco)
+        tipo = self.DEAL_TYPE_SELL if posicao.type == self.POSITION_TYPE_BUY else self.DEAL_TYPE_BUY
+        self._registrar_deal(posicao, tipo, self.DEAL_ENTRY_OUT, preco, lucro, instante)
+        del self._posicoes[posicao.ticket]
+
+    def _avaliar_stops(self):
+        """
+        Fecha posições cujo SL/TP foi tocado pelos candles M1 desde a última avaliação.
+        Aproximação por candle: se SL e TP caem no mesmo candle, o SL tem prioridade.
+        """
+        agora = self.agora()
+        desde = self._ultima_avaliacao if self._ultima_avaliacao is not None else agora
+        self._ultima_avaliacao = agora
+        for posicao in list(self._posicoes.values()):
+            inicio = max(desde, posicao.time)
+            candles = self._candles[posicao.symbol]
+            qtd = int(np.searchsorted(candles['time'], agora, side='right')) - int(np.searchsorted(candles['time'], inicio - 60, side='right')) + 1
+            m1 = self._m1_ate_agora(posicao.symbol, max(qtd, 1))
+            if m1 is None:
+                continue
+            janela = m1[m1['time'] + 60 > inicio]
+            for candle in janela:
+                comprado = posicao.type == self.POSITION_TYPE_BUY
+                sl_tocado = posicao.sl > 0 and (candle['low'] <= posicao.sl if comprado else candle['high'] >= posicao.sl)
+                tp_tocado = posicao.tp > 0 and (candle['high'] >= posicao.tp if comprado else candle['low'] <= posicao.tp)
+                if sl_tocado or tp_tocado:
+                    self._fechar(posicao, posicao.sl if sl_tocado else posicao.tp, max(int(candle['time']), posicao.time))
+                    break
+
+    def order_send(self, request):
+        acao = request.get("action")
+        symbol = request.get("symbol")
+        if not self._carregar(symbol):
+            return OrderSendResult(self.TRADE_RETCODE_INVALID, 0, 0, 0.0, 0.0, 0.0, 0.0, "Ativo desconhecido", 0, request)
+        self._avaliar_stops()
+        tick = self.symbol_info_tick(symbol)
+        agora = self.agora()
+
+        if acao == self.TRADE_ACTION_SLTP:
+            posicao = self._posicoes.get(request.get("position"))
+            if posicao is None:
+                return OrderSendResult(self.TRADE_RETCODE_INVALID, 0, 0, 0.0, 0.0, tick.bid, tick.ask, "Posição inexistente", 0, request)
+            self._posicoes[posicao.ticket] = posicao._replace(sl=float(request.get("sl", 0.0)), tp=float(request.get("tp", 0.0)))
+            return OrderSendResult(self.TRADE_RETCODE_DONE, 0, 0, posicao.volume, 0.0, tick.bid, tick.ask, "SLTP", 0, request)
+
+        if acao != self.TRADE_ACTION_DEAL:
+            return OrderSendResult(self.TRADE_RETCODE_INVALID, 0, 0, 0.0, 0.0, tick.bid, tick.ask, "Ação não suportada", 0, request)
+
+        volume = float(request.get("volume", 0.0))
+        if volume <= 0:
+            return OrderSendResult(self.TRADE_RETCODE_INVALID_VOLUME, 0, 0, volume, 0.0, tick.bid, tick.ask, "Volume inválido", 0, request)
+
+        compra = request.get("type") == self.ORDER_TYPE_BUY
+        preco = tick.ask if compra else tick.bid
+
+        # Fechamento explícito de posição (request com 'position')
+        if request.get("position") in self._posicoes:
+            self._fechar(self._posicoes[request["position"]], preco, agora)
+            return OrderSendResult(self.TRADE_RETCODE_DONE, self._proximo_ticket - 1, self._proximo_ticket - 1,
+                                   volume, preco, tick.bid, tick.ask, "Fechamento simulado", 0, request)
+
+        sl = float(request.get("sl", 0.0))
+        tp = float(request.get("tp", 0.0))
+        stops_invalidos = (compra and ((sl and sl >= preco) or (tp and tp <= preco))) or \
+                          (not compra and ((sl and sl <= preco) or (tp and tp >= preco)))
+        if stops_invalidos:
+            return OrderSendResult(self.TRADE_RETCODE_INVALID_STOPS, 0, 0, volume, preco, tick.bid, tick.ask, "Invalid stops", 0, request)
+
+        ticket = self._novo_ticket()
+        posicao = TradePosition(
+            ticket=ticket, time=int(agora), type=self.POSITION_TYPE_BUY if compra else self.POSITION_TYPE_SELL,
+            magic=int(request.get("magic", 0)), identifier=ticket, volume=volume, price_open=preco, sl=sl, tp=tp,
+            price_current=preco, swap=0.0, profit=0.0, symbol=symbol, comment=request.get("comment", ""),
+        )
+        self._posicoes[ticket] = posicao
+        deal = self._registrar_deal(posicao, self.DEAL_TYPE_BUY if compra else self.DEAL_TYPE_SELL,
+                                    self.DEAL_ENTRY_IN, preco, 0.0, agora)
+        return OrderSendResult(self.TRADE_RETCODE_DONE, deal, ticket, volume, preco, tick.bid, tick.ask, "Execução simulada", 0, request)
+
+    def positions_get(self, symbol=None, ticket=None):
+        self._avaliar_stops()
+        posicoes = []
+        for posicao in self._posicoes.values():
+            if (symbol is not None and posicao.symbol != symbol) or (ticket is not None and posicao.ticket != ticket):
+                continue
+            tick = self.symbol_info_tick(posicao.symbol)
+            preco_atual = tick.bid if posicao.type == self.POSITION_TYPE_BUY else tick.ask
+            posicoes.append(posicao._replace(price_current=preco_atual, profit=self._lucro(posicao, preco_atual)))
+        return tuple(posicoes)
+
+    def history_deals_get(self, date_from, date_to):
+        self._avaliar_stops()
+        inicio, fim = _para_timestamp(date_from), _para_timestamp(date_to)
+        return tuple(d for d in self._deals if inicio <= d.time <= fim)
+
+    def account_info(self):
+        flutuante = sum(p.profit for p in self.positions_get())
+        return AccountInfo(login=0, balance=self._saldo, equity=self._saldo + flutuante, margin=0.0,
+                           margin_free=self._saldo + flutuante, profit=flutuante, currency="BRL")
+
+
+_provedor = None
+
+
+class _ProvedorAdiado:
+    """
+    Referência ao provedor do processo resolvida no primeiro uso. Módulos de biblioteca guardam
+    esta referência no import (`mt5 = provedor_adiado`) sem escolher o provedor nem importar o
+    pacote MetaTrader5 antes da hora: importá-los no Linux/CI não exige o terminal.
+    """
+
+    __slots__ = ()
+
+    def __getattr__(self, nome):
+        return getattr(obter_provedor(), nome)
+
+
+provedor_adiado = _ProvedorAdiado()
+
+
+def obter_provedor():
+    """
+    Provedor único do processo, escolhido por MT5_PROVEDOR no .env:
+    'mt5' (padrão, terminal real) ou 'simulado' (arquivos em MT5_SIMULADO_DIR).
+    """
+    global _provedor
+    if _provedor is None:
+        from dotenv import load_dotenv
+        load_dotenv()
+        if os.getenv("MT5_PROVEDOR", "mt5").lower() == "simulado":
+            _provedor = ProvedorSimulado(
+                diretorio=os.getenv("MT5_SIMULADO_DIR", "dados_simulados"),
+                velocidade=float(os.getenv("MT5_SIMULADO_VELOCIDADE", "0")),
+                armazem=ArmazemCandles(),
+                ticks_dir=os.getenv("GRAVADOR_TICKS_DIR", "dados_ticks"),
+            )
+        else:
+            _provedor = ProvedorMT5()
+    return _provedor
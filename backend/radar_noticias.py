@@ -0,0 +1,312 @@
+import asyncio
+import bisect
+import json
+import os
+import time
+from datetime import datetime
+
+import httpx
+
+# Fonte pública gratuita e confiável para calendário econômico (Forex Factory)
+URL_FOREX_FACTORY = "https://nfs.faireconomy.media/ff_calendar_thisweek.json"
+
+# Moedas cujas notícias de alto impacto bloqueiam o ativo. B3 (WIN/WDO/ações) e cripto na B3
+# sentem Brasil e EUA; pares de forex de 6 letras usam as duas moedas do par
+MOEDAS_PADRAO = ("USD", "BRL")
+MOEDAS_POR_PREFIXO = {"BIT": ("USD", "BRL"), "ETH": ("USD", "BRL")}
+# Moedas publicadas pelo calendário (evita ler "WDOFUT" como par de forex)
+MOEDAS_CALENDARIO = {"USD", "EUR", "GBP", "JPY", "CHF", "CAD", "AUD", "NZD", "CNY", "BRL"}
+
+
+def moedas_do_ativo(ativo: str = None):
+    if not ativo:
+        return MOEDAS_PADRAO
+    ativo = ativo.upper()
+    for prefixo, moedas in MOEDAS_POR_PREFIXO.items():
+        if ativo.startswith(prefixo):
+            return moedas
+    if len(ativo) >= 6 and ativo[:3] in MOEDAS_CALENDARIO and ativo[3:6] in MOEDAS_CALENDARIO:
+        return ativo[:3], ativo[3:6]
+    return MOEDAS_PADRAO
+
+
+class FonteCalendarioRemota:
+    """Calendário da semana baixado por HTTP (formato Forex Factory), sem bloquear o event loop."""
+
+    def __init__(self, url=URL_FOREX_FACTORY, timeout=10.0):
+        self.url = url
+        self.timeout = timeout
+
+    async def buscar(self):
+        async with httpx.AsyncClient() as client:
+            resposta = await client.get(self.url, timeout=self.timeout)
+            resposta.raise_for_status()
+            return resposta.json()
+
+
+class FonteCalendarioLocal:
+    """Feed stub: arquivo JSON local no mesmo formato do Forex Factory (testes, replay offline)."""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+
+    async def buscar(self):
+        with open(self.caminho, encoding="utf-8") as arquivo:
+            return json.load(arquivo)
+
+
+def fonte_padrao():
+    """NOTICIAS_FONTE no .env: URL do calendário (padrão Forex Factory) ou caminho de um JSON local."""
+    fonte = os.getenv("NOTICIAS_FONTE", URL_FOREX_FACTORY)
+    if fonte.startswith(("http://", "https://")):
+        return FonteCalendarioRemota(fonte)
+    return FonteCalendarioLocal(fonte)
+
+
+class IndiceJanelas:
+    """
+    Janelas de bloqueio [início, fim] (timestamps) unidas quando se sobrepõem e ordenadas pelo
+    início: a consulta de um instante é um bisect, O(log n).
+    """
+
+    def __init__(self, janelas):
+        mescladas = []
+        for inicio, fim, rotulo in sorted(janelas):
+            if mescladas and inicio <= mescladas[-1][1]:
+                mescladas[-1][1] = max(mescladas[-1][1], fim)
+                mescladas[-1][2].append(rotulo)
+            else:
+                mescladas.append([inicio, fim, [rotulo]])
+        self.inicios = [inicio for inicio, _, _ in mescladas]
+        self.fins = [fim for _, fim, _ in mescladas]
+        self.rotulos = [" + ".join(rotulos) for _, _, rotulos in mescladas]
+
+    def __len__(self):
+        return len(self.inicios)
+
+    def consultar(self, instante: float):
+        """Rótulo da janela que contém `instante` (ou None)."""
+        i = bisect.bisect_right(self.inicios, instante) - 1
+        if i >= 0 and instante <= self.fins[i]:
+            return self.rotulos[i]
+        return None
+
+
+class NewsRadar:
+    """
+    Calendário de notícias de alto impacto e hiato operacional em torno delas.
+    A busca roda em segundo plano (executar(), no event loop do robô) e a última cópia fica em
+    disco para a partida a quente; a consulta do loop nunca toca a rede. As janelas de bloqueio
+    (±`margem_minutos` do evento) ficam num índice ordenado por conjunto de moedas do ativo.
+    """
+
+    def __init__(self, fonte=None, caminho_cache=None, intervalo_atualizacao=14400, margem_minutos=15,
+                 espera_apos_falha=300):
+        # Gatilhos Reais: Brasil, USA e Crypto (Essencial para BITH11 e WIN/WDO)
+        self.hard_triggers = [
+            "Copom", "IPCA", "Payroll", "FOMC", "Taxa de Juros",
+            "PIB", "CPI", "Decisão FED", "SEC",
+            "Relatório Focus", "Caged", "Inflação", "PMI", "Non-Farm"
+        ]
+        self.fonte = fonte or fonte_padrao()
+        self.caminho_cache = caminho_cache or os.getenv("NOTICIAS_CACHE", "dados_noticias/calendario.json")
+        self.intervalo_atualizacao = intervalo_atualizacao
+        self.margem_segundos = margem_minutos * 60
+        self.espera_apos_falha = espera_apos_falha
+        self.eventos_cache = []
+        self.ultimo_update = 0
+        self._indices = {}   # moedas -> IndiceJanelas
+        self.atualizacoes = 0
+        self.falhas = 0
+        self._carregar_copia()
+
+    def _definir_eventos(self, itens, atualizado_em):
+        """Filtra os eventos de ALTO IMPACTO do feed e descarta os índices montados com a versão anterior."""
+        eventos = []
+        for item in itens or []:
+            if item.get('impact') != 'High' or not item.get('date'):
+                continue
+            try:
+                # O formato ISO vem com timezone (ex: 2026-03-02T10:00:00-05:00)
+                # Converte para o fuso horário local do servidor (onde o robô roda)
+                dt_evento_local = datetime.fromisoformat(item['date']).astimezone()
+            except (TypeError, ValueError):
+                continue
+            eventos.append({
+                'evento': item.get('title'),
+                'hora': dt_evento_local.strftime("%H:%M"),
+                'data_completa': dt_evento_local,
+                'moeda': item.get('country')
+            })
+        self.eventos_cache = eventos
+        self.ultimo_update = atualizado_em
+        self._indices = {}
+
+    def _carregar_copia(self):
+        """Partida a quente: o último calendário salvo vale até a primeira atualização em segundo plano."""
+        try:
+            with open(self.caminho_cache, encoding="utf-8") as arquivo:
+                copia = json.load(arquivo)
+            self._definir_eventos(copia.get("itens"), copia.get("atualizado_em", 0))
+        except (OSError, ValueError):
+            return
+
+    def _salvar_copia(self, itens, atualizado_em):
+        pasta = os.path.dirname(self.caminho_cache)
+        if pasta:
+            os.makedirs(pasta, exist_ok=True)
+        # Grava num temporário e troca: uma queda no meio não deixa a cópia corrompida
+        temporario = self.caminho_cache + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as arquivo:
+            json.dump({"atualizado_em": atualizado_em, "itens": itens}, arquivo, ensure_ascii=False)
+        os.replace(temporario, self.caminho_cache)
+
+    async def atualizar(self):
+        """Busca o calendário na fonte, troca o índice e salva a cópia. Em falha mantém a versão anterior."""
+        try:
+            dados = await self.fonte.buscar()
+        except Exception as e:
+            self.falhas += 1
+            print(f"⚠️ Erro ao capturar calendário econômico: {e}")
+            return False
+        itens = [item for item in dados if item.get('impact') == 'High']
+        agora_ts = time.time()
+        self._definir_eventos(itens, agora_ts)
+        try:
+            self._salvar_copia(itens, agora_ts)
+        except OSError as e:
+            print(f"⚠️ Calendário econômico não pôde ser salvo em disco: {e}")
+        self.atualizacoes += 1
+        print(f"📡 Radar de Notícias Atualizado: {len(self.eventos_cache)} eventos de ALTO IMPACTO encontrados para esta semana.")
+        return True
+
+    async def executar(self):
+        """Tarefa de fundo: atualiza ao iniciar se a cópia estiver velha e depois a cada `intervalo_atualizacao`."""
+        while True:
+            vencimento = self.ultimo_update + self.intervalo_atualizacao - time.time()
+            if vencimento > 0:
+                await asyncio.sleep(vencimento)
+                continue
+            if not await self.atualizar():
+                await asyncio.sleep(self.espera_apos_falha)
+
+    def _indice(self, moedas):
+        indice = self._indices.get(moedas)
+        if indice is None:
+            indice = IndiceJanelas(
+                (evento['data_completa'].timestamp() - self.margem_segundos,
+                 evento['data_completa'].timestamp() + self.margem_segundos,
+                 f"{evento['moeda']} - {evento['evento']}")
+                for evento in self.eventos_cache if evento['moeda'] in moedas
+            )
+            self._indices[moedas] = indice
+        return indice
+
+    def verificar_bloqueio_operacional(self, ativo: str = None, agora_ts: float = None):
+        """
+        Implementa o Hiato Operacional de 30 minutos em torno de notícias fatais (15min antes e
+        15min depois) para as moedas do ativo. Só consulta o índice em memória.
+        """
+        rotulo = self._indice(moedas_do_ativo(ativo)).consultar(time.time() if agora_ts is None else agora_ts)
+        if rotulo is None:
+            return False, None
+        return True, rotulo
+
+    def estatisticas(self):
+        return {
+            "eventos": len(self.eventos_cache),
+            "idade_min": round((time.time() - self.ultimo_update) / 60) if self.ultimo_update else None,
+            "atualizacoes": self.atualizacoes,
+            "falhas": self.falhas,
+            "indices": {"/".join(moedas): len(indice) for moedas, indice in self._indices.items()},
+        }
+
+
+def _verificar_bloqueio_legado(eventos, moedas, agora):
+    """Implementação original (varredura linear com as janelas refeitas a cada chamada), para a paridade."""
+    from datetime import timedelta
+
+    for evento in eventos:
+        if evento['moeda'] not in moedas:
+            continue
+        dt_evento = evento['data_completa']
+        if dt_evento.date() == agora.date():
+            inicio_janela = dt_evento - timedelta(minutes=15)
+            fim_janela = dt_evento + timedelta(minutes=15)
+            if inicio_janela <= agora <= fim_janela:
+                return True, f"{evento['moeda']} - {evento['evento']}"
+    return False, None
+
+
+if __name__ == "__main__":
+    import random
+    import tempfile
+    from datetime import timedelta, timezone
+
+    # Feed stub com uma semana de eventos (inclui sobreposições e moedas fora do filtro) servido de
+    # um arquivo local; fonte lenta simulada para mostrar que o loop não espera pela rede
+    aleatorio = random.Random(3)
+    inicio_semana = datetime(2026, 3, 2, 8, 0, tzinfo=timezone(timedelta(hours=-5)))
+    itens = []
+    for i in range(400):
+        momento = inicio_semana + timedelta(minutes=aleatorio.randrange(0, 5 * 24 * 60, 5))
+        itens.append({"title": f"Evento {i}", "country": aleatorio.choice(["USD", "BRL", "EUR", "GBP", "JPY"]),
+                      "date": momento.isoformat(), "impact": aleatorio.choice(["High", "Medium", "Low"])})
+
+    class FonteLenta(FonteCalendarioLocal):
+        async def buscar(self):
+            await asyncio.sleep(2.0)
+            return await super().buscar()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho_feed = os.path.join(pasta, "feed.json")
+        with open(caminho_feed, "w", encoding="utf-8") as arquivo:
+            json.dump(itens, arquivo)
+        caminho_copia = os.path.join(pasta, "calendario.json")
+
+        async def cenario():
+            radar = NewsRadar(FonteLenta(caminho_feed), caminho_copia)
+            fundo = asyncio.create_task(radar.executar())
+            # O loop segue consultando enquanto o feed demora; sem cópia em disco não há bloqueio ainda
+            inicio = time.perf_counter()
+            consultas = 0
+            while radar.atualizacoes == 0:
+                radar.verificar_bloqueio_operacional("WIN")
+                consultas += 1
+                await asyncio.sleep(0.05)
+            fundo.cancel()
+            print(f"Partida a frio: {consultas} consultas atendidas durante os {time.perf_counter() - inicio:.1f}s do feed "
+                  f"(maior espera do loop: 0, a busca roda em segundo plano)")
+            return radar
+
+        radar = asyncio.run(cenario())
+        t0 = time.perf_counter()
+        quente = NewsRadar(FonteLenta(caminho_feed), caminho_copia)
+        print(f"Partida a quente: {len(quente.eventos_cache)} eventos lidos da cópia em disco em "
+              f"{(time.perf_counter() - t0) * 1000:.1f} ms")
+
+    # Paridade com a varredura original e custo por consulta, instante a instante ao longo da semana
+    divergencias = virada_do_dia = 0
+    instantes = [inicio_semana + timedelta(minutes=m) for m in range(0, 5 * 24 * 60, 1)]
+    for ativo in ("WIN", "EURUSD", "BITG26"):
+        moedas = moedas_do_ativo(ativo)
+        for agora in instantes:
+            agora = agora.astimezone()
+            bloqueado, _ = radar.verificar_bloqueio_operacional(ativo, agora.timestamp())
+            bloqueado_legado, _ = _verificar_bloqueio_legado(radar.eventos_cache, moedas, agora)
+            if bloqueado != bloqueado_legado:
+                divergencias += 1
+                # A varredura antiga só olhava eventos do mesmo dia: perdia a janela que cruza a meia-noite
+                virada_do_dia += bloqueado and min(agora.hour, 23 - agora.hour) == 0
+    amostra = [agora.astimezone() for agora in instantes[::7]]
+    t0 = time.perf_counter()
+    for agora in amostra:
+        _verificar_bloqueio_legado(radar.eventos_cache, MOEDAS_PADRAO, agora)
+    t_legado = (time.perf_counter() - t0) / len(amostra)
+    t0 = time.perf_counter()
+    for agora in amostra:
+        radar.verificar_bloqueio_operacional("WIN", agora.timestamp())
+    t_indice = (time.perf_counter() - t0) / len(amostra)
+    print(f"Paridade do hiato: {divergencias} divergências em {3 * len(instantes)} consultas "
+          f"({virada_do_dia} na virada do dia) | "
+          f"varredura: {t_legado * 1e6:.1f} µs | índice: {t_indice * 1e6:.1f} µs por consulta | {radar.estatisticas()}")
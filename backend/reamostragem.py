@@ -0,0 +1,67 @@
+import numpy as np
+
+
+def baldes_de_tempo(tempos, minutos: int):
+    """Horário de abertura do candle de N minutos de cada timestamp (alinhado à meia-noite)."""
+    segundos = minutos * 60
+    tempos = tempos.astype(np.int64)
+    inicio_dia = tempos - tempos % 86400
+    return inicio_dia + ((tempos - inicio_dia) // segundos) * segundos
+
+
+def reamostrar(rates_m1, minutos: int):
+    """
+    Agrega rates M1 (array estruturado do MT5) em candles de N minutos com reduções
+    vetorizadas do numpy. Devolve um array com o mesmo dtype dos rates de entrada.
+    """
+    if rates_m1 is None or len(rates_m1) == 0:
+        return rates_m1
+    baldes = baldes_de_tempo(rates_m1['time'], minutos)
+    inicios = np.flatnonzero(np.r_[True, baldes[1:] != baldes[:-1]])
+    fins = np.r_[inicios[1:], len(rates_m1)] - 1
+
+    saida = np.zeros(len(inicios), dtype=rates_m1.dtype)
+    saida['time'] = baldes[inicios]
+    saida['open'] = rates_m1['open'][inicios]
+    saida['high'] = np.maximum.reduceat(rates_m1['high'], inicios)
+    saida['low'] = np.minimum.reduceat(rates_m1['low'], inicios)
+    saida['close'] = rates_m1['close'][fins]
+    saida['tick_volume'] = np.add.reduceat(rates_m1['tick_volume'], inicios)
+    if 'real_volume' in rates_m1.dtype.names:
+        saida['real_volume'] = np.add.reduceat(rates_m1['real_volume'], inicios)
+    if 'spread' in rates_m1.dtype.names:
+        saida['spread'] = np.minimum.reduceat(rates_m1['spread'], inicios)
+    return saida
+
+
+def comparar_com_corretora(reamostrados, rates_corretora, tolerancia_preco=1e-9):
+    """
+    Confere os candles reamostrados contra os candles da corretora no mesmo horário.
+    O último candle de cada lado (em formação) fica de fora da comparação.
+    """
+    resultado = {"comparados": 0, "divergentes": 0, "exemplos": []}
+    if reamostrados is None or rates_corretora is None or len(reamostrados) < 2 or len(rates_corretora) < 2:
+        return resultado
+
+    locais = reamostrados[:-1]
+    corretora = rates_corretora[:-1]
+    comuns, idx_local, idx_corretora = np.intersect1d(locais['time'], corretora['time'], return_indices=True)
+    if len(comuns) == 0:
+        return resultado
+
+    a = locais[idx_local]
+    b = corretora[idx_corretora]
+    divergente = np.zeros(len(comuns), dtype=bool)
+    for campo in ('open', 'high', 'low', 'close'):
+        divergente |= np.abs(a[campo] - b[campo]) > tolerancia_preco
+    divergente |= a['tick_volume'] != b['tick_volume']
+
+    resultado["comparados"] = int(len(comuns))
+    resultado["divergentes"] = int(divergente.sum())
+    for i in np.flatnonzero(divergente)[:3]:
+        resultado["exemplos"].append({
+            "time": int(comuns[i]),
+            "local": {c: float(a[c][i]) for c in ('open', 'high', 'low', 'close', 'tick_volume')},
+            "corretora": {c: float(b[c][i]) for c in ('open', 'high', 'low', 'close', 'tick_volume')},
+        })
+    return resultado
@@ -0,0 +1,426 @@
+import json
+from collections import deque
+from dataclasses import dataclass, field
+
+import numpy as np
+from google.genai import types
+
+DECISOES = ("WAIT", "WAIT_TO_BUY", "WAIT_TO_SELL", "BUY", "SELL", "HOLD", "BREAKEVEN")
+ACOES_ARMADILHA = ("BUY", "SELL", "NONE")
+DIRECOES_TENDENCIA = ("UP", "DOWN", "SIDEWAYS")
+
+_TEXTO = types.Schema(type=types.Type.STRING)
+_NUMERO = types.Schema(type=types.Type.NUMBER)
+
+# Contrato da resposta da IA (GenerateContentConfig.response_schema): o modelo só consegue gerar
+# JSON neste formato, com decisao/acao restritas aos enums
+ESQUEMA_RESPOSTA = types.Schema(
+    type=types.Type.OBJECT,
+    properties={
+        "relevancia": types.Schema(type=types.Type.INTEGER, minimum=1, maximum=5),
+        "decisao": types.Schema(type=types.Type.STRING, enum=list(DECISOES)),
+        "motivo": _TEXTO,
+        "regime_mercado": _TEXTO,
+        "estrategia_escolhida": _TEXTO,
+        "raciocinio_macro": _TEXTO,
+        "raciocinio_micro": _TEXTO,
+        "adaptabilidade": _TEXTO,
+        "probabilidade_acerto": _TEXTO,
+        "estado_operacional": _TEXTO,
+        "ordem_programada": types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "acao": types.Schema(type=types.Type.STRING, enum=list(ACOES_ARMADILHA)),
+                "preco_gatilho": _NUMERO,
+                "motivo_gatilho": _TEXTO,
+            },
+            required=["acao", "preco_gatilho"],
+        ),
+        "estudos_visuais": types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "suporte": _NUMERO,
+                "resistencia": _NUMERO,
+                "tendencia_direcao": types.Schema(type=types.Type.STRING, enum=list(DIRECOES_TENDENCIA)),
+                "tendencia_preco": _NUMERO,
+                "linhas_tendencia": types.Schema(type=types.Type.ARRAY, items=_TEXTO),
+                "suporte_resistencia": types.Schema(type=types.Type.ARRAY, items=_NUMERO),
+                "fibo_proposals": types.Schema(
+                    type=types.Type.ARRAY,
+                    items=types.Schema(type=types.Type.OBJECT, properties={"level": _TEXTO, "price": _NUMERO}),
+                ),
+            },
+        ),
+    },
+    required=["relevancia", "decisao", "motivo", "estado_operacional", "ordem_programada"],
+    # Campos de decisão primeiro: no streaming a armadilha/execução sai antes da narrativa
+    property_ordering=["relevancia", "decisao", "motivo", "estado_operacional", "ordem_programada",
+                       "regime_mercado", "estrategia_escolhida", "raciocinio_macro", "raciocinio_micro",
+                       "adaptabilidade", "probabilidade_acerto", "estudos_visuais"],
+)
+
+# Campos que bastam para o loop agir (memória, armadilha, execução); o resto é narrativa para o painel
+CAMPOS_DECISAO = ("relevancia", "decisao", "motivo", "estado_operacional", "ordem_programada")
+
+
+class ErroRespostaIA(ValueError):
+    """Resposta do modelo fora do contrato (JSON inválido, campo obrigatório ausente, enum desconhecido)."""
+
+
+@dataclass(slots=True)
+class OrdemProgramada:
+    acao: str = "NONE"
+    preco_gatilho: float = 0.0
+    motivo_gatilho: str = ""
+
+
+@dataclass(slots=True)
+class RespostaIA:
+    relevancia: int
+    decisao: str
+    motivo: str
+    estado_operacional: str
+    ordem_programada: OrdemProgramada
+    regime_mercado: str = ""
+    estrategia_escolhida: str = ""
+    raciocinio_macro: str = ""
+    raciocinio_micro: str = ""
+    adaptabilidade: str = ""
+    probabilidade_acerto: str = ""
+    estudos_visuais: dict = field(default_factory=dict)
+
+    @classmethod
+    def de_json(cls, texto: str, estrito: bool = True):
+        """
+        Valida o texto do modelo. Com `estrito=False` (saída livre, sem response_schema) ainda tira
+        as cercas de markdown, como o parser antigo precisava.
+        """
+        if texto is None:
+            raise ErroRespostaIA("resposta vazia")
+        if not estrito:
+            texto = texto.strip()
+            if texto.startswith("```"):
+                texto = texto.split("\n", 1)[1] if "\n" in texto else ""
+                texto = texto.rsplit("```", 1)[0]
+        try:
+            dados = json.loads(texto)
+        except (TypeError, ValueError) as e:
+            raise ErroRespostaIA(f"JSON inválido: {e}") from None
+        return cls.de_dict(dados)
+
+    @classmethod
+    def de_dict(cls, dados):
+        if not isinstance(dados, dict):
+            raise ErroRespostaIA("a resposta não é um objeto JSON")
+        try:
+            decisao = dados["decisao"]
+            if decisao not in DECISOES:
+                raise ErroRespostaIA(f"decisao desconhecida: {decisao!r}")
+            ordem = dados.get("ordem_programada") or {}
+            acao = ordem.get("acao", "NONE")
+            if acao not in ACOES_ARMADILHA:
+                raise ErroRespostaIA(f"acao desconhecida: {acao!r}")
+            estudos = dados.get("estudos_visuais") or {}
+            return cls(
+                relevancia=min(5, max(1, int(dados["relevancia"]))),
+                decisao=decisao,
+                motivo=str(dados.get("motivo", "")),
+                estado_operacional=str(dados.get("estado_operacional", "")),
+                ordem_programada=OrdemProgramada(acao, float(ordem.get("preco_gatilho") or 0.0),
+                                                 str(ordem.get("motivo_gatilho", ""))),
+                regime_mercado=str(dados.get("regime_mercado", "")),
+                estrategia_escolhida=str(dados.get("estrategia_escolhida", "")),
+                raciocinio_macro=str(dados.get("raciocinio_macro", "")),
+                raciocinio_micro=str(dados.get("raciocinio_micro", "")),
+                adaptabilidade=str(dados.get("adaptabilidade", "")),
+                probabilidade_acerto=str(dados.get("probabilidade_acerto", "")),
+                estudos_visuais=estudos if isinstance(estudos, dict) else {},
+            )
+        except KeyError as e:
+            raise ErroRespostaIA(f"campo obrigatório ausente: {e}") from None
+        except (TypeError, ValueError, AttributeError) as e:
+            if isinstance(e, ErroRespostaIA):
+                raise
+            raise ErroRespostaIA(f"campo com tipo inválido: {e}") from None
+
+    def para_dict(self) -> dict:
+        """Formato de dicionário consumido pelo loop do robô e pelo painel."""
+        return {
+            "relevancia": self.relevancia,
+            "decisao": self.decisao,
+            "motivo": self.motivo,
+            "regime_mercado": self.regime_mercado,
+            "estrategia_escolhida": self.estrategia_escolhida,
+            "raciocinio_macro": self.raciocinio_macro,
+            "raciocinio_micro": self.raciocinio_micro,
+            "adaptabilidade": self.adaptabilidade,
+            "probabilidade_acerto": self.probabilidade_acerto,
+            "estado_operacional": self.estado_operacional,
+            "ordem_programada": {
+                "acao": self.ordem_programada.acao,
+                "preco_gatilho": self.ordem_programada.preco_gatilho,
+                "motivo_gatilho": self.ordem_programada.motivo_gatilho,
+            },
+            "estudos_visuais": self.estudos_visuais,
+        }
+
+
+class LeitorJSONIncremental:
+    """
+    Parser incremental do objeto JSON da resposta em streaming: recebe os trechos conforme chegam e
+    devolve cada campo de primeiro nível assim que o valor dele fecha (vírgula ou '}' no nível 1),
+    sem esperar o fim do texto. Só acompanha aspas, escapes e profundidade; cada membro completo é
+    decodificado com json.loads. Texto antes do '{' (cercas de markdown) é ignorado.
+    """
+
+    def __init__(self):
+        self._texto = []
+        self._membro = []          # caracteres do membro de primeiro nível em andamento
+        self._profundidade = 0
+        self._em_string = False
+        self._escape = False
+        self.campos = {}
+        self.completo = False
+
+    def alimentar(self, trecho: str):
+        """Consome um trecho e devolve a lista de (campo, valor) que ficaram completos com ele."""
+        novos = []
+        if not trecho or self.completo:
+            return novos
+        self._texto.append(trecho)
+        membro = self._membro
+        for caractere in trecho:
+            if self._profundidade == 0:
+                if caractere == "{":
+                    self._profundidade = 1
+                continue
+            if self._em_string:
+                if self._escape:
+                    self._escape = False
+                elif caractere == "\\":
+                    self._escape = True
+                elif caractere == '"':
+                    self._em_string = False
+            elif caractere == '"':
+                self._em_string = True
+            elif caractere in "{[":
+                self._profundidade += 1
+            elif caractere in "}]":
+                self._profundidade -= 1
+                if self._profundidade == 0:
+                    self._fechar_membro(novos)
+                    self.completo = True
+                    break
+            elif caractere == "," and self._profundidade == 1:
+                self._fechar_membro(novos)
+                continue
+            membro.append(caractere)
+        return novos
+
+    def _fechar_membro(self, novos):
+        texto = "".join(self._membro).strip()
+        self._membro.clear()
+        if not texto:
+            return
+        try:
+            (campo, valor), = json.loads("{" + texto + "}").items()
+        except (ValueError, TypeError):
+            return
+        self.campos[campo] = valor
+        novos.append((campo, valor))
+
+    def tem_campos(self, campos=CAMPOS_DECISAO) -> bool:
+        return all(campo in self.campos for campo in campos)
+
+    @property
+    def texto(self) -> str:
+        return "".join(self._texto)
+
+
+class MetricasResposta:
+    """Tokens de saída, latência e taxa de falha de parse por modo ("schema" ou "livre")."""
+
+    def __init__(self, janela=500):
+        self._modos = {}   # modo -> [chamadas, falhas, tokens de saída, segundos]
+        # Streaming: (segundos até a decisão, segundos até a resposta completa) por chamada
+        self._fluxo = deque(maxlen=janela)
+
+    def registrar(self, modo: str, response, segundos: float, falhou: bool):
+        uso = getattr(response, "usage_metadata", None)
+        totais = self._modos.setdefault(modo, [0, 0, 0, 0.0])
+        totais[0] += 1
+        totais[1] += falhou
+        totais[2] += (getattr(uso, "candidates_token_count", None) or 0) if uso else 0
+        totais[3] += segundos
+
+    def registrar_fluxo(self, segundos_decisao: float, segundos_total: float):
+        """Tempo até os campos de decisão e tempo até o fim da resposta de uma chamada em streaming."""
+        self._fluxo.append((segundos_decisao, segundos_total))
+
+    def estatisticas(self):
+        resumo = {
+            modo: {
+                "chamadas": chamadas,
+                "falhas_parse": f"{falhas / chamadas:.1%}",
+                "tokens_saida_medio": round(tokens / chamadas),
+                "latencia_media_s": round(segundos / chamadas, 2),
+            }
+            for modo, (chamadas, falhas, tokens, segundos) in self._modos.items() if chamadas
+        }
+        if self._fluxo:
+            tempos = np.array(self._fluxo, dtype=np.float64)
+            resumo["streaming"] = {
+                "chamadas": len(tempos),
+                "ate_decisao_p50_s": round(float(np.percentile(tempos[:, 0], 50)), 2),
+                "ate_decisao_p95_s": round(float(np.percentile(tempos[:, 0], 95)), 2),
+                "ate_completa_p50_s": round(float(np.percentile(tempos[:, 1], 50)), 2),
+                "ate_completa_p95_s": round(float(np.percentile(tempos[:, 1], 95)), 2),
+                "antecipacao_media_s": round(float((tempos[:, 1] - tempos[:, 0]).mean()), 2),
+            }
+        return resumo
+
+
+if __name__ == "__main__":
+    import time
+
+    exemplo = {
+        "relevancia": 2, "decisao": "WAIT", "motivo": "[Preço 128450.0] Status mantido. Aguardando confirmação.",
+        "estado_operacional": "[Preço 128450.0] Aguardando pullback no suporte.",
+        "ordem_programada": {"acao": "NONE", "preco_gatilho": 0.0, "motivo_gatilho": ""},
+        "estudos_visuais": {"suporte": 128300.0, "resistencia": 128600.0, "tendencia_direcao": "UP"},
+    }
+    texto = json.dumps(exemplo, ensure_ascii=False)
+
+    # Respostas típicas da saída livre: cercas de markdown, texto extra, JSON truncado, enum inventado
+    livres = [texto, f"```json\n{texto}\n```", f"Segue a análise:\n{texto}", texto[:-20],
+              texto.replace('"WAIT"', '"AGUARDAR"', 1)]
+    for estrito, rotulo in ((True, "parser estrito"), (False, "parser livre (tira cercas)")):
+        falhas = 0
+        for resposta in livres:
+            try:
+                RespostaIA.de_json(resposta, estrito=estrito)
+            except ErroRespostaIA:
+                falhas += 1
+        print(f"{rotulo}: {falhas}/{len(livres)} respostas livres viram WAIT por falha de parse")
+
+    rodadas = 20000
+    t0 = time.perf_counter()
+    for _ in range(rodadas):
+        json.loads(texto)
+    t_json = (time.perf_counter() - t0) / rodadas
+    t0 = time.perf_counter()
+    for _ in range(rodadas):
+        RespostaIA.de_json(texto).para_dict()
+    t_validacao = (time.perf_counter() - t0) / rodadas
+    print(f"json.loads: {t_json * 1e6:.1f} µs | json.loads + validação + dict: {t_validacao * 1e6:.1f} µs")
+
+    # Streaming: parser incremental em trechos de tamanho variável (como chegam do modelo) e em que
+    # ponto da resposta os campos de decisão ficam completos. Resposta típica, na ordem do schema
+    import asyncio
+    import random
+
+    completa = dict(exemplo)
+    completa["ordem_programada"] = {"acao": "BUY", "preco_gatilho": 128520.0,
+                                    "motivo_gatilho": "Rompimento da LTB do M1 com volume acima da média."}
+    completa.update({
+        "regime_mercado": "Tendência de alta no M5 / pullback no M1",
+        "estrategia_escolhida": "Pullback na VWAP",
+        "raciocinio_macro": "M15 com topos e fundos ascendentes desde a abertura; preço acima da VWAP e da máxima de ontem. " * 2,
+        "raciocinio_micro": "M5 respeitando a LTA; M1 corrigindo até o suporte de 128300 com volume secando e martelo no fundo. " * 2,
+        "adaptabilidade": "Mantida a leitura de pullback; só muda se perder a VWAP com volume.",
+        "probabilidade_acerto": "72%",
+    })
+    completa["estudos_visuais"] = {**exemplo["estudos_visuais"], "tendencia_preco": 128380.0,
+                                   "linhas_tendencia": ["LTA M5 128100 -> 128350", "LTB M1 128600 -> 128520"],
+                                   "suporte_resistencia": [128300.0, 128450.0, 128600.0, 128750.0],
+                                   "fibo_proposals": [{"level": "38.2%", "price": 128390.0}, {"level": "61.8%", "price": 128330.0}]}
+    ordem_schema = ESQUEMA_RESPOSTA.property_ordering or list(completa)
+    texto_stream = json.dumps({campo: completa[campo] for campo in ordem_schema if campo in completa}, ensure_ascii=False)
+
+    aleatorio = random.Random(1)
+    divergencias = 0
+    posicao_decisao = []
+    for _ in range(500):
+        leitor = LeitorJSONIncremental()
+        consumidos, decidiu_em = 0, None
+        while consumidos < len(texto_stream):
+            tamanho = aleatorio.randint(1, 80)
+            leitor.alimentar(texto_stream[consumidos:consumidos + tamanho])
+            consumidos += tamanho
+            if decidiu_em is None and leitor.tem_campos():
+                decidiu_em = min(consumidos, len(texto_stream))
+        divergencias += leitor.campos != json.loads(texto_stream)
+        posicao_decisao.append(decidiu_em / len(texto_stream))
+    t0 = time.perf_counter()
+    for _ in range(200):
+        LeitorJSONIncremental().alimentar(texto_stream)
+    custo = (time.perf_counter() - t0) / 200
+    fracao = float(np.mean(posicao_decisao))
+    print(f"Parser incremental: {divergencias} divergências em 500 streams | decisão completa em {fracao:.0%} "
+          f"dos {len(texto_stream)} caracteres | {custo * 1e6:.0f} µs por resposta")
+
+    # Tempo até a decisão x tempo até a resposta completa: stream reproduzido de um cassete, com a
+    # geração (~4 caracteres por token a GEMINI_TOKENS_POR_S tokens/s) distribuída entre os trechos
+    import os
+    import tempfile
+
+    from backend_llm import GravadorCassete, ReprodutorCassete, RespostaGravada, UsoGravado
+
+    tokens_por_s = float(os.getenv("GEMINI_TOKENS_POR_S", "200"))
+    geracao = len(texto_stream) / 4 / tokens_por_s
+
+    class _Config:
+        response_schema = ESQUEMA_RESPOSTA
+
+    class _Gerador:
+        def gerar(self, modelo, contents, config, instrucao=""):
+            time.sleep(geracao / 10)
+            return RespostaGravada(texto_stream, UsoGravado(6000, 0, len(texto_stream) // 4, 6000 + len(texto_stream) // 4))
+
+    async def medir_stream(reprodutor):
+        inicio = time.perf_counter()
+        leitor, ate_decisao = LeitorJSONIncremental(), None
+        async for trecho in reprodutor.gerar_stream_async("modelo", ["prompt"], _Config()):
+            leitor.alimentar(trecho.text)
+            if ate_decisao is None and leitor.tem_campos():
+                ate_decisao = time.perf_counter() - inicio
+        return ate_decisao, time.perf_counter() - inicio
+
+    with tempfile.TemporaryDirectory() as pasta:
+        gravador = GravadorCassete(_Gerador(), os.path.join(pasta, "stream.db"))
+        gravador.gerar("modelo", ["prompt"], _Config())
+        gravador.cassete.fechar()
+        # Gravado a 1/10 do tempo e reproduzido com escala 10
+        reprodutor = ReprodutorCassete(gravador.cassete.caminho, latencia="gravada", escala=10, tamanho_trecho=48)
+        ate_decisao, ate_completa = asyncio.run(medir_stream(reprodutor))
+    print(f"Stream reproduzido ({tokens_por_s:.0f} tokens/s): decisão em {ate_decisao:.2f}s x resposta completa em "
+          f"{ate_completa:.2f}s ({ate_completa - ate_decisao:.2f}s antes para armadilha/execução)")
+
+    # A/B ao vivo (precisa de GEMINI_API_KEY): mesmo prompt com response_schema e com JSON livre
+    from dotenv import load_dotenv
+    from google import genai
+
+    from ai_service import INSTRUCAO_SISTEMA
+
+    load_dotenv()
+    if os.getenv("GEMINI_API_KEY"):
+        client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+        modelo = os.getenv("GEMINI_MODELO_BENCH", "gemini-2.5-flash-lite")
+        metricas = MetricasResposta()
+        prompt = ("ANÁLISE HÍBRIDA (DADOS + IMAGEM) EM TEMPO REAL.\nEstratégia: Camaleão | Preço Atual: 128450.0\n"
+                  "VWAP Atual: 128390.00000 | ATR Atual: 85.00000\nSUA MEMÓRIA DO CICLO ANTERIOR: \"Iniciando...\"\n"
+                  "Gere o JSON estrito.")
+        for modo in ("livre", "schema"):
+            config = types.GenerateContentConfig(
+                system_instruction=INSTRUCAO_SISTEMA, response_mime_type="application/json", temperature=0.2,
+                response_schema=ESQUEMA_RESPOSTA if modo == "schema" else None)
+            for _ in range(10):
+                inicio = time.perf_counter()
+                resposta = client.models.generate_content(model=modelo, contents=[prompt], config=config)
+                try:
+                    RespostaIA.de_json(resposta.text, estrito=modo == "schema")
+                    falhou = False
+                except ErroRespostaIA:
+                    falhou = True
+                metricas.registrar(modo, resposta, time.perf_counter() - inicio, falhou)
+        print(metricas.estatisticas())
@@ -0,0 +1,137 @@
+from datetime import datetime
+
+from provedor_mercado import provedor_adiado
+
+# Provedor resolvido no primeiro uso: importar o módulo não exige o MetaTrader5
+mt5 = provedor_adiado
+
+
+class AcumuladorResultado:
+    """
+    Resultado do dia (lucro dos fechamentos + comissão + swap) de uma conta, mantido de forma
+    incremental: cada atualização só pede ao terminal os deals desde o último processado
+    (com uma pequena margem para deals que chegam atrasados, deduplicados pelo ticket).
+    Os totais são separados por magic number e zeram na virada da sessão (meia-noite).
+    """
+
+    def __init__(self, margem_segundos=60):
+        self.margem_segundos = margem_segundos
+        self.resetar(None)
+
+    def resetar(self, inicio_sessao):
+        self.inicio_sessao = inicio_sessao
+        self.ultimo_tempo = None
+        self.ultimo_ticket = None
+        self._tickets_recentes = {}   # ticket -> time, só dos deals dentro da margem
+        self.lucro = 0.0
+        self.comissao = 0.0
+        self.swap = 0.0
+        self.por_magic = {}           # magic -> [lucro, comissao, swap]
+        self.deals_processados = 0
+
+    def atualizar(self, agora_ts=None):
+        """Processa os deals novos e devolve o resultado total do dia."""
+        agora = datetime.fromtimestamp(agora_ts if agora_ts is not None else mt5.agora())
+        inicio_sessao = int(agora.replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+        if inicio_sessao != self.inicio_sessao:
+            self.resetar(inicio_sessao)
+
+        desde = inicio_sessao if self.ultimo_tempo is None else max(inicio_sessao, self.ultimo_tempo - self.margem_segundos)
+        historico = mt5.history_deals_get(desde, int(agora.timestamp()))
+        if historico:
+            for deal in historico:
+                if deal.ticket in self._tickets_recentes or deal.time < desde:
+                    continue
+                self._somar(deal)
+                self._tickets_recentes[deal.ticket] = deal.time
+                if self.ultimo_tempo is None or deal.time >= self.ultimo_tempo:
+                    self.ultimo_tempo, self.ultimo_ticket = deal.time, deal.ticket
+
+            # Esquece os tickets que já saíram da margem de reconsulta
+            if self.ultimo_tempo is not None:
+                limite = self.ultimo_tempo - self.margem_segundos
+                for ticket in [t for t, tempo in self._tickets_recentes.items() if tempo < limite]:
+                    del self._tickets_recentes[ticket]
+        return self.resultado()
+
+    def _somar(self, deal):
+        # Filtra apenas o que é lucro/prejuízo de trade (ignora depósitos/ajustes)
+        # Entry 1 é 'OUT' (fechamento de posição)
+        lucro = deal.profit if deal.entry == mt5.DEAL_ENTRY_OUT else 0.0
+        self.lucro += lucro
+        self.comissao += deal.commission
+        self.swap += deal.swap
+        totais = self.por_magic.setdefault(deal.magic, [0.0, 0.0, 0.0])
+        totais[0] += lucro
+        totais[1] += deal.commission
+        totais[2] += deal.swap
+        self.deals_processados += 1
+
+    def resultado(self, magic=None):
+        if magic is None:
+            return float(self.lucro + self.comissao + self.swap)
+        return float(sum(self.por_magic.get(magic, (0.0, 0.0, 0.0))))
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    import pandas as pd
+
+    from provedor_mercado import TradeDeal
+
+    # Dia sintético com 2000 deals; o robô consulta o resultado a cada 15s
+    inicio = int(datetime(2025, 3, 10).timestamp())
+    rng = random.Random(3)
+    deals = []
+    for i in range(2000):
+        instante = inicio + 9 * 3600 + i * 15 + rng.randint(0, 14)
+        deals.append(TradeDeal(ticket=i + 1, order=i + 1, time=instante, time_msc=instante * 1000, type=i % 2,
+                               entry=i % 2, magic=rng.choice((123456, 777)), position_id=i // 2 + 1, volume=1.0,
+                               price=100.0, commission=-0.5, swap=rng.choice((0.0, -0.1)),
+                               profit=rng.uniform(-50, 60) if i % 2 else 0.0, fee=0.0, symbol="BENCH", comment=""))
+
+    class Terminal:
+        DEAL_ENTRY_OUT = 1
+        devolvidos = 0
+
+        def history_deals_get(self, inicio, fim):
+            selecionados = tuple(d for d in deals if inicio <= d.time <= fim)
+            Terminal.devolvidos += len(selecionados)
+            return selecionados
+
+    mt5 = Terminal()
+
+    def legado(agora_ts):
+        historico = mt5.history_deals_get(inicio, agora_ts)
+        if not historico:
+            return 0.0
+        df = pd.DataFrame(list(historico), columns=historico[0]._asdict().keys())
+        return float(df[df['entry'] == 1]['profit'].sum() + df['commission'].sum() + df['swap'].sum())
+
+    acumulador = AcumuladorResultado()
+    divergencia = 0.0
+    t_legado = t_incremental = 0.0
+    devolvidos_legado = devolvidos_incremental = 0
+    consultas = 0
+    for agora_ts in range(inicio + 9 * 3600, deals[-1].time + 60, 15):
+        Terminal.devolvidos = 0
+        t0 = time.perf_counter()
+        esperado = legado(agora_ts)
+        t1 = time.perf_counter()
+        devolvidos_legado += Terminal.devolvidos
+        Terminal.devolvidos = 0
+        obtido = acumulador.atualizar(agora_ts)
+        t2 = time.perf_counter()
+        devolvidos_incremental += Terminal.devolvidos
+        t_legado += t1 - t0
+        t_incremental += t2 - t1
+        divergencia = max(divergencia, abs(esperado - obtido))
+        consultas += 1
+
+    print(f"Maior divergência: {divergencia:.2e} | por magic: "
+          f"{ {m: round(acumulador.resultado(m), 2) for m in acumulador.por_magic} }")
+    print(f"{consultas} consultas | legado {t_legado / consultas * 1e6:.0f} µs e {devolvidos_legado / consultas:.0f} deals "
+          f"por consulta | incremental {t_incremental / consultas * 1e6:.0f} µs e "
+          f"{devolvidos_incremental / consultas:.1f} deals por consulta")
@@ -0,0 +1,257 @@
+import asyncio
+import time
+from collections import deque
+
+import numpy as np
+
+
+class SaudeModelo:
+    """Janela das últimas chamadas de um modelo (latência e sucesso) e estado do disjuntor."""
+
+    def __init__(self, janela):
+        self.latencias = deque(maxlen=janela)
+        self.resultados = deque(maxlen=janela)
+        self.falhas_seguidas = 0
+        self.aberto_ate = 0.0
+        self.aberturas = 0
+        self.canceladas = 0
+
+    def percentil(self, p):
+        if not self.latencias:
+            return None
+        return float(np.percentile(np.fromiter(self.latencias, dtype=np.float64), p))
+
+    def taxa_erro(self):
+        if not self.resultados:
+            return 0.0
+        return 1.0 - sum(self.resultados) / len(self.resultados)
+
+
+class RoteadorModelos:
+    """
+    Roteamento das chamadas entre o modelo principal e o reserva:
+    - latência (p50/p95) e taxa de erro por modelo numa janela móvel;
+    - requisição em hedge: se o principal passa do próprio p95 sem responder, a mesma pergunta vai
+      ao reserva; vale a primeira resposta (ou a primeira decisão, no streaming) e a outra é cancelada.
+      Latência e prazo do hedge contam de quando a chamada sai da fila do pool (`iniciou`): enquanto
+      o principal ainda espera vaga ou cota, não há hedge (só aumentaria a fila);
+    - erro de indisponibilidade (`falha_modelo`) antes do hedge passa direto ao reserva;
+    - disjuntor: `limite_falhas` falhas seguidas tiram o modelo da rota por `pausa` segundos. Na
+      volta basta uma falha para abrir de novo.
+    """
+
+    def __init__(self, modelos, hedge=True, janela=200, minimo_amostras=20, atraso_minimo=1.0,
+                 limite_falhas=3, pausa=60.0, relogio=time.monotonic):
+        self.modelos = list(modelos)
+        self.hedge = hedge
+        self.minimo_amostras = minimo_amostras
+        self.atraso_minimo = atraso_minimo
+        self.limite_falhas = limite_falhas
+        self.pausa = pausa
+        self.relogio = relogio
+        self.saude = {modelo: SaudeModelo(janela) for modelo in self.modelos}
+        self.decisoes = deque(maxlen=janela)  # latência da pergunta até a resposta vencedora
+        self.chamadas = 0
+        self.hedges = 0
+        self.vitorias_reserva = 0
+        self.desvios = 0  # chamadas que pularam o principal por disjuntor aberto
+
+    def ordem(self):
+        """Modelos na ordem de preferência, sem os de disjuntor aberto (todos abertos: tenta todos)."""
+        agora = self.relogio()
+        disponiveis = [modelo for modelo in self.modelos if self.saude[modelo].aberto_ate <= agora]
+        return disponiveis or list(self.modelos)
+
+    def atraso_hedge(self, modelo):
+        """Segundos até o hedge: p95 do modelo (None enquanto a janela tem poucas amostras)."""
+        saude = self.saude[modelo]
+        if not self.hedge or len(saude.latencias) < self.minimo_amostras:
+            return None
+        return max(self.atraso_minimo, saude.percentil(95))
+
+    def registrar(self, modelo, segundos, ok):
+        """Desfecho de uma chamada; `segundos` None quando ela não chegou a sair da fila do pool."""
+        saude = self.saude[modelo]
+        saude.resultados.append(ok)
+        if ok:
+            if segundos is not None:
+                saude.latencias.append(segundos)
+            saude.falhas_seguidas = 0
+            return
+        saude.falhas_seguidas += 1
+        if saude.falhas_seguidas >= self.limite_falhas:
+            agora = self.relogio()
+            saude.falhas_seguidas = self.limite_falhas - 1
+            if saude.aberto_ate <= agora:
+                saude.aberturas += 1
+                print(f"🔌 Disjuntor aberto para {modelo}: {self.limite_falhas} falhas seguidas. Fora da rota por {self.pausa:.0f}s.")
+            saude.aberto_ate = agora + self.pausa
+
+    async def executar(self, fabrica, ao_decidir=None, falha_modelo=lambda erro: False):
+        """
+        Roda `fabrica(modelo, decidir, iniciou)` (corrotina da chamada) no principal e, se preciso, no
+        reserva. Devolve o resultado da primeira chamada bem-sucedida; se todas falharem, relança o
+        último erro. `decidir` repassa a `ao_decidir` apenas a primeira decisão e cancela a chamada
+        concorrente. A fábrica chama `iniciou()` quando a requisição sai da fila e vai ao modelo.
+        """
+        ordem = self.ordem()
+        principal, reserva = ordem[0], (ordem[1] if len(ordem) > 1 else None)
+        self.chamadas += 1
+        if principal != self.modelos[0]:
+            self.desvios += 1
+        inicio = time.monotonic()
+        abertas = {}  # tarefa -> modelo, até o desfecho ser registrado
+        partidas = {}  # tarefa -> instante em que saiu da fila do pool
+        modelos = {}
+        decidida = []
+        partida_principal = asyncio.get_running_loop().create_future()
+
+        def cancelar(tarefa):
+            if tarefa in abertas:
+                # Sem amostra de latência: a chamada cancelada não terminou (e contá-la inflaria o p95)
+                self.saude[abertas.pop(tarefa)].canceladas += 1
+            tarefa.cancel()
+
+        def lancar(modelo):
+            def decidir(decisao):
+                if decidida:
+                    return
+                decidida.append(modelo)
+                for outra, modelo_outra in modelos.items():
+                    if modelo_outra != modelo:
+                        cancelar(outra)
+                ao_decidir(decisao)
+
+            def iniciou():
+                partidas[tarefa] = time.monotonic()
+                if modelo == principal and not partida_principal.done():
+                    partida_principal.set_result(None)
+
+            tarefa = asyncio.ensure_future(fabrica(modelo, decidir if ao_decidir is not None else None, iniciou))
+            abertas[tarefa] = modelo
+            modelos[tarefa] = modelo
+            return tarefa
+
+        pendentes = {lancar(principal)}
+        atraso = self.atraso_hedge(principal) if reserva else None
+        ultimo_erro = None
+        try:
+            while pendentes:
+                espera = None
+                aguardando = set(pendentes)
+                if reserva and atraso is not None and len(modelos) == 1 and not decidida:
+                    partida = partidas.get(next(iter(modelos)))
+                    if partida is not None:
+                        espera = max(0.0, partida + atraso - time.monotonic())
+                    else:
+                        # Principal ainda na fila do pool: o prazo do hedge só corre depois que ele sair
+                        aguardando.add(partida_principal)
+                feitas, _ = await asyncio.wait(aguardando, timeout=espera, return_when=asyncio.FIRST_COMPLETED)
+                feitas.discard(partida_principal)
+                if espera is not None and not feitas:
+                    self.hedges += 1
+                    pendentes.add(lancar(reserva))
+                    continue
+                pendentes -= feitas
+                for tarefa in feitas:
+                    if tarefa.cancelled():
+                        continue
+                    modelo = abertas.pop(tarefa)
+                    erro = tarefa.exception()
+                    partida = partidas.get(tarefa)
+                    self.registrar(modelo, None if partida is None else time.monotonic() - partida, erro is None)
+                    if erro is None:
+                        self.decisoes.append(time.monotonic() - inicio)
+                        if modelo != principal:
+                            self.vitorias_reserva += 1
+                        return tarefa.result()
+                    ultimo_erro = erro
+                    if reserva and len(modelos) == 1 and falha_modelo(erro):
+                        print(f"⚠️ Modelo {modelo} indisponível (503). Tentando fallback para {reserva}...")
+                        pendentes.add(lancar(reserva))
+            if ultimo_erro is None:
+                raise RuntimeError("Todas as chamadas ao modelo foram canceladas antes de responder.")
+            raise ultimo_erro
+        finally:
+            for tarefa in list(modelos):
+                if not tarefa.done():
+                    cancelar(tarefa)
+
+    def estatisticas(self):
+        agora = self.relogio()
+        resumo = {"chamadas": self.chamadas, "hedges": self.hedges,
+                  "vitorias_reserva": self.vitorias_reserva, "desvios": self.desvios}
+        if self.decisoes:
+            decisoes = np.fromiter(self.decisoes, dtype=np.float64)
+            resumo["decisao_s"] = {"p50": round(float(np.percentile(decisoes, 50)), 2),
+                                   "p95": round(float(np.percentile(decisoes, 95)), 2)}
+        for modelo, saude in self.saude.items():
+            resumo[modelo] = {
+                "p50_s": round(saude.percentil(50), 2) if saude.latencias else None,
+                "p95_s": round(saude.percentil(95), 2) if saude.latencias else None,
+                "erro": round(saude.taxa_erro(), 3),
+                "canceladas": saude.canceladas,
+                "disjuntor": "aberto" if saude.aberto_ate > agora else "fechado",
+                "aberturas": saude.aberturas,
+            }
+        return resumo
+
+
+if __name__ == "__main__":
+    import random
+
+    # Principal rápido mas com cauda (4% das chamadas "vivas mas lentas", 6-12s) e reserva mais lento
+    # e estável. Tempos em segundos do modelo, reproduzidos em escala para a demonstração rodar rápido.
+    ESCALA = 0.02
+    PRINCIPAL, RESERVA = "gemini-2.5-flash-lite", "gemini-2.5-flash"
+
+    class Indisponivel(Exception):
+        pass
+
+    def cenario(hedge, chamadas=320, perfis=4, pane=None, semente=7):
+        aleatorio = random.Random(semente)
+        roteador = RoteadorModelos([PRINCIPAL, RESERVA], hedge=hedge, atraso_minimo=1.0 * ESCALA,
+                                   pausa=60 * ESCALA)
+        feitas = [0]
+        erros = [0]
+
+        async def modelo_falso(modelo, decidir, iniciou):
+            iniciou()
+            if modelo == PRINCIPAL:
+                if pane and pane[0] <= feitas[0] < pane[1]:
+                    await asyncio.sleep(0.3 * ESCALA)
+                    raise Indisponivel("503 UNAVAILABLE")
+                segundos = aleatorio.uniform(6, 12) if aleatorio.random() < 0.04 else aleatorio.lognormvariate(0.2, 0.3)
+            else:
+                segundos = aleatorio.lognormvariate(0.8, 0.2)
+            await asyncio.sleep(segundos * ESCALA)
+            return {"decisao": "WAIT", "modelo": modelo}
+
+        async def perfil():
+            for _ in range(chamadas // perfis):
+                feitas[0] += 1
+                try:
+                    await roteador.executar(modelo_falso, falha_modelo=lambda e: "503" in str(e))
+                except Indisponivel:
+                    erros[0] += 1
+
+        async def rodar():
+            await asyncio.gather(*(perfil() for _ in range(perfis)))
+
+        asyncio.run(rodar())
+        decisoes = np.fromiter(roteador.decisoes, dtype=np.float64) / ESCALA
+        return decisoes, roteador, erros[0]
+
+    for hedge in (False, True):
+        decisoes, roteador, _ = cenario(hedge)
+        p50, p95, p99 = np.percentile(decisoes, [50, 95, 99])
+        custo = roteador.hedges / roteador.chamadas
+        print(f"{'com hedge' if hedge else 'sem hedge'}: decisão p50={p50:.2f}s p95={p95:.2f}s p99={p99:.2f}s "
+              f"max={decisoes.max():.2f}s | hedges={custo:.0%} das chamadas, reserva venceu {roteador.vitorias_reserva}")
+
+    # Pane do principal (503 em sequência): o disjuntor tira o modelo da rota em vez de pagar a falha toda vez
+    _, roteador, erros = cenario(True, pane=(100, 220))
+    saude = roteador.saude[PRINCIPAL]
+    print(f"pane de 120 chamadas no principal: {roteador.desvios} desviadas pelo disjuntor, "
+          f"{len(saude.resultados) - sum(saude.resultados)} falhas pagas, {saude.aberturas} aberturas, "
+          f"{erros} sem resposta")
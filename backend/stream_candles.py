@@ -0,0 +1,180 @@
+import time
+
+import numpy as np
+
+from pivots import tempos_unix
+
+CAMPOS_GRAFICO = ('open', 'high', 'low', 'close')
+
+
+def serializar_candles(dados):
+    """
+    Candles (rates do MT5 ou DataFrame) no formato do gráfico do painel, serializados por
+    coluna (tolist + zip) em vez de iterrows.
+    """
+    if dados is None or len(dados) == 0:
+        return []
+    tempos = tempos_unix(dados['time'] if isinstance(dados, np.ndarray) else dados['time'].values).tolist()
+    colunas = [np.asarray(dados[c], dtype=np.float64).tolist() for c in CAMPOS_GRAFICO]
+    return [{"time": t, "open": o, "high": h, "low": l, "close": c} for t, o, h, l, c in zip(tempos, *colunas)]
+
+
+class EmissorCandles:
+    """
+    Lado do robô: primeiro envia um snapshot completo e depois só deltas (candle em formação
+    alterado + candles recém-fechados), todos numerados com `seq` para o servidor e os clientes
+    detectarem mensagens perdidas. Um snapshot periódico cura qualquer divergência restante.
+    """
+
+    def __init__(self, intervalo_snapshot=300.0):
+        self.intervalo_snapshot = intervalo_snapshot
+        self.seq = 0
+        self.ativo = None
+        self._ultimo = None          # último candle enviado (o em formação), como dict
+        self._ultimo_snapshot = 0.0
+        self._forcar_snapshot = True
+
+    def solicitar_snapshot(self):
+        self._forcar_snapshot = True
+
+    def proxima_mensagem(self, ativo: str, rates):
+        """Mensagem market_data a enviar (snapshot ou delta) ou None se nada mudou."""
+        if rates is None or len(rates) == 0:
+            return None
+        agora = time.monotonic()
+        if (self._forcar_snapshot or ativo != self.ativo or self._ultimo is None
+                or agora - self._ultimo_snapshot >= self.intervalo_snapshot):
+            candles = serializar_candles(rates)
+            self._forcar_snapshot = False
+            self._ultimo_snapshot = agora
+            return self._mensagem("snapshot", ativo, candles)
+
+        # Delta: do candle em formação anterior (pode ter fechado com valores finais) em diante
+        tempos = rates['time'] if isinstance(rates, np.ndarray) else rates['time'].values
+        inicio = int(np.searchsorted(tempos_unix(tempos), self._ultimo["time"], side='left'))
+        candles = serializar_candles(rates[inicio:])
+        if candles and candles[0]["time"] != self._ultimo["time"]:
+            # O candle anterior saiu da janela (buraco maior que ela): resincroniza
+            self._ultimo_snapshot = agora
+            return self._mensagem("snapshot", ativo, serializar_candles(rates))
+        if len(candles) == 1 and candles[0] == self._ultimo:
+            return None
+        mensagem = self._mensagem("delta", ativo, candles)
+        # Delta compacto: cada candle vira [time, open, high, low, close]
+        mensagem["candles"] = [[c["time"], c["open"], c["high"], c["low"], c["close"]] for c in candles]
+        return mensagem
+
+    def _mensagem(self, modo, ativo, candles):
+        self.seq += 1
+        self.ativo = ativo
+        self._ultimo = candles[-1] if candles else None
+        return {"type": "market_data", "modo": modo, "ativo": ativo, "seq": self.seq, "candles": candles}
+
+
+class EstadoGrafico:
+    """
+    Lado do servidor: mantém o último snapshot com os deltas aplicados, para entregar o
+    gráfico completo a conexões novas e a clientes que pedirem resync.
+    """
+
+    def __init__(self, capacidade=500):
+        self.capacidade = capacidade
+        self.ativo = None
+        self.seq = None
+        self.candles = []
+
+    def aplicar(self, mensagem: dict) -> bool:
+        """Aplica snapshot/delta. Retorna False se houve buraco na sequência (precisa de snapshot)."""
+        seq = mensagem.get("seq")
+        candles = mensagem.get("candles") or []
+        if mensagem.get("modo") != "delta":
+            self.ativo = mensagem.get("ativo")
+            self.seq = seq
+            self.candles = list(candles[-self.capacidade:])
+            return True
+
+        if self.seq is None or seq != self.seq + 1 or mensagem.get("ativo") != self.ativo:
+            return False
+        self.seq = seq
+        for t, o, h, l, c in candles:
+            candle = {"time": t, "open": o, "high": h, "low": l, "close": c}
+            if self.candles and self.candles[-1]["time"] == candle["time"]:
+                self.candles[-1] = candle
+            elif not self.candles or candle["time"] > self.candles[-1]["time"]:
+                self.candles.append(candle)
+        if len(self.candles) > self.capacidade:
+            del self.candles[:len(self.candles) - self.capacidade]
+        return True
+
+    def snapshot(self):
+        if self.seq is None:
+            return None
+        return {"type": "market_data", "modo": "snapshot", "ativo": self.ativo, "seq": self.seq,
+                "candles": list(self.candles)}
+
+
+def _serializar_legado(df):
+    """Serialização original (iterrows), mantida só para a paridade e o benchmark."""
+    import pandas as pd
+
+    candles_list = []
+    for _, row in df.iterrows():
+        candles_list.append({
+            "time": int(row['time'].timestamp() if hasattr(row['time'], 'timestamp') else pd.to_datetime(row['time']).timestamp()),
+            "open": float(row['open']), "high": float(row['high']),
+            "low": float(row['low']), "close": float(row['close'])
+        })
+    return candles_list
+
+
+if __name__ == "__main__":
+    import json
+
+    def _json(mensagem):
+        # Mesmo formato compacto do send_json do WebSocket
+        return json.dumps(mensagem, separators=(",", ":"))
+
+    import pandas as pd
+
+    from indicadores import _gerar_rates_sinteticos
+
+    rates = _gerar_rates_sinteticos(2000, passo=300)
+    # Preços com 5 casas, como os cotados pela corretora
+    for campo in CAMPOS_GRAFICO:
+        rates[campo] = np.round(rates[campo], 5)
+    df = pd.DataFrame(rates[-100:])
+    df['time'] = pd.to_datetime(df['time'], unit='s')
+    print(f"Paridade snapshot: {serializar_candles(df) == _serializar_legado(df)}")
+
+    t0 = time.perf_counter()
+    for _ in range(200):
+        _serializar_legado(df)
+    t_legado = (time.perf_counter() - t0) / 200
+    t0 = time.perf_counter()
+    for _ in range(200):
+        serializar_candles(rates[-100:])
+    t_vetorizado = (time.perf_counter() - t0) / 200
+    print(f"Serialização de 100 candles: iterrows {t_legado * 1e6:.0f} µs | vetorizada {t_vetorizado * 1e6:.0f} µs")
+
+    # Replay: cada candle M5 recebe 10 atualizações do candle em formação
+    emissor, servidor = EmissorCandles(), EstadoGrafico()
+    bytes_snapshot = bytes_delta = mensagens = 0
+    for fim in range(100, len(rates)):
+        janela = rates[fim - 100:fim].copy()
+        alvo = janela[-1].copy()
+        for passo in range(1, 11):
+            janela[-1]['close'] = alvo['open'] + (alvo['close'] - alvo['open']) * passo / 10
+            janela[-1]['high'] = max(alvo['open'], janela[-1]['close'])
+            janela[-1]['low'] = min(alvo['open'], janela[-1]['close'])
+            if passo == 10:
+                janela[-1] = alvo
+            mensagem = emissor.proxima_mensagem("BENCH", janela)
+            if mensagem is None:
+                continue
+            assert servidor.aplicar(json.loads(_json(mensagem)))
+            mensagens += 1
+            bytes_delta += len(_json(mensagem))
+            bytes_snapshot += len(_json({"type": "market_data", "candles": serializar_candles(janela)}))
+    print(f"Estado do servidor igual ao histórico: {servidor.candles[-100:] == serializar_candles(janela)}")
+    print(f"{mensagens} mensagens | payload médio: snapshot {bytes_snapshot / mensagens:.0f} B | "
+          f"delta {bytes_delta / mensagens:.0f} B ({bytes_snapshot / bytes_delta:.0f}x menor)")
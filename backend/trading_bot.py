@@ -1,5 +1,8 @@
 import os
+import sys
+import signal
 import asyncio
+import functools
 import json
 import httpx
 import requests
@@ -7,20 +10,51 @@ import time as time_lib
 from datetime import datetime
 from dotenv import load_dotenv
 from supabase import create_client, Client
-import MetaTrader5 as mt5
 import pandas as pd
 
 from mt5_service import MT5Service
 from ai_service import AITrader
+from gravador_ticks import GravadorTicks
+from provedor_mercado import ProvedorSimulado, obter_provedor
+from stream_candles import EmissorCandles
+from contexto_ativos import AnaliseCancelada, ContextosAtivos
+from monitor_loop import MonitorLoop
+from portao_quant import PortaoQuant
+from agendador_perfis import AgendadorPerfis
+from prazo_analise import PrazoAnalise
+from motor_armadilhas import MotorArmadilhas
 
 load_dotenv()
 
+# Terminal real (MetaTrader5) ou simulado, conforme MT5_PROVEDOR no .env
+mt5 = obter_provedor()
+
+def ler_relogio_ativo(ativo):
+    """(horário do servidor, marca do último tick) do ativo, para o agendador detectar barras e ticks."""
+    tick = mt5.symbol_info_tick(ativo)
+    if isinstance(mt5, ProvedorSimulado):
+        # No simulador o relógio do provedor já é o do servidor
+        return mt5.agora(), tick.time_msc if tick is not None else None
+    if tick is None:
+        return None
+    return tick.time, tick.time_msc
+
+def segundos_de_parede(segundos_mercado):
+    """Intervalo do relógio do mercado em tempo de parede (None se o relógio só anda com avancar())."""
+    if isinstance(mt5, ProvedorSimulado):
+        return segundos_mercado / mt5.velocidade if mt5.velocidade > 0 else None
+    return segundos_mercado
+
 def capturar_dados_triplos(symbol):
-    # Aumentamos para 100 candles de M1 para ver micro-tendências e exaustão
-    rates_m1 = mt5.copy_rates_from_pos(symbol, mt5.TIMEFRAME_M1, 0, 100)
-    rates_m2 = mt5.copy_rates_from_pos(symbol, mt5.TIMEFRAME_M2, 0, 50)
-    rates_m5 = mt5.copy_rates_from_pos(symbol, mt5.TIMEFRAME_M5, 0, 60) # Aumentado para 60 para a IA ter o histórico correto na foto
-    rates_m15 = mt5.copy_rates_from_pos(symbol, mt5.TIMEFRAME_M15, 0, 15)
+    # Leitura via cache compartilhado: após o aquecimento só o candle em formação e os novos vêm do terminal.
+    # M2, M5 e M15 são reamostrados localmente do M1 (uma única série consultada por ativo)
+    cache = mt5_service.cache_candles
+    # Aumentamos para 100 candles de M1 para ver micro-tendências e exaustão.
+    # O M1 passa pelo motor incremental de indicadores: RSI, Estocástico, ATR-14 e VWAP para a IA e o portão
+    df_m1 = mt5_service.obter_dados_mercado(symbol, mt5.TIMEFRAME_M1, 100)
+    rates_m2 = cache.obter(symbol, mt5.TIMEFRAME_M2, 50)
+    rates_m5 = cache.obter(symbol, mt5.TIMEFRAME_M5, 60) # Aumentado para 60 para a IA ter o histórico correto na foto
+    rates_m15 = cache.obter(symbol, mt5.TIMEFRAME_M15, 15)
 
     def process_df(rates):
         if rates is None:
@@ -31,12 +65,45 @@ def capturar_dados_triplos(symbol):
         return df
 
     return {
-        "m1": process_df(rates_m1),
+        "m1": df_m1,
         "m2": process_df(rates_m2),
         "m5": process_df(rates_m5),
         "m15": process_df(rates_m15)
     }
 
+def montar_contexto_ativo(ativo):
+    """Dados do MT5 e métricas derivadas do ativo, calculados uma vez e repassados a todos os perfis dele."""
+    pacote_dados = capturar_dados_triplos(ativo)
+
+    if pacote_dados["m1"] is None or pacote_dados["m1"].empty:
+        return None
+
+    df_micro = pacote_dados["m1"]
+    ultima, anterior = df_micro.iloc[-1], df_micro.iloc[-2]
+    especificacao = mt5_service.especificacoes.obter(ativo)
+    atr_atual = df_micro['atr_14'].iloc[-1] if 'atr_14' in df_micro.columns else 0
+    timestamp_atual = int(ultima['time'].timestamp() if hasattr(ultima['time'], 'timestamp') else pd.to_datetime(ultima['time']).timestamp())
+    # Prazo da análise: fechamento da barra em formação, medido no relógio do servidor (o do último tick)
+    relogio_local = mt5.agora()
+    tick = mt5.symbol_info_tick(ativo)
+    relogio_servidor = tick.time if tick is not None else relogio_local
+    return {
+        "pacote_dados": pacote_dados,
+        "preco_atual": float(ultima['close']), # Tick atual (Vivo)
+        "fechamento_anterior": float(anterior['close']), # Fechamento da última vela
+        "abertura_anterior": float(anterior['open']), # Abertura da última vela (Para saber a cor)
+        "maxima_anterior": float(anterior['high']),
+        "minima_anterior": float(anterior['low']),
+        "timestamp_atual": timestamp_atual,
+        "atr_atual": atr_atual,
+        # Régua de volatilidade do portão quant (mesmo fallback da estatística prévia da IA)
+        "atr_referencia": atr_atual if atr_atual > 0 else float((df_micro['high'] - df_micro['low']).tail(14).mean()),
+        "tempo_fechado": int(pd.Timestamp(anterior['time']).timestamp()),
+        "point": especificacao.point if especificacao else 1.0,
+        "digits": especificacao.digits if especificacao else None,
+        "prazo": prazo_analise.prazo(timestamp_atual, relogio_servidor, relogio_local),
+    }
+
 # Inicialização do Supabase
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY", "")
@@ -47,12 +114,52 @@ if SUPABASE_URL and SUPABASE_KEY:
 
 mt5_service = MT5Service()
 ai_trader = AITrader()
+# Log binário de todos os ticks observados (dataset de replay em alta resolução)
+gravador_ticks = GravadorTicks()
+# Gráfico do painel: snapshot + deltas numerados
+emissor_candles = EmissorCandles()
+# Contexto de mercado e análises da IA compartilhados entre perfis do mesmo ativo
+contextos_ativos = ContextosAtivos(montar_contexto_ativo, relogio=mt5.agora)
+# Filtro determinístico que evita chamar a IA quando nada mudou desde a última análise do perfil
+portao_quant = PortaoQuant(
+    fracao_atr=float(os.getenv("PORTAO_FRACAO_ATR", "0.25")),
+    barras_novas=int(os.getenv("PORTAO_BARRAS_NOVAS", "1"))
+)
+# Prazo de cada análise pela barra M1 do snapshot: atrasadas são rebaixadas, tarde demais descartadas/canceladas
+prazo_analise = PrazoAnalise(tolerancia=float(os.getenv("PRAZO_TOLERANCIA", "60")))
+# Memória de Armadilhas (Ordens Programadas pela IA): gatilhos por ativo ordenados por preço, validade de 15 min
+motor_armadilhas = MotorArmadilhas(validade=900)
+
+def fechar_barra(ativo):
+    """
+    Barra M1 nova no ativo: contexto de mercado e foto das posições são refeitos no próximo acesso
+    e as armadilhas do ativo são conferidas já, no primeiro tick da barra nova.
+    """
+    contextos_ativos.novo_ciclo(ativo)
+    mt5_service.livro_posicoes.novo_ciclo()
+    vencer_armadilhas()
+    if ativo in motor_armadilhas.ativos():
+        agendador.lancar(disparar_armadilhas(ativo))
+
+def vencer_armadilhas():
+    for armadilha in motor_armadilhas.vencer(mt5.agora()):
+        print(f"[{armadilha.ativo}] ⏰ Armadilha de {armadilha.acao} expirou (Timeout > 15m). Desarmando.")
+
+# Uma tarefa por perfil, acordada na virada da barra do ativo ou pelo próprio timer. No simulador sem
+# velocidade própria o relógio é virtual: salta para o próximo evento quando todos os perfis dormem
+agendador = AgendadorPerfis(
+    relogio=mt5.agora, ler_tick=ler_relogio_ativo, ao_fechar_barra=fechar_barra, observados=motor_armadilhas.ativos,
+    avancar=mt5.avancar if isinstance(mt5, ProvedorSimulado) and mt5.velocidade == 0 else None
+)
+# Lag do event loop e cadência das tarefas de ticks/gráfico (a IA não pode congelá-las)
+monitor_loop = MonitorLoop()
+
+# Margem do ciclo da IA: o perfil acorda logo depois da virada da barra, alguns segundos antes do intervalo exato
+FOLGA_CICLO_IA = 5
 
 # --- VARIÁVEIS DE ESTADO EM MEMÓRIA ---
 memoria_relevancia = {} 
 memoria_estado_ia = {}
-# NOVO: Memória de Armadilhas (Ordens Programadas pela IA)
-memoria_ordem_programada = {}
 
 async def log_to_supabase(profile_id: str, log_type: str, message: str):
     """Salva logs de sistema no Supabase."""
@@ -87,12 +194,532 @@ async def broadcast_to_frontend(message: dict):
     """Envia os dados em tempo real para o servidor WebSocket repassar ao Painel Web (Assíncrono)."""
     try:
         async with httpx.AsyncClient() as client:
-            await client.post("http://127.0.0.1:8000/api/broadcast_log", json=message, timeout=2.0)
+            resposta = await client.post("http://127.0.0.1:8000/api/broadcast_log", json=message, timeout=2.0)
+            return resposta.json()
     except Exception:
-        pass 
+        return None
+
+async def analisar_perfil(snapshot: dict, decisao_pendente, analise_pendente):
+    """
+    Aguarda a decisão da IA de um perfil (fila do pool de inferência) e a aplica; a análise completa
+    (narrativa, estudos visuais) vai para o painel quando termina de chegar.
+    """
+    # Medidor de Latência da IA
+    start_time = time_lib.time()
+    try:
+        decisao = await decisao_pendente
+    except AnaliseCancelada:
+        # Chamada compartilhada cancelada: sem decisão neste ciclo (memória e armadilha mantidas).
+        # O cancelamento da própria tarefa do perfil continua subindo como CancelledError.
+        print(f"🗑️ [{snapshot['ativo']}] Análise da IA cancelada antes da decisão. Memória e armadilha mantidas.")
+        portao_quant.esquecer(snapshot["profile_id"])
+        analise_pendente.close()
+        return
+    except asyncio.CancelledError:
+        analise_pendente.close()
+        raise
+    tempo_decisao = time_lib.time() - start_time
+
+    # Decisão que chegou depois do fechamento da barra do snapshot: rebaixada ou descartada
+    situacao, atraso = prazo_analise.classificar(snapshot["prazo"], mt5.agora())
+    if decisao.get('motivo', '').startswith("Prazo IA"):
+        situacao = "cancelada"
+    prazo_analise.registrar(situacao, None if situacao == "cancelada" else -atraso)
+    if situacao in ("descartada", "cancelada"):
+        print(f"🗑️ [{snapshot['ativo']}] Decisão {situacao}: {decisao.get('motivo', '')[:80]} "
+              f"(barra do snapshot fechou há {atraso:.1f}s). Memória e armadilha mantidas.")
+        portao_quant.esquecer(snapshot["profile_id"])
+        analise_pendente.close()
+        return
+    if situacao == "rebaixada":
+        rebaixada = prazo_analise.rebaixar(decisao, atraso)
+        if rebaixada is not decisao:
+            print(f"⌛ [{snapshot['ativo']}] {decisao['decisao']} rebaixado para WAIT: chegou {atraso:.1f}s após o fechamento da barra.")
+        decisao = rebaixada
+    aplicada = await aplicar_analise(snapshot, decisao, tempo_decisao)
+    try:
+        analise = await analise_pendente
+    except AnaliseCancelada:
+        # Decisão já aplicada; só a narrativa para o painel se perdeu
+        return
+    await publicar_analise(snapshot, analise, aplicada, tempo_decisao, time_lib.time() - start_time)
+
+async def aplicar_analise(snapshot: dict, analise: dict, tempo_ia: float):
+    """
+    Memória, armadilha e execução de um perfil a partir da decisão calculada sobre `snapshot`.
+    Só lê os campos de decisão (relevância, decisão, motivo, memória, ordem programada).
+    """
+    inicio_sinal = time_lib.perf_counter()
+    profile_id, ativo, ambiente = snapshot["profile_id"], snapshot["ativo"], snapshot["ambiente"]
+    estrategia, agressividade = snapshot["estrategia"], snapshot["agressividade"]
+    lote, sl_real, tp_real = snapshot["lote"], snapshot["sl_real"], snapshot["tp_real"]
+    preco_atual_log, timestamp_atual = snapshot["preco_atual"], snapshot["timestamp_atual"]
+    posicao_aberta, estado_anterior_ia = snapshot["posicao_aberta"], snapshot["estado_anterior"]
+    minuto_atual = snapshot["minuto_atual"]
+    # Outro perfil do mesmo ativo pode ter aberto posição enquanto esta análise estava em voo
+    esta_posicionado = snapshot["esta_posicionado"] or (ambiente != 'REPLAY HISTÓRICO' and mt5_service.tem_posicao_aberta(ativo))
+
+    nova_relevancia = analise.get('relevancia', 1)
+    memoria_relevancia[profile_id] = nova_relevancia
+    memoria_estado_ia[profile_id] = analise.get('estado_operacional', analise.get('motivo', ''))
+
+    # Armazena nova armadilha que a IA definir
+    nova_armadilha = analise.get('ordem_programada', {"acao": "NONE"})
+    nova_armadilha["motivo_ia"] = analise.get('motivo', 'Motivo não especificado.')
+
+    # Salva o Timestamp para o Timeout apenas se a armadilha for válida (Com Trava Anti-Alucinação)
+    if nova_armadilha.get("acao") != "NONE":
+        gatilho_ia = float(nova_armadilha.get("preco_gatilho", 0))
+        acao_ia = nova_armadilha.get("acao")
+        
+        # Sanitização: O gatilho não pode estar a mais de 1.5% de distância do preço atual
+        distancia_percentual = abs(gatilho_ia - preco_atual_log) / preco_atual_log if preco_atual_log > 0 else 1
+        
+        # TRAVA DE AÇO MATEMÁTICA: BUY Stop deve ser > Preço Atual | SELL Stop deve ser < Preço Atual
+        direcao_invalida = (acao_ia == "BUY" and gatilho_ia <= preco_atual_log) or \
+                           (acao_ia == "SELL" and gatilho_ia >= preco_atual_log)
+        
+        if distancia_percentual > 0.015 or gatilho_ia <= 0 or direcao_invalida:
+            print(f"⚠️ [ANTI-ALUCINAÇÃO] Gatilho ignorado ({gatilho_ia} para {acao_ia}). Distância irreal ou direção inválida (Preço Atual: {preco_atual_log}).")
+            nova_armadilha = {"acao": "NONE"}
+        else:
+            nova_armadilha["timestamp"] = mt5.agora()
+            nova_armadilha["preco_gatilho"] = gatilho_ia # Garante que é float
+        
+    decisao = analise.get('decisao', 'WAIT')
+
+    # --- BLINDAGEM QUANT: IA NÃO PODE ABRIR NOVA ORDEM SE JÁ ESTIVER POSICIONADA ---
+    if esta_posicionado:
+        if nova_armadilha.get("acao") != "NONE":
+            print(f"⚠️ [BLINDAGEM] Armadilha ignorada. IA já está posicionada e deve focar apenas na gestão.")
+            nova_armadilha = {"acao": "NONE"}
+        if decisao not in ['HOLD', 'BREAKEVEN']:
+            print(f"⚠️ [BLINDAGEM] Decisão '{decisao}' inválida para gestão. Convertida para 'HOLD'. IA já está posicionada.")
+            decisao = 'HOLD'
+
+    motor_armadilhas.armar(profile_id, ativo, nova_armadilha, mt5.agora())
+    motivo = analise.get('motivo', 'Sem motivo')
+
+    # Referência do portão quant (uma resposta de erro/timeout não conta como decisão)
+    if motivo.startswith(("Erro IA", "Timeout IA")):
+        portao_quant.esquecer(profile_id)
+    else:
+        portao_quant.registrar(profile_id, snapshot["tempo_fechado"], preco_atual_log, nova_armadilha, posicao_aberta, decisao)
+    estrategia_escolhida = analise.get('estrategia_escolhida') or estrategia
+
+    # Log Silencioso para Notícias
+    if "BLOQUEIO: Notícia" in motivo:
+        if minuto_atual % 5 == 0:
+            print(f"🛑 [PAUSA DE NOTÍCIA] {motivo}")
+    else:
+        print(f"IA [{nova_relevancia}★] [Preço: {preco_atual_log}] [Delay: {tempo_ia:.2f}s]: {decisao} | {motivo}")
+        
+    if nova_armadilha.get("acao") != "NONE":
+        print(f"   🎯 ARMADILHA CONFIGURADA: {nova_armadilha['acao']} no rompimento/fechamento de {nova_armadilha['preco_gatilho']}")
+    else:
+        print(f"   ↳ Memória da IA: {estado_anterior_ia}")
+
+    # 5. EXECUTAR ORDEM IMEDIATA SE A IA MANDAR A MERCADO
+    if decisao in ['BUY', 'SELL']:
+
+        if agressividade == 'SNIPER' and nova_relevancia < 5:
+            print(f"Sinal {decisao} rejeitado (Filtro SNIPER).")
+        elif agressividade == 'SCALPER' and nova_relevancia < 4:
+            print(f"Sinal {decisao} rejeitado (Filtro SCALPER).")
+        else:
+            # Executa de fato
+            if ambiente == 'REPLAY HISTÓRICO':
+                print(f"[MODO REPLAY] Simulando ordem {decisao} para {ativo} (Paper Trading)...")
+                resultado = mt5_service.simular_ordem_paper_trading(ativo, decisao, preco_atual_log, motivo)
+            else:
+                print(f"[MODO AO VIVO] Executando ordem REAL {decisao} para {ativo}...")
+                resultado = mt5_service.enviar_ordem(ativo, decisao, lote, sl_real, tp_real, inicio_sinal)
+            
+            if resultado:
+                tag = "[SIMULAÇÃO] " if ambiente == 'REPLAY HISTÓRICO' else ""
+                await log_to_supabase(profile_id, "trade", f"{tag}Ordem {decisao} via {estrategia_escolhida}")
+                await save_trade_history(profile_id, resultado.order, ativo, decisao, resultado.price, motivo)
+                
+                msg_execucao_mercado = f"[{ativo}] ⚡ ORDEM A MERCADO {decisao} EXECUTADA!\n🧠 Raciocínio da IA: {motivo}"
+                await broadcast_to_frontend({
+                    "id": str(datetime.now().timestamp()),
+                    "timestamp": datetime.now().strftime("%H:%M:%S"),
+                    "type": "trade",
+                    "message": msg_execucao_mercado
+                })
+                
+                await broadcast_to_frontend({
+                    "type": "trade",
+                    "marker": {
+                        "time": timestamp_atual,
+                        "position": 'belowBar' if decisao == 'BUY' else 'aboveBar',
+                        "color": '#10b981' if decisao == 'BUY' else '#ef4444',
+                        "shape": 'arrowUp' if decisao == 'BUY' else 'arrowDown',
+                        "text": f"{decisao} {nova_relevancia}★"
+                    }
+                })
+            else:
+                await log_to_supabase(profile_id, "error", f"Falha ao executar ordem {decisao} para {ativo}.")
+                
+    elif decisao == 'BREAKEVEN' and posicao_aberta:
+        if ambiente != 'REPLAY HISTÓRICO':
+            try:
+                sucesso = mt5_service.mover_stop_breakeven(ativo)
+                if sucesso:
+                    msg_breakeven = f"🛡️ DEFESA ATIVADA: Stop Loss movido para o 0 a 0 (Breakeven). Motivo: {motivo}"
+                    await broadcast_to_frontend({
+                        "id": str(datetime.now().timestamp()),
+                        "timestamp": datetime.now().strftime("%H:%M:%S"),
+                        "type": "trade",
+                        "message": f"[{ativo}] {msg_breakeven}"
+                    })
+            except Exception as e:
+                print(f"Erro ao aplicar Breakeven: {e}")
+                
+    elif decisao == 'HOLD' and posicao_aberta:
+        print(f"[{ativo}] ⏳ HOLD: IA decidiu manter a posição atual aberta. Lucro atual: {posicao_aberta['profit']}")
+
+    return {"relevancia": nova_relevancia, "decisao": decisao, "motivo": motivo, "armadilha": nova_armadilha}
+
+async def publicar_analise(snapshot: dict, analise: dict, aplicada: dict, tempo_decisao: float, tempo_ia: float):
+    """Broadcast da análise completa para o painel, com a decisão como foi aplicada ao perfil."""
+    latencia = f"{tempo_ia:.2f}s"
+    if tempo_ia - tempo_decisao >= 0.01:
+        latencia = f"decisão {tempo_decisao:.2f}s | completa {tempo_ia:.2f}s"
+    log_msg = (f"Relevância: {aplicada['relevancia']}★ | Ativo: {snapshot['ativo']} | Decisão: {aplicada['decisao']}\n"
+               f"Motivo: {aplicada['motivo']}\nLatência: {latencia}")
+    await broadcast_to_frontend({
+        "id": str(datetime.now().timestamp()),
+        "timestamp": datetime.now().strftime("%H:%M:%S"),
+        "type": "ai_analysis",
+        "message": log_msg,
+        "estudos_visuais": analise.get('estudos_visuais', {}),
+        "relevancia": aplicada['relevancia'],
+        "armadilha": aplicada['armadilha']
+    })
+
+def trava_operacional(config):
+    """Motivo que impede o perfil de operar agora (meta/limite do dia ou fora do horário), ou None."""
+    horario_inicio = config.get('horario_inicio', '09:00')
+    horario_fim = config.get('horario_fim', '17:30')
+
+    # --- TRAVA INQUEBRÁVEL DE GESTÃO DE RISCO ---
+    meta_diaria = float(config.get('meta_diaria', 500.0))
+    limite_perda = float(config.get('limite_perda', -250.0))
+
+    resultado_atual = mt5_service.obter_resultado_diario()
+
+    if resultado_atual >= meta_diaria:
+        return f"META ALCANÇADA: R$ {resultado_atual:.2f}. Hibernando."
+
+    if resultado_atual <= limite_perda:
+        return f"LIMITE DE PERDA ATINGIDO: R$ {resultado_atual:.2f}. Travado."
+
+    # 2. Verificar Filtro de Horário
+    agora = datetime.fromtimestamp(mt5.agora()).time()
+    try:
+        h_inicio = datetime.strptime(horario_inicio, '%H:%M').time()
+        h_fim = datetime.strptime(horario_fim, '%H:%M').time()
+        if h_inicio <= h_fim:
+            dentro_horario = h_inicio <= agora <= h_fim
+        else:
+            dentro_horario = agora >= h_inicio or agora <= h_fim
+    except ValueError:
+        dentro_horario = True
+
+    if not dentro_horario:
+        return f"Fora da janela operacional ({horario_inicio} às {horario_fim})."
+    return None
+
+async def disparar_armadilhas(ativo):
+    """
+    Fechamento de barra num ativo com armadilhas: confirma pela vela que acabou de fechar (mesma
+    regra de rompimento/pullback de antes) e envia as ordens no primeiro tick da barra nova, sem
+    esperar o ciclo do perfil. Sem posição aberta no ativo e com as travas do perfil liberadas.
+    """
+    rates = mt5.copy_rates_from_pos(ativo, mt5.TIMEFRAME_M1, 1, 1)
+    if rates is None or len(rates) == 0:
+        return
+    vela = rates[-1]
+    confirmadas = motor_armadilhas.avaliar_barra(
+        ativo, float(vela['open']), float(vela['high']), float(vela['low']), float(vela['close'])
+    )
+    if not confirmadas:
+        return
+    tick = mt5.symbol_info_tick(ativo)
+    preco_atual = float(tick.last if tick.last != 0 else tick.bid) if tick else float(vela['close'])
+    fechamento_barra = int(vela['time']) + 60
+
+    # Todas as ordens primeiro; os avisos ao painel (HTTP) vêm depois
+    executadas = []
+    for armadilha, rompimento, pullback in confirmadas:
+        estado = agendador.estados.get(armadilha.profile_id)
+        if estado is None:
+            motor_armadilhas.desarmar(armadilha.profile_id)
+            continue
+        # Com posição no ativo ou perfil travado a armadilha segue armada (até disparar ou expirar)
+        if mt5_service.tem_posicao_aberta(ativo) or trava_operacional(estado.config):
+            continue
+        config = estado.config
+        print(f"🔥 ARMADILHA CONFIRMADA: Gatilho {armadilha.gatilho} acionado (Rompimento: {rompimento} | Pullback: {pullback}). {armadilha.acao}!")
+        inicio_sinal = time_lib.perf_counter()
+        if config.get('ambiente', 'AO VIVO') == 'REPLAY HISTÓRICO':
+            resultado = mt5_service.simular_ordem_paper_trading(ativo, armadilha.acao, preco_atual, armadilha.dados.get("motivo_gatilho", "Rompimento"))
+        else:
+            resultado = mt5_service.enviar_ordem(ativo, armadilha.acao, float(config.get('lote', 1.0)),
+                                                 int(config.get('stop_loss', 100)), int(config.get('take_profit', 200)), inicio_sinal)
+
+        # Limpa a armadilha após atirar para não atirar duplicado
+        relogio = ler_relogio_ativo(ativo)
+        motor_armadilhas.disparada(armadilha, relogio[0] - fechamento_barra if relogio else None)
+        if resultado:
+            executadas.append(armadilha)
+
+    for armadilha in executadas:
+        acao_armada = armadilha.acao
+        motivo_detalhado = armadilha.dados.get("motivo_ia", "Motivo não registrado.")
+        msg_execucao = f"[{ativo}] 🎯 ARMADILHA {acao_armada} ACIONADA no preço {preco_atual}!\n🧠 Raciocínio da IA: {motivo_detalhado}"
+
+        await broadcast_to_frontend({
+            "id": str(datetime.now().timestamp()),
+            "timestamp": datetime.now().strftime("%H:%M:%S"),
+            "type": "trade",
+            "message": msg_execucao
+        })
+
+        await broadcast_to_frontend({
+            "type": "trade",
+            "marker": {
+                "time": fechamento_barra,
+                "position": 'belowBar' if acao_armada == 'BUY' else 'aboveBar',
+                "color": '#10b981' if acao_armada == 'BUY' else '#ef4444',
+                "shape": 'arrowUp' if acao_armada == 'BUY' else 'arrowDown',
+                "text": f"{acao_armada} [ARMADILHA]"
+            }
+        })
+
+async def ciclo_perfil(estado):
+    """
+    Um ciclo de um perfil: travas de risco e horário, armadilha, gestão da posição e, com o ciclo
+    da IA vencido, a análise. Devolve o instante (relógio do provedor) em que o perfil quer acordar
+    de novo, ou None para a próxima barra do ativo.
+    """
+    config = estado.config
+    profile_id = estado.profile_id
+    ativo_banco = config.get('ativo', 'BITG26')
+
+    # --- A BALA DE PRATA: CRIA A VARIÁVEL QUE FALTAVA ---
+    ativo = ativo_banco
+    symbol = ativo_banco 
+
+    # --- FORÇA A SINCRONIZAÇÃO COM O FRONTEND ---
+    import main
+    main.current_symbol = ativo 
+
+    # VARIÁVEIS DE EXECUÇÃO ORIGINAIS
+    lote = float(config.get('lote', 1.0))
+    sl_pts = int(config.get('stop_loss', 100))
+    tp_pts = int(config.get('take_profit', 200))
+    estrategia = config.get('estrategia_ativa', 'Adaptável (Camaleão / Dinâmica)')
+    ambiente = config.get('ambiente', 'AO VIVO')
+
+    # --- NOVAS VARIÁVEIS DE INTELIGÊNCIA IA ---
+    trailing_stop_auto = config.get('trailing_stop_auto', True)
+    auto_decisao_ia = config.get('auto_decisao_ia', False)
+    agressividade = config.get('agressividade', 'SCALPER')
+
+    trava = trava_operacional(config)
+    if trava:
+        print(f"[{ativo}] {trava}")
+        return None
+
+    # 3. Puxar dados do MT5 (Fractal M1, M5, M15 + Ontem): uma vez por ativo no ciclo
+    contexto = contextos_ativos.obter(ativo)
+
+    if contexto is None:
+        return None
+
+    pacote_dados = contexto["pacote_dados"]
+    preco_atual_log = contexto["preco_atual"]
+    preco_fechamento_anterior = contexto["fechamento_anterior"]
+    timestamp_atual = contexto["timestamp_atual"]
+
+    atr_atual = contexto["atr_atual"]
+
+    # --- CÁLCULO DE SL E TP DINÂMICOS (BASEADO NO ATR) ---
+    point = contexto["point"]
+
+    if atr_atual > 0 and point > 0:
+        atr_pts = atr_atual / point
+        sl_dinamico_pts = int(atr_pts * 1.5)
+        tp_dinamico_pts = int(atr_pts * 2.0)
+    else:
+        sl_dinamico_pts = sl_pts
+        tp_dinamico_pts = tp_pts
+
+    # --- PROTEÇÃO DINÂMICA CONTRA ERRO 10016 ---
+    # O código passa a usar ESTRITAMENTE o sl_pts e tp_pts configurados pelo usuário
+    sl_real = sl_pts
+    tp_real = tp_pts
+
+    # ======================================================================
+    # MÓDULO EXECUTOR (LATÊNCIA ZERO): ARMADILHA
+    # O disparo é do motor de armadilhas, no fechamento da barra (disparar_armadilhas); aqui só a validade
+    # ======================================================================
+    vencer_armadilhas()
+    armadilha = motor_armadilhas.obter(profile_id)
+    if armadilha.get("acao") in ["BUY", "SELL"]:
+        print(f"[{ativo}] Monitorando Armadilha {armadilha['acao']} no gatilho {armadilha['preco_gatilho']}. Fechamento Anterior: {preco_fechamento_anterior}")
+
+    # 2.5 Obter Posição Aberta para a IA Gerir
+    posicao_aberta = None
+    if ambiente != 'REPLAY HISTÓRICO' and mt5_service.tem_posicao_aberta(ativo):
+        posicao_aberta = mt5_service.obter_posicao_aberta(ativo)
+
+        if posicao_aberta:
+            sl = posicao_aberta.get("sl_atual", 0)
+            price_open = posicao_aberta.get("price_open", 0)
+            pos_type = posicao_aberta.get("type", "")
+
+            is_protected = False
+            if sl > 0:
+                if pos_type == "BUY" and sl >= price_open - 0.00001:
+                    is_protected = True
+                elif pos_type == "SELL" and sl <= price_open + 0.00001:
+                    is_protected = True
+
+            if is_protected:
+                agora_ts_loop = mt5.agora()
+                if (agora_ts_loop - estado.ultimo_ts_ia) > 60:
+                    estado.ultimo_ts_ia = agora_ts_loop
+                    print(f"[{ativo}] 💤 Operação protegida no 0 a 0 (Breakeven). IA dormindo para economizar tokens.")
+                    await broadcast_to_frontend({
+                        "id": str(datetime.now().timestamp()),
+                        "timestamp": datetime.now().strftime("%H:%M:%S"),
+                        "type": "info",
+                        "message": f"[{ativo}] 💤 Operação protegida no 0 a 0. IA em modo de economia de tokens."
+                    })
+                # Dorme até a próxima barra do ativo
+                return None
+
+        print(f"[{ativo}] Posicionado. IA assumindo gestão da operação...")
+
+    # ======================================================================
+    # MÓDULO ANALISTA (IA): CONTROLE DE CICLO DINÂMICO (1min vs 2.5min)
+    # ======================================================================
+    agora_ts_loop = mt5.agora()
+    esta_posicionado = (ambiente != 'REPLAY HISTÓRICO' and mt5_service.tem_posicao_aberta(ativo))
+
+    # Define o intervalo do ciclo da IA
+    if esta_posicionado:
+        intervalo_ia = 150  # 2.5 minutos (150 segundos)
+    else:
+        intervalo_ia = 60   # 1 minuto (60 segundos)
+
+    estado.posicionado = esta_posicionado
+    estado.relevancia = memoria_relevancia.get(profile_id, 1)
+
+    # CICLO DE ESPERA: Monitora Armadilhas (relógio do próprio perfil; a folga absorve o atraso do despertar na barra)
+    if (agora_ts_loop - estado.ultimo_ts_ia) < intervalo_ia - FOLGA_CICLO_IA:
+        # Apenas avisa o frontend que está vivo e monitorando
+        tempo_restante = int(intervalo_ia - (agora_ts_loop - estado.ultimo_ts_ia))
+        await broadcast_to_frontend({
+            "id": str(datetime.now().timestamp()),
+            "timestamp": datetime.now().strftime("%H:%M:%S"),
+            "type": "info",
+            "message": f"[{ativo}] Monitorando armadilhas e trailing stops... (Próxima IA em ~{tempo_restante}s)"
+        })
+        return estado.ultimo_ts_ia + intervalo_ia
+
+    # CICLO DA IA ATINGIDO
+    estado.marcar_ciclo_ia(agora_ts_loop, intervalo_ia)
+    minuto_atual = datetime.fromtimestamp(agora_ts_loop).minute
+
+    if "dados_ontem" not in contexto:
+        contexto["dados_ontem"] = mt5_service.obter_ohlc_ontem(ativo) or {}
+    dados_ontem = contexto["dados_ontem"]
+    relevancia_anterior = memoria_relevancia.get(profile_id, 1)
+    estado_anterior_ia = memoria_estado_ia.get(profile_id, "Iniciando...")
+
+    # Controle Inteligente de Visão Computacional (Economiza Latência e Tokens)
+    enviar_fotos = False
+    if esta_posicionado:
+        # A cada 2.5 min, alterna: 1=Texto, 2=Imagem
+        estado.contador_posicionado += 1
+        if estado.contador_posicionado % 2 == 0:
+            enviar_fotos = True # No ciclo par (5 min), envia foto
+    else:
+        # Quando não posicionado, mantém a regra original (a cada 5 minutos do relógio)
+        enviar_fotos = (minuto_atual % 5 == 0)
+        estado.contador_posicionado = 0 # Reseta o contador
+
+    # Fotos geradas uma vez por ativo no ciclo; os demais perfis que pedirem fotos reaproveitam
+    caminho_foto_m1, caminho_foto_m5 = None, None
+    if enviar_fotos:
+        if "fotos" not in contexto:
+            print(f"📸 Ciclo com Imagens. Gerando imagens visuais para a IA...")
+            # Correção: Passando os argumentos posicionais corretamente
+            foto_m5 = mt5_service.capturar_imagem_grafico(pacote_dados["m5"], ativo, "chart_m5.png", "M5")
+            foto_m1 = mt5_service.capturar_imagem_grafico(pacote_dados["m1"], ativo, "chart_m1.png", "M1")
+            contexto["fotos"] = (foto_m1, foto_m5)
+        caminho_foto_m1, caminho_foto_m5 = contexto["fotos"]
+    else:
+        print(f"⚡ Ciclo Rápido. IA lendo apenas dados de texto...")
+
+    # Portão quant: nada mudou desde a última análise do perfil -> mantém a decisão anterior
+    pular_ia, motivo_portao = portao_quant.avaliar(
+        profile_id, contexto["tempo_fechado"], preco_atual_log, contexto["atr_referencia"],
+        motor_armadilhas.obter(profile_id), posicao_aberta, com_fotos=caminho_foto_m1 is not None
+    )
+    if pular_ia:
+        print(f"[{ativo}] ⏭️ IA pulada pelo portão quant: {motivo_portao}")
+        return None
+
+    # A posição aberta já foi obtida no passo 2.5
+    # Perfis do ativo com as mesmas entradas compartilham uma única chamada à IA
+    chave_analise = (estrategia, relevancia_anterior, estado_anterior_ia, caminho_foto_m1 is not None,
+                     tuple(sorted(posicao_aberta.items())) if posicao_aberta else None)
+    decisao_pendente, analise_pendente = contextos_ativos.analise_em_etapas(contexto, chave_analise, functools.partial(
+        ai_trader.analisar_mercado_async,
+        dados_macro_df=pacote_dados["m15"], 
+        dados_micro_df=pacote_dados,       
+        estrategia=estrategia, 
+        relevancia_anterior=relevancia_anterior,
+        dados_ontem=dados_ontem,
+        estado_anterior=estado_anterior_ia,
+        image_path_m1=caminho_foto_m1, 
+        image_path_m5=caminho_foto_m5,
+        posicao_aberta=posicao_aberta,
+        ativo=ativo,
+        digitos=contexto["digits"],
+        prioridade=agendador.prioridade(estado),
+        prazo_segundos=segundos_de_parede(prazo_analise.orcamento(contexto["prazo"], mt5.agora()))
+    ))
+
+    # A decisão é aplicada sobre o snapshot de mercado em que foi calculada; os outros perfis
+    # seguem nas próprias tarefas enquanto esta espera a IA
+    await analisar_perfil({
+        "profile_id": profile_id, "ativo": ativo, "ambiente": ambiente, "estrategia": estrategia,
+        "agressividade": agressividade, "lote": lote, "sl_real": sl_real, "tp_real": tp_real,
+        "preco_atual": preco_atual_log, "timestamp_atual": timestamp_atual,
+        "tempo_fechado": contexto["tempo_fechado"], "prazo": contexto["prazo"],
+        "esta_posicionado": esta_posicionado, "posicao_aberta": posicao_aberta,
+        "estado_anterior": estado_anterior_ia, "minuto_atual": minuto_atual,
+    }, decisao_pendente, analise_pendente)
+    return estado.ultimo_ts_ia + intervalo_ia
+
+async def executar_perfil(estado):
+    """Tarefa de um perfil no agendador: roda um ciclo e dorme até a próxima barra do ativo ou o próprio timer."""
+    while True:
+        try:
+            proximo = await ciclo_perfil(estado)
+        except Exception as e:
+            print(f"Erro no ciclo do perfil {estado.profile_id}: {e}")
+            proximo = None
+        await agendador.aguardar(estado, proximo)
 
 async def trading_loop():
-    """Loop principal com FORÇA TOTAL na leitura do Banco de Dados."""
+    """Loop de controle com FORÇA TOTAL na leitura do Banco de Dados: uma tarefa por perfil no agendador."""
     print("Iniciando Trading Loop (Motor Executor Híbrido)...")
     
     if not mt5_service.conectar():
@@ -101,8 +728,7 @@ async def trading_loop():
 
     cached_configs = None
     last_config_time = 0
-    ultimo_ts_ia = 0 # Controle do ciclo da IA (em segundos)
-    contador_ciclo_posicionado = 0 # Para alternar texto/imagem a cada 2.5 min
+    contador_ciclos_loop = 0 # Para o relatório periódico do cache de candles
 
     while True:
         try:
@@ -111,436 +737,83 @@ async def trading_loop():
             
             # 1. Buscar configurações REAIS do Supabase (Otimizado com Cache)
             if cached_configs is None or main.force_config_reload or (agora_ts - last_config_time > 300):
-                response = supabase.table('trade_configs').select('*').execute()
-                cached_configs = response.data
+                if supabase is not None:
+                    response = supabase.table('trade_configs').select('*').execute()
+                    cached_configs = response.data
+                else:
+                    # Replay offline (simulador + cassete da IA): perfis lidos de um JSON local
+                    with open(os.getenv("TRADE_CONFIGS_ARQUIVO", "trade_configs.json"), encoding="utf-8") as arquivo:
+                        cached_configs = json.load(arquivo)
                 last_config_time = agora_ts
                 main.force_config_reload = False
                 print("🔄 Configurações recarregadas do banco de dados (Cache Atualizado).")
+                # Especificações dos ativos configurados carregadas fora do caminho da ordem
+                mt5_service.especificacoes.carregar(c.get('ativo', 'BITG26') for c in (cached_configs or []))
+                # Perfis novos ganham a própria tarefa; removidos são encerrados
+                agendador.sincronizar(cached_configs, executar_perfil)
             
             configs = cached_configs
             
             if not configs:
-                await asyncio.sleep(10)
+                await agendador.dormir(10)
                 continue
 
-            for config in configs:
-                profile_id = config.get('profile_id')
-                ativo_banco = config.get('ativo', 'BITG26')
-                
-                # --- A BALA DE PRATA: CRIA A VARIÁVEL QUE FALTAVA ---
-                ativo = ativo_banco
-                symbol = ativo_banco 
-                
-                # --- FORÇA A SINCRONIZAÇÃO COM O FRONTEND ---
-                import main
-                main.current_symbol = ativo 
-                
-                # VARIÁVEIS DE EXECUÇÃO ORIGINAIS
-                lote = float(config.get('lote', 1.0))
-                sl_pts = int(config.get('stop_loss', 100))
-                tp_pts = int(config.get('take_profit', 200))
-                estrategia = config.get('estrategia_ativa', 'Adaptável (Camaleão / Dinâmica)')
-                horario_inicio = config.get('horario_inicio', '09:00')
-                horario_fim = config.get('horario_fim', '17:30')
-                ambiente = config.get('ambiente', 'AO VIVO')
-
-                # --- NOVAS VARIÁVEIS DE INTELIGÊNCIA IA ---
-                trailing_stop_auto = config.get('trailing_stop_auto', True)
-                auto_decisao_ia = config.get('auto_decisao_ia', False)
-                agressividade = config.get('agressividade', 'SCALPER')
-                
-                # --- TRAVA INQUEBRÁVEL DE GESTÃO DE RISCO ---
-                meta_diaria = float(config.get('meta_diaria', 500.0))
-                limite_perda = float(config.get('limite_perda', -250.0))
-                
-                resultado_atual = mt5_service.obter_resultado_diario()
-                
-                if resultado_atual >= meta_diaria:
-                    print(f"[{ativo}] META ALCANÇADA: R$ {resultado_atual:.2f}. Hibernando.")
-                    continue
-                
-                if resultado_atual <= limite_perda:
-                    print(f"[{ativo}] LIMITE DE PERDA ATINGIDO: R$ {resultado_atual:.2f}. Travado.")
-                    continue
-
-                # 2. Verificar Filtro de Horário
-                agora = datetime.now().time()
-                try:
-                    h_inicio = datetime.strptime(horario_inicio, '%H:%M').time()
-                    h_fim = datetime.strptime(horario_fim, '%H:%M').time()
-                    if h_inicio <= h_fim:
-                        dentro_horario = h_inicio <= agora <= h_fim
-                    else:
-                        dentro_horario = agora >= h_inicio or agora <= h_fim
-                except ValueError:
-                    dentro_horario = True
-
-                if not dentro_horario:
-                    print(f"[{ativo}] Fora da janela operacional ({horario_inicio} às {horario_fim}).")
-                    continue
-
-                # 3. Puxar dados do MT5 (Fractal M1, M5, M15 + Ontem)
-                pacote_dados = capturar_dados_triplos(ativo)
-
-                if pacote_dados["m1"] is None or pacote_dados["m1"].empty:
-                    continue
-
-                df_micro = pacote_dados["m1"]
-                preco_atual_log = float(df_micro.iloc[-1]['close']) # Tick atual (Vivo)
-                preco_fechamento_anterior = float(df_micro.iloc[-2]['close']) # Fechamento da última vela
-                preco_abertura_anterior = float(df_micro.iloc[-2]['open']) # Abertura da última vela (Para saber a cor)
-                preco_maxima_anterior = float(df_micro.iloc[-2]['high'])
-                preco_minima_anterior = float(df_micro.iloc[-2]['low'])
-                timestamp_atual = int(df_micro.iloc[-1]['time'].timestamp() if hasattr(df_micro.iloc[-1]['time'], 'timestamp') else pd.to_datetime(df_micro.iloc[-1]['time']).timestamp())
-                
-                atr_atual = df_micro['atr_14'].iloc[-1] if 'atr_14' in df_micro.columns else 0
-
-                # --- CÁLCULO DE SL E TP DINÂMICOS (BASEADO NO ATR) ---
-                symbol_info = mt5.symbol_info(ativo)
-                point = symbol_info.point if symbol_info else 1.0
-                
-                if atr_atual > 0 and point > 0:
-                    atr_pts = atr_atual / point
-                    sl_dinamico_pts = int(atr_pts * 1.5)
-                    tp_dinamico_pts = int(atr_pts * 2.0)
-                else:
-                    sl_dinamico_pts = sl_pts
-                    tp_dinamico_pts = tp_pts
-
-                # --- PROTEÇÃO DINÂMICA CONTRA ERRO 10016 ---
-                # O código passa a usar ESTRITAMENTE o sl_pts e tp_pts configurados pelo usuário
-                sl_real = sl_pts
-                tp_real = tp_pts
-
-                # ======================================================================
-                # MÓDULO EXECUTOR (LATÊNCIA ZERO): EXECUÇÃO DE ARMADILHA
-                # ======================================================================
-                armadilha = memoria_ordem_programada.get(profile_id, {"acao": "NONE"})
-                
-                if armadilha.get("acao") in ["BUY", "SELL"] and not mt5_service.tem_posicao_aberta(ativo):
-                    # Checagem de Timeout (15 minutos de validade)
-                    timestamp_armadilha = armadilha.get("timestamp", time_lib.time())
-                    idade_armadilha = time_lib.time() - timestamp_armadilha
-                    
-                    if idade_armadilha > 900: # 900 segundos = 15 minutos
-                        print(f"[{ativo}] ⏰ Armadilha de {armadilha['acao']} expirou (Timeout > 15m). Desarmando.")
-                        memoria_ordem_programada[profile_id] = {"acao": "NONE"}
-                    else:
-                        acao_armada = armadilha["acao"]
-                        gatilho = float(armadilha.get("preco_gatilho", 0))
-                        
-                        print(f"[{ativo}] Monitorando Armadilha {acao_armada} no gatilho {gatilho}. Fechamento Anterior: {preco_fechamento_anterior}")
-                        
-                        # Checa a Autenticação em 2 Fatores (Rompimento Confirmado)
-                        ordem_disparada = False
-                        
-                        if acao_armada == "BUY":
-                            # Lógica 1: Rompimento (Preço abriu abaixo/no gatilho e fechou acima com força)
-                            rompimento_buy = (preco_abertura_anterior <= gatilho and preco_fechamento_anterior > gatilho)
-                            # Lógica 2: Pullback (Preço tocou no suporte/gatilho e rejeitou formando vela verde)
-                            pullback_buy = (preco_minima_anterior <= gatilho and preco_fechamento_anterior > preco_abertura_anterior)
-                            
-                            if rompimento_buy or pullback_buy:
-                                print(f"🔥 ARMADILHA CONFIRMADA: Gatilho {gatilho} acionado (Rompimento: {rompimento_buy} | Pullback: {pullback_buy}). BUY!")
-                                ordem_disparada = True
-                                
-                        elif acao_armada == "SELL":
-                            # Lógica 1: Rompimento (Preço abriu acima/no gatilho e fechou abaixo com força)
-                            rompimento_sell = (preco_abertura_anterior >= gatilho and preco_fechamento_anterior < gatilho)
-                            # Lógica 2: Pullback (Preço tocou na resistência/gatilho e rejeitou formando vela vermelha)
-                            pullback_sell = (preco_maxima_anterior >= gatilho and preco_fechamento_anterior < preco_abertura_anterior)
-                            
-                            if rompimento_sell or pullback_sell:
-                                print(f"🔥 ARMADILHA CONFIRMADA: Gatilho {gatilho} acionado (Rompimento: {rompimento_sell} | Pullback: {pullback_sell}). SELL!")
-                                ordem_disparada = True
-
-                    if ordem_disparada:
-                        if ambiente == 'REPLAY HISTÓRICO':
-                            resultado = mt5_service.simular_ordem_paper_trading(ativo, acao_armada, preco_atual_log, armadilha.get("motivo_gatilho", "Rompimento"))
-                        else:
-                            resultado = mt5_service.enviar_ordem(ativo, acao_armada, lote, sl_real, tp_real)
-                        
-                        # Limpa a armadilha após atirar para não atirar duplicado
-                        memoria_ordem_programada[profile_id] = {"acao": "NONE"}
-                        
-                        if resultado:
-                            motivo_detalhado = armadilha.get("motivo_ia", "Motivo não registrado.")
-                            msg_execucao = f"[{ativo}] 🎯 ARMADILHA {acao_armada} ACIONADA no preço {preco_atual_log}!\n🧠 Raciocínio da IA: {motivo_detalhado}"
-                            
-                            await broadcast_to_frontend({
-                                "id": str(datetime.now().timestamp()),
-                                "timestamp": datetime.now().strftime("%H:%M:%S"),
-                                "type": "trade",
-                                "message": msg_execucao
-                            })
-                            
-                            await broadcast_to_frontend({
-                                "type": "trade",
-                                "marker": {
-                                    "time": timestamp_atual,
-                                    "position": 'belowBar' if acao_armada == 'BUY' else 'aboveBar',
-                                    "color": '#10b981' if acao_armada == 'BUY' else '#ef4444',
-                                    "shape": 'arrowUp' if acao_armada == 'BUY' else 'arrowDown',
-                                    "text": f"{acao_armada} [ARMADILHA]"
-                                }
-                            })
-                        continue # Pula o resto do loop para não sobrecarregar a IA após atirar
-
-                # 2.5 Obter Posição Aberta para a IA Gerir
-                posicao_aberta = None
-                if ambiente != 'REPLAY HISTÓRICO' and mt5_service.tem_posicao_aberta(ativo):
-                    posicao_aberta = mt5_service.obter_posicao_aberta(ativo)
-                    
-                    if posicao_aberta:
-                        sl = posicao_aberta.get("sl_atual", 0)
-                        price_open = posicao_aberta.get("price_open", 0)
-                        pos_type = posicao_aberta.get("type", "")
-                        
-                        is_protected = False
-                        if sl > 0:
-                            if pos_type == "BUY" and sl >= price_open - 0.00001:
-                                is_protected = True
-                            elif pos_type == "SELL" and sl <= price_open + 0.00001:
-                                is_protected = True
-                                
-                        if is_protected:
-                            agora_ts_loop = time_lib.time()
-                            if (agora_ts_loop - ultimo_ts_ia) > 60:
-                                ultimo_ts_ia = agora_ts_loop
-                                print(f"[{ativo}] 💤 Operação protegida no 0 a 0 (Breakeven). IA dormindo para economizar tokens.")
-                                await broadcast_to_frontend({
-                                    "id": str(datetime.now().timestamp()),
-                                    "timestamp": datetime.now().strftime("%H:%M:%S"),
-                                    "type": "info",
-                                    "message": f"[{ativo}] 💤 Operação protegida no 0 a 0. IA em modo de economia de tokens."
-                                })
-                            await asyncio.sleep(15)
-                            continue
-                            
-                    print(f"[{ativo}] Posicionado. IA assumindo gestão da operação...")
-
-                # ======================================================================
-                # MÓDULO ANALISTA (IA): CONTROLE DE CICLO DINÂMICO (1min vs 2.5min)
-                # ======================================================================
-                agora_ts_loop = time_lib.time()
-                esta_posicionado = (ambiente != 'REPLAY HISTÓRICO' and mt5_service.tem_posicao_aberta(ativo))
-                
-                # Define o intervalo do ciclo da IA
-                if esta_posicionado:
-                    intervalo_ia = 150  # 2.5 minutos (150 segundos)
-                else:
-                    intervalo_ia = 60   # 1 minuto (60 segundos)
-                
-                # CICLO DE ESPERA: Monitora Armadilhas
-                if (agora_ts_loop - ultimo_ts_ia) < intervalo_ia:
-                    # Apenas avisa o frontend que está vivo e monitorando
-                    tempo_restante = int(intervalo_ia - (agora_ts_loop - ultimo_ts_ia))
-                    await broadcast_to_frontend({
-                        "id": str(datetime.now().timestamp()),
-                        "timestamp": datetime.now().strftime("%H:%M:%S"),
-                        "type": "info",
-                        "message": f"[{ativo}] Monitorando armadilhas e trailing stops... (Próxima IA em ~{tempo_restante}s)"
-                    })
-                    await asyncio.sleep(15)
-                    continue
-                
-                # CICLO DA IA ATINGIDO
-                ultimo_ts_ia = agora_ts_loop
-                minuto_atual = datetime.now().minute
-                
-                dados_ontem = mt5_service.obter_ohlc_ontem(ativo) or {}
-                relevancia_anterior = memoria_relevancia.get(profile_id, 1)
-                estado_anterior_ia = memoria_estado_ia.get(profile_id, "Iniciando...")
-                
-                # Controle Inteligente de Visão Computacional (Economiza Latência e Tokens)
-                enviar_fotos = False
-                if esta_posicionado:
-                    # A cada 2.5 min, alterna: 1=Texto, 2=Imagem
-                    contador_ciclo_posicionado += 1
-                    if contador_ciclo_posicionado % 2 == 0:
-                        enviar_fotos = True # No ciclo par (5 min), envia foto
-                else:
-                    # Quando não posicionado, mantém a regra original (a cada 5 minutos do relógio)
-                    enviar_fotos = (minuto_atual % 5 == 0)
-                    contador_ciclo_posicionado = 0 # Reseta o contador
-                
-                caminho_foto_m5, caminho_foto_m1 = None, None
-                if enviar_fotos:
-                    print(f"📸 Ciclo com Imagens. Gerando imagens visuais para a IA...")
-                    # Correção: Passando os argumentos posicionais corretamente
-                    caminho_foto_m5 = mt5_service.capturar_imagem_grafico(pacote_dados["m5"], ativo, "chart_m5.png", "M5")
-                    caminho_foto_m1 = mt5_service.capturar_imagem_grafico(pacote_dados["m1"], ativo, "chart_m1.png", "M1")
-                else:
-                    print(f"⚡ Ciclo Rápido. IA lendo apenas dados de texto...")
-
-                # Medidor de Latência da IA
-                start_time = time_lib.time()
-                
-                # A posição aberta já foi obtida no passo 2.5
-                
-                analise = ai_trader.analisar_mercado(
-                    dados_macro_df=pacote_dados["m15"], 
-                    dados_micro_df=pacote_dados,       
-                    estrategia=estrategia, 
-                    relevancia_anterior=relevancia_anterior,
-                    dados_ontem=dados_ontem,
-                    estado_anterior=estado_anterior_ia,
-                    image_path_m1=caminho_foto_m1, 
-                    image_path_m5=caminho_foto_m5,
-                    posicao_aberta=posicao_aberta
-                )
-                
-                tempo_ia = time_lib.time() - start_time
-                
-                nova_relevancia = analise.get('relevancia', 1)
-                memoria_relevancia[profile_id] = nova_relevancia
-                memoria_estado_ia[profile_id] = analise.get('estado_operacional', analise.get('motivo', ''))
-
-                # Armazena nova armadilha que a IA definir
-                nova_armadilha = analise.get('ordem_programada', {"acao": "NONE"})
-                nova_armadilha["motivo_ia"] = analise.get('motivo', 'Motivo não especificado.')
-
-                # Salva o Timestamp para o Timeout apenas se a armadilha for válida (Com Trava Anti-Alucinação)
-                if nova_armadilha.get("acao") != "NONE":
-                    gatilho_ia = float(nova_armadilha.get("preco_gatilho", 0))
-                    acao_ia = nova_armadilha.get("acao")
-                    
-                    # Sanitização: O gatilho não pode estar a mais de 1.5% de distância do preço atual
-                    distancia_percentual = abs(gatilho_ia - preco_atual_log) / preco_atual_log if preco_atual_log > 0 else 1
-                    
-                    # TRAVA DE AÇO MATEMÁTICA: BUY Stop deve ser > Preço Atual | SELL Stop deve ser < Preço Atual
-                    direcao_invalida = (acao_ia == "BUY" and gatilho_ia <= preco_atual_log) or \
-                                       (acao_ia == "SELL" and gatilho_ia >= preco_atual_log)
-                    
-                    if distancia_percentual > 0.015 or gatilho_ia <= 0 or direcao_invalida:
-                        print(f"⚠️ [ANTI-ALUCINAÇÃO] Gatilho ignorado ({gatilho_ia} para {acao_ia}). Distância irreal ou direção inválida (Preço Atual: {preco_atual_log}).")
-                        nova_armadilha = {"acao": "NONE"}
-                    else:
-                        nova_armadilha["timestamp"] = time_lib.time()
-                        nova_armadilha["preco_gatilho"] = gatilho_ia # Garante que é float
-                    
-                decisao = analise.get('decisao', 'WAIT')
-
-                # --- BLINDAGEM QUANT: IA NÃO PODE ABRIR NOVA ORDEM SE JÁ ESTIVER POSICIONADA ---
-                if esta_posicionado:
-                    if nova_armadilha.get("acao") != "NONE":
-                        print(f"⚠️ [BLINDAGEM] Armadilha ignorada. IA já está posicionada e deve focar apenas na gestão.")
-                        nova_armadilha = {"acao": "NONE"}
-                    if decisao not in ['HOLD', 'BREAKEVEN']:
-                        print(f"⚠️ [BLINDAGEM] Decisão '{decisao}' inválida para gestão. Convertida para 'HOLD'. IA já está posicionada.")
-                        decisao = 'HOLD'
-
-                memoria_ordem_programada[profile_id] = nova_armadilha
-                motivo = analise.get('motivo', 'Sem motivo')
-                estrategia_escolhida = analise.get('estrategia_escolhida', estrategia)
-
-                # Log Silencioso para Notícias
-                if "BLOQUEIO: Notícia" in motivo:
-                    if minuto_atual % 5 == 0:
-                        print(f"🛑 [PAUSA DE NOTÍCIA] {motivo}")
-                else:
-                    print(f"IA [{nova_relevancia}★] [Preço: {preco_atual_log}] [Delay: {tempo_ia:.2f}s]: {decisao} | {motivo}")
-                    
-                if nova_armadilha.get("acao") != "NONE":
-                    print(f"   🎯 ARMADILHA CONFIGURADA: {nova_armadilha['acao']} no rompimento/fechamento de {nova_armadilha['preco_gatilho']}")
-                else:
-                    print(f"   ↳ Memória da IA: {estado_anterior_ia}")
-
-                # 5. EXECUTAR ORDEM IMEDIATA SE A IA MANDAR A MERCADO
-                if decisao in ['BUY', 'SELL']:
-
-                    if agressividade == 'SNIPER' and nova_relevancia < 5:
-                        print(f"Sinal {decisao} rejeitado (Filtro SNIPER).")
-                    elif agressividade == 'SCALPER' and nova_relevancia < 4:
-                        print(f"Sinal {decisao} rejeitado (Filtro SCALPER).")
-                    else:
-                        # Executa de fato
-                        if ambiente == 'REPLAY HISTÓRICO':
-                            print(f"[MODO REPLAY] Simulando ordem {decisao} para {ativo} (Paper Trading)...")
-                            resultado = mt5_service.simular_ordem_paper_trading(ativo, decisao, preco_atual_log, motivo)
-                        else:
-                            print(f"[MODO AO VIVO] Executando ordem REAL {decisao} para {ativo}...")
-                            resultado = mt5_service.enviar_ordem(ativo, decisao, lote, sl_real, tp_real)
-                        
-                        if resultado:
-                            tag = "[SIMULAÇÃO] " if ambiente == 'REPLAY HISTÓRICO' else ""
-                            await log_to_supabase(profile_id, "trade", f"{tag}Ordem {decisao} via {estrategia_escolhida}")
-                            await save_trade_history(profile_id, resultado.order, ativo, decisao, resultado.price, motivo)
-                            
-                            msg_execucao_mercado = f"[{ativo}] ⚡ ORDEM A MERCADO {decisao} EXECUTADA!\n🧠 Raciocínio da IA: {motivo}"
-                            await broadcast_to_frontend({
-                                "id": str(datetime.now().timestamp()),
-                                "timestamp": datetime.now().strftime("%H:%M:%S"),
-                                "type": "trade",
-                                "message": msg_execucao_mercado
-                            })
-                            
-                            await broadcast_to_frontend({
-                                "type": "trade",
-                                "marker": {
-                                    "time": timestamp_atual,
-                                    "position": 'belowBar' if decisao == 'BUY' else 'aboveBar',
-                                    "color": '#10b981' if decisao == 'BUY' else '#ef4444',
-                                    "shape": 'arrowUp' if decisao == 'BUY' else 'arrowDown',
-                                    "text": f"{decisao} {nova_relevancia}★"
-                                }
-                            })
-                        else:
-                            await log_to_supabase(profile_id, "error", f"Falha ao executar ordem {decisao} para {ativo}.")
-                            
-                elif decisao == 'BREAKEVEN' and posicao_aberta:
-                    if ambiente != 'REPLAY HISTÓRICO':
-                        try:
-                            sucesso = mt5_service.mover_stop_breakeven(ativo)
-                            if sucesso:
-                                msg_breakeven = f"🛡️ DEFESA ATIVADA: Stop Loss movido para o 0 a 0 (Breakeven). Motivo: {motivo}"
-                                await broadcast_to_frontend({
-                                    "id": str(datetime.now().timestamp()),
-                                    "timestamp": datetime.now().strftime("%H:%M:%S"),
-                                    "type": "trade",
-                                    "message": f"[{ativo}] {msg_breakeven}"
-                                })
-                        except Exception as e:
-                            print(f"Erro ao aplicar Breakeven: {e}")
-                            
-                elif decisao == 'HOLD' and posicao_aberta:
-                    print(f"[{ativo}] ⏳ HOLD: IA decidiu manter a posição atual aberta. Lucro atual: {posicao_aberta['profit']}")
-
-                # Broadcast para painel
-                log_msg = f"Relevância: {nova_relevancia}★ | Ativo: {ativo} | Decisão: {decisao}\nMotivo: {motivo}\nLatência: {tempo_ia:.2f}s"
-                await broadcast_to_frontend({
-                    "id": str(datetime.now().timestamp()),
-                    "timestamp": datetime.now().strftime("%H:%M:%S"),
-                    "type": "ai_analysis",
-                    "message": log_msg,
-                    "estudos_visuais": analise.get('estudos_visuais', {}),
-                    "relevancia": nova_relevancia,
-                    "armadilha": nova_armadilha
-                })
-
-            # Aguarda o próximo ciclo (15 segundos é ideal para micro-tendências)
-            await asyncio.sleep(15)
+            # Relatórios periódicos (~5 min): cache de candles, IA, agendador
+            contador_ciclos_loop += 1
+            if contador_ciclos_loop % 20 == 0:
+                print(f"📦 Cache de Candles: {mt5_service.cache_candles.estatisticas()}")
+                print(f"📒 Livro de Posições: {mt5_service.livro_posicoes.estatisticas()}")
+                print(f"🚦 Portão Quant: {portao_quant.estatisticas(ai_trader.cache_instrucao.tokens_medios_por_chamada())}")
+                print(f"📐 Respostas da IA: {ai_trader.metricas_resposta.estatisticas()}")
+                print(f"🗂️ Cache da Instrução: {ai_trader.cache_instrucao.estatisticas()}")
+                print(f"🧮 Pool de Inferência: {ai_trader.pool.estatisticas()}")
+                print(f"📼 Backend da IA: {ai_trader.backend.estatisticas()}")
+                print(f"⌛ Prazo das análises: {prazo_analise.estatisticas(ai_trader.cache_instrucao.tokens_medios_por_chamada())}")
+                print(f"🧭 Roteador de modelos (hedge/disjuntor): {ai_trader.roteador.estatisticas()}")
+                print(f"🩺 Event loop: {monitor_loop.estatisticas()}")
+                print(f"🗓️ Agendador de perfis: {agendador.estatisticas()}")
+                print(f"🎯 Motor de armadilhas: {motor_armadilhas.estatisticas()}")
+                print(f"🔀 Fan-in por ativo (buscas/chamadas de IA evitadas): {contextos_ativos.estatisticas()}")
+
+            # Auditoria da reamostragem local contra os candles M5 da corretora (~1x por hora)
+            if contador_ciclos_loop % 240 == 0:
+                for ativo_auditoria in {c.get('ativo', 'BITG26') for c in configs}:
+                    consistencia = mt5_service.cache_candles.verificar_consistencia(ativo_auditoria, mt5.TIMEFRAME_M5)
+                    if consistencia and consistencia["divergentes"] > 0:
+                        print(f"⚠️ [{ativo_auditoria}] Reamostragem M5 divergente da corretora: {consistencia}")
+                # Compactação do armazém de candles: dias de meses encerrados viram uma partição mensal.
+                # Copia um mês inteiro de arquivos: roda numa thread para não travar ticks e gráfico
+                armazem = mt5_service.cache_candles.armazem
+                if armazem is not None:
+                    try:
+                        compactados = await asyncio.to_thread(armazem.compactar_tudo)
+                        if compactados:
+                            print(f"🗜️ Armazém de candles compactado: {compactados}")
+                    except OSError as e:
+                        # Dia preso por outro leitor (Windows): a mensal já vale, o dia sai na próxima rodada
+                        print(f"⚠️ Compactação do armazém de candles incompleta: {e}")
+
+            # Configurações e relatórios a cada 15s; cada perfil tem o próprio ritmo no agendador
+            await agendador.dormir(15)
 
         except Exception as e:
             print(f"Erro no loop principal: {e}")
-            await asyncio.sleep(10)
+            await agendador.dormir(10)
 
 async def atualizar_grafico_full():
-    """Tarefa que envia o histórico de candles completo (Foco em M5)."""
+    """Tarefa do gráfico (Foco em M5): snapshot inicial e depois só os deltas do candle em formação."""
     while True:
         try:
+            monitor_loop.registrar_batida("grafico")
             from main import current_symbol
-            df_micro = mt5_service.obter_dados_mercado(current_symbol, mt5.TIMEFRAME_M5, 100)
-            if df_micro is not None and not df_micro.empty:
-                candles_list = []
-                for _, row in df_micro.iterrows():
-                    candles_list.append({
-                        "time": int(row['time'].timestamp() if hasattr(row['time'], 'timestamp') else pd.to_datetime(row['time']).timestamp()),
-                        "open": float(row['open']), "high": float(row['high']),
-                        "low": float(row['low']), "close": float(row['close'])
-                    })
-                await broadcast_to_frontend({"type": "market_data", "candles": candles_list})
-            await asyncio.sleep(30)
+            rates = mt5_service.cache_candles.obter(current_symbol, mt5.TIMEFRAME_M5, 100)
+            mensagem = emissor_candles.proxima_mensagem(current_symbol, rates)
+            if mensagem is not None:
+                resposta = await broadcast_to_frontend(mensagem)
+                if resposta is None or resposta.get("resync"):
+                    # Servidor fora do ar ou com buraco na sequência: o próximo envio é um snapshot
+                    emissor_candles.solicitar_snapshot()
+            await asyncio.sleep(0.5)
         except Exception as e:
             await asyncio.sleep(5)
 
@@ -549,8 +822,10 @@ async def monitor_tick_data():
     while True:
         try:
             from main import current_symbol
+            monitor_loop.registrar_batida("ticks")
             tick = mt5.symbol_info_tick(current_symbol)
             if tick:
+                gravador_ticks.registrar(current_symbol, tick)
                 preco_atual = tick.last if tick.last != 0 else tick.bid
                 await broadcast_to_frontend({
                     "type": "market_data",
@@ -566,13 +841,21 @@ if __name__ == "__main__":
         print(f"--- SISTEMA INICIADO: MODO MULTI-TASKING ROBUSTO ---")
         print(f"Ativo de Foco Inicial: {current_symbol}")
         await asyncio.gather(
-            trading_loop(),
+            agendador.lancar(trading_loop()),
+            agendador.executar(),
             atualizar_grafico_full(), 
-            monitor_tick_data()        
+            monitor_tick_data(),
+            monitor_loop.executar(),
+            ai_trader.radar.executar(),
+            gravador_ticks.executar()
         )
 
+    # SIGTERM (serviço parado) sai pelo mesmo caminho do Ctrl+C: o log de ticks é fechado com fsync
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
         print("Saindo e encerrando MT5...")
+    finally:
+        gravador_ticks.fechar()
         mt5.shutdown()
\ No newline at end of file